@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_valid_strategy(self, args=not_set):
+        return f(self, args)
+    return test_valid_strategy
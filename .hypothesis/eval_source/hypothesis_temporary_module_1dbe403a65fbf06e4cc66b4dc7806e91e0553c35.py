@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_records_blockdeviceid(self, dataset_id=not_set, blockdevice_id=not_set):
+        return f(self, dataset_id, blockdevice_id)
+    return test_records_blockdeviceid
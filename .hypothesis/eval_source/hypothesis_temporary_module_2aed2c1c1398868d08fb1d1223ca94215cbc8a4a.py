@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_smaller_than_json(self, deployment=not_set):
+        return f(self, deployment)
+    return test_smaller_than_json
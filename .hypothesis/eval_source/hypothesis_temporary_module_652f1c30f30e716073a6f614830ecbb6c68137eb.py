@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_first_is_min_sleep(self, duration=not_set):
+        return f(self, duration)
+    return test_first_is_min_sleep
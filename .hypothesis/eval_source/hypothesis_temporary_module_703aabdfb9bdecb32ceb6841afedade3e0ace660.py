@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_extra_attributes(self, args=not_set, choice=not_set, extra_value=not_set):
+        return f(self, args, choice, extra_value)
+    return test_extra_attributes
@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_parsenum_all_sizes(self, expr=not_set, size=not_set):
+        return f(self, expr, size)
+    return test_parsenum_all_sizes
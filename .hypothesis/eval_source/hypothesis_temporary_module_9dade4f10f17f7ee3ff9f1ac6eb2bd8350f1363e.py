@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_missing_attributes(self, args=not_set, choice=not_set):
+        return f(self, args, choice)
+    return test_missing_attributes
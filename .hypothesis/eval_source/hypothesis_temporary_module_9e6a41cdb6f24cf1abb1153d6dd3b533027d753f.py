@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_upgrade_configuration_versions(self, versions=not_set):
+        return f(self, versions)
+    return test_upgrade_configuration_versions
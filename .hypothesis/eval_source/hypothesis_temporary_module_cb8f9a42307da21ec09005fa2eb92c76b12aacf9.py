@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_parsenum_bad_size(self, size=not_set):
+        return f(self, size)
+    return test_parsenum_bad_size
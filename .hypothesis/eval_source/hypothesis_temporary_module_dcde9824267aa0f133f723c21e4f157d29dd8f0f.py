@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_make_file(self, content=not_set, perms=not_set):
+        return f(self, content, perms)
+    return test_make_file
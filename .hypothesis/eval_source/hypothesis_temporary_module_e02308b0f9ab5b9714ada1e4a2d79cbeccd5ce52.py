@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_optional(self, klass=not_set):
+        return f(self, klass)
+    return test_optional
@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_invalid_states(self, state=not_set, extra_value=not_set):
+        return f(self, state, extra_value)
+    return test_invalid_states
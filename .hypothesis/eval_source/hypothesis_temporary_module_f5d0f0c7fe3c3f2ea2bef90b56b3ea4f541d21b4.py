@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_duplicate_blockdevice_id(self, dataset_id=not_set, blockdevice_id=not_set, other_blockdevice_id=not_set):
+        return f(self, dataset_id, blockdevice_id, other_blockdevice_id)
+    return test_duplicate_blockdevice_id
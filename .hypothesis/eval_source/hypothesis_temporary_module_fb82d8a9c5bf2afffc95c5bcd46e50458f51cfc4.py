@@ -0,0 +1,6 @@
+from hypothesis.utils.conventions import not_set
+
+def accept(f):
+    def test_to_unserialized_json_matches_wire_encode(self, deployment=not_set):
+        return f(self, deployment)
+    return test_to_unserialized_json_matches_wire_encode
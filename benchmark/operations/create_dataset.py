@@ -9,7 +9,7 @@ from uuid import uuid4
 from pyrsistent import PClass, field
 from zope.interface import implementer
 
-from flocker.common import loop_until
+from flocker.apiclient import wait_for_state
 
 from benchmark._interfaces import IProbe, IOperation
 from benchmark.operations._common import select_node
@@ -81,7 +81,8 @@ class CreateDatasetProbe(PClass):
 
     def run(self):
         """
-        Create a dataset, then wait for convergence.
+        Create a dataset, then wait for convergence, checking each time the
+        cluster state changes.
         """
         d = self.control_service.create_dataset(
             primary=self.primary.uuid,
@@ -89,9 +90,11 @@ class CreateDatasetProbe(PClass):
             dataset_id=self.dataset_id,
         )
 
-        def loop_until_converged(expected):
-            return loop_until(self.reactor, partial(self._converged, expected))
-        d.addCallback(loop_until_converged)
+        def wait_until_converged(expected):
+            return wait_for_state(
+                self.control_service, self.reactor,
+                partial(self._converged, expected))
+        d.addCallback(wait_until_converged)
 
         return d
 
@@ -8,9 +8,12 @@ from eliot.testing import capture_logging
 from ipaddr import IPAddress
 from zope.interface.verify import verifyClass
 
+from twisted.internet.defer import fail
 from twisted.internet.task import Clock
+from twisted.web.http import NOT_FOUND
 
 from flocker.apiclient import FakeFlockerClient, Node
+from flocker.apiclient._client import ResponseError
 from flocker.testtools import TestCase
 
 from benchmark.cluster import BenchmarkCluster
@@ -38,17 +41,14 @@ class CreateDatasetTests(TestCase):
         """
         verifyClass(IProbe, CreateDatasetProbe)
 
-    @capture_logging(None)
-    def test_create_dataset(self, logger):
+    def assert_converges(self, control_service):
         """
-        CreateDataset probe waits for cluster to converge.
+        Assert that the CreateDataset probe waits for the cluster to converge.
+
+        :param control_service: The ``FakeFlockerClient`` the cluster uses.
         """
         clock = Clock()
 
-        node_id = uuid4()
-        node = Node(uuid=node_id, public_address=IPAddress('10.0.0.1'))
-        control_service = FakeFlockerClient([node], node_id)
-
         cluster = BenchmarkCluster(
             IPAddress('10.0.0.1'),
             lambda reactor: control_service,
@@ -68,8 +68,6 @@ class CreateDatasetTests(TestCase):
             return d
         d.addCallback(run_probe)
 
-        # Advance the clock because probe periodically polls the state.
-
         # The Deferred does not fire before the dataset has been created.
         clock.advance(1)
         self.assertNoResult(d)
@@ -81,6 +79,29 @@ class CreateDatasetTests(TestCase):
         clock.advance(1)
         self.successResultOf(d)
 
+    @capture_logging(None)
+    def test_create_dataset(self, logger):
+        """
+        CreateDataset probe waits for cluster to converge.
+        """
+        node_id = uuid4()
+        node = Node(uuid=node_id, public_address=IPAddress('10.0.0.1'))
+        self.assert_converges(FakeFlockerClient([node], node_id))
+
+    @capture_logging(None)
+    def test_create_dataset_without_watch(self, logger):
+        """
+        CreateDataset probe polls for the cluster to converge if the control
+        service can't wait for changes.
+        """
+        node_id = uuid4()
+        node = Node(uuid=node_id, public_address=IPAddress('10.0.0.1'))
+        control_service = FakeFlockerClient([node], node_id)
+        self.patch(
+            control_service, "watch_state",
+            lambda tag=None: fail(ResponseError(NOT_FOUND, b"")))
+        self.assert_converges(control_service)
+
     def test_empty_cluster(self):
         """
         CreateDataset fails if no nodes in cluster.
@@ -10,9 +10,14 @@ from ._client import (
     IFlockerAPIV1Client, FakeFlockerClient, Dataset, DatasetState,
     DatasetAlreadyExists, FlockerClient, Lease, LeaseAlreadyHeld,
     conditional_create, DatasetsConfiguration, Node, MountedDataset,
+    CreateDataset, MoveDataset, ResizeDataset, DeleteDataset, AcquireLease,
+    ReleaseLease, BatchResult, conditional_apply_batch, wait_for_state,
 )
 
 __all__ = ["IFlockerAPIV1Client", "FakeFlockerClient", "Dataset",
            "DatasetState", "DatasetAlreadyExists", "FlockerClient",
            "Lease", "LeaseAlreadyHeld", "conditional_create",
-           "DatasetsConfiguration", "Node", "MountedDataset", ]
+           "DatasetsConfiguration", "Node", "MountedDataset",
+           "CreateDataset", "MoveDataset", "ResizeDataset", "DeleteDataset",
+           "AcquireLease", "ReleaseLease", "BatchResult",
+           "conditional_apply_batch", "wait_for_state", ]
@@ -8,6 +8,7 @@ from uuid import UUID, uuid4
 from json import dumps
 from datetime import datetime
 from os import environ
+from urllib import urlencode
 
 from ipaddr import IPv4Address, IPv6Address, IPAddress
 
@@ -20,7 +21,7 @@ from pyrsistent import PClass, field, pmap_field, pmap
 from eliot import ActionType, Field
 from eliot.twisted import DeferredContext
 
-from twisted.internet.defer import succeed, fail
+from twisted.internet.defer import Deferred, succeed, fail, maybeDeferred
 from twisted.python.filepath import FilePath
 from twisted.web.http import (
     CREATED, OK, CONFLICT, NOT_FOUND, PRECONDITION_FAILED,
@@ -32,7 +33,7 @@ from treq import json_content, content
 
 from ..ca import treq_with_authentication
 from ..control import Leases as LeasesModel, LeaseError, DockerImage
-from ..common import retry_failure
+from ..common import retry_failure, loop_until
 
 from .. import __version__
 
@@ -49,9 +50,15 @@ _LOG_CONDITIONAL_CREATE = ActionType(
     u"flocker:apiclient:conditional_create", [], [],
     u"Conditionally create a dataset.")
 
+_LOG_CONDITIONAL_APPLY_BATCH = ActionType(
+    u"flocker:apiclient:conditional_apply_batch", [], [],
+    u"Conditionally apply a batch of changes to the configuration.")
+
 
 NoneType = type(None)
 
+NEXT_CURSOR_HEADER = b"X-Next-Cursor"
+
 
 class ServerResponseMissingElementError(Exception):
     """
@@ -217,6 +224,121 @@ class ConfigurationChanged(Exception):
     """
 
 
+class CreateDataset(PClass):
+    """
+    A batch operation creating a dataset.
+
+    The attributes are the arguments of
+    ``IFlockerAPIV1Client.create_dataset``.
+    """
+    primary = field(type=UUID, mandatory=True)
+    maximum_size = field(initial=None)
+    dataset_id = field(type=(UUID, NoneType), initial=None)
+    metadata = pmap_field(unicode, unicode)
+
+
+class MoveDataset(PClass):
+    """
+    A batch operation moving a dataset.
+
+    :attr UUID primary: The node where the dataset should manifest.
+    :attr UUID dataset_id: Which dataset to move.
+    """
+    primary = field(type=UUID, mandatory=True)
+    dataset_id = field(type=UUID, mandatory=True)
+
+
+class ResizeDataset(PClass):
+    """
+    A batch operation changing the maximum size of a dataset.
+
+    :attr UUID dataset_id: Which dataset to resize.
+    :attr maximum_size: The new size of the dataset in bytes (as ``int``)
+        or ``None`` to remove the size limit.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+    maximum_size = field(type=(int, long, NoneType), mandatory=True)
+
+
+class DeleteDataset(PClass):
+    """
+    A batch operation deleting a dataset.
+
+    :attr UUID dataset_id: Which dataset to delete.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+
+
+class AcquireLease(PClass):
+    """
+    A batch operation acquiring or renewing a lease.
+
+    The attributes are those of the ``Lease`` to acquire.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+    node_uuid = field(type=UUID, mandatory=True)
+    expires = field(type=(float, int, NoneType), mandatory=True)
+
+
+class ReleaseLease(PClass):
+    """
+    A batch operation releasing a lease.
+
+    :attr UUID dataset_id: The dataset whose lease is released.
+    """
+    dataset_id = field(type=UUID, mandatory=True)
+
+
+class BatchResult(PClass):
+    """
+    The result of applying a batch of operations.
+
+    :ivar bool committed: Whether the configuration was changed; only
+        ``False`` if the batch was atomic and an operation failed.
+    :ivar list results: The result of each operation, in order: the
+        resulting ``Dataset`` or ``Lease``, or the exception describing why
+        the operation failed.
+    """
+    committed = field(type=bool, mandatory=True)
+    results = field(type=list, mandatory=True)
+
+
+def _batch_operation_json(operation):
+    """
+    :param operation: A batch operation, e.g. ``CreateDataset``.
+    :return dict: The operation as given to the batch endpoint.
+    """
+    if isinstance(operation, CreateDataset):
+        result = {u"operation": u"create_dataset",
+                  u"primary": unicode(operation.primary),
+                  u"metadata": dict(operation.metadata)}
+        if operation.dataset_id is not None:
+            result[u"dataset_id"] = unicode(operation.dataset_id)
+        if operation.maximum_size is not None:
+            result[u"maximum_size"] = operation.maximum_size
+        return result
+    if isinstance(operation, MoveDataset):
+        return {u"operation": u"move_dataset",
+                u"primary": unicode(operation.primary),
+                u"dataset_id": unicode(operation.dataset_id)}
+    if isinstance(operation, ResizeDataset):
+        return {u"operation": u"resize_dataset",
+                u"dataset_id": unicode(operation.dataset_id),
+                u"maximum_size": operation.maximum_size}
+    if isinstance(operation, DeleteDataset):
+        return {u"operation": u"delete_dataset",
+                u"dataset_id": unicode(operation.dataset_id)}
+    if isinstance(operation, AcquireLease):
+        return {u"operation": u"acquire_lease",
+                u"dataset_id": unicode(operation.dataset_id),
+                u"node_uuid": unicode(operation.node_uuid),
+                u"expires": operation.expires}
+    if isinstance(operation, ReleaseLease):
+        return {u"operation": u"release_lease",
+                u"dataset_id": unicode(operation.dataset_id)}
+    raise TypeError("Not a batch operation: {!r}".format(operation))
+
+
 class DatasetsConfiguration(PClass):
     """
     Currently configured datasets.
@@ -236,6 +358,28 @@ class DatasetsConfiguration(PClass):
         return self.datasets.itervalues()
 
 
+def _dataset_matches(dataset, dataset_id=None, primary=None, metadata=None):
+    """
+    :param dataset: A ``Dataset`` or ``DatasetState``.
+    :param dataset_id: If not ``None``, the ``UUID`` the dataset must have.
+    :param primary: If not ``None``, the ``UUID`` of the node the dataset
+        must be on.
+    :param metadata: If not ``None``, a mapping between unicode keys and
+        values which the dataset's metadata must include.
+
+    :return bool: Whether the dataset matches the filters.
+    """
+    if dataset_id is not None and dataset.dataset_id != dataset_id:
+        return False
+    if primary is not None and dataset.primary != primary:
+        return False
+    if metadata:
+        for key, value in metadata.items():
+            if dataset.metadata.get(key) != value:
+                return False
+    return True
+
+
 class IFlockerAPIV1Client(Interface):
     """
     The Flocker REST API v1 client.
@@ -288,18 +432,36 @@ class IFlockerAPIV1Client(Interface):
         been deleted, after the configuration has been updated.
         """
 
-    def list_datasets_configuration():
+    def list_datasets_configuration(dataset_id=None, primary=None,
+                                    metadata=None, page_size=None):
         """
         Return the configured datasets, excluding any datasets that
         have been deleted.
 
+        :param dataset_id: If not ``None``, only return the dataset with
+            this ``UUID``.
+        :param primary: If not ``None``, only return datasets on the node
+            with this ``UUID``.
+        :param metadata: If not ``None``, a mapping between unicode keys and
+            values; only return datasets whose metadata includes all of
+            them.
+        :param page_size: If not ``None``, the maximum number of datasets to
+            retrieve in each request to the server.
+
         :return: ``Deferred`` firing with a ``DatasetsConfiguration``.
         """
 
-    def list_datasets_state():
+    def list_datasets_state(dataset_id=None, primary=None, page_size=None):
         """
         Return the actual datasets in the cluster.
 
+        :param dataset_id: If not ``None``, only return the dataset with
+            this ``UUID``.
+        :param primary: If not ``None``, only return datasets on the node
+            with this ``UUID``.
+        :param page_size: If not ``None``, the maximum number of datasets to
+            retrieve in each request to the server.
+
         :return: ``Deferred`` firing with iterable of ``DatasetState``.
         """
 
@@ -329,6 +491,22 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with the released ``Lease`` on success.
         """
 
+    def apply_batch(operations, atomic=False, configuration_tag=None):
+        """
+        Apply many changes to the configuration at once.
+
+        :param operations: Sequence of ``CreateDataset``, ``MoveDataset``,
+            ``ResizeDataset``, ``DeleteDataset``, ``AcquireLease`` and
+            ``ReleaseLease`` instances, applied in order.
+        :param bool atomic: If true, the configuration is only changed if
+            every operation succeeds.
+        :param configuration_tag: If not ``None``, should be
+            ``DatasetsConfiguration.tag``.
+
+        :return: ``Deferred`` firing with a ``BatchResult`` after the
+            configuration has been updated.
+        """
+
     def list_leases():
         """
         Return current leases.
@@ -336,6 +514,30 @@ class IFlockerAPIV1Client(Interface):
         :return: ``Deferred`` firing with a list of ``Lease`` instance.
         """
 
+    def watch_configuration(tag=None):
+        """
+        Wait for the configuration to change.
+
+        :param tag: ``None``, or a tag from an earlier call identifying the
+            configuration to wait for a change from.
+
+        :return: ``Deferred`` firing with a tag identifying the current
+            configuration; immediately if ``tag`` is ``None``, otherwise
+            once the configuration has changed since ``tag``.
+        """
+
+    def watch_state(tag=None):
+        """
+        Wait for the cluster state to change.
+
+        :param tag: ``None``, or a tag from an earlier call identifying the
+            cluster state to wait for a change from.
+
+        :return: ``Deferred`` firing with a tag identifying the current
+            cluster state; immediately if ``tag`` is ``None``, otherwise
+            once the cluster state has changed since ``tag``.
+        """
+
     def version():
         """
         Return current version.
@@ -367,8 +569,13 @@ class IFlockerAPIV1Client(Interface):
             exists.
         """
 
-    def list_containers_configuration():
+    def list_containers_configuration(node_uuid=None, page_size=None):
         """
+        :param node_uuid: If not ``None``, only return containers on the
+            node with this ``UUID``.
+        :param page_size: If not ``None``, the maximum number of containers
+            to retrieve in each request to the server.
+
         :return: ``Deferred`` firing with ``iterable`` of ``Container``.
         """
 
@@ -410,6 +617,7 @@ class FakeFlockerClient(object):
             nodes = []
         self._nodes = nodes
         self._this_node_uuid = this_node_uuid
+        self._watchers = []
         self.synchronize_state()
 
     def _ensure_matching_tag(self, configuration_tag):
@@ -438,6 +646,7 @@ class FakeFlockerClient(object):
                          dataset_id=dataset_id, metadata=metadata)
         self._configured_datasets = self._configured_datasets.set(
             dataset_id, result)
+        self._notify_watchers()
         return succeed(result)
 
     def delete_dataset(self, dataset_id, configuration_tag=None):
@@ -449,6 +658,7 @@ class FakeFlockerClient(object):
         dataset = self._configured_datasets[dataset_id]
         self._configured_datasets = self._configured_datasets.remove(
             dataset_id)
+        self._notify_watchers()
         return succeed(dataset)
 
     def move_dataset(self, primary, dataset_id, configuration_tag=None):
@@ -459,17 +669,27 @@ class FakeFlockerClient(object):
 
         self._configured_datasets = self._configured_datasets.transform(
             [dataset_id, "primary"], primary)
+        self._notify_watchers()
         return succeed(self._configured_datasets[dataset_id])
 
-    def list_datasets_configuration(self):
+    def list_datasets_configuration(self, dataset_id=None, primary=None,
+                                    metadata=None, page_size=None):
         return succeed(DatasetsConfiguration(
             # Since the tag is opaque object, using the actual configuration
             # is a fine way to have a matching tag.
             tag=self._configured_datasets,
-            datasets=self._configured_datasets))
-
-    def list_datasets_state(self):
-        return succeed(self._state_datasets)
+            datasets={
+                key: dataset
+                for (key, dataset) in self._configured_datasets.items()
+                if _dataset_matches(dataset, dataset_id, primary, metadata)
+            }))
+
+    def list_datasets_state(self, dataset_id=None, primary=None,
+                            page_size=None):
+        return succeed([
+            dataset for dataset in self._state_datasets
+            if _dataset_matches(dataset, dataset_id, primary)
+        ])
 
     def synchronize_state(self):
         """
@@ -492,6 +712,7 @@ class FakeFlockerClient(object):
                 volumes=container.volumes,
             ) for container in self._configured_containers.values()
         ]
+        self._notify_watchers()
 
     def acquire_lease(self, dataset_id, node_uuid, expires):
         try:
@@ -499,6 +720,7 @@ class FakeFlockerClient(object):
                 self._NOW, dataset_id, node_uuid, expires)
         except LeaseError:
             return fail(LeaseAlreadyHeld())
+        self._notify_watchers()
         return succeed(
             Lease(dataset_id=dataset_id, node_uuid=node_uuid, expires=expires))
 
@@ -508,11 +730,67 @@ class FakeFlockerClient(object):
         # expand this logic.
         lease = self._leases[dataset_id]
         self._leases = self._leases.release(dataset_id, lease.node_id)
+        self._notify_watchers()
         return succeed(
             Lease(dataset_id=dataset_id, node_uuid=lease.node_id,
                   expires=((lease.expiration - self._NOW).total_seconds()
                            if lease.expiration is not None else None)))
 
+    def _resize_dataset(self, dataset_id, maximum_size):
+        """
+        Change the maximum size of a dataset.
+        """
+        self._configured_datasets = self._configured_datasets.transform(
+            [dataset_id, "maximum_size"], maximum_size)
+        self._notify_watchers()
+        return succeed(self._configured_datasets[dataset_id])
+
+    def _apply_batch_operation(self, operation):
+        """
+        :param operation: A batch operation, e.g. ``CreateDataset``.
+        :return: ``Deferred`` firing with the result of the operation.
+        """
+        if isinstance(operation, CreateDataset):
+            return self.create_dataset(
+                operation.primary, operation.maximum_size,
+                operation.dataset_id, operation.metadata)
+        if isinstance(operation, MoveDataset):
+            return self.move_dataset(operation.primary, operation.dataset_id)
+        if isinstance(operation, ResizeDataset):
+            return self._resize_dataset(
+                operation.dataset_id, operation.maximum_size)
+        if isinstance(operation, DeleteDataset):
+            return self.delete_dataset(operation.dataset_id)
+        if isinstance(operation, AcquireLease):
+            return self.acquire_lease(
+                operation.dataset_id, operation.node_uuid, operation.expires)
+        if isinstance(operation, ReleaseLease):
+            return self.release_lease(operation.dataset_id)
+        raise TypeError("Not a batch operation: {!r}".format(operation))
+
+    def apply_batch(self, operations, atomic=False, configuration_tag=None):
+        try:
+            self._ensure_matching_tag(configuration_tag)
+        except:
+            return fail()
+
+        original = self._configured_datasets, self._leases
+        # Watchers only see the outcome of the whole batch:
+        watchers, self._watchers = self._watchers, []
+        results = []
+        for operation in operations:
+            d = maybeDeferred(self._apply_batch_operation, operation)
+            d.addErrback(lambda failure: failure.value)
+            d.addCallback(results.append)
+        committed = True
+        if atomic and any(isinstance(result, Exception)
+                          for result in results):
+            self._configured_datasets, self._leases = original
+            committed = False
+        self._watchers = watchers
+        self._notify_watchers()
+        return succeed(BatchResult(committed=committed, results=results))
+
     def list_leases(self):
         return succeed([
             Lease(dataset_id=l.dataset_id, node_uuid=l.node_id,
@@ -540,21 +818,75 @@ class FakeFlockerClient(object):
         self._configured_containers = self._configured_containers.set(
             name, result
         )
+        self._notify_watchers()
         return succeed(result)
 
-    def list_containers_configuration(self):
-        return succeed(self._configured_containers.values())
+    def list_containers_configuration(self, node_uuid=None, page_size=None):
+        return succeed([
+            container for container in self._configured_containers.values()
+            if node_uuid is None or container.node_uuid == node_uuid
+        ])
 
     def list_containers_state(self):
         return succeed(self._state_containers)
 
     def delete_container(self, name):
         self._configured_containers = self._configured_containers.remove(name)
+        self._notify_watchers()
         return succeed(None)
 
     def this_node_uuid(self):
         return succeed(self._this_node_uuid)
 
+    def _configuration_tag(self):
+        """
+        :return: A tag identifying the current configuration.
+        """
+        # As with ``list_datasets_configuration``, the configuration itself
+        # makes a fine opaque tag:
+        return (self._configured_datasets, self._configured_containers,
+                self._leases)
+
+    def _state_tag(self):
+        """
+        :return: A tag identifying the current cluster state.
+        """
+        return (tuple(self._state_datasets), tuple(self._state_containers))
+
+    def _watch(self, get_tag, tag):
+        """
+        :param get_tag: ``_configuration_tag`` or ``_state_tag``.
+        :param tag: ``None`` or a tag returned by ``get_tag``.
+
+        :return: ``Deferred`` firing with the current result of ``get_tag``
+            once it differs from ``tag``.
+        """
+        current = get_tag()
+        if tag is None or current != tag:
+            return succeed(current)
+        waiting = Deferred(lambda _: self._watchers.remove(watcher))
+        watcher = (get_tag, tag, waiting)
+        self._watchers.append(watcher)
+        return waiting
+
+    def _notify_watchers(self):
+        """
+        Fire the ``Deferred``\ s of the watchers whose tags have changed.
+        """
+        watchers, self._watchers = self._watchers, []
+        for (get_tag, tag, waiting) in watchers:
+            current = get_tag()
+            if current != tag:
+                waiting.callback(current)
+            else:
+                self._watchers.append((get_tag, tag, waiting))
+
+    def watch_configuration(self, tag=None):
+        return self._watch(self._configuration_tag, tag)
+
+    def watch_state(self, tag=None):
+        return self._watch(self._state_tag, tag)
+
 
 class ResponseError(Exception):
     """
@@ -673,6 +1005,50 @@ class FlockerClient(object):
         return self._request_with_headers(*args, **kwargs).addCallback(
             lambda t: t[0])
 
+    def _list(self, path, arguments, page_size=None):
+        """
+        Retrieve a listing from the Flocker API, following the cursors of its
+        pages if it is paged.
+
+        :param bytes path: Path of the listing to add to base URL.
+        :param list arguments: ``(name, value)`` tuples of ``unicode`` query
+            arguments selecting the items to list.
+        :param page_size: If not ``None``, the maximum number of items to
+            retrieve in each request.
+
+        :return: ``Deferred`` firing with a tuple of (``list`` of decoded
+            items, headers of the response to the first request).
+        """
+        if page_size is not None:
+            arguments = arguments + [(u"limit", unicode(page_size))]
+        items = []
+        first_headers = []
+
+        def get_page(cursor):
+            page_arguments = arguments
+            if cursor is not None:
+                page_arguments = page_arguments + [(u"cursor", cursor)]
+            page_path = path
+            if page_arguments:
+                page_path += b"?" + urlencode([
+                    (name.encode("utf-8"), value.encode("utf-8"))
+                    for (name, value) in page_arguments
+                ])
+            d = self._request_with_headers(b"GET", page_path, None, {OK})
+            d.addCallback(got_page)
+            return d
+
+        def got_page((page, headers)):
+            if not first_headers:
+                first_headers.append(headers)
+            items.extend(page)
+            cursor = headers.getRawHeaders(NEXT_CURSOR_HEADER, [None])[0]
+            if cursor is None:
+                return items, first_headers[0]
+            return get_page(cursor.decode("utf-8"))
+
+        return get_page(None)
+
     def _parse_configuration_dataset(self, dataset_dict):
         """
         Convert a dictionary decoded from JSON with a dataset's configuration.
@@ -718,25 +1094,45 @@ class FlockerClient(object):
         request.addCallback(self._parse_configuration_dataset)
         return request
 
-    def list_datasets_configuration(self):
-        request = self._request_with_headers(
-            b"GET", b"/configuration/datasets", None, {OK})
+    def list_datasets_configuration(self, dataset_id=None, primary=None,
+                                    metadata=None, page_size=None):
+        arguments = []
+        if dataset_id is not None:
+            arguments.append((u"dataset_id", unicode(dataset_id)))
+        if primary is not None:
+            arguments.append((u"primary", unicode(primary)))
+        if metadata:
+            arguments.extend(
+                (u"metadata", u"{}={}".format(key, value))
+                for (key, value) in sorted(metadata.items()))
+        request = self._list(b"/configuration/datasets", arguments, page_size)
+
         # In order to accomodate the client running against older versions of
         # flocker, put an artificial tag of None in if we are running against
-        # an older server.
-        request.addCallback(
-            lambda (results, headers):
-            DatasetsConfiguration(
+        # an older server.  Older servers also ignore the filters, so they're
+        # applied again here.
+        def got_results((results, headers)):
+            datasets = (self._parse_configuration_dataset(d)
+                        for d in results if not d['deleted'])
+            return DatasetsConfiguration(
                 tag=headers.getRawHeaders('X-Configuration-Tag', [None])[0],
                 datasets={
-                    UUID(d['dataset_id']): self._parse_configuration_dataset(d)
-                    for d in results if not d['deleted']
+                    dataset.dataset_id: dataset for dataset in datasets
+                    if _dataset_matches(
+                        dataset, dataset_id, primary, metadata)
                 })
-        )
+        request.addCallback(got_results)
         return request
 
-    def list_datasets_state(self):
-        request = self._request(b"GET", b"/state/datasets", None, {OK})
+    def list_datasets_state(self, dataset_id=None, primary=None,
+                            page_size=None):
+        arguments = []
+        if dataset_id is not None:
+            arguments.append((u"dataset_id", unicode(dataset_id)))
+        if primary is not None:
+            arguments.append((u"primary", unicode(primary)))
+        request = self._list(b"/state/datasets", arguments, page_size)
+        request.addCallback(lambda (results, headers): results)
 
         def parse_dataset_state(dataset_dict):
             primary = dataset_dict.get(u"primary")
@@ -752,7 +1148,10 @@ class FlockerClient(object):
                                 path=path)
 
         request.addCallback(
-            lambda results: [parse_dataset_state(d) for d in results])
+            lambda results: [
+                dataset for dataset in map(parse_dataset_state, results)
+                if _dataset_matches(dataset, dataset_id, primary)
+            ])
         return request
 
     def _parse_lease(self, dictionary):
@@ -783,6 +1182,47 @@ class FlockerClient(object):
         request.addCallback(self._parse_lease)
         return request
 
+    def _parse_batch_result(self, operation, result):
+        """
+        Parse the result of one operation of a batch.
+
+        :param operation: The batch operation, e.g. ``CreateDataset``.
+        :param dict result: The result given for it, with the response code
+            as ``code`` and the decoded body as ``result``.
+
+        :return: ``Dataset`` or ``Lease``, or an exception if the operation
+            failed.
+        """
+        code, body = result[u"code"], result[u"result"]
+        lease_operation = isinstance(operation, (AcquireLease, ReleaseLease))
+        if code == CONFLICT:
+            if isinstance(operation, CreateDataset):
+                return DatasetAlreadyExists(body)
+            if isinstance(operation, AcquireLease):
+                return LeaseAlreadyHeld(body)
+        if code not in {OK, CREATED}:
+            return ResponseError(code, body)
+        if lease_operation:
+            return self._parse_lease(body)
+        return self._parse_configuration_dataset(body)
+
+    def apply_batch(self, operations, atomic=False, configuration_tag=None):
+        operations = list(operations)
+        request = self._request(
+            b"POST", b"/configuration/batch",
+            {u"operations": [_batch_operation_json(operation)
+                             for operation in operations],
+             u"atomic": atomic},
+            {OK}, {PRECONDITION_FAILED: ConfigurationChanged},
+            configuration_tag=configuration_tag)
+        request.addCallback(
+            lambda batch: BatchResult(
+                committed=batch[u"committed"],
+                results=[self._parse_batch_result(operation, result)
+                         for (operation, result)
+                         in zip(operations, batch[u"results"])]))
+        return request
+
     def list_leases(self):
         request = self._request(
             b"GET", b"/configuration/leases", None, {OK})
@@ -831,12 +1271,18 @@ class FlockerClient(object):
         d.addCallback(self._parse_configuration_container)
         return d
 
-    def list_containers_configuration(self):
-        d = self._request(b"GET", b"/configuration/containers", None, {OK})
+    def list_containers_configuration(self, node_uuid=None, page_size=None):
+        arguments = []
+        if node_uuid is not None:
+            arguments.append((u"node_uuid", unicode(node_uuid)))
+        d = self._list(b"/configuration/containers", arguments, page_size)
         d.addCallback(
-            lambda containers: list(
-                self._parse_configuration_container(container_dict)
-                for container_dict in containers
+            lambda (containers, headers): list(
+                container for container in (
+                    self._parse_configuration_container(container_dict)
+                    for container_dict in containers
+                )
+                if node_uuid is None or container.node_uuid == node_uuid
             )
         )
         return d
@@ -905,6 +1351,36 @@ class FlockerClient(object):
         request.addCallback(lambda result: UUID(result["uuid"]))
         return request
 
+    def _watch(self, name, tag):
+        """
+        Wait for the tag of the configuration or the cluster state to change.
+
+        :param unicode name: ``u"configuration"`` or ``u"state"``.
+        :param tag: ``None``, or the ``unicode`` tag to wait for a change
+            from.
+
+        :return: ``Deferred`` firing with the new ``unicode`` tag.
+        """
+        path = b"/watch"
+        if tag is not None:
+            path += b"?" + urlencode([
+                (name.encode("utf-8"), tag.encode("utf-8"))])
+        request = self._request(b"GET", path, None, {OK})
+
+        def got_tags(tags):
+            if tags[name] == tag:
+                # The server stopped waiting before anything changed:
+                return self._watch(name, tag)
+            return tags[name]
+        request.addCallback(got_tags)
+        return request
+
+    def watch_configuration(self, tag=None):
+        return self._watch(u"configuration", tag)
+
+    def watch_state(self, tag=None):
+        return self._watch(u"state", tag)
+
 
 def conditional_create(client, reactor, condition, *args, **kwargs):
     """
@@ -949,3 +1425,97 @@ def conditional_create(client, reactor, condition, *args, **kwargs):
                           [0.001] * 19))
         result.addActionFinish()
         return result.result
+
+
+def conditional_apply_batch(client, reactor, condition, operations):
+    """
+    Apply a batch of changes to the configuration only if a certain condition
+    is true for the configuration, and only if every change succeeds.
+
+    This is the batch variant of ``conditional_create``: if the
+    configuration changes between the check and the batch being applied,
+    the whole check-and-apply will be retried, up to 20 times.
+
+    :param client: ``IFlockerAPIV1Client`` provider.
+    :param reactor: ``IReactorTime`` provider.
+    :param condition: Callable which will be called with the current
+        ``DatasetsConfiguration`` retrieved from the server. If this
+        raises an exception then the batch will be aborted.
+    :param operations: Batch operations, as accepted by
+        ``IFlockerAPIV1Client.apply_batch``.
+
+    :return: ``Deferred`` firing with the ``list`` of results of the
+        operations if they all succeeded, or failing with the relevant
+        exception if the batch was not applied.
+    """
+    context = _LOG_CONDITIONAL_APPLY_BATCH()
+    operations = list(operations)
+
+    def apply_batch():
+        d = client.list_datasets_configuration()
+
+        def got_config(config):
+            condition(config)
+            return deferLater(reactor, 0.001, context.run,
+                              client.apply_batch, operations, atomic=True,
+                              configuration_tag=config.tag)
+        d.addCallback(got_config)
+
+        def applied(batch):
+            for result in batch.results:
+                if isinstance(result, Exception):
+                    raise result
+            return batch.results
+        d.addCallback(applied)
+        return d
+
+    with context.context():
+        result = DeferredContext(
+            retry_failure(reactor, apply_batch, [ConfigurationChanged],
+                          [0.001] * 19))
+        result.addActionFinish()
+        return result.result
+
+
+def wait_for_state(client, reactor, predicate, steps=None):
+    """
+    Call a function, and call it again each time the cluster state changes
+    until it returns a true value.
+
+    This is a replacement for polling the cluster state with
+    ``loop_until`` which doesn't load the control service, and which
+    notices changes as soon as they happen.  Control services too old to
+    support waiting for changes are polled with ``loop_until`` instead.
+
+    :param client: ``IFlockerAPIV1Client`` provider.
+    :param reactor: The reactor to poll with.
+    :param predicate: Callable taking no arguments and returning a value,
+        or a ``Deferred`` firing with one.
+    :param steps: The delays between calls when polling, as for
+        ``loop_until``.
+
+    :return: ``Deferred`` firing with the first true value returned by
+        ``predicate``.
+    """
+    def poll(failure):
+        failure.trap(ResponseError)
+        if failure.value.code != NOT_FOUND:
+            return failure
+        # The control service has no watch endpoint:
+        return loop_until(reactor, predicate, steps)
+
+    def check(tag):
+        d = maybeDeferred(predicate)
+
+        def checked(result):
+            if result:
+                return result
+            watching = client.watch_state(tag)
+            watching.addCallbacks(check, poll)
+            return watching
+        d.addCallback(checked)
+        return d
+
+    d = client.watch_state()
+    d.addCallbacks(check, poll)
+    return d
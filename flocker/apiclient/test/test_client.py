@@ -4,6 +4,7 @@
 Tests for the Flocker REST API client.
 """
 
+from itertools import repeat
 from uuid import uuid4, UUID
 from unittest import skipUnless
 from subprocess import check_output
@@ -20,11 +21,13 @@ from eliot import ActionType
 from eliot.testing import capture_logging, assertHasAction, LoggedAction
 
 from twisted.python.filepath import FilePath
-from twisted.internet.task import Clock
+from twisted.internet.task import Clock, LoopingCall, deferLater
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ServerEndpoint
-from twisted.web.http import BAD_REQUEST
-from twisted.internet.defer import gatherResults
+from twisted.web.http import BAD_REQUEST, NOT_FOUND
+from twisted.internet.defer import (
+    gatherResults, maybeDeferred, CancelledError, fail,
+)
 from twisted.python.runtime import platform
 from twisted.python.procutils import which
 
@@ -34,6 +37,9 @@ from .._client import (
     Lease, LeaseAlreadyHeld, Node, Container, ContainerAlreadyExists,
     DatasetsConfiguration, ConfigurationChanged, conditional_create,
     _LOG_CONDITIONAL_CREATE, ContainerState, MountedDataset,
+    CreateDataset, MoveDataset, ResizeDataset, DeleteDataset, AcquireLease,
+    ReleaseLease, BatchResult, conditional_apply_batch,
+    _LOG_CONDITIONAL_APPLY_BATCH, wait_for_state,
 )
 from ...ca import rest_api_context_factory
 from ...ca.testtools import get_credential_sets
@@ -42,7 +48,8 @@ from ...testtools import (
 )
 from ...control._persistence import ConfigurationPersistenceService
 from ...control._clusterstate import ClusterStateService
-from ...control.httpapi import create_api_service
+from ...control.testtools import EagerClock
+from ...control.httpapi import create_api_service, DEFAULT_WATCH_TIMEOUT
 from ...control import (
     NodeState, NonManifestDatasets, Dataset as ModelDataset, ChangeSource,
     DockerImage, UpdateNodeStateEra,
@@ -104,6 +111,91 @@ def make_clientv1_tests():
             creating.addCallback(created)
             return creating
 
+        def create_datasets_for_filtering(self):
+            """
+            Create two datasets on ``node_1`` and one on ``node_2`` with
+            differing metadata.
+
+            :return: ``Deferred`` firing with a ``list`` of the created
+                ``Dataset`` instances.
+            """
+            return gatherResults([
+                self.client.create_dataset(
+                    primary=primary, maximum_size=DATASET_SIZE,
+                    metadata=metadata)
+                for (primary, metadata) in [
+                    (self.node_1.uuid, {u"name": u"alpha", u"tier": u"gold"}),
+                    (self.node_1.uuid, {u"name": u"beta", u"tier": u"gold"}),
+                    (self.node_2.uuid, {u"name": u"gamma"}),
+                ]
+            ])
+
+        def test_list_dataset_configuration_filtered(self):
+            """
+            ``list_datasets_configuration`` only lists the datasets matching
+            the given ``dataset_id``, ``primary`` and ``metadata``, and the
+            tag is that of the whole configuration.
+            """
+            d = self.create_datasets_for_filtering()
+
+            def created(datasets):
+                def listed(kwargs):
+                    listing = self.client.list_datasets_configuration(
+                        **kwargs)
+                    listing.addCallback(
+                        lambda result: (result.tag, set(result)))
+                    return listing
+
+                return gatherResults([
+                    listed(dict(dataset_id=datasets[1].dataset_id)),
+                    listed(dict(primary=self.node_2.uuid)),
+                    listed(dict(metadata={u"tier": u"gold"})),
+                    listed(dict(primary=self.node_1.uuid,
+                                metadata={u"name": u"gamma"})),
+                    listed(dict(page_size=1)),
+                ]).addCallback(
+                    self.assertEqual,
+                    [(self.get_configuration_tag(), expected) for expected in [
+                        {datasets[1]},
+                        {datasets[2]},
+                        {datasets[0], datasets[1]},
+                        set(),
+                        set(datasets),
+                    ]]
+                )
+            d.addCallback(created)
+            return d
+
+        def test_list_dataset_state_filtered(self):
+            """
+            ``list_datasets_state`` only lists the datasets matching the given
+            ``dataset_id`` and ``primary``.
+            """
+            d = self.create_datasets_for_filtering()
+
+            def created(datasets):
+                self.synchronize_state()
+
+                def listed(kwargs):
+                    listing = self.client.list_datasets_state(**kwargs)
+                    listing.addCallback(
+                        lambda states: sorted(
+                            state.dataset_id for state in states))
+                    return listing
+
+                return gatherResults([
+                    listed(dict(dataset_id=datasets[0].dataset_id)),
+                    listed(dict(primary=self.node_2.uuid)),
+                    listed(dict(page_size=2)),
+                ]).addCallback(
+                    self.assertEqual,
+                    [[datasets[0].dataset_id],
+                     [datasets[2].dataset_id],
+                     sorted(dataset.dataset_id for dataset in datasets)]
+                )
+            d.addCallback(created)
+            return d
+
         def assert_creates(self, client, dataset_id=None, maximum_size=None,
                            configuration_tag=None, **create_kwargs):
             """
@@ -443,6 +535,177 @@ def make_clientv1_tests():
                 dataset_id, self.node_2.uuid, None))
             return self.assertFailure(d, LeaseAlreadyHeld)
 
+        def test_apply_batch(self):
+            """
+            ``apply_batch`` returns a ``Deferred`` firing with the result of
+            each operation, and the changes are all made to the
+            configuration.
+            """
+            first = Dataset(dataset_id=uuid4(), primary=self.node_1.uuid,
+                            maximum_size=DATASET_SIZE,
+                            metadata={u"name": u"first"})
+            second = Dataset(dataset_id=uuid4(), primary=self.node_2.uuid,
+                             maximum_size=None)
+            lease = Lease(dataset_id=first.dataset_id,
+                          node_uuid=self.node_1.uuid, expires=None)
+            d = self.client.apply_batch([
+                CreateDataset(primary=first.primary,
+                              dataset_id=first.dataset_id,
+                              maximum_size=first.maximum_size,
+                              metadata=first.metadata),
+                CreateDataset(primary=second.primary,
+                              dataset_id=second.dataset_id),
+                AcquireLease(dataset_id=lease.dataset_id,
+                             node_uuid=lease.node_uuid, expires=None),
+            ])
+            d.addCallback(
+                self.assertEqual,
+                BatchResult(committed=True, results=[first, second, lease]))
+            d.addCallback(lambda _: gatherResults([
+                self.client.list_datasets_configuration(),
+                self.client.list_leases()]))
+            d.addCallback(
+                lambda (datasets, leases): self.assertEqual(
+                    ({first, second}, [lease]),
+                    (set(datasets), leases)))
+            return d
+
+        def test_apply_batch_sequential(self):
+            """
+            Each operation of a batch applies to the configuration changed by
+            the previous ones.
+            """
+            dataset = Dataset(dataset_id=uuid4(), primary=self.node_1.uuid,
+                              maximum_size=None)
+            resized = dataset.set(maximum_size=DATASET_SIZE * 2)
+            moved = resized.set(primary=self.node_2.uuid)
+            lease = Lease(dataset_id=dataset.dataset_id,
+                          node_uuid=self.node_2.uuid, expires=None)
+            d = self.client.apply_batch([
+                CreateDataset(primary=dataset.primary,
+                              dataset_id=dataset.dataset_id),
+                ResizeDataset(dataset_id=dataset.dataset_id,
+                              maximum_size=resized.maximum_size),
+                MoveDataset(dataset_id=dataset.dataset_id,
+                            primary=moved.primary),
+                AcquireLease(dataset_id=dataset.dataset_id,
+                             node_uuid=lease.node_uuid, expires=None),
+                ReleaseLease(dataset_id=dataset.dataset_id),
+                DeleteDataset(dataset_id=dataset.dataset_id),
+            ])
+            d.addCallback(
+                self.assertEqual,
+                BatchResult(committed=True,
+                            results=[dataset, resized, moved, lease, lease,
+                                     moved]))
+            d.addCallback(
+                lambda _: self.client.list_datasets_configuration())
+            d.addCallback(
+                lambda datasets: self.assertEqual([], list(datasets)))
+            return d
+
+        def test_apply_batch_failure(self):
+            """
+            A failed operation's result is the exception describing the
+            failure, and the other operations still succeed.
+            """
+            dataset = Dataset(dataset_id=uuid4(), primary=self.node_1.uuid,
+                              maximum_size=None)
+            create = CreateDataset(primary=dataset.primary,
+                                   dataset_id=dataset.dataset_id)
+            d = self.client.apply_batch([create, create])
+
+            def applied(batch):
+                self.assertEqual(
+                    (True, dataset, DatasetAlreadyExists),
+                    (batch.committed, batch.results[0],
+                     batch.results[1].__class__))
+                return self.client.list_datasets_configuration()
+            d.addCallback(applied)
+            d.addCallback(
+                lambda datasets: self.assertEqual([dataset], list(datasets)))
+            return d
+
+        def test_apply_batch_atomic(self):
+            """
+            If an operation of an atomic batch fails none of the changes are
+            made.
+            """
+            create = CreateDataset(primary=self.node_1.uuid,
+                                   dataset_id=uuid4())
+            d = self.client.apply_batch([create, create], atomic=True)
+            d.addCallback(
+                lambda batch: self.assertFalse(batch.committed))
+            d.addCallback(
+                lambda _: self.client.list_datasets_configuration())
+            d.addCallback(
+                lambda datasets: self.assertEqual([], list(datasets)))
+            return d
+
+        def test_apply_batch_conflicting_tag(self):
+            """
+            ``apply_batch`` fails with ``ConfigurationChanged`` if the
+            configuration tag doesn't match.
+            """
+            d = self.client.apply_batch(
+                [CreateDataset(primary=self.node_1.uuid)],
+                configuration_tag=u"willnotmatch")
+            return self.assertFailure(d, ConfigurationChanged)
+
+        def test_watch_unchanged(self):
+            """
+            Without a tag ``watch_configuration`` and ``watch_state``
+            immediately return the same tags while nothing changes.
+            """
+            d = gatherResults([
+                self.client.watch_configuration(),
+                self.client.watch_state(),
+                self.client.watch_configuration(),
+                self.client.watch_state(),
+            ])
+            d.addCallback(
+                lambda tags: self.assertEqual(tags[:2], tags[2:]))
+            return d
+
+        def assert_watch_changes(self, watch, change):
+            """
+            Assert that a watch method returns a new tag after a change.
+
+            :param watch: ``watch_configuration`` or ``watch_state``.
+            :param change: Callable making a change, possibly returning a
+                ``Deferred``.
+
+            :return: ``Deferred`` firing when the assertion is done.
+            """
+            d = watch()
+
+            def got_tag(tag):
+                watching = watch(tag)
+                changed = gatherResults([watching, maybeDeferred(change)])
+                changed.addCallback(
+                    lambda (new_tag, _): self.assertNotEqual(tag, new_tag))
+                return changed
+            d.addCallback(got_tag)
+            return d
+
+        def test_watch_configuration(self):
+            """
+            ``watch_configuration`` returns a new tag once the configuration
+            changes.
+            """
+            return self.assert_watch_changes(
+                self.client.watch_configuration,
+                lambda: self.client.create_dataset(primary=self.node_1.uuid))
+
+        def test_watch_state(self):
+            """
+            ``watch_state`` returns a new tag once the cluster state changes.
+            """
+            d = self.client.create_dataset(primary=self.node_1.uuid)
+            d.addCallback(lambda _: self.assert_watch_changes(
+                self.client.watch_state, self.synchronize_state))
+            return d
+
         def test_version(self):
             """
             ``version`` returns a ``Deferred`` firing with a ``dict``
@@ -499,6 +762,32 @@ def make_clientv1_tests():
             d.addCallback(got_result)
             return d
 
+        def test_list_containers_configuration_filtered(self):
+            """
+            ``list_containers_configuration`` only lists the containers on
+            the node given by ``node_uuid``.
+            """
+            expected = []
+            creating = []
+            for _ in range(3):
+                container, d = create_container_for_test(self, self.client)
+                expected.append(container)
+                creating.append(d)
+            d = gatherResults(creating)
+            d.addCallback(
+                lambda _: gatherResults([
+                    self.client.list_containers_configuration(
+                        node_uuid=expected[1].node_uuid),
+                    self.client.list_containers_configuration(page_size=2),
+                ])
+            )
+            d.addCallback(
+                lambda (filtered, paged): self.assertEqual(
+                    ([expected[1]], set(expected)),
+                    (list(filtered), set(paged)))
+            )
+            return d
+
         def test_container_state(self):
             """
             ``list_containers_state`` returns information about state.
@@ -698,6 +987,43 @@ class FakeFlockerClientTests(make_clientv1_tests()):
     def get_configuration_tag(self):
         return self.client._configured_datasets
 
+    def test_watch_waits(self):
+        """
+        ``watch_state`` doesn't fire until the cluster state changes, and
+        configuration changes don't affect it.
+        """
+        tag = self.successResultOf(self.client.watch_state())
+        d = self.client.watch_state(tag)
+        self.client.create_dataset(primary=self.node_1.uuid)
+        self.assertNoResult(d)
+        self.client.synchronize_state()
+        self.assertNotEqual(tag, self.successResultOf(d))
+
+    def test_watch_batch(self):
+        """
+        ``watch_configuration`` doesn't fire for an atomic batch which isn't
+        applied.
+        """
+        tag = self.successResultOf(self.client.watch_configuration())
+        d = self.client.watch_configuration(tag)
+        self.client.apply_batch(
+            [CreateDataset(primary=self.node_1.uuid),
+             DeleteDataset(dataset_id=uuid4())],
+            atomic=True)
+        self.assertNoResult(d)
+
+    def test_watch_cancel(self):
+        """
+        A cancelled watch is forgotten, so later changes don't fire it
+        again.
+        """
+        tag = self.successResultOf(self.client.watch_configuration())
+        d = self.client.watch_configuration(tag)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.successResultOf(
+            self.client.create_dataset(primary=self.node_1.uuid))
+
 
 class FlockerClientTests(make_clientv1_tests()):
     """
@@ -714,7 +1040,7 @@ class FlockerClientTests(make_clientv1_tests()):
 
         :return: ``FlockerClient`` instance.
         """
-        clock = Clock()
+        self.api_clock = clock = EagerClock()
         _, self.port = find_free_port()
         self.persistence_service = ConfigurationPersistenceService(
             clock, FilePath(self.mktemp()))
@@ -797,6 +1123,38 @@ class FlockerClientTests(make_clientv1_tests()):
                                     dataset_id=unicode(dataset_id)))))
         return d
 
+    @capture_logging(None)
+    def test_watch_repeated(self, logger):
+        """
+        If the server stops waiting before there is a change ``watch_state``
+        asks it again.
+        """
+        d = self.client.watch_state()
+
+        def got_tag(tag):
+            watching = self.client.watch_state(tag)
+            # Make the server stop waiting a few times before changing the
+            # state:
+            advancing = LoopingCall(
+                self.api_clock.advance, DEFAULT_WATCH_TIMEOUT)
+            advancing.start(0.01)
+            changing = deferLater(
+                reactor, 0.2, self.cluster_state_service.apply_changes,
+                [NodeState(uuid=uuid4(), hostname=u"192.0.2.3")])
+
+            def changed((new_tag, _)):
+                advancing.stop()
+                requests = [
+                    action for action in LoggedAction.ofType(
+                        logger.messages, _LOG_HTTP_REQUEST)
+                    if b"/watch?" in action.startMessage[u"url"]
+                ]
+                self.assertEqual(
+                    (new_tag != tag, len(requests) > 1), (True, True))
+            return gatherResults([watching, changing]).addCallback(changed)
+        d.addCallback(got_tag)
+        return d
+
     @capture_logging(None)
     def test_cross_process_logging(self, logger):
         """
@@ -1006,3 +1364,175 @@ class ConditionalCreateTests(TestCase):
                 primary=self.node_id))
             self.advance()
         self.failureResultOf(d, ConfigurationChanged)
+
+
+class ConditionalApplyBatchTests(TestCase):
+    """
+    Tests for ``conditional_apply_batch``.
+    """
+    def setUp(self):
+        super(ConditionalApplyBatchTests, self).setUp()
+        self.client = FakeFlockerClient()
+        self.reactor = Clock()
+        self.node_id = uuid4()
+
+    def advance(self):
+        """
+        Advance the clock such that next step of process happens.
+        """
+        self.reactor.advance(0.001)
+
+    def list_datasets(self):
+        """
+        :return: ``set`` of the configured ``Dataset`` instances.
+        """
+        return set(self.successResultOf(
+            self.client.list_datasets_configuration()))
+
+    @capture_logging(assertHasAction, _LOG_CONDITIONAL_APPLY_BATCH, True)
+    def test_simple_success(self, logger):
+        """
+        If no configuration changes or condition violations occur the batch
+        is applied and the results of its operations are returned.
+        """
+        datasets = [Dataset(dataset_id=uuid4(), primary=self.node_id,
+                            maximum_size=None)
+                    for _ in range(2)]
+        d = conditional_apply_batch(
+            self.client, self.reactor, lambda config: None,
+            [CreateDataset(primary=self.node_id,
+                           dataset_id=dataset.dataset_id)
+             for dataset in datasets])
+        self.advance()
+        self.assertEqual((datasets, set(datasets)),
+                         (self.successResultOf(d), self.list_datasets()))
+
+    def test_condition_violation(self):
+        """
+        If the condition is violated the batch is aborted and the raised
+        exception is returned.
+        """
+        def condition(config):
+            raise CustomException()
+        self.failureResultOf(
+            conditional_apply_batch(
+                self.client, self.reactor, condition,
+                [CreateDataset(primary=self.node_id)]),
+            CustomException)
+        self.assertEqual(set(), self.list_datasets())
+
+    def test_operation_failure(self):
+        """
+        If an operation fails none of the changes are made and its exception
+        is returned.
+        """
+        existing = self.successResultOf(
+            self.client.create_dataset(primary=self.node_id))
+        d = conditional_apply_batch(
+            self.client, self.reactor, lambda config: None,
+            [CreateDataset(primary=self.node_id),
+             CreateDataset(primary=self.node_id,
+                           dataset_id=existing.dataset_id)])
+        self.advance()
+        self.failureResultOf(d, DatasetAlreadyExists)
+        self.assertEqual({existing}, self.list_datasets())
+
+    def test_eventual_success(self):
+        """
+        If the configuration changes between listing and applying the batch
+        the operation is retried until it succeeds.
+        """
+        d = conditional_apply_batch(
+            self.client, self.reactor, lambda config: None,
+            [CreateDataset(primary=self.node_id)])
+        # Change configuration in between listing and condition check:
+        self.successResultOf(self.client.create_dataset(primary=self.node_id))
+        # Applying, which should fail with ConfigurationChanged:
+        self.advance()
+        # List again:
+        self.advance()
+        # Apply again:
+        self.advance()
+        [created] = self.successResultOf(d)
+        self.assertIn(created, self.list_datasets())
+
+
+class WaitForStateTests(TestCase):
+    """
+    Tests for ``wait_for_state``.
+    """
+    def setUp(self):
+        super(WaitForStateTests, self).setUp()
+        self.client = FakeFlockerClient()
+        self.clock = Clock()
+        self.node_id = uuid4()
+
+    def predicate(self):
+        """
+        :return: A predicate which counts its calls in ``self.calls`` and
+            returns a ``Deferred`` firing with the datasets in the state.
+        """
+        self.calls = 0
+
+        def predicate():
+            self.calls += 1
+            return self.client.list_datasets_state()
+        return predicate
+
+    def test_immediate(self):
+        """
+        If the predicate is already true its value is returned.
+        """
+        created = self.successResultOf(
+            self.client.create_dataset(primary=self.node_id))
+        self.client.synchronize_state()
+        [state] = self.successResultOf(
+            wait_for_state(self.client, self.clock, self.predicate()))
+        self.assertEqual(
+            (state.dataset_id, self.calls), (created.dataset_id, 1))
+
+    def test_state_change(self):
+        """
+        The predicate is only called again when the state changes, and its
+        first true value is returned.
+        """
+        d = wait_for_state(self.client, self.clock, self.predicate())
+        created = self.successResultOf(
+            self.client.create_dataset(primary=self.node_id))
+        self.assertEqual(1, self.calls)
+        self.assertNoResult(d)
+        self.client.synchronize_state()
+        [state] = self.successResultOf(d)
+        self.assertEqual(
+            (state.dataset_id, self.calls), (created.dataset_id, 2))
+
+    def test_watch_not_found(self):
+        """
+        If the control service has no watch endpoint the predicate is polled
+        instead, at the given intervals.
+        """
+        self.patch(
+            self.client, "watch_state",
+            lambda tag=None: fail(ResponseError(NOT_FOUND, b"")))
+        d = wait_for_state(
+            self.client, self.clock, self.predicate(), repeat(1.0))
+        created = self.successResultOf(
+            self.client.create_dataset(primary=self.node_id))
+        self.client.synchronize_state()
+        self.assertEqual(1, self.calls)
+        self.clock.advance(1.0)
+        [state] = self.successResultOf(d)
+        self.assertEqual(
+            (state.dataset_id, self.calls), (created.dataset_id, 2))
+
+    def test_watch_error(self):
+        """
+        Errors from the watch endpoint other than it not being found are
+        passed on.
+        """
+        self.patch(
+            self.client, "watch_state",
+            lambda tag=None: fail(ResponseError(BAD_REQUEST, b"")))
+        self.failureResultOf(
+            wait_for_state(self.client, self.clock, self.predicate()),
+            ResponseError)
@@ -25,6 +25,7 @@ from ._retry import (
     get_default_retry_steps,
     retry_if, decorate_methods, with_retry,
 )
+from ._timerwheel import TimerWheel
 from .version import parse_version, UnparseableVersion
 
 
@@ -43,6 +44,8 @@ __all__ = [
     'DEVICEMAPPER_LOOPBACK_SIZE',
 
     'make_directory', 'make_file',
+
+    'TimerWheel',
 ]
 
 # This is currently set to the minimum size for a SATA based Rackspace Cloud
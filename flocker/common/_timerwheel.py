@@ -0,0 +1,191 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.common.test.test_timerwheel -*-
+
+"""
+Many coarse timers driven by a single periodic reactor call.
+
+Timers which are reset very often, such as idle timeouts reset whenever a
+connection receives anything, are expensive to implement as ``IDelayedCall``
+providers since each reset reorders the reactor's queue of delayed calls.  A
+``TimerWheel`` instead sorts its timers into slots of ``tick`` seconds and
+checks one slot per tick, so that resetting a timer only records its new
+deadline and timers due in the same tick are handled together.  The price is
+that timers fire up to ``tick`` seconds late.
+"""
+
+from math import ceil, floor
+
+from eliot import write_traceback
+
+from twisted.internet.task import LoopingCall
+
+# The default resolution of a ``TimerWheel``, in seconds:
+DEFAULT_TICK = 1.0
+
+
+class WheelTimer(object):
+    """
+    A timer scheduled using a ``TimerWheel``.
+
+    :ivar float deadline: The reactor time at which the timer is due.
+    :ivar _slot: The slot of the wheel which contains the timer, or ``None``
+        if the timer has fired or has been cancelled.
+    """
+    def __init__(self, wheel, delay, function, repeat):
+        """
+        :param TimerWheel wheel: The wheel the timer is scheduled on.
+        :param float delay: The number of seconds until the timer is due.
+        :param function: The function to call when the timer is due.
+        :param bool repeat: Whether to call the function every ``delay``
+            seconds rather than only once.
+        """
+        self._wheel = wheel
+        self._delay = delay
+        self._function = function
+        self._repeat = repeat
+        self._slot = None
+        self.deadline = wheel.seconds() + delay
+
+    def active(self):
+        """
+        :return bool: Whether the timer is still scheduled.
+        """
+        return self._slot is not None
+
+    def reset(self):
+        """
+        Postpone the timer so that it is due ``delay`` seconds from now.
+
+        This only records the new deadline, which the wheel takes into
+        account when it reaches the timer's current slot.
+        """
+        self.deadline = self._wheel.seconds() + self._delay
+
+    def cancel(self):
+        """
+        Unschedule the timer.
+        """
+        self._wheel._remove(self)
+
+
+class TimerWheel(object):
+    """
+    Schedule timers with a resolution of ``tick`` seconds using a single
+    ``LoopingCall``, which only runs while there are timers scheduled.
+
+    :ivar float _origin: The time at which the wheel was last started.
+    :ivar dict _slots: Map slot numbers to the ``set`` of ``WheelTimer``\ s
+        in that slot.  Slot ``n`` is checked ``n`` ticks after ``_origin``
+        and only contains timers which are due by then.
+    :ivar int _next_slot: The first slot which hasn't been checked yet.
+    """
+    def __init__(self, reactor, tick=DEFAULT_TICK):
+        """
+        :param IReactorTime reactor: The reactor used to tell the time and
+            run the wheel.
+        :param float tick: The resolution of the timers, in seconds.
+        """
+        self._reactor = reactor
+        self._tick = tick
+        self._slots = {}
+        self._origin = None
+        self._next_slot = None
+        self._looping_call = LoopingCall.withCount(self._advance)
+        self._looping_call.clock = reactor
+
+    def __len__(self):
+        return sum(len(timers) for timers in self._slots.itervalues())
+
+    def seconds(self):
+        """
+        :return float: The current time according to the reactor.
+        """
+        return self._reactor.seconds()
+
+    def call_later(self, delay, function):
+        """
+        Call a function once, ``delay`` seconds from now.
+
+        :param float delay: The number of seconds to wait.
+        :param function: The function to call with no arguments.
+
+        :return WheelTimer: The timer, which may be reset or cancelled.
+        """
+        timer = WheelTimer(self, delay, function, repeat=False)
+        self._insert(timer)
+        return timer
+
+    def call_repeatedly(self, interval, function):
+        """
+        Call a function every ``interval`` seconds, starting ``interval``
+        seconds from now.  As with ``LoopingCall``, calls which are missed are
+        skipped rather than made up for.
+
+        :param float interval: The number of seconds between calls.
+        :param function: The function to call with no arguments.
+
+        :return WheelTimer: The timer, which may be cancelled.
+        """
+        timer = WheelTimer(self, interval, function, repeat=True)
+        self._insert(timer)
+        return timer
+
+    def _insert(self, timer):
+        """
+        Add a timer to the slot for its deadline, starting the wheel if
+        necessary.
+        """
+        if not self._looping_call.running:
+            self._origin = self.seconds()
+            self._next_slot = 1
+            self._looping_call.start(self._tick, now=False)
+        slot = max(
+            int(ceil((timer.deadline - self._origin) / self._tick)),
+            self._next_slot,
+        )
+        self._slots.setdefault(slot, set()).add(timer)
+        timer._slot = slot
+
+    def _remove(self, timer):
+        """
+        Remove a timer from its slot.
+        """
+        timers = self._slots.get(timer._slot)
+        if timers is not None:
+            timers.discard(timer)
+            if not timers:
+                del self._slots[timer._slot]
+        timer._slot = None
+
+    def _advance(self, ticks):
+        """
+        Fire the timers which are due and reschedule the ones which have
+        been reset since they were put in their current slot.
+
+        :param int ticks: The number of ticks since the last call, which is
+            more than one if the reactor was too busy to make some calls.
+        """
+        now = self.seconds()
+        current_slot = self._next_slot + ticks - 1
+        for slot in xrange(self._next_slot, current_slot + 1):
+            timers = self._slots.pop(slot, ())
+            self._next_slot = slot + 1
+            for timer in timers:
+                if timer._slot != slot:
+                    # Cancelled by another timer's function.
+                    continue
+                if timer.deadline > now:
+                    self._insert(timer)
+                    continue
+                if timer._repeat:
+                    missed = floor((now - timer.deadline) / timer._delay)
+                    timer.deadline += (missed + 1) * timer._delay
+                    self._insert(timer)
+                else:
+                    timer._slot = None
+                try:
+                    timer._function()
+                except:
+                    write_traceback()
+        if not self._slots:
+            self._looping_call.stop()
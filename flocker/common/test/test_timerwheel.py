@@ -0,0 +1,160 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.common._timerwheel``.
+"""
+
+from eliot.testing import capture_logging
+
+from twisted.internet.task import Clock
+
+from .. import TimerWheel
+from ...testtools import TestCase
+
+
+class TimerWheelTests(TestCase):
+    """
+    Tests for ``TimerWheel``.
+    """
+    def setUp(self):
+        super(TimerWheelTests, self).setUp()
+        self.reactor = Clock()
+        self.wheel = TimerWheel(self.reactor, tick=1)
+        self.calls = []
+
+    def record(self, name):
+        """
+        :return: A function recording ``name`` and the time it was called in
+            ``self.calls``.
+        """
+        return lambda: self.calls.append((name, self.reactor.seconds()))
+
+    def test_call_later(self):
+        """
+        ``TimerWheel.call_later`` calls the function once when its delay has
+        passed.
+        """
+        self.wheel.call_later(5, self.record(u"a"))
+        self.reactor.advance(4)
+        before = list(self.calls)
+        self.reactor.pump([1] * 10)
+        self.assertEqual(([], [(u"a", 5)]), (before, self.calls))
+
+    def test_late_by_less_than_tick(self):
+        """
+        A timer whose deadline falls between ticks is called at the next
+        tick.
+        """
+        self.reactor.advance(0.5)
+        self.wheel.call_later(2, self.record(u"a"))
+        self.reactor.pump([0.25] * 20)
+        [(name, when)] = self.calls
+        self.assertTrue(2.5 <= when < 3.5, when)
+
+    def test_reset(self):
+        """
+        ``WheelTimer.reset`` postpones the call until the delay has passed
+        again.
+        """
+        timer = self.wheel.call_later(5, self.record(u"a"))
+        self.reactor.advance(3)
+        timer.reset()
+        self.reactor.pump([1] * 10)
+        self.assertEqual([(u"a", 8)], self.calls)
+
+    def test_cancel(self):
+        """
+        A cancelled timer is not called and is no longer active.
+        """
+        timer = self.wheel.call_later(5, self.record(u"a"))
+        timer.cancel()
+        self.reactor.pump([1] * 10)
+        self.assertEqual(([], False), (self.calls, timer.active()))
+
+    def test_call_repeatedly(self):
+        """
+        ``TimerWheel.call_repeatedly`` calls the function every interval
+        until it is cancelled.
+        """
+        timer = self.wheel.call_repeatedly(3, self.record(u"a"))
+        self.reactor.pump([1] * 10)
+        timer.cancel()
+        self.reactor.pump([1] * 10)
+        self.assertEqual([(u"a", 3), (u"a", 6), (u"a", 9)], self.calls)
+
+    def test_repeatedly_skips_missed(self):
+        """
+        Calls missed because the reactor was busy are skipped.
+        """
+        self.wheel.call_repeatedly(3, self.record(u"a"))
+        self.reactor.advance(10)
+        self.reactor.pump([1] * 3)
+        self.assertEqual([(u"a", 10), (u"a", 12)], self.calls)
+
+    def test_due_together(self):
+        """
+        All the timers due in the same tick are called in that tick.
+        """
+        for name in [u"a", u"b", u"c"]:
+            self.wheel.call_later(2, self.record(name))
+        self.reactor.pump([1] * 3)
+        self.assertEqual(
+            [(u"a", 2), (u"b", 2), (u"c", 2)], sorted(self.calls),
+        )
+
+    def test_cancelled_by_other_timer(self):
+        """
+        A timer cancelled by another timer due in the same tick is not
+        called.
+        """
+        timers = []
+
+        def cancel_others():
+            self.calls.append(self.reactor.seconds())
+            for timer in timers:
+                if timer.active():
+                    timer.cancel()
+        timers.extend([
+            self.wheel.call_later(2, cancel_others),
+            self.wheel.call_later(2, cancel_others),
+        ])
+        self.reactor.pump([1] * 3)
+        self.assertEqual([2], self.calls)
+
+    def test_stops_when_empty(self):
+        """
+        The wheel only has a delayed call scheduled while it has timers.
+        """
+        timer = self.wheel.call_repeatedly(3, self.record(u"a"))
+        self.wheel.call_later(2, self.record(u"b"))
+        running = len(self.reactor.getDelayedCalls())
+        timer.cancel()
+        self.reactor.pump([1] * 3)
+        self.assertEqual(
+            (1, [], 0),
+            (running, self.reactor.getDelayedCalls(), len(self.wheel)),
+        )
+
+    def test_restart(self):
+        """
+        Timers added after the wheel has stopped are called.
+        """
+        self.wheel.call_later(1, self.record(u"a"))
+        self.reactor.pump([1] * 3)
+        self.wheel.call_later(1, self.record(u"b"))
+        self.reactor.pump([1] * 3)
+        self.assertEqual([(u"a", 1), (u"b", 4)], self.calls)
+
+    @capture_logging(None)
+    def test_error(self, logger):
+        """
+        An exception raised by a timer's function is logged and doesn't stop
+        other timers being called.
+        """
+        self.wheel.call_later(1, lambda: 1 / 0)
+        self.wheel.call_later(1, self.record(u"a"))
+        self.reactor.pump([1] * 2)
+        self.assertEqual(
+            (1, [(u"a", 1)]),
+            (len(logger.flush_tracebacks(ZeroDivisionError)), self.calls),
+        )
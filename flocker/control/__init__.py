@@ -26,6 +26,7 @@ from ._model import (
 from ._protocol import (
     IConvergenceAgent,
     NodeStateCommand,
+    NodeStateDiffCommand,
     AgentAMP,
     SetNodeEraCommand,
     SetBlockDeviceIdForDatasetId,
@@ -33,6 +34,9 @@ from ._protocol import (
 from ._registry import (
     IStatePersister,
 )
+from ._scope import (
+    ClusterScope,
+)
 
 __all__ = [
     'same_node',
@@ -62,6 +66,7 @@ __all__ = [
 
     'IConvergenceAgent',
     'NodeStateCommand',
+    'NodeStateDiffCommand',
     'SetNodeEraCommand',
     'SetBlockDeviceIdForDatasetId',
     'AgentAMP',
@@ -73,4 +78,5 @@ __all__ = [
     'UpdateNodeStateEra',
     'NoWipe',
     'IStatePersister',
+    'ClusterScope',
 ]
@@ -0,0 +1,427 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_benchmarks -*-
+
+"""
+Synthetic workloads and measurements for benchmarking the control service
+in-process, without a real cluster.
+
+These are run using ``flocker-benchmark``.
+"""
+
+from json import dumps, loads
+from tempfile import mkdtemp
+from timeit import default_timer
+from uuid import UUID, uuid4
+
+from twisted.internet.base import ReactorBase
+from twisted.internet.task import LoopingCall
+from twisted.python.filepath import FilePath
+
+from ..common import TimerWheel
+
+from ._model import (
+    Application, Dataset, Deployment, DeploymentState, DockerImage,
+    Manifestation, Node, NodeState,
+)
+from ._persistence import (
+    wire_encode, wire_decode, migrate_configuration,
+    migrate_configuration_file, ConfigurationMigration, _CONFIG_VERSION,
+)
+from ._binary import binary_wire_encode, binary_wire_decode
+from ._protocol import PING_INTERVAL
+
+
+def synthetic_cluster(datasets, nodes=10):
+    """
+    Create a configuration and state with datasets spread evenly across
+    nodes, each dataset manifest on the node it is configured on.
+
+    :param int datasets: The total number of datasets.
+    :param int nodes: The number of nodes.
+
+    :return: A tuple of a ``Deployment`` and the matching
+        ``DeploymentState``.
+    """
+    configured_nodes = []
+    node_states = []
+    for node_index in range(nodes):
+        node_uuid = UUID(int=node_index + 1)
+        manifestations = {}
+        paths = {}
+        devices = {}
+        for dataset_index in range(node_index, datasets, nodes):
+            dataset_id = unicode(UUID(int=2 ** 64 + dataset_index))
+            manifestations[dataset_id] = Manifestation(
+                dataset=Dataset(
+                    dataset_id=dataset_id,
+                    maximum_size=1024 * 1024 * 1024,
+                    metadata={u"name": u"dataset-{}".format(dataset_index)},
+                ),
+                primary=True,
+            )
+            paths[dataset_id] = FilePath(b"/flocker").child(
+                dataset_id.encode("ascii"))
+            devices[UUID(dataset_id)] = FilePath(
+                b"/dev/xvd{}".format(dataset_index))
+        configured_nodes.append(
+            Node(uuid=node_uuid, manifestations=manifestations)
+        )
+        node_states.append(NodeState(
+            uuid=node_uuid, hostname=u"10.0.{}.{}".format(
+                node_index // 256, node_index % 256),
+            applications=[], manifestations=manifestations, paths=paths,
+            devices=devices,
+        ))
+    return (
+        Deployment(nodes=configured_nodes),
+        DeploymentState(
+            nodes=node_states,
+            node_uuid_to_era={node.uuid: uuid4() for node in node_states},
+        ),
+    )
+
+
+def best_time(function, repeat):
+    """
+    Call a function several times and measure the fastest call.
+
+    :param function: A function taking no arguments.
+    :param int repeat: The number of times to call it.
+
+    :return: A tuple of the fastest call's duration in seconds and the result
+        of the last call.
+    """
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        result = function()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+# The wire formats compared by ``benchmark_wire_format``:
+WIRE_FORMATS = [
+    (u"json", wire_encode, wire_decode),
+    (u"binary", binary_wire_encode, binary_wire_decode),
+]
+
+
+def benchmark_wire_format(datasets, nodes=10, repeat=3):
+    """
+    Compare the size and the encoding and decoding time of the JSON and
+    binary wire formats for a synthetic cluster.
+
+    :param int datasets: The number of datasets in the cluster.
+    :param int nodes: The number of nodes in the cluster.
+    :param int repeat: The number of times to repeat each measurement.
+
+    :return: A ``list`` of ``dict``\ s, one for each of the configuration and
+        the state in each wire format, giving the size in bytes and the
+        fastest encoding and decoding times in seconds.
+    """
+    configuration, state = synthetic_cluster(datasets, nodes)
+    results = []
+    for name, obj in [(u"configuration", configuration), (u"state", state)]:
+        for wire_format, encode, decode in WIRE_FORMATS:
+            encode_seconds, data = best_time(
+                lambda encode=encode, obj=obj: encode(obj), repeat)
+            decode_seconds, _ = best_time(
+                lambda decode=decode, data=data: decode(data), repeat)
+            results.append({
+                u"object": name,
+                u"format": wire_format,
+                u"datasets": datasets,
+                u"bytes": len(data),
+                u"encode_seconds": encode_seconds,
+                u"decode_seconds": decode_seconds,
+            })
+    return results
+
+
+class _SimulatedReactor(ReactorBase):
+    """
+    A reactor with a simulated clock, whose delayed calls are run by calling
+    ``runUntilCurrent``.  Unlike ``Clock`` it manages delayed calls the way
+    real reactors do, so the cost of that can be measured.
+
+    :ivar float now: The simulated time.
+    """
+    def __init__(self):
+        self.now = 0.0
+        ReactorBase.__init__(self)
+
+    def installWaker(self):
+        pass
+
+    def seconds(self):
+        return self.now
+
+
+def _delayed_call_timers(reactor, timeout, ping):
+    """
+    Schedule a connection's timeout and pings with their own delayed calls,
+    as ``ControlAMP`` and ``AgentAMP`` used to.
+
+    :return: A function resetting the timeout.
+    """
+    delayed_call = reactor.callLater(timeout, lambda: None)
+    pinger = LoopingCall(ping)
+    pinger.clock = reactor
+    pinger.start(PING_INTERVAL.total_seconds(), now=False)
+    return lambda: delayed_call.reset(timeout)
+
+
+def _timer_wheel_timers(wheel, timeout, ping):
+    """
+    Schedule a connection's timeout and pings on a shared ``TimerWheel``.
+
+    :return: A function resetting the timeout.
+    """
+    timer = wheel.call_later(timeout, lambda: None)
+    wheel.call_repeatedly(PING_INTERVAL.total_seconds(), ping)
+    return timer.reset
+
+
+# The ways of scheduling connection timers compared by
+# ``benchmark_connection_timers``, given a reactor:
+CONNECTION_TIMERS = [
+    (u"delayed-calls", lambda reactor: reactor, _delayed_call_timers),
+    (u"timer-wheel", TimerWheel, _timer_wheel_timers),
+]
+
+
+def benchmark_connection_timers(connections, seconds=120, box_interval=1.0,
+                                step=0.1):
+    """
+    Compare the time spent managing the idle timeouts and pings of many AMP
+    connections when each connection has its own delayed calls and when they
+    share a ``TimerWheel``.
+
+    Every connection receives a box, and so resets its timeout, every
+    ``box_interval`` seconds, with the connections spread evenly over the
+    interval.  Simulated time passes in increments of ``step`` seconds, with
+    the reactor running its delayed calls after each one.
+
+    :param int connections: The number of simulated connections.
+    :param float seconds: The number of seconds of simulated time.
+    :param float box_interval: The number of seconds between the boxes
+        received by each connection.
+    :param float step: The number of seconds of simulated time between
+        reactor iterations.
+
+    :return: A ``list`` of ``dict``\ s, one for each way of scheduling the
+        timers, giving the time taken, the number of pings sent and the
+        number of delayed calls the reactor had to manage.
+    """
+    timeout = PING_INTERVAL.total_seconds() * 2
+    steps = int(round(seconds / step))
+    steps_per_box = max(int(round(box_interval / step)), 1)
+    results = []
+    for strategy, scheduler, schedule in CONNECTION_TIMERS:
+        reactor = _SimulatedReactor()
+        scheduler = scheduler(reactor)
+        pings = [0]
+
+        def ping(pings=pings):
+            pings[0] += 1
+        # Group the connections by the step, modulo ``steps_per_box``, in
+        # which they receive boxes:
+        resets = [[] for _ in range(steps_per_box)]
+        for index in range(connections):
+            resets[index % steps_per_box].append(
+                schedule(scheduler, timeout, ping))
+        delayed_calls = len(reactor.getDelayedCalls())
+        start = default_timer()
+        for index in range(1, steps + 1):
+            reactor.now = index * step
+            for reset in resets[index % steps_per_box]:
+                reset()
+            reactor.runUntilCurrent()
+        elapsed = default_timer() - start
+        results.append({
+            u"strategy": strategy,
+            u"connections": connections,
+            u"simulated_seconds": seconds,
+            u"seconds": elapsed,
+            u"pings": pings[0],
+            u"delayed_calls": delayed_calls,
+        })
+    return results
+
+
+def _scan_get_node(deployment, uuid):
+    """
+    Find a node by scanning all of a deployment's nodes, as ``get_node`` used
+    to.
+    """
+    return [node for node in deployment.nodes if node.uuid == uuid][0]
+
+
+def _scan_update_node(deployment, node):
+    """
+    Replace a node by scanning all of a deployment's nodes, as
+    ``update_node`` used to.
+    """
+    return deployment.set(
+        "nodes", [n for n in deployment.nodes if n.uuid != node.uuid] + [node]
+    )
+
+
+# The ways of looking up and replacing nodes compared by
+# ``benchmark_node_index``:
+NODE_LOOKUPS = [
+    (u"scan", _scan_get_node, _scan_update_node),
+    (u"index", lambda deployment, uuid: deployment.get_node(uuid),
+     lambda deployment, node: deployment.update_node(node)),
+]
+
+
+def benchmark_node_index(nodes, operations=100, repeat=3):
+    """
+    Compare the time taken to look up and replace nodes of the configuration
+    and the state of a synthetic cluster by scanning all the nodes and by
+    using the UUID to node index.
+
+    The index of the original configuration and state is built before
+    measuring, as it would be by earlier operations on them.
+
+    :param int nodes: The number of nodes in the cluster, each with two
+        datasets.
+    :param int operations: The number of nodes looked up or replaced in each
+        measurement, each update being made to the result of the last.
+    :param int repeat: The number of times to repeat each measurement.
+
+    :return: A ``list`` of ``dict``\ s, one for each operation on each of the
+        configuration and the state using each way of finding nodes, giving
+        the fastest time per operation in seconds.
+    """
+    configuration, state = synthetic_cluster(nodes * 2, nodes)
+    results = []
+    for name, obj in [(u"configuration", configuration), (u"state", state)]:
+        obj.get_node(next(iter(obj.nodes)).uuid)
+        existing = list(obj.nodes)[:operations]
+        updates = [
+            node.set(applications=[Application(
+                name=u"app-{}".format(index),
+                image=DockerImage.from_string(u"busybox"),
+            )])
+            for index, node in enumerate(existing)
+        ]
+
+        for strategy, get_node, update_node in NODE_LOOKUPS:
+            def lookup(obj=obj, existing=existing, get_node=get_node):
+                for node in existing:
+                    get_node(obj, node.uuid)
+
+            def update(obj=obj, updates=updates, update_node=update_node):
+                updated = obj
+                for node in updates:
+                    updated = update_node(updated, node)
+                return updated
+
+            for operation, function in [(u"get_node", lookup),
+                                        (u"update_node", update)]:
+                seconds, _ = best_time(function, repeat)
+                results.append({
+                    u"object": name,
+                    u"operation": operation,
+                    u"strategy": strategy,
+                    u"nodes": nodes,
+                    u"seconds_per_operation": seconds / len(existing),
+                })
+    return results
+
+
+def synthetic_v1_configuration(datasets, nodes=10):
+    """
+    Create a version 1 configuration file's contents for a synthetic
+    cluster.
+
+    :param int datasets: The total number of datasets.
+    :param int nodes: The number of nodes.
+
+    :return bytes: The JSON configuration.
+    """
+    configuration, _ = synthetic_cluster(datasets, nodes)
+    deployment = loads(wire_encode(configuration))
+    # Version 1 deployments had neither leases nor persistent state:
+    del deployment[u"leases"]
+    del deployment[u"persistent_state"]
+    return dumps(deployment)
+
+
+class _ReserializingMigration(object):
+    """
+    The upgrades of ``ConfigurationMigration``, each parsing and
+    serializing the whole configuration as they used to.
+    """
+    def __getattr__(self, name):
+        upgrade = getattr(ConfigurationMigration, name)
+        return lambda config: dumps(upgrade(loads(config)))
+
+
+def _reserializing_migrate(config):
+    """
+    Migrate a version 1 configuration, parsing and serializing it for every
+    upgrade.
+    """
+    migration = _ReserializingMigration()
+    for version in range(1, _CONFIG_VERSION):
+        config = getattr(migration, u"upgrade_from_v%d" % (version,))(config)
+    return config
+
+
+def _file_migrate(config):
+    """
+    Migrate a version 1 configuration file, streaming the result to another
+    file.
+    """
+    directory = FilePath(mkdtemp())
+    try:
+        source = directory.child(b"source.json")
+        source.setContent(config)
+        target = directory.child(b"target.json")
+        migrate_configuration_file(
+            1, _CONFIG_VERSION, source, target, ConfigurationMigration)
+        return target.getContent()
+    finally:
+        directory.remove()
+
+
+# The ways of migrating configurations compared by ``benchmark_migration``:
+MIGRATIONS = [
+    (u"reserializing", _reserializing_migrate),
+    (u"single-parse", lambda config: migrate_configuration(
+        1, _CONFIG_VERSION, config, ConfigurationMigration)),
+    (u"single-parse-file", _file_migrate),
+]
+
+
+def benchmark_migration(datasets, nodes=10, repeat=3):
+    """
+    Compare the time taken to migrate a synthetic version 1 configuration to
+    the current version by parsing and serializing it for every upgrade,
+    and by parsing it once and serializing it once, either in memory or to a
+    file.
+
+    :param int datasets: The number of datasets in the cluster.
+    :param int nodes: The number of nodes in the cluster.
+    :param int repeat: The number of times to repeat each measurement.
+
+    :return: A ``list`` of ``dict``\ s, one for each way of migrating,
+        giving the fastest time in seconds.
+    """
+    config = synthetic_v1_configuration(datasets, nodes)
+    results = []
+    for strategy, migrate in MIGRATIONS:
+        seconds, _ = best_time(lambda migrate=migrate: migrate(config), repeat)
+        results.append({
+            u"strategy": strategy,
+            u"datasets": datasets,
+            u"bytes": len(config),
+            u"versions": _CONFIG_VERSION - 1,
+            u"seconds": seconds,
+        })
+    return results
@@ -0,0 +1,279 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_binary -*-
+
+"""
+A compact binary wire format for the configuration model.
+
+This is an alternative to the JSON format of ``wire_encode`` for use over
+the network between peers which have agreed to use it.  JSON remains the
+on-disk format and the format used with peers which don't support this one.
+
+Objects are converted to nested msgpack arrays whose first element is a
+small integer tag describing how to decode the rest of the array.  Model
+classes and their fields are not named: a class is identified by its index in
+a table of the serializable classes and its fields are given positionally in
+sorted order.  Both sides must therefore have the same table, which is why
+peers only use this format if they announce the same
+``BINARY_WIRE_FORMAT_SIGNATURE``.
+
+Decoding produces the same objects ``wire_decode`` would produce from the
+JSON encoding of the same object.
+"""
+
+from calendar import timegm
+from datetime import datetime
+from hashlib import sha256
+from uuid import UUID
+
+from msgpack import packb, unpackb
+
+from pyrsistent import PClass, PMap, PRecord, PSet, PVector, pmap
+
+from pytz import UTC
+
+from twisted.python.filepath import FilePath
+
+from ._persistence import _CONFIG_CLASS_MAP
+
+
+# Prefix of binary encoded objects.  JSON never starts with a NUL byte, so
+# this distinguishes the two formats.
+_BINARY_PREFIX = b"\x00"
+
+# Tags identifying the type of each encoded array:
+_TAG_LIST = 0
+_TAG_DICT = 1
+_TAG_PMAP = 2
+_TAG_CLASS = 3
+_TAG_UNSET = 4
+_TAG_UUID = 5
+_TAG_FILEPATH = 6
+_TAG_DATETIME = 7
+_TAG_BIG_INTEGER = 8
+
+# Types which msgpack encodes itself.  ``long`` is handled separately since
+# msgpack can't encode integers which don't fit in 64 bits:
+_PRIMITIVES = frozenset([unicode, bytes, int, float, bool, type(None)])
+
+
+def _field_names(cls):
+    """
+    :param cls: A ``PClass`` or ``PRecord`` subclass.
+
+    :return: The names of the fields of ``cls``, in the order they are
+        encoded.
+    """
+    if issubclass(cls, PClass):
+        return tuple(sorted(cls._pclass_fields))
+    return tuple(sorted(cls._precord_fields))
+
+
+# The serializable record classes, ordered by name, and their field names.
+# Other classes in _CONFIG_CLASS_MAP are mappings, which are encoded as
+# ``PMap``, just as the JSON format does.
+_CLASSES = [
+    (cls, _field_names(cls))
+    for (name, cls) in sorted(_CONFIG_CLASS_MAP.items())
+    if issubclass(cls, (PClass, PRecord))
+]
+
+# Identify the table of classes.  Peers with different tables can't use this
+# format to talk to each other.
+BINARY_WIRE_FORMAT_SIGNATURE = sha256(repr([
+    (cls.__name__, names) for (cls, names) in _CLASSES
+])).hexdigest()[:16].decode("ascii")
+
+
+class _Unset(object):
+    """
+    Marker for a field which was not set on an encoded object.
+    """
+
+_UNSET = _Unset()
+_ENCODED_UNSET = [_TAG_UNSET]
+
+
+def _encode_list(obj):
+    result = [_TAG_LIST]
+    result.extend(_encode(item) for item in obj)
+    return result
+
+
+def _encode_dict(obj, tag=_TAG_DICT):
+    result = [tag]
+    for key, value in obj.iteritems():
+        result.append(_encode(key))
+        result.append(_encode(value))
+    return result
+
+
+def _encode_pmap(obj):
+    return _encode_dict(obj, _TAG_PMAP)
+
+
+def _encode_long(obj):
+    if -2 ** 63 <= obj < 2 ** 64:
+        return obj
+    return [_TAG_BIG_INTEGER, unicode(obj)]
+
+
+def _encode_uuid(obj):
+    value = obj.int
+    return [_TAG_UUID, value >> 64, value & 0xffffffffffffffff]
+
+
+def _encode_filepath(obj):
+    return [_TAG_FILEPATH, obj.path.decode("utf-8")]
+
+
+def _encode_datetime(obj):
+    if obj.tzinfo is None:
+        raise ValueError("Datetime without a timezone: {}".format(obj))
+    return [_TAG_DATETIME, timegm(obj.utctimetuple())]
+
+
+def _record_encoder(index, names, is_pclass):
+    """
+    Create an encoder for a record class.
+
+    :param int index: The index of the class in ``_CLASSES``.
+    :param names: The field names of the class.
+    :param bool is_pclass: Whether the class is a ``PClass`` rather than a
+        ``PRecord``.
+    """
+    if is_pclass:
+        def get(obj, name):
+            return getattr(obj, name, _UNSET)
+    else:
+        def get(obj, name):
+            return obj.get(name, _UNSET)
+
+    def encode(obj):
+        result = [_TAG_CLASS, index]
+        for name in names:
+            value = get(obj, name)
+            if value is _UNSET:
+                result.append(_ENCODED_UNSET)
+            else:
+                result.append(_encode(value))
+        return result
+    return encode
+
+
+# Map exact types to the function which encodes them.  Types not found here
+# are looked up by ``_find_encoder`` and then added.
+_ENCODERS = {
+    list: _encode_list,
+    tuple: _encode_list,
+    set: _encode_list,
+    frozenset: _encode_list,
+    dict: _encode_dict,
+    long: _encode_long,
+    UUID: _encode_uuid,
+    FilePath: _encode_filepath,
+    datetime: _encode_datetime,
+}
+_ENCODERS.update({
+    cls: _record_encoder(index, names, issubclass(cls, PClass))
+    for index, (cls, names) in enumerate(_CLASSES)
+})
+
+
+def _find_encoder(cls):
+    """
+    Find the encoder for a type which isn't in ``_ENCODERS``, and add it
+    there.
+
+    :param type cls: The type of an object to encode.
+
+    :raise TypeError: If objects of the given type can't be encoded.
+    """
+    if issubclass(cls, PMap):
+        encoder = _encode_pmap
+    elif issubclass(cls, (PSet, PVector)):
+        encoder = _encode_list
+    elif issubclass(cls, datetime):
+        encoder = _encode_datetime
+    else:
+        raise TypeError("{} is not serializable".format(cls))
+    _ENCODERS[cls] = encoder
+    return encoder
+
+
+def _encode(obj):
+    """
+    Convert an object to a structure of msgpack-serializable primitives.
+    """
+    cls = type(obj)
+    if cls in _PRIMITIVES:
+        return obj
+    try:
+        encoder = _ENCODERS[cls]
+    except KeyError:
+        encoder = _find_encoder(cls)
+    return encoder(obj)
+
+
+def _decode_class(encoded):
+    cls, names = _CLASSES[encoded[1]]
+    return cls.create({
+        name: value for (name, value) in zip(names, encoded[2:])
+        if value is not _UNSET
+    })
+
+
+def _decode_dict(encoded):
+    return dict(zip(encoded[1::2], encoded[2::2]))
+
+
+# Functions decoding arrays, indexed by their tag:
+_DECODERS = [
+    lambda encoded: encoded[1:],
+    _decode_dict,
+    lambda encoded: pmap(_decode_dict(encoded)),
+    _decode_class,
+    lambda encoded: _UNSET,
+    lambda encoded: UUID(int=(encoded[1] << 64) | encoded[2]),
+    lambda encoded: FilePath(encoded[1].encode("utf-8")),
+    lambda encoded: datetime.fromtimestamp(encoded[1], UTC),
+    lambda encoded: long(encoded[1]),
+]
+
+
+def _decode(encoded):
+    """
+    Convert a decoded msgpack array back to the object it represents.
+    """
+    return _DECODERS[encoded[0]](encoded)
+
+
+def binary_wire_encode(obj):
+    """
+    Encode the given model object into bytes using the binary wire format.
+
+    :param obj: An object from the configuration model, e.g. ``Deployment``.
+    :return bytes: Encoded object.
+    """
+    return _BINARY_PREFIX + packb(_encode(obj), use_bin_type=False)
+
+
+def is_binary_wire_encoded(data):
+    """
+    :param bytes data: An encoded object.
+
+    :return bool: Whether ``data`` is in the binary wire format, rather than
+        JSON.
+    """
+    return data[:1] == _BINARY_PREFIX
+
+
+def binary_wire_decode(data):
+    """
+    Decode the given model object from bytes in the binary wire format.
+
+    :param bytes data: Encoded object.
+    """
+    return unpackb(
+        buffer(data, len(_BINARY_PREFIX)),
+        list_hook=_decode, encoding="utf-8",
+    )
@@ -5,6 +5,11 @@ Combine and retrieve current cluster state.
 """
 
 from datetime import datetime, timedelta
+from heapq import heappop, heappush
+from itertools import count
+from weakref import WeakKeyDictionary
+
+from eliot import write_traceback
 
 from twisted.python.versions import Version
 from twisted.python.deprecate import deprecated
@@ -14,6 +19,7 @@ from twisted.application.internet import TimerService
 from pyrsistent import PClass, field, pmap
 
 from . import DeploymentState, ChangeSource
+from ._diffing import apply_sequence_diff
 
 # Allowed inactivity period before updates are expired
 EXPIRATION_TIME = timedelta(seconds=120)
@@ -42,6 +48,15 @@ class _WiperAndSource(PClass):
         return self.wiper.update_cluster_state(deployment_state)
 
 
+class ResyncRequired(Exception):
+    """
+    A diff of the changes from a source can't be applied because it isn't
+    relative to the last changes received from that source, for example
+    because an earlier update was lost.  The source must send all of its
+    changes again.
+    """
+
+
 class ClusterStateService(MultiService):
     """
     Store known current cluster state, and combine partial updates with the
@@ -54,7 +69,23 @@ class ClusterStateService(MultiService):
     :ivar DeploymentState _deployment_state: The current known cluster state.
     :ivar PMap _information_wipers: Map (wiper class, wiper key) to
         ``_WiperAndSource``.
+    :ivar dict _source_wipers: Map each source in ``_information_wipers`` to
+        the ``set`` of its keys there, so that all of a source's information
+        can be wiped together.
+    :ivar list _expiry_heap: A heap of ``(expiry, counter, source)`` tuples,
+        at most one per source, giving a time before which the source's
+        information certainly won't expire.  Since sources only ever report
+        later activity the real expiry may be later, in which case the source
+        is pushed back on to the heap when it is reached.  ``counter`` only
+        breaks ties.
+    :ivar set _scheduled_sources: The sources with an entry in
+        ``_expiry_heap``.
     :ivar _clock: ``IReactorTime`` provider.
+    :ivar WeakKeyDictionary _source_changes: Map sources which number their
+        changes to a tuple of the sequence number and the list of their last
+        changes, which their next diff will be relative to.
+    :ivar int _generation: The number of times the state has changed.
+    :ivar list _change_callbacks: Callables to call when the state changes.
     """
     def __init__(self, reactor):
         MultiService.__init__(self)
@@ -63,22 +94,92 @@ class ClusterStateService(MultiService):
         timer.clock = reactor
         timer.setServiceParent(self)
         self._information_wipers = pmap()
+        self._source_wipers = {}
+        self._expiry_heap = []
+        self._scheduled_sources = set()
+        self._counter = count()
         self._clock = reactor
+        self._source_changes = WeakKeyDictionary()
+        self._generation = 0
+        self._change_callbacks = []
+
+    def state_generation(self):
+        """
+        :return int: The generation of the cluster state.  This increases
+            every time the state changes, so it identifies states during the
+            lifetime of this service.
+        """
+        return self._generation
+
+    def register(self, change_callback):
+        """
+        Register a function to be called whenever the cluster state changes.
+
+        :param change_callback: Callable that takes no arguments, will be
+            called when the state changes.
+        """
+        self._change_callbacks.append(change_callback)
+
+    def _count_change(self, previous):
+        """
+        Increase the generation and call the change callbacks if the state
+        differs from an earlier one.
+
+        :param DeploymentState previous: The earlier state.
+        """
+        state = self._deployment_state
+        # Updates from agents usually describe unchanged nodes with new but
+        # equal objects, which share most of their structure with the old
+        # ones, so this is cheap.
+        if state is not previous and state != previous:
+            self._generation += 1
+            for callback in self._change_callbacks:
+                try:
+                    callback()
+                except:
+                    write_traceback()
+
+    def _schedule_expiry(self, source):
+        """
+        Push a source on to ``_expiry_heap`` at the time its information
+        expires if there is no further activity.
+        """
+        expiry = source.last_activity() + EXPIRATION_TIME
+        heappush(self._expiry_heap, (expiry, next(self._counter), source))
+        self._scheduled_sources.add(source)
 
     def _wipe_expired(self):
         """
         Clear any expired state from memory.
+
+        Only the sources at the front of ``_expiry_heap`` are examined, so
+        this takes time proportional to the number of sources which might
+        have expired rather than the amount of information known.
         """
         current_time = datetime.utcfromtimestamp(self._clock.seconds())
+        previous = self._deployment_state
         evolver = self._information_wipers.evolver()
-        for key, wipe in self._information_wipers.items():
-            last_activity = wipe.last_activity()
-            if current_time - last_activity >= EXPIRATION_TIME:
+        while self._expiry_heap and self._expiry_heap[0][0] <= current_time:
+            _, _, source = heappop(self._expiry_heap)
+            self._scheduled_sources.remove(source)
+            keys = self._source_wipers.get(source)
+            if not keys:
+                # All of the source's information was replaced by information
+                # from other sources.
+                self._source_wipers.pop(source, None)
+                continue
+            if current_time - source.last_activity() < EXPIRATION_TIME:
+                self._schedule_expiry(source)
+                continue
+            del self._source_wipers[source]
+            for key in keys:
+                wipe = self._information_wipers[key]
                 self._deployment_state = wipe.update_cluster_state(
                     self._deployment_state
                 )
                 evolver.remove(key)
         self._information_wipers = evolver.persistent()
+        self._count_change(previous)
 
     def manifestation_path(self, node_uuid, dataset_id):
         """
@@ -100,7 +201,7 @@ class ClusterStateService(MultiService):
         """
         return self._deployment_state
 
-    def apply_changes_from_source(self, source, changes):
+    def apply_changes_from_source(self, source, changes, sequence=None):
         """
         Apply some changes to the cluster state.
 
@@ -109,20 +210,61 @@ class ClusterStateService(MultiService):
             kept until they are overwritten or this entity goes away.
         :param list changes: Some ``IClusterStateChange`` providers to use to
             update the internal cluster state.
+        :param sequence: If not ``None``, the ``int`` sequence number of these
+            changes.  The next changes from the same source may then be given
+            to ``apply_diff_from_source`` as a diff against these ones.
         """
+        if sequence is not None:
+            self._source_changes[source] = (sequence, changes)
         # XXX: Multiple nodes may report being primary for a dataset. Enforce
         # consistency here. See
         # https://clusterhq.atlassian.net/browse/FLOC-1303
+        previous = self._deployment_state
         for change in changes:
             self._deployment_state = change.update_cluster_state(
                 self._deployment_state
             )
+        self._count_change(previous)
+        evolver = self._information_wipers.evolver()
+        source_keys = self._source_wipers.setdefault(source, set())
         for change in changes:
             wiper = change.get_information_wipe()
             key = (wiper.__class__, wiper.key())
-            self._information_wipers = self._information_wipers.set(
-                key, _WiperAndSource(wiper=wiper, source=source)
-            )
+            previous = self._information_wipers.get(key)
+            if previous is not None and previous.source is not source:
+                self._source_wipers[previous.source].discard(key)
+            source_keys.add(key)
+            evolver[key] = _WiperAndSource(wiper=wiper, source=source)
+        self._information_wipers = evolver.persistent()
+        if source_keys and source not in self._scheduled_sources:
+            self._schedule_expiry(source)
+        elif not source_keys:
+            del self._source_wipers[source]
+
+    def apply_diff_from_source(self, source, changes_diff, sequence):
+        """
+        Apply changes to the cluster state given as a diff against the last
+        changes from the same source.
+
+        :param IClusterChangeSource source: See ``apply_changes_from_source``.
+        :param Diff changes_diff: A diff created by ``create_sequence_diff``
+            from the source's last changes to its new changes.
+        :param int sequence: The sequence number of the new changes.  It must
+            follow on from the sequence number of the last changes.
+
+        :raise ResyncRequired: If the last changes from the source are
+            unknown or the sequence number shows some changes were missed.
+
+        :return: The ``list`` of new changes.
+        """
+        last_sequence, last_changes = self._source_changes.pop(
+            source, (None, None)
+        )
+        if last_sequence is None or sequence != last_sequence + 1:
+            raise ResyncRequired()
+        changes = apply_sequence_diff(changes_diff, last_changes)
+        self.apply_changes_from_source(source, changes, sequence)
+        return changes
 
     @deprecated(v1_0, "ClusterStateService.apply_changes_from_source")
     def apply_changes(self, changes):
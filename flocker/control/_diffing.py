@@ -0,0 +1,347 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_diffing -*-
+
+"""
+Code to calculate the difference between objects. This is particularly useful
+for computing the difference between deeply pyrsisistent objects such as the
+flocker configuration or the flocker state.
+
+Diffs are themselves serializable model objects, so they can be sent to
+convergence agents in place of the much larger objects they describe.
+"""
+
+from pyrsistent import (
+    PClass, PMap, PSet, PRecord, InvariantException, field, pmap, pvector,
+    pvector_field,
+)
+
+from zope.interface import Interface, implementer
+
+
+class _IDiffChange(Interface):
+    """
+    Interface for a diff change.
+
+    This is simply something that can be applied to an object to create a new
+    object.
+
+    This interface is created as documentation rather than for any of the
+    actual zope.interface mechanisms.
+    """
+
+    def apply(obj):
+        """
+        Apply this diff change to the passed in object and return a new object
+        that is obj with the ``self`` diff applied.
+
+        :param object obj: The object to apply the diff to.
+
+        :returns: A new object that is the passed in object with the diff
+            applied.
+        """
+
+
+@implementer(_IDiffChange)
+class _Remove(PClass):
+    """
+    A ``_IDiffChange`` that removes an object from a ``PSet`` or a key from a
+    ``PMap`` inside a nested object tree.
+
+    :ivar path: The path in the nested object tree of the object to be removed
+        from.
+
+    :ivar item: The item to be removed from the set, or the key to be removed
+        from the mapping.
+    """
+    path = pvector_field(object)
+    item = field()
+
+    def apply(self, obj):
+        return obj.transform(self.path, lambda o: o.discard(self.item))
+
+
+@implementer(_IDiffChange)
+class _Set(PClass):
+    """
+    A ``_IDiffChange`` that sets a field in a ``PClass`` or sets a key in a
+    ``PMap``.
+
+    :ivar path: The path in the nested object to the field or key to be set to
+        a new value.
+
+    :ivar value: The value to set the field or key to.
+    """
+    path = pvector_field(object)
+    value = field()
+
+    def apply(self, obj):
+        if not self.path:
+            # The whole object is being replaced.
+            return self.value
+        return obj.transform(self.path, self.value)
+
+
+@implementer(_IDiffChange)
+class _Add(PClass):
+    """
+    A ``_IDiffChange`` that adds an item to a ``PSet``.
+
+    :ivar path: The path to the set to which the item will be added.
+
+    :ivar item: The item to be added to the set.
+    """
+    path = pvector_field(object)
+    item = field()
+
+    def apply(self, obj):
+        return obj.transform(self.path, lambda o: o.add(self.item))
+
+
+@implementer(_IDiffChange)
+class Diff(PClass):
+    """
+    A ``_IDiffChange`` that is simply the serial application of other diff
+    changes.
+
+    This is the object that external modules get and use to apply diffs to
+    objects.
+
+    :ivar changes: A vector of ``_IDiffChange`` s that represent a diff between
+        two objects.
+    """
+
+    changes = pvector_field(object)
+
+    def apply(self, obj):
+        for c in self.changes:
+            obj = c.apply(obj)
+        return obj
+
+    def is_empty(self):
+        """
+        :return bool: ``True`` if applying this diff makes no changes.
+        """
+        return len(self.changes) == 0
+
+
+def _create_diffs_for_sets(current_path, set_a, set_b):
+    """
+    Computes a series of ``_IDiffChange`` s to turn ``set_a`` into ``set_b``
+    assuming that these sets are at ``current_path`` inside a nested pyrsistent
+    object.
+
+    Set items are opaque to this algorithm: an item which has changed is
+    represented as the removal of the old item and the addition of the new one.
+
+    :param current_path: An iterable of pyrsistent object describing the path
+        inside the root pyrsistent object where the other arguments are
+        located.  See ``PMap.transform`` for the format of this sort of path.
+
+    :param set_a: The desired input set.
+
+    :param set_b: The desired output set.
+
+    :returns: An iterable of ``_IDiffChange`` s that will turn ``set_a`` into
+        ``set_b``.
+    """
+    resulting_diffs = pvector([]).evolver()
+    for item in set_a.difference(set_b):
+        resulting_diffs.append(
+            _Remove(path=current_path, item=item)
+        )
+    for item in set_b.difference(set_a):
+        resulting_diffs.append(
+            _Add(path=current_path, item=item)
+        )
+    return resulting_diffs.persistent()
+
+
+def _create_diffs_for_mappings(current_path, mapping_a, mapping_b):
+    """
+    Computes a series of ``_IDiffChange`` s to turn ``mapping_a`` into
+    ``mapping_b`` assuming that these mappings are at ``current_path`` inside a
+    nested pyrsistent object.
+
+    :param current_path: An iterable of pyrsistent object describing the path
+        inside the root pyrsistent object where the other arguments are
+        located.  See ``PMap.transform`` for the format of this sort of path.
+
+    :param mapping_a: The desired input mapping.
+
+    :param mapping_b: The desired output mapping.
+
+    :returns: An iterable of ``_IDiffChange`` s that will turn ``mapping_a``
+        into ``mapping_b``.
+    """
+    resulting_diffs = pvector([]).evolver()
+    a_keys = frozenset(mapping_a.keys())
+    b_keys = frozenset(mapping_b.keys())
+    for key in a_keys.intersection(b_keys):
+        resulting_diffs.extend(
+            _create_diffs_for(
+                current_path.append(key),
+                mapping_a[key],
+                mapping_b[key]
+            )
+        )
+    for key in b_keys.difference(a_keys):
+        resulting_diffs.append(
+            _Set(path=current_path.append(key), value=mapping_b[key])
+        )
+    for key in a_keys.difference(b_keys):
+        resulting_diffs.append(
+            _Remove(path=current_path, item=key)
+        )
+    return resulting_diffs.persistent()
+
+
+def _create_diffs_for_record(current_path, record_a, record_b,
+                             fields_a, fields_b, invariants):
+    """
+    Computes a series of ``_IDiffChange`` s to turn ``record_a`` (a ``PClass``
+    or ``PRecord``) into ``record_b``.
+
+    Changes to a record are applied one field at a time, so if the record has
+    global invariants an intermediate record might violate them.  In that
+    case, when more than one change is needed they are tried out on
+    ``record_a`` and if any of them fails the whole record is replaced
+    instead.
+
+    :param current_path: See ``_create_diffs_for``.
+    :param record_a: The desired input record.
+    :param record_b: The desired output record.
+    :param fields_a: Mapping of the fields of ``record_a``.
+    :param fields_b: Mapping of the fields of ``record_b``.
+    :param invariants: The global invariants of the record's class.
+
+    :returns: An iterable of ``_IDiffChange`` s that will turn ``record_a``
+        into ``record_b``.
+    """
+    changes = _create_diffs_for_mappings(current_path, fields_a, fields_b)
+    if invariants and len(changes) > 1:
+        prefix = len(current_path)
+        relative = Diff(changes=[
+            change.set(path=change.path[prefix:]) for change in changes
+        ])
+        try:
+            relative.apply(record_a)
+        except InvariantException:
+            return pvector([_Set(path=current_path, value=record_b)])
+    return changes
+
+
+def _create_diffs_for(current_path, subobj_a, subobj_b):
+    """
+    Computes a series of ``_IDiffChange`` s to turn ``subobj_a`` into
+    ``subobj_b`` assuming that these subobjs are at ``current_path`` inside a
+    nested pyrsistent object.
+
+    :param current_path: An iterable of pyrsistent object describing the path
+        inside the root pyrsistent object where the other arguments are
+        located.  See ``PMap.transform`` for the format of this sort of path.
+
+    :param subobj_a: The desired input sub object.
+
+    :param subobj_b: The desired output sub object.
+
+    :returns: An iterable of ``_IDiffChange`` s that will turn ``subobj_a``
+        into ``subobj_b``.
+    """
+    # Unchanged subtrees are very often shared between generations of
+    # pyrsistent objects, so the identity check saves a deep comparison.
+    if subobj_a is subobj_b or subobj_a == subobj_b:
+        return pvector([])
+    elif type(subobj_a) is type(subobj_b):
+        if isinstance(subobj_a, PClass):
+            return _create_diffs_for_record(
+                current_path, subobj_a, subobj_b,
+                subobj_a._to_dict(), subobj_b._to_dict(),
+                type(subobj_a)._pclass_invariants,
+            )
+        elif isinstance(subobj_a, PRecord):
+            return _create_diffs_for_record(
+                current_path, subobj_a, subobj_b, subobj_a, subobj_b,
+                type(subobj_a)._precord_invariants,
+            )
+        elif isinstance(subobj_a, PMap):
+            return _create_diffs_for_mappings(
+                current_path, subobj_a, subobj_b
+            )
+        elif isinstance(subobj_a, PSet):
+            return _create_diffs_for_sets(current_path, subobj_a, subobj_b)
+    # If the objects are not equal, and there is no intelligent way to recurse
+    # inside the objects to make a smaller diff, simply set the current path
+    # to the object in b.
+    return pvector([_Set(path=current_path, value=subobj_b)])
+
+
+def create_diff(object_a, object_b):
+    """
+    Constructs a diff from ``object_a`` to ``object_b``
+
+    :param object_a: The desired input object.
+
+    :param object_b: The desired output object.
+
+    :returns: A ``Diff`` that will convert ``object_a`` into ``object_b``
+        when applied.
+    """
+    changes = _create_diffs_for(pvector([]), object_a, object_b)
+    return Diff(changes=changes)
+
+
+def compose_diffs(iterable_of_diffs):
+    """
+    Compose multiple ``Diff`` objects into a single diff.
+
+    Assuming you have 3 objects, A, B, and C and you compute diff AB and BC.
+    If you pass [AB, BC] into this function it will return AC, a diff that when
+    applied to object A, will return object C.
+
+    :param iterable_of_diffs: An iterable of diffs to be composed.
+
+    :returns: A new diff such that applying this diff is equivalent to
+        applying each of the input diffs in serial.
+    """
+    return Diff(
+        changes=[
+            c for d in iterable_of_diffs for c in d.changes
+        ]
+    )
+
+
+def create_sequence_diff(sequence_a, sequence_b):
+    """
+    Constructs a diff from one sequence of objects to another, item by item,
+    so that the diff only describes the changes within each item rather than
+    replacing the whole sequence.
+
+    :param sequence_a: The desired input sequence.
+    :param sequence_b: The desired output sequence.
+
+    :returns: A ``Diff`` which ``apply_sequence_diff`` can apply to
+        ``sequence_a`` to give the items of ``sequence_b``.
+    """
+    return create_diff(
+        pmap(dict(enumerate(sequence_a))), pmap(dict(enumerate(sequence_b))),
+    )
+
+
+def apply_sequence_diff(diff, sequence):
+    """
+    Apply a diff created by ``create_sequence_diff``.
+
+    :param Diff diff: The diff to apply.
+    :param sequence: The sequence it was created from.
+
+    :returns: A ``list`` of the items of the sequence the diff was created
+        to.
+    """
+    items = diff.apply(pmap(dict(enumerate(sequence))))
+    return [items[index] for index in range(len(items))]
+
+
+# Ensure that the representation of a ``Diff`` is entirely serializable:
+DIFF_SERIALIZABLE_CLASSES = [
+    _Set, _Remove, _Add, Diff
+]
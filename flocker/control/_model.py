@@ -10,8 +10,10 @@ cluster configuration file you need to write upgrade code to support
 upgrading from older versions of Flocker.
 """
 
+from functools import partial
 from uuid import UUID
 from warnings import warn
+from weakref import ref
 from hashlib import md5
 from datetime import datetime, timedelta
 
@@ -26,6 +28,29 @@ from pyrsistent import (
 from zope.interface import Interface, implementer
 
 
+def _checked_factory(checked_type, optional):
+    """
+    Create a factory for a field containing a checked collection.
+
+    Values which already have the checked type are used as they are, since
+    their items were checked when they were created.  Copying them would
+    make setting any field of a record cost time proportional to the size of
+    its collections.
+
+    :param checked_type: The checked collection type.
+    :param bool optional: If true, ``None`` is also a valid value.
+
+    :return: A one-argument callable converting values to ``checked_type``.
+    """
+    def factory(argument):
+        if optional and argument is None:
+            return None
+        if type(argument) is checked_type:
+            return argument
+        return checked_type(argument)
+    return factory
+
+
 def _sequence_field(checked_class, suffix, item_type, optional, initial):
     """
     Create checked field for either ``PSet`` or ``PVector``.
@@ -43,14 +68,7 @@ def _sequence_field(checked_class, suffix, item_type, optional, initial):
         __type__ = item_type
     TheType.__name__ = item_type.__name__.capitalize() + suffix
 
-    if optional:
-        def factory(argument):
-            if argument is None:
-                return None
-            else:
-                return TheType(argument)
-    else:
-        factory = TheType
+    factory = _checked_factory(TheType, optional)
     return field(type=optional_type(TheType) if optional else TheType,
                  factory=factory, mandatory=True,
                  initial=factory(initial))
@@ -119,14 +137,7 @@ def pmap_field(
     TheMap.__name__ = (key_type.__name__.capitalize() +
                        value_type.__name__.capitalize() + "PMap")
 
-    if optional:
-        def factory(argument):
-            if argument is None:
-                return None
-            else:
-                return TheMap(argument)
-    else:
-        factory = TheMap
+    factory = _checked_factory(TheMap, optional)
 
     if initial is _UNDEFINED:
         initial = TheMap()
@@ -138,6 +149,113 @@ def pmap_field(
                  factory=factory, invariant=invariant)
 
 
+class _IdentityMemo(object):
+    """
+    Memoize a function of immutable objects, keyed by the identity of its
+    argument rather than by equality, so that looking up a large object
+    doesn't require hashing or comparing it.
+
+    Only weak references to the arguments are kept and results are
+    discarded once their argument is garbage collected, so the memo holds
+    results for live objects only.
+    """
+    def __init__(self, function):
+        """
+        :param function: A function of one argument, which must be an
+            immutable object that can be weakly referenced.
+        """
+        self._function = function
+        self._results = {}
+
+    def __len__(self):
+        return len(self._results)
+
+    def __call__(self, obj):
+        key = id(obj)
+        try:
+            reference, result = self._results[key]
+        except KeyError:
+            pass
+        else:
+            if reference() is obj:
+                return result
+        result = self._function(obj)
+        self.remember(obj, result)
+        return result
+
+    def remember(self, obj, result):
+        """
+        Record the result for an object without calling the function, for
+        example because it was cheaply derived from the result for an object
+        the new one was derived from.
+
+        :param obj: The argument.
+        :param result: The function's result for ``obj``.
+        """
+        key = id(obj)
+        self._results[key] = (ref(obj, partial(self._forget, key)), result)
+
+    def get(self, obj, default=None):
+        """
+        :param obj: The argument.
+        :param default: The value to return if there is no result for
+            ``obj``.
+
+        :return: The function's result for ``obj`` if it is already known,
+            without calling the function, otherwise ``default``.
+        """
+        entry = self._results.get(id(obj))
+        if entry is not None and entry[0]() is obj:
+            return entry[1]
+        return default
+
+    def _forget(self, key, reference):
+        """
+        Discard the result for an object which has been garbage collected,
+        unless it has already been replaced by the result for a new object
+        with the same identity.
+        """
+        entry = self._results.get(key)
+        if entry is not None and entry[0] is reference:
+            self._results.pop(key, None)
+
+
+def _cache_hash(cls):
+    """
+    Class decorator caching the hashes of a record class's instances.
+
+    pyrsistent recomputes the hash of a record, and so of everything it
+    contains, whenever it is needed.  Nodes and deployments are hashed every
+    time they are added to, removed from or looked up in a set and every
+    time they are compared, so for large clusters this would dominate.
+    Equality is also short-circuited using identity and the cached hashes.
+
+    :param cls: A ``PClass`` or ``PRecord`` subclass.
+
+    :return: ``cls``.
+    """
+    hashes = _IdentityMemo(cls.__hash__)
+    original_eq = cls.__eq__
+
+    def __hash__(self):
+        return hashes(self)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, cls) and hash(self) != hash(other):
+            return False
+        return original_eq(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    cls.__hash__ = __hash__
+    cls.__eq__ = __eq__
+    cls.__ne__ = __ne__
+    return cls
+
+
 class DockerImage(PClass):
     """
     An image that can be used to run an application using Docker.
@@ -414,6 +532,7 @@ def _keys_match(attribute):
 _keys_match_dataset_id = _keys_match("dataset_id")
 
 
+@_cache_hash
 class Node(PClass):
     """
     Configuration for a single node on which applications will be managed
@@ -470,6 +589,143 @@ def same_node(node1, node2):
     return node1.uuid == node2.uuid
 
 
+def _index_nodes(nodes):
+    """
+    :param PSet nodes: The nodes of a ``Deployment`` or ``DeploymentState``.
+
+    :return PMap: Map the UUIDs of the nodes to the nodes.
+    """
+    return pmap({node.uuid: node for node in nodes})
+
+
+# The UUID to node index of the nodes of each ``Deployment`` and
+# ``DeploymentState``.  Nodes are looked up and replaced by UUID all the
+# time, so each index is built at most once and the index of a deployment
+# created by replacing a node is derived from the index of the original.
+# Indexes are kept for the sets of nodes rather than for the deployments, so
+# changing anything else, e.g. the leases, keeps them.
+_node_indexes = _IdentityMemo(_index_nodes)
+
+
+def _node_index(deployment):
+    """
+    :param deployment: A ``Deployment`` or ``DeploymentState``.
+
+    :return PMap: Map the UUIDs of the deployment's nodes to the nodes.
+    """
+    return _node_indexes(deployment.nodes)
+
+
+def _index_datasets(nodes):
+    """
+    :param PSet nodes: The nodes of a ``Deployment`` or ``DeploymentState``.
+
+    :return PMap: Map the ID of each dataset with manifestations on the
+        nodes to a ``PMap`` of the UUIDs of the nodes it is manifest on to
+        its ``Manifestation`` on that node.
+    """
+    index = {}
+    for node in nodes:
+        if node.manifestations is None:
+            continue
+        for dataset_id, manifestation in node.manifestations.items():
+            index.setdefault(dataset_id, {})[node.uuid] = manifestation
+    return pmap({
+        dataset_id: pmap(manifestations)
+        for (dataset_id, manifestations) in index.items()
+    })
+
+
+# The dataset ID index of the nodes of each ``Deployment`` and
+# ``DeploymentState``.  Unlike the node index it is only derived for a
+# deployment created by replacing a node if it was already needed for the
+# original.
+_dataset_indexes = _IdentityMemo(_index_datasets)
+
+
+def _dataset_index(deployment):
+    """
+    :param deployment: A ``Deployment`` or ``DeploymentState``.
+
+    :return PMap: The dataset ID index of the deployment's nodes, as
+        returned by ``_index_datasets``.
+    """
+    return _dataset_indexes(deployment.nodes)
+
+
+def _reindex_datasets(index, uuid, original, node):
+    """
+    Update a dataset ID index for the replacement of a node.
+
+    :param PMap index: The index of the original deployment.
+    :param UUID uuid: The UUID of the replaced node.
+    :param original: The original ``Node`` or ``NodeState``, or ``None``.
+    :param node: The new ``Node`` or ``NodeState``, or ``None``.
+
+    :return PMap: The index of the updated deployment.
+    """
+    empty = pmap()
+    old = getattr(original, "manifestations", None) or empty
+    new = getattr(node, "manifestations", None) or empty
+    if old is new:
+        return index
+    evolver = index.evolver()
+    for dataset_id in old:
+        if dataset_id not in new:
+            manifestations = index[dataset_id].discard(uuid)
+            if manifestations:
+                evolver[dataset_id] = manifestations
+            else:
+                del evolver[dataset_id]
+    for dataset_id, manifestation in new.items():
+        if old.get(dataset_id) is not manifestation:
+            evolver[dataset_id] = index.get(dataset_id, empty).set(
+                uuid, manifestation)
+    return evolver.persistent()
+
+
+def _replace_node(deployment, uuid, node):
+    """
+    Replace a node of a deployment.  Should the deployment have several
+    nodes with the same UUID, they are all replaced.
+
+    :param deployment: A ``Deployment`` or ``DeploymentState``.
+    :param UUID uuid: The UUID of the node to replace.
+    :param node: The new ``Node`` or ``NodeState``, or ``None`` to remove the
+        node.
+
+    :return: The updated deployment, which is ``deployment`` itself if the
+        node is already there.
+    """
+    index = _node_index(deployment)
+    nodes = deployment.nodes
+    if len(index) != len(nodes):
+        # Some nodes share a UUID, so the index only has one of them.  Drop
+        # every node with this UUID, as the nodes were before they were
+        # indexed, and leave the indexes of the result to be built afresh:
+        for original in [n for n in nodes if n.uuid == uuid]:
+            nodes = nodes.remove(original)
+        if node is not None:
+            nodes = nodes.add(node)
+        return deployment.set(nodes=nodes)
+    original = index.get(uuid)
+    if original is node:
+        return deployment
+    if original is not None:
+        nodes = nodes.remove(original)
+        index = index.discard(uuid)
+    if node is not None:
+        nodes = nodes.add(node)
+        index = index.set(uuid, node)
+    _node_indexes.remember(nodes, index)
+    datasets = _dataset_indexes.get(deployment.nodes)
+    if datasets is not None:
+        _dataset_indexes.remember(
+            nodes, _reindex_datasets(datasets, uuid, original, node),
+        )
+    return deployment.set(nodes=nodes)
+
+
 def _get_node(default_factory):
     """
     Create a helper function for getting a node from a deployment.
@@ -486,12 +742,10 @@ def _get_node(default_factory):
              is found.
     """
     def get_node(deployment, uuid, **defaults):
-        nodes = list(
-            node for node in deployment.nodes if node.uuid == uuid
-        )
-        if len(nodes) == 0:
+        node = _node_index(deployment).get(uuid)
+        if node is None:
             return default_factory(uuid=uuid, **defaults)
-        return nodes[0]
+        return node
     return get_node
 
 
@@ -663,6 +917,7 @@ class PersistentState(PClass):
                                   initial=BlockDeviceOwnership())
 
 
+@_cache_hash
 class Deployment(PClass):
     """
     A ``Deployment`` describes the configuration of a number of applications on
@@ -683,6 +938,18 @@ class Deployment(PClass):
 
     get_node = _get_node(Node)
 
+    def get_dataset_manifestations(self, dataset_id):
+        """
+        Find the manifestations of a dataset without looking at every node.
+
+        :param unicode dataset_id: The ID of the dataset.
+
+        :return PMap: Map the UUID of each node the dataset is manifest on to
+            its ``Manifestation`` on that node.  This is empty if there are no
+            manifestations of the dataset.
+        """
+        return _dataset_index(self).get(dataset_id, pmap())
+
     def applications(self):
         """
         Return all applications in all nodes.
@@ -704,10 +971,7 @@ class Deployment(PClass):
 
         :return Deployment: Updated with new ``Node``.
         """
-        return self.set(
-            'nodes',
-            [n for n in self.nodes if not same_node(n, node)] + [node]
-        )
+        return _replace_node(self, node.uuid, node)
 
     def move_application(self, application, target_node):
         """
@@ -932,6 +1196,7 @@ def ip_to_uuid(ip):
     return UUID(bytes=md5(ip.encode("utf-8")).digest())
 
 
+@_cache_hash
 @implementer(IClusterStateChange)
 class NodeState(PRecord):
     """
@@ -1059,24 +1324,22 @@ class _WipeNodeState(PClass):
     attributes = pset_field(str)
 
     def update_cluster_state(self, cluster_state):
-        nodes = {n for n in cluster_state.nodes
-                 if n.uuid == self.node_uuid}
-        if not nodes:
+        original_node = _node_index(cluster_state).get(self.node_uuid)
+        if original_node is None:
             return cluster_state
-        [original_node] = nodes
         updated_node = original_node.evolver()
         for attribute in self.attributes:
             updated_node = updated_node.set(attribute, None)
         updated_node = updated_node.persistent()
-        final_nodes = cluster_state.nodes.discard(original_node)
-        if updated_node._provides_information():
-            final_nodes = final_nodes.add(updated_node)
-        return cluster_state.set("nodes", final_nodes)
+        if not updated_node._provides_information():
+            updated_node = None
+        return _replace_node(cluster_state, self.node_uuid, updated_node)
 
     def key(self):
         return (self.node_uuid, self.attributes)
 
 
+@_cache_hash
 class DeploymentState(PClass):
     """
     A ``DeploymentState`` describes the state of the nodes in the cluster.
@@ -1122,17 +1385,15 @@ class DeploymentState(PClass):
 
         :return DeploymentState: Updated with new ``NodeState``.
         """
-        nodes = {n for n in self.nodes if same_node(n, node_state)}
-        if not nodes:
-            return self.transform(["nodes"], lambda s: s.add(node_state))
-        [original_node] = nodes
+        original_node = _node_index(self).get(node_state.uuid)
+        if original_node is None:
+            return _replace_node(self, node_state.uuid, node_state)
         updated_node = original_node.evolver()
         for key, value in node_state.items():
             if value is not None:
                 updated_node = updated_node.set(key, value)
-        return self.set(
-            "nodes", self.nodes.discard(original_node).add(
-                updated_node.persistent()))
+        return _replace_node(
+            self, node_state.uuid, updated_node.persistent())
 
     def remove_node(self, node_uuid):
         """
@@ -1142,8 +1403,7 @@ class DeploymentState(PClass):
 
         :return: Updated ``DeploymentState``.
         """
-        return self.set(nodes={node for node in self.nodes
-                               if node.uuid != node_uuid})
+        return _replace_node(self, node_uuid, None)
 
     def all_datasets(self):
         """
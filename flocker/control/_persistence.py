@@ -4,24 +4,34 @@
 Persistence of cluster configuration.
 """
 
-from json import dumps, loads, JSONEncoder
+import os
+import sqlite3
+from json import dumps, load, loads, JSONEncoder
+from functools import partial
 from uuid import UUID
 from calendar import timegm
 from datetime import datetime
 from hashlib import sha256
 
-from eliot import Logger, write_traceback, MessageType, Field, ActionType
+from eliot import (
+    Logger, write_traceback, write_failure, MessageType, Field, ActionType,
+)
 
 from pyrsistent import PRecord, PVector, PMap, PSet, pmap, PClass
 
 from pytz import UTC
 
+from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 from twisted.application.service import Service, MultiService
-from twisted.internet.defer import succeed
-from twisted.internet.task import LoopingCall
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.internet.threads import deferToThreadPool
 
-from ._model import SERIALIZABLE_CLASSES, Deployment, Configuration
+from ._model import (
+    SERIALIZABLE_CLASSES, Deployment, Configuration, Node, NodeState,
+    _IdentityMemo, _node_index,
+)
+from ._diffing import DIFF_SERIALIZABLE_CLASSES, create_diff
 
 # The class at the root of the configuration tree.
 ROOT_CLASS = Deployment
@@ -35,7 +45,10 @@ _CLASS_MARKER = u"$__class__$"
 _CONFIG_VERSION = 4
 
 # Map of serializable class names to classes
-_CONFIG_CLASS_MAP = {cls.__name__: cls for cls in SERIALIZABLE_CLASSES}
+_CONFIG_CLASS_MAP = {
+    cls.__name__: cls
+    for cls in SERIALIZABLE_CLASSES + DIFF_SERIALIZABLE_CLASSES
+}
 
 
 class ConfigurationMigrationError(Exception):
@@ -68,6 +81,85 @@ class MissingMigrationError(Exception):
         super(MissingMigrationError, self).__init__(self.message)
 
 
+def _migrations(source_version, target_version, migration_class):
+    """
+    Find the ``migration_class`` class methods for sequential upgrades
+    between the supplied source and target versions.
+
+    :param int source_version: The version to migrate from.
+    :param int target_version: The version to migrate to.
+    :param class migration_class: The class containing the methods
+        that will be used for migration.
+
+    :return list: ``(version, method)`` pairs of the version each upgrade
+        method migrates from and the method, in the order they must be
+        called.
+    :raises MissingMigrationError: If any of the required upgrade methods
+        cannot be found in the supplied migration class.
+    """
+    migrations_sequence = []
+    for current_version in range(source_version, target_version):
+        migration_method = u"upgrade_from_v%d" % current_version
+        migration = getattr(migration_class, migration_method, None)
+        if migration is None:
+            raise MissingMigrationError(current_version, current_version + 1)
+        migrations_sequence.append((current_version, migration))
+    return migrations_sequence
+
+
+def _migrate_decoded(source_version, target_version, config,
+                     migration_class):
+    """
+    Migrate a decoded configuration from one version to another.
+
+    :param config: The decoded JSON of the source configuration.
+
+    See ``migrate_configuration`` for the other parameters.
+
+    :return: The decoded JSON of the updated configuration.
+    """
+    for current_version, migration in _migrations(
+        source_version, target_version, migration_class
+    ):
+        with _LOG_UPGRADE_STEP(source_version=current_version,
+                               target_version=current_version + 1):
+            config = migration(config)
+    return config
+
+
+def _encode_chunks(obj, depth=3):
+    """
+    Encode decoded JSON as ``dumps`` would, in chunks.
+
+    The containers nested less than ``depth`` levels deep are encoded here,
+    so that the whole encoding is never in memory at once, and the values
+    within them are each encoded by ``dumps``, which is much faster than
+    ``JSONEncoder.iterencode``.
+
+    :param obj: The decoded JSON.
+    :param int depth: The number of levels of containers to encode here.
+
+    :return: An iterator of ``bytes``.
+    """
+    if depth and isinstance(obj, dict):
+        yield b"{"
+        for index, (key, value) in enumerate(obj.iteritems()):
+            yield (b", " if index else b"") + dumps(key) + b": "
+            for chunk in _encode_chunks(value, depth - 1):
+                yield chunk
+        yield b"}"
+    elif depth and isinstance(obj, list):
+        yield b"["
+        for index, value in enumerate(obj):
+            if index:
+                yield b", "
+            for chunk in _encode_chunks(value, depth - 1):
+                yield chunk
+        yield b"]"
+    else:
+        yield dumps(obj)
+
+
 def migrate_configuration(source_version, target_version,
                           config, migration_class):
     """
@@ -78,6 +170,9 @@ def migrate_configuration(source_version, target_version,
 
     Calls the correct ``migration_class`` class methods for
     sequential upgrades between the suppled source and target versions.
+    The configuration is only parsed before the first upgrade and
+    serialized after the last, since the upgrades transform its decoded
+    JSON.
 
     :param int source_version: The version to migrate from.
     :param int target_version: The version to migrate to.
@@ -90,76 +185,94 @@ def migrate_configuration(source_version, target_version,
         required upgrade methods cannot be found in the supplied migration
         class, before attempting to execute any upgrade paths.
     """
-    upgraded_config = config
-    current_version = source_version
-    migrations_sequence = []
-    for upgrade_version in range(source_version + 1, target_version + 1):
-        with _LOG_UPGRADE(configuration=upgraded_config,
-                          source_version=current_version,
-                          target_version=upgrade_version):
-            migration_method = u"upgrade_from_v%d" % current_version
-            migration = getattr(migration_class, migration_method, None)
-            if migration is None:
-                raise MissingMigrationError(current_version, upgrade_version)
-            migrations_sequence.append(migration)
-            current_version += 1
-    for migration in migrations_sequence:
-        upgraded_config = migration(upgraded_config)
-    return upgraded_config
+    return dumps(_migrate_decoded(
+        source_version, target_version, loads(config), migration_class,
+    ))
+
+
+def migrate_configuration_file(source_version, target_version,
+                               source_path, target_path, migration_class):
+    """
+    Migrate a persisted configuration file, as ``migrate_configuration``
+    does, writing the result to another file.
+
+    The source configuration is read and decoded whole, since the upgrades
+    transform the decoded configuration as a whole and ``json`` has no
+    incremental parser.  Only the output is streamed: the updated
+    configuration is written as it is serialized, a part at a time, rather
+    than being serialized in memory first.  The target file is replaced
+    atomically.
+
+    :param FilePath source_path: The file containing the source
+        configuration.
+    :param FilePath target_path: The file to write the updated
+        configuration to.
+
+    See ``migrate_configuration`` for the other parameters.
+    """
+    with source_path.open("rb") as f:
+        config = load(f)
+    config = _migrate_decoded(
+        source_version, target_version, config, migration_class)
+    temporary = target_path.temporarySibling()
+    with temporary.open("wb") as f:
+        for chunk in _encode_chunks(config):
+            f.write(chunk)
+    temporary.moveTo(target_path)
 
 
 class ConfigurationMigration(object):
     """
     Migrate a JSON configuration from one version to another.
+
+    Each upgrade takes the decoded JSON of a configuration and returns the
+    decoded JSON of the next version, which may be the same object
+    modified.
     """
     @classmethod
     def upgrade_from_v1(cls, config):
         """
         Migrate a v1 JSON configuration to v2.
 
-        :param bytes config: The v1 JSON data.
-        :return bytes: The v2 JSON data.
+        :param dict config: The decoded v1 JSON data.
+        :return dict: The decoded v2 JSON data.
         """
-        v1_config = loads(config)
-        v2_config = {
+        return {
             _CLASS_MARKER: u"Configuration",
             u"version": 2,
-            u"deployment": v1_config
+            u"deployment": config,
         }
-        return dumps(v2_config)
 
     @classmethod
     def upgrade_from_v2(cls, config):
         """
         Migrate a v2 JSON configuration to v3.
 
-        :param bytes config: The v2 JSON data.
-        :return bytes: The v3 JSON data.
+        :param dict config: The decoded v2 JSON data.
+        :return dict: The decoded v3 JSON data.
         """
-        decoded_config = loads(config)
-        decoded_config[u"version"] = 3
-        decoded_config[u"deployment"][u"leases"] = {
+        config[u"version"] = 3
+        config[u"deployment"][u"leases"] = {
             u"values": [], _CLASS_MARKER: u"PMap",
         }
-        return dumps(decoded_config)
+        return config
 
     @classmethod
     def upgrade_from_v3(cls, config):
         """
         Migrate a v3 JSON configuration to v4.
 
-        :param bytes config: The v3 JSON data.
-        :return bytes: The v4 JSON data.
+        :param dict config: The decoded v3 JSON data.
+        :return dict: The decoded v4 JSON data.
         """
-        decoded_config = loads(config)
-        decoded_config[u"version"] = 4
-        decoded_config[u"deployment"][u"persistent_state"] = {
+        config[u"version"] = 4
+        config[u"deployment"][u"persistent_state"] = {
             _CLASS_MARKER: u"PersistentState",
             u"blockdevice_ownership": {
                 u"values": [], _CLASS_MARKER: "PMap",
             },
         }
-        return dumps(decoded_config)
+        return config
 
 
 class _ConfigurationEncoder(JSONEncoder):
@@ -195,6 +308,41 @@ class _ConfigurationEncoder(JSONEncoder):
         return JSONEncoder.default(self, obj)
 
 
+# Model classes whose JSON encodings are memoized by ``wire_encode``.
+# Successive versions of the configuration and the cluster state share most
+# of their nodes, so encoding a new version only needs to encode the nodes
+# which changed.
+_MEMOIZED_CLASSES = frozenset([Node, NodeState])
+
+_ENCODER = _ConfigurationEncoder()
+
+_encode_memoized = _IdentityMemo(partial(dumps, cls=_ConfigurationEncoder))
+
+
+def _encode_fragment(obj):
+    """
+    Encode an object as ``dumps`` would, using memoized encodings for
+    objects in ``_MEMOIZED_CLASSES``.
+
+    Records, and sequences which may contain records, are encoded here so
+    that memoized encodings can be found within them.  Anything else is
+    encoded by ``dumps``.
+    """
+    cls = type(obj)
+    if cls in _MEMOIZED_CLASSES:
+        return _encode_memoized(obj)
+    elif issubclass(cls, (PRecord, PClass)):
+        return b"{" + b", ".join(
+            dumps(key) + b": " + _encode_fragment(value)
+            for (key, value) in _ENCODER.default(obj).iteritems()
+        ) + b"}"
+    elif issubclass(cls, (PSet, PVector, set, list, tuple)):
+        return b"[" + b", ".join(
+            _encode_fragment(item) for item in obj
+        ) + b"]"
+    return dumps(obj, cls=_ConfigurationEncoder)
+
+
 def wire_encode(obj):
     """
     Encode the given model object into bytes.
@@ -202,7 +350,7 @@ def wire_encode(obj):
     :param obj: An object from the configuration model, e.g. ``Deployment``.
     :return bytes: Encoded object.
     """
-    return dumps(obj, cls=_ConfigurationEncoder)
+    return _encode_fragment(obj)
 
 
 def wire_decode(data):
@@ -239,8 +387,61 @@ def to_unserialized_json(obj):
     :param obj: An object that can be passed to ``wire_encode``.
     :return: Python object that can be JSON serialized.
     """
-    # Worst implementation everrrr:
-    return loads(wire_encode(obj))
+    return _unserialize(obj)
+
+
+def _unserialize(obj):
+    """
+    Convert an object to what ``loads(wire_encode(obj))`` would return,
+    without encoding it, using memoized conversions for objects in
+    ``_MEMOIZED_CLASSES``.
+
+    Since memoized conversions are shared, the result must not be mutated.
+    """
+    cls = type(obj)
+    if cls is unicode or cls is int or cls is bool or obj is None:
+        return obj
+    elif cls is bytes:
+        return obj.decode("utf-8")
+    elif cls in _MEMOIZED_CLASSES:
+        return _unserialize_memoized(obj)
+    elif issubclass(cls, (PRecord, PClass)):
+        return _unserialize_dict(_ENCODER.default(obj))
+    elif issubclass(cls, PMap):
+        return {
+            _CLASS_MARKER: u"PMap",
+            u"values": [[_unserialize(key), _unserialize(value)]
+                        for (key, value) in dict(obj).iteritems()],
+        }
+    elif issubclass(cls, (PSet, PVector, set, list, tuple)):
+        return [_unserialize(item) for item in obj]
+    elif issubclass(cls, dict):
+        if all(type(key) is unicode for key in obj):
+            return {
+                key: _unserialize(value) for (key, value) in obj.iteritems()
+            }
+        # JSON only has string keys; let ``dumps`` decide how to convert
+        # these ones.
+        return loads(dumps(obj, cls=_ConfigurationEncoder))
+    elif issubclass(cls, (int, long, float)):
+        return loads(dumps(obj))
+    return _unserialize_dict(_ENCODER.default(obj))
+
+
+def _unserialize_dict(dictionary):
+    """
+    Convert the result of ``_ConfigurationEncoder.default``, whose keys are
+    all strings, as ``_unserialize`` would.
+    """
+    return {
+        key.decode("utf-8") if type(key) is bytes else key:
+        _unserialize(value)
+        for (key, value) in dictionary.iteritems()
+    }
+
+_unserialize_memoized = _IdentityMemo(
+    lambda obj: _unserialize_dict(_ENCODER.default(obj))
+)
 
 _DEPLOYMENT_FIELD = Field(u"configuration", to_unserialized_json)
 _LOG_STARTUP = MessageType(u"flocker-control:persistence:startup",
@@ -255,6 +456,10 @@ _UPGRADE_TARGET_FIELD = Field.for_types(
 _LOG_UPGRADE = ActionType(u"flocker-control:persistence:migrate_configuration",
                           [_DEPLOYMENT_FIELD, _UPGRADE_SOURCE_FIELD,
                            _UPGRADE_TARGET_FIELD, ], [])
+_LOG_UPGRADE_STEP = ActionType(
+    u"flocker-control:persistence:migrate_configuration_step",
+    [_UPGRADE_SOURCE_FIELD, _UPGRADE_TARGET_FIELD], [],
+    u"Upgrade a configuration from one version to the next.")
 _LOG_EXPIRE = MessageType(
     u"flocker-control:persistence:lease-expired",
     [Field(u"dataset_id", unicode), Field(u"node_id", unicode)],
@@ -268,30 +473,82 @@ _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED = MessageType(
 )
 
 
+# Leases are expired this many seconds after their expiration time, since
+# they only count as expired once it has passed:
+_EXPIRY_MARGIN = 0.001
+
+
+def _timestamp(when):
+    """
+    :param datetime when: A timezone-aware date/time.
+
+    :return float: The corresponding POSIX timestamp.
+    """
+    return timegm(when.utctimetuple()) + when.microsecond / 1000000.0
+
+
 class LeaseService(Service):
     """
     Manage leases.
-    In particular, clear out expired leases once a second.
+    In particular, clear out leases when they expire.
 
     :ivar _reactor: A ``IReactorTime`` provider.
     :ivar _persistence_service: The persistence service to act with.
-    :ivar _lc: A ``twisted.internet.task.LoopingCall`` run every second
-        to update the configured leases by releasing leases that have
-        expired.
+    :ivar Leases _leases: The leases whose earliest expiration is scheduled,
+        or ``None`` if nothing is scheduled.
+    :ivar _call: An ``IDelayedCall`` to release the leases which have expired
+        when the earliest one expires, or ``None`` if no lease expires.
     """
     def __init__(self, reactor, persistence_service):
         self._reactor = reactor
         self._persistence_service = persistence_service
+        self._leases = None
+        self._call = None
+        persistence_service.register(self._schedule)
 
     def startService(self):
-        self._lc = LoopingCall(self._expire)
-        self._lc.clock = self._reactor
-        self._lc.start(1)
+        Service.startService(self)
+        self._schedule()
 
     def stopService(self):
-        self._lc.stop()
+        Service.stopService(self)
+        self._leases = None
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+    def _schedule(self):
+        """
+        Schedule the release of expired leases for when the earliest
+        expiration of the configured leases has passed.  The schedule is
+        only recalculated when the leases have changed.
+        """
+        if not self.running:
+            return
+        leases = self._persistence_service.get().leases
+        if leases is self._leases:
+            return
+        self._leases = leases
+        expirations = [
+            lease.expiration for lease in leases.itervalues()
+            if lease.expiration is not None
+        ]
+        if not expirations:
+            if self._call is not None:
+                self._call.cancel()
+                self._call = None
+            return
+        delay = max(
+            _timestamp(min(expirations)) - self._reactor.seconds(), 0
+        ) + _EXPIRY_MARGIN
+        if self._call is None:
+            self._call = self._reactor.callLater(delay, self._expire)
+        else:
+            self._call.reset(delay)
 
     def _expire(self):
+        self._call = None
+        self._leases = None
         now = datetime.fromtimestamp(self._reactor.seconds(), tz=UTC)
 
         def expire(leases):
@@ -300,7 +557,10 @@ class LeaseService(Service):
                 _LOG_EXPIRE(dataset_id=dataset_id,
                             node_id=leases[dataset_id].node_id).write()
             return updated_leases
-        return update_leases(expire, self._persistence_service)
+        d = update_leases(expire, self._persistence_service)
+        # Reschedule even if nothing was saved:
+        self._schedule()
+        return d
 
 
 def update_leases(transform, persistence_service):
@@ -316,31 +576,627 @@ def update_leases(transform, persistence_service):
         persistence service has saved.
     """
     config = persistence_service.get()
-    new_config = config.set("leases", transform(config.leases))
+    new_leases = transform(config.leases)
+    if new_leases is config.leases:
+        # Nothing changed, so saving the same object is very cheap.
+        new_config = config
+    else:
+        new_config = config.set("leases", new_leases)
     d = persistence_service.save(new_config)
     d.addCallback(lambda _: new_config.leases)
     return d
 
 
+_LOG_JOURNAL_DISCARDED = MessageType(
+    u"flocker-control:persistence:journal-discarded",
+    [Field.for_types(u"reason", [unicode], u"Why it was discarded.")],
+    u"Some or all of the configuration journal was not replayed.",
+)
+
+# Journals aren't compacted until they are at least this big, however small
+# the snapshot is:
+_MINIMUM_COMPACTION_SIZE = 1024 * 1024
+
+
+def _snapshot_cache_header(snapshot_hash):
+    """
+    :param bytes snapshot_hash: The hash of a configuration snapshot.
+
+    :return dict: The header identifying a snapshot cache which is valid for
+        that snapshot and for this version of the code.
+    """
+    # ``_binary`` imports this module:
+    from ._binary import BINARY_WIRE_FORMAT_SIGNATURE
+    return {
+        u"version": _CONFIG_VERSION,
+        u"signature": BINARY_WIRE_FORMAT_SIGNATURE,
+        u"snapshot": snapshot_hash,
+    }
+
+
+def _read_snapshot_cache(path, snapshot_hash):
+    """
+    Read the configuration from a snapshot cache, which holds the same
+    configuration as a snapshot but in the binary wire format, which is
+    quicker to decode.
+
+    :param FilePath path: The cache file.
+    :param bytes snapshot_hash: The hash of the snapshot.
+
+    :return: The cached ``Deployment``, or ``None`` if there is no cache for
+        the snapshot.
+    """
+    from ._binary import binary_wire_decode
+    if not path.exists():
+        return None
+    header, _, data = path.getContent().partition(b"\n")
+    try:
+        header = loads(header)
+    except ValueError:
+        return None
+    if header != _snapshot_cache_header(snapshot_hash):
+        return None
+    return binary_wire_decode(data)
+
+
+def _write_snapshot_cache(path, snapshot_hash, deployment):
+    """
+    Write a snapshot cache.
+
+    :param FilePath path: The cache file.
+    :param bytes snapshot_hash: The hash of the snapshot.
+    :param Deployment deployment: The configuration in the snapshot.
+    """
+    from ._binary import binary_wire_encode
+    _write_durably(
+        path,
+        dumps(_snapshot_cache_header(snapshot_hash)) + b"\n" +
+        binary_wire_encode(deployment),
+    )
+
+
+def _journal_view(deployment):
+    """
+    Describe a ``Deployment`` in a form whose diffs are proportional to the
+    size of a change.  ``create_diff`` treats the items of a ``PSet`` as
+    opaque, so changing one manifestation of a node in ``Deployment.nodes``
+    would replace the whole node.  Nodes are keyed by UUID here instead.
+
+    :param Deployment deployment: The configuration.
+
+    :return PMap: The view of the configuration.
+    """
+    return pmap({
+        u"nodes": _node_index(deployment),
+        u"leases": deployment.leases,
+        u"persistent_state": deployment.persistent_state,
+    })
+
+
+def _from_journal_view(view):
+    """
+    :param PMap view: A view created by ``_journal_view``, possibly with
+        diffs applied.
+
+    :return Deployment: The configuration it describes.
+    """
+    return Deployment(
+        nodes=view[u"nodes"].values(),
+        leases=view[u"leases"],
+        persistent_state=view[u"persistent_state"],
+    )
+
+
+def _write_durably(path, data):
+    """
+    Replace the contents of a file atomically, and only return once the new
+    contents are on disk.
+
+    :param FilePath path: The file to replace.
+    :param bytes data: Its new contents.
+    """
+    temporary = path.temporarySibling()
+    with temporary.open("wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    temporary.moveTo(path)
+
+
+class _Journal(object):
+    """
+    An append-only log of the changes made to the configuration since the
+    last snapshot was written.
+
+    The first line is a JSON header giving the configuration version and the
+    SHA256 hash of the snapshot the changes apply to.  Each further line is
+    a ``Diff`` of the result of ``_journal_view``, encoded by
+    ``wire_encode``.
+
+    :ivar int size: The number of bytes in the journal.
+    """
+    def __init__(self, path):
+        """
+        :param FilePath path: The journal file.
+        """
+        self._path = path
+        self._file = None
+        self.size = 0
+
+    def read(self, snapshot_hash):
+        """
+        Read the changes which apply to a snapshot.
+
+        :param bytes snapshot_hash: The hash of the snapshot.
+
+        :return: A ``list`` of ``Diff``\ s, in the order they were made.
+        """
+        if not self._path.exists():
+            return []
+        with self._path.open("rb") as f:
+            lines = f.read().split(b"\n")
+        try:
+            header = loads(lines[0])
+        except ValueError:
+            header = {}
+        if header.get(u"snapshot") != snapshot_hash:
+            # Written for an earlier snapshot, which was replaced before the
+            # journal could be reset.
+            _LOG_JOURNAL_DISCARDED(reason=u"stale").write()
+            return []
+        if header[u"version"] != _CONFIG_VERSION:
+            raise ConfigurationMigrationError(
+                "Journal for configuration version {} can't be replayed by "
+                "version {}.".format(header[u"version"], _CONFIG_VERSION)
+            )
+        diffs = []
+        for index, line in enumerate(lines[1:], 1):
+            if not line:
+                continue
+            try:
+                diffs.append(wire_decode(line))
+            except ValueError:
+                if index < len(lines) - 1:
+                    raise
+                # The last change was only partly written.
+                _LOG_JOURNAL_DISCARDED(reason=u"incomplete").write()
+        return diffs
+
+    def replay(self, deployment, snapshot_hash):
+        """
+        Apply the changes in the journal to the snapshot they were made to.
+
+        :param Deployment deployment: The configuration in the snapshot.
+        :param bytes snapshot_hash: The hash of the snapshot file.
+
+        :return Deployment: The configuration with the changes applied, which
+            is ``deployment`` itself if there were none.
+        """
+        diffs = self.read(snapshot_hash)
+        if not diffs:
+            return deployment
+        view = _journal_view(deployment)
+        for diff in diffs:
+            view = diff.apply(view)
+        return _from_journal_view(view)
+
+    def reset(self, snapshot_hash):
+        """
+        Discard all the changes and start logging changes to a new snapshot.
+
+        :param bytes snapshot_hash: The hash of the new snapshot.
+        """
+        self.close()
+        header = dumps({
+            u"version": _CONFIG_VERSION, u"snapshot": snapshot_hash,
+        }) + b"\n"
+        _write_durably(self._path, header)
+        self._file = self._path.open("ab")
+        self.size = len(header)
+
+    def append(self, diff):
+        """
+        Add a change to the end of the journal.  It isn't necessarily on disk
+        until ``sync`` is called.
+
+        :param Diff diff: A diff of the result of ``_journal_view``.
+        """
+        data = wire_encode(diff)
+        self._file.write(data + b"\n")
+        self._file.flush()
+        self.size += len(data) + 1
+
+    def sync(self):
+        """
+        Make sure all the changes are on disk.
+        """
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """
+        Close the journal file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# The tables of a configuration database.  Manifestations, leases and block
+# device owners each have a row per dataset, and a node's applications are
+# kept apart from its manifestations:
+_DATABASE_SCHEMA = b"""
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS nodes (
+    uuid TEXT PRIMARY KEY, applications TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS manifestations (
+    node_uuid TEXT NOT NULL, dataset_id TEXT NOT NULL,
+    manifestation TEXT NOT NULL, PRIMARY KEY (node_uuid, dataset_id));
+CREATE INDEX IF NOT EXISTS manifestations_by_dataset
+    ON manifestations (dataset_id);
+CREATE TABLE IF NOT EXISTS leases (
+    dataset_id TEXT PRIMARY KEY, lease TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS blockdevice_ownership (
+    dataset_id TEXT PRIMARY KEY, blockdevice_id TEXT NOT NULL);
+"""
+
+_DATABASE_TABLES = [
+    b"settings", b"nodes", b"manifestations", b"leases",
+    b"blockdevice_ownership",
+]
+
+
+def _changed_items(old, new):
+    """
+    Compare two mappings.
+
+    :param PMap old: The old mapping.
+    :param PMap new: The new mapping.
+
+    :return: A ``list`` of ``(key, value)`` for the items of ``new`` which
+        aren't in ``old``, and of ``(key, None)`` for the keys of ``old``
+        which aren't in ``new``.
+    """
+    if old is new:
+        return []
+    changed = []
+    for key, value in new.iteritems():
+        old_value = old.get(key)
+        if old_value is not value and old_value != value:
+            changed.append((key, value))
+    changed.extend((key, None) for key in old if key not in new)
+    return changed
+
+
+def _encode_object(class_name, fields):
+    """
+    Encode a model object as ``wire_encode`` would, from the encodings of
+    its fields.
+
+    :param unicode class_name: The name of the object's class.
+    :param fields: A ``list`` of ``(unicode, bytes)`` giving each field's
+        name and encoding.
+
+    :return bytes: The encoded object.
+    """
+    return b"{" + b", ".join(
+        dumps(name) + b": " + value
+        for (name, value) in fields + [(_CLASS_MARKER, dumps(class_name))]
+    ) + b"}"
+
+
+def _encode_pmap(items):
+    """
+    Encode a ``PMap`` as ``wire_encode`` would, from the encodings of its
+    items.
+
+    :param items: A ``list`` of ``(bytes, bytes)`` giving each item's
+        encoded key and value.
+
+    :return bytes: The encoded ``PMap``.
+    """
+    return _encode_object(u"PMap", [(u"values", b"[" + b", ".join(
+        b"[" + key + b", " + value + b"]" for (key, value) in items
+    ) + b"]")])
+
+
+class _Database(object):
+    """
+    A SQLite database holding the configuration, with a row for each node,
+    manifestation, lease and block device owner, so that a change is saved
+    by updating only the rows it affects in a single transaction.
+
+    :ivar sqlite3.Connection _connection: The connection to the database, or
+        ``None`` if it isn't open.
+    """
+    def __init__(self, path):
+        """
+        :param FilePath path: The database file.
+        """
+        self._path = path
+        self._connection = None
+
+    def open(self):
+        """
+        Open the database, creating it if necessary.
+        """
+        if self._connection is not None:
+            return
+        # Commits may be written by any thread of the service's threadpool,
+        # but only one at a time:
+        self._connection = sqlite3.connect(
+            self._path.path, check_same_thread=False)
+        self._connection.text_factory = bytes
+        self._connection.execute(b"PRAGMA journal_mode = WAL")
+        self._connection.execute(b"PRAGMA synchronous = FULL")
+        self._connection.executescript(_DATABASE_SCHEMA)
+
+    def close(self):
+        """
+        Close the database.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def read(self):
+        """
+        Read the configuration.
+
+        :return: The configuration encoded by ``wire_encode`` as it would be
+            in a snapshot, or ``None`` if no configuration has been written.
+        """
+        execute = self._connection.execute
+        version = execute(
+            b"SELECT value FROM settings WHERE name = 'version'"
+        ).fetchone()
+        if version is None:
+            return None
+        manifestations = {}
+        for node_uuid, dataset_id, manifestation in execute(
+            b"SELECT node_uuid, dataset_id, manifestation FROM manifestations "
+            b"ORDER BY node_uuid, dataset_id"
+        ):
+            manifestations.setdefault(node_uuid, []).append(
+                (dumps(dataset_id), manifestation))
+        nodes = [
+            _encode_object(u"Node", [
+                (u"uuid", wire_encode(UUID(uuid))),
+                (u"applications", applications),
+                (u"manifestations",
+                 _encode_pmap(manifestations.get(uuid, []))),
+            ])
+            for (uuid, applications) in execute(
+                b"SELECT uuid, applications FROM nodes ORDER BY uuid")
+        ]
+        leases = [
+            (wire_encode(UUID(dataset_id)), lease)
+            for (dataset_id, lease) in execute(
+                b"SELECT dataset_id, lease FROM leases ORDER BY dataset_id")
+        ]
+        owners = [
+            (wire_encode(UUID(dataset_id)),
+             dumps(blockdevice_id.decode("utf-8")))
+            for (dataset_id, blockdevice_id) in execute(
+                b"SELECT dataset_id, blockdevice_id "
+                b"FROM blockdevice_ownership ORDER BY dataset_id")
+        ]
+        return _encode_object(u"Configuration", [
+            (u"version", version[0]),
+            (u"deployment", _encode_object(u"Deployment", [
+                (u"nodes", b"[" + b", ".join(nodes) + b"]"),
+                (u"leases", _encode_pmap(leases)),
+                (u"persistent_state", _encode_object(u"PersistentState", [
+                    (u"blockdevice_ownership", _encode_pmap(owners)),
+                ])),
+            ])),
+        ])
+
+    def _changes(self, previous, deployment):
+        """
+        :param Deployment previous: The configuration in the database.
+        :param Deployment deployment: A new configuration.
+
+        :return: A ``list`` of the ``(statement, parameters)`` which update
+            the rows that differ between the two.
+        """
+        statements = []
+        previous_nodes = _node_index(previous)
+        nodes = _node_index(deployment)
+        for uuid, node in _changed_items(previous_nodes, nodes):
+            uuid = unicode(uuid)
+            if node is None:
+                statements.extend([
+                    (b"DELETE FROM nodes WHERE uuid = ?", (uuid,)),
+                    (b"DELETE FROM manifestations WHERE node_uuid = ?",
+                     (uuid,)),
+                ])
+                continue
+            old = previous_nodes.get(node.uuid)
+            if old is None or old.applications != node.applications:
+                statements.append((
+                    b"INSERT OR REPLACE INTO nodes (uuid, applications) "
+                    b"VALUES (?, ?)",
+                    (uuid, wire_encode(node.applications)),
+                ))
+            for dataset_id, manifestation in _changed_items(
+                pmap() if old is None else old.manifestations,
+                node.manifestations,
+            ):
+                if manifestation is None:
+                    statements.append((
+                        b"DELETE FROM manifestations "
+                        b"WHERE node_uuid = ? AND dataset_id = ?",
+                        (uuid, dataset_id),
+                    ))
+                else:
+                    statements.append((
+                        b"INSERT OR REPLACE INTO manifestations "
+                        b"(node_uuid, dataset_id, manifestation) "
+                        b"VALUES (?, ?, ?)",
+                        (uuid, dataset_id, wire_encode(manifestation)),
+                    ))
+        for dataset_id, lease in _changed_items(
+            previous.leases, deployment.leases
+        ):
+            if lease is None:
+                statements.append((
+                    b"DELETE FROM leases WHERE dataset_id = ?",
+                    (unicode(dataset_id),),
+                ))
+            else:
+                statements.append((
+                    b"INSERT OR REPLACE INTO leases (dataset_id, lease) "
+                    b"VALUES (?, ?)",
+                    (unicode(dataset_id), wire_encode(lease)),
+                ))
+        for dataset_id, blockdevice_id in _changed_items(
+            previous.persistent_state.blockdevice_ownership,
+            deployment.persistent_state.blockdevice_ownership,
+        ):
+            if blockdevice_id is None:
+                statements.append((
+                    b"DELETE FROM blockdevice_ownership WHERE dataset_id = ?",
+                    (unicode(dataset_id),),
+                ))
+            else:
+                statements.append((
+                    b"INSERT OR REPLACE INTO blockdevice_ownership "
+                    b"(dataset_id, blockdevice_id) VALUES (?, ?)",
+                    (unicode(dataset_id), blockdevice_id),
+                ))
+        return statements
+
+    def _execute(self, statements):
+        """
+        Execute statements in a single transaction.
+
+        :param statements: A ``list`` of ``(statement, parameters)``.
+        """
+        with self._connection:
+            for statement, parameters in statements:
+                self._connection.execute(statement, parameters)
+
+    def write(self, previous, deployment):
+        """
+        Update the rows which differ between the configuration in the
+        database and a new one.
+
+        :param Deployment previous: The configuration in the database.
+        :param Deployment deployment: The new configuration.
+        """
+        self._execute(self._changes(previous, deployment))
+
+    def replace(self, deployment):
+        """
+        Replace everything in the database with a configuration.
+
+        :param Deployment deployment: The configuration.
+        """
+        self._execute(
+            [(b"DELETE FROM " + table, ()) for table in _DATABASE_TABLES] +
+            [(b"INSERT INTO settings (name, value) VALUES ('version', ?)",
+              (_CONFIG_VERSION,))] +
+            self._changes(Deployment(), deployment)
+        )
+
+
+def _encode_configuration(deployment):
+    """
+    Encode a configuration as it is written to a snapshot.
+
+    :param Deployment deployment: The configuration.
+
+    :return: ``tuple`` of the encoded configuration and its SHA256 hash.
+    """
+    data = wire_encode(
+        Configuration(version=_CONFIG_VERSION, deployment=deployment))
+    return data, sha256(data).hexdigest()
+
+
 class ConfigurationPersistenceService(MultiService):
     """
     Persist configuration to disk, and load it back.
 
+    Saves are committed to disk in batches: while one commit is being written
+    any further saves are queued, and are then all committed together by
+    writing only the latest configuration.
+
     :ivar Deployment _deployment: The current desired deployment configuration.
-    :ivar bytes _hash: A SHA256 hash of the configuration.
+    :ivar bytes _hash: A SHA256 hash of the encoded configuration.
+    :ivar bytes _encoded: The configuration encoded by
+        ``_encode_configuration``.
+    :ivar int _generation: The number of times a changed configuration has
+        been saved, including when it was loaded.
+    :ivar _Journal _journal: The journal of changes since the snapshot in
+        ``_config_path`` was written, or ``None`` if every change is saved by
+        writing a new snapshot.
+    :ivar _Database _database: The database holding the configuration, or
+        ``None`` if it is held in a snapshot.
+    :ivar Deployment _committed: The configuration most recently written to
+        disk.
+    :ivar bytes _written_hash: The hash of the snapshot most recently
+        written to disk.
+    :ivar int _snapshot_size: The size of the last snapshot written.
+    :ivar bytes _cached_hash: The hash of the snapshot in the snapshot cache
+        at ``_cache_path``, or ``None``.
+    :ivar bool _committing: Whether a commit is being written, or is
+        scheduled to be.
+    :ivar _commit_call: The ``IDelayedCall`` which starts the most recently
+        scheduled commit, or ``None``.
+    :ivar list _batch: ``Deferred``\ s for the saves waiting for the next
+        commit.
+    :ivar list _idle_waiters: ``Deferred``\ s to fire once there are no
+        commits being written or waiting to be.
     """
     logger = Logger()
 
-    def __init__(self, reactor, path):
+    def __init__(self, reactor, path, journal=False, threadpool=None,
+                 database=False):
         """
         :param reactor: Reactor to use for thread pool.
         :param FilePath path: Directory where desired deployment will be
             persisted.
+        :param bool journal: If true, save changes by appending them to a
+            journal, which is compacted into a new snapshot of the whole
+            configuration once it is bigger than the last one.  Otherwise a
+            new snapshot is written for every commit.
+        :param threadpool: A ``twisted.python.threadpool.ThreadPool`` in which
+            to write commits, or ``None`` to write them synchronously.
+        :param bool database: If true, keep the configuration in a SQLite
+            database rather than in a snapshot, so that each commit only
+            updates the parts of the configuration which changed.  A
+            snapshot is imported into a new database, and a database is
+            exported to a snapshot when the service is next started without
+            this option.
         """
+        if journal and database:
+            raise ValueError(
+                "A configuration database can't be used with a journal.")
         MultiService.__init__(self)
+        self._reactor = reactor
         self._path = path
         self._config_path = self._path.child(b"current_configuration.json")
+        self._cache_path = self._path.child(b"current_configuration.cache")
+        self._database_path = self._path.child(
+            b"current_configuration.sqlite")
+        self._cached_hash = None
         self._change_callbacks = []
+        self._generation = 0
+        self._journal = None
+        if journal:
+            self._journal = _Journal(
+                self._path.child(b"current_configuration.journal"))
+        self._database = None
+        if database:
+            self._database = _Database(self._database_path)
+        self._threadpool = threadpool
+        self._snapshot_size = 0
+        self._committing = False
+        self._commit_call = None
+        self._batch = []
+        self._idle_waiters = []
         LeaseService(reactor, self).setServiceParent(self)
 
     def startService(self):
@@ -350,6 +1206,29 @@ class ConfigurationPersistenceService(MultiService):
         MultiService.startService(self)
         _LOG_STARTUP(configuration=self.get()).write(self.logger)
 
+    def stopService(self):
+        stopped = MultiService.stopService(self)
+        if self._commit_call is not None and self._commit_call.active():
+            # Don't wait for the reactor to start the scheduled commit:
+            self._commit_call.cancel()
+            self._commit()
+        d = self._wait_for_commits()
+
+        def compact(_):
+            if self._database is not None:
+                self._database.close()
+                return
+            if self._journal is not None:
+                # Leave a snapshot of everything and an empty journal, so the
+                # journal only needs replaying after a crash.
+                self._write_snapshot(self._encoded)
+                self._committed = self._deployment
+                self._journal.close()
+            self._write_cache(self._committed)
+        d.addCallback(compact)
+        d.addCallback(lambda _: stopped)
+        return d
+
     def _process_v1_config(self, file_name, archive_name):
         """
         Check if a v1 configuration file exists and upgrade it if necessary.
@@ -371,19 +1250,31 @@ class ConfigurationPersistenceService(MultiService):
                               configuration=v1_json,
                               source_version=1,
                               target_version=_CONFIG_VERSION):
-                updated_json = migrate_configuration(
-                    1, _CONFIG_VERSION, v1_json,
+                migrate_configuration_file(
+                    1, _CONFIG_VERSION, v1_config_path, self._config_path,
                     ConfigurationMigration
                 )
-                self._config_path.setContent(updated_json)
                 v1_config_path.moveTo(v1_archived_path)
 
     def configuration_hash(self):
         """
-        :return bytes: A hash of the configuration.
+        :return bytes: A hash of the configuration.  It is a hash of the
+            configuration as it is written to a snapshot, whichever way it
+            is actually saved, so it changes as soon as a changed
+            configuration is saved rather than once it has been written.
         """
         return self._hash
 
+    def configuration_generation(self):
+        """
+        :return int: The generation of the configuration.  This increases
+            every time a changed configuration is saved, so unlike
+            ``configuration_hash`` it only identifies configurations during
+            the lifetime of this service, but it can be used by caches of
+            anything derived from the configuration without hashing it.
+        """
+        return self._generation
+
     def load_configuration(self):
         """
         Load the persisted configuration, upgrading the configuration format
@@ -401,26 +1292,131 @@ class ConfigurationPersistenceService(MultiService):
             archive_name=b"current_configuration.v1.old.json"
         )
 
+        if self._database is not None:
+            self._load_database()
+            self._encoded, self._hash = _encode_configuration(self._deployment)
+            self._generation += 1
+            return
+        self._export_database()
+
         # We can now safely attempt to detect and process a >v1 configuration
         # file as normal.
         if self._config_path.exists():
             config_json = self._config_path.getContent()
-            config_dict = loads(config_json)
-            config_version = config_dict['version']
-            if config_version < _CONFIG_VERSION:
-                with _LOG_UPGRADE(self.logger,
-                                  configuration=config_json,
-                                  source_version=config_version,
-                                  target_version=_CONFIG_VERSION):
-                    config_json = migrate_configuration(
-                        config_version, _CONFIG_VERSION,
-                        config_json, ConfigurationMigration)
-            config = wire_decode(config_json)
-            self._deployment = config.deployment
-            self._sync_save(config.deployment)
+            snapshot_hash = sha256(config_json).hexdigest()
+            deployment = _read_snapshot_cache(self._cache_path, snapshot_hash)
+            if deployment is None:
+                deployment, changed = self._decode_snapshot(config_json)
+            else:
+                self._cached_hash = snapshot_hash
+                changed = False
+            if self._journal is not None:
+                replayed = self._journal.replay(deployment, snapshot_hash)
+                changed = changed or replayed is not deployment
+                deployment = replayed
+        else:
+            deployment = Deployment()
+            changed = True
+        self._deployment = self._committed = deployment
+        if changed:
+            self._encoded, self._hash = _encode_configuration(deployment)
+            self._write_snapshot(self._encoded)
+        else:
+            # The snapshot is already up to date, so there's no need to
+            # rewrite it:
+            self._encoded = config_json
+            self._hash = self._written_hash = snapshot_hash
+            self._snapshot_size = len(config_json)
+            if self._journal is not None:
+                self._journal.reset(snapshot_hash)
+        self._write_cache(deployment)
+        self._generation += 1
+
+    def _load_database(self):
+        """
+        Load the configuration from the database, importing the snapshot into
+        the database if it has no configuration yet.  The imported snapshot
+        is archived, so it isn't loaded in preference to the database should
+        the service be started without a database later.
+
+        A journal left by a service in journal mode which didn't stop
+        cleanly is replayed onto the snapshot before it is imported, and is
+        archived along with it.
+        """
+        self._database.open()
+        config_json = self._database.read()
+        if config_json is not None:
+            deployment, changed = self._decode_snapshot(config_json)
+        elif self._config_path.exists():
+            snapshot_json = self._config_path.getContent()
+            deployment, _ = self._decode_snapshot(snapshot_json)
+            journal_path = self._path.child(b"current_configuration.journal")
+            deployment = _Journal(journal_path).replay(
+                deployment, sha256(snapshot_json).hexdigest())
+            self._database.replace(deployment)
+            self._config_path.moveTo(
+                self._path.child(b"current_configuration.old.json"))
+            if journal_path.exists():
+                journal_path.moveTo(
+                    self._path.child(b"current_configuration.old.journal"))
+            changed = False
         else:
-            self._deployment = Deployment()
-            self._sync_save(self._deployment)
+            deployment = Deployment()
+            changed = True
+        if changed:
+            self._database.replace(deployment)
+        self._deployment = self._committed = deployment
+
+    def _export_database(self):
+        """
+        Replace the snapshot with the configuration in the database, if there
+        is a database, and archive the database so that it is only exported
+        once.
+
+        The database orders the configuration it reads differently from
+        ``wire_encode``, so the configuration is encoded again to give the
+        snapshot the hash the configuration had in the database.
+        """
+        if not self._database_path.exists():
+            return
+        database = _Database(self._database_path)
+        database.open()
+        try:
+            config_json = database.read()
+        finally:
+            database.close()
+        if config_json is not None:
+            deployment, _ = self._decode_snapshot(config_json)
+            _write_durably(
+                self._config_path, _encode_configuration(deployment)[0])
+        self._database_path.moveTo(
+            self._path.child(b"current_configuration.old.sqlite"))
+
+    def _decode_snapshot(self, config_json):
+        """
+        Decode a snapshot, upgrading its configuration format if it is an
+        older version.
+
+        Snapshots of older versions can be decoded as if they were the
+        current version, because fields added since have defaults, so
+        the current version is decoded in a single pass and only older
+        versions need decoding again after they have been upgraded.
+
+        :param bytes config_json: The contents of the snapshot.
+
+        :return: A tuple of the ``Deployment`` and whether it was upgraded.
+        """
+        config = wire_decode(config_json)
+        if config.version >= _CONFIG_VERSION:
+            return config.deployment, False
+        with _LOG_UPGRADE(self.logger,
+                          configuration=config_json,
+                          source_version=config.version,
+                          target_version=_CONFIG_VERSION):
+            config_json = migrate_configuration(
+                config.version, _CONFIG_VERSION,
+                config_json, ConfigurationMigration)
+        return wire_decode(config_json).deployment, True
 
     def register(self, change_callback):
         """
@@ -431,14 +1427,146 @@ class ConfigurationPersistenceService(MultiService):
         """
         self._change_callbacks.append(change_callback)
 
-    def _sync_save(self, deployment):
+    def _write_snapshot(self, data):
+        """
+        Atomically replace the snapshot with the whole configuration,
+        returning once it is on disk, and empty the journal.
+
+        :param bytes data: The configuration encoded by
+            ``_encode_configuration``.
+
+        :return bytes: The hash of the configuration.
         """
-        Save and flush new configuration to disk synchronously.
+        self._written_hash = sha256(data).hexdigest()
+        self._snapshot_size = len(data)
+        _write_durably(self._config_path, data)
+        if self._journal is not None:
+            self._journal.reset(self._written_hash)
+        return self._written_hash
+
+    def _write_cache(self, deployment):
+        """
+        Write the snapshot cache for the last snapshot written, unless it is
+        already up to date.
+
+        :param Deployment deployment: The configuration in the snapshot.
         """
-        config = Configuration(version=_CONFIG_VERSION, deployment=deployment)
-        data = wire_encode(config)
-        self._hash = sha256(data).hexdigest()
-        self._config_path.setContent(data)
+        if self._cached_hash != self._written_hash:
+            _write_snapshot_cache(
+                self._cache_path, self._written_hash, deployment)
+            self._cached_hash = self._written_hash
+
+    def _write(self, previous, deployment, data):
+        """
+        Write a commit to disk.  This is run in the threadpool, if there is
+        one, and only one commit is written at a time.
+
+        In journal and database modes only the change is written, unless the
+        journal is compacted.
+
+        :param Deployment previous: The configuration written by the last
+            commit.
+        :param Deployment deployment: The configuration to write.
+        :param bytes data: The configuration encoded by
+            ``_encode_configuration``, which is what is written to a
+            snapshot.
+        """
+        if self._database is not None:
+            self._database.write(previous, deployment)
+            return
+        if self._journal is None:
+            self._write_snapshot(data)
+            return
+        self._journal.append(create_diff(
+            _journal_view(previous), _journal_view(deployment),
+        ))
+        if self._journal.size > max(
+            self._snapshot_size, _MINIMUM_COMPACTION_SIZE
+        ):
+            # Snapshots are rarely written in journal mode, so they can be
+            # cached for a quick start even after a crash:
+            self._write_snapshot(data)
+            self._write_cache(deployment)
+            return
+        self._journal.sync()
+
+    def _notify_changed(self):
+        """
+        Call the change callbacks, logging any errors they raise.
+        """
+        for callback in self._change_callbacks:
+            try:
+                callback()
+            except:
+                # Second argument will be ignored in next Eliot release, so
+                # not bothering with particular value.
+                write_traceback(self.logger, u"")
+
+    def _commit(self):
+        """
+        Write the latest configuration to disk, then call the change
+        callbacks and fire the ``Deferred``\ s of the saves in the batch.
+        Saves made in the meantime are committed once it is done.
+
+        If the write fails and there have been no further saves, the
+        ``Deferred``\ s fail and the configuration is rolled back to the one
+        last written, so that it matches what is on disk.  Otherwise the
+        later saves include the failed changes, so the next commit writes
+        them and the ``Deferred``\ s fire along with its own.
+        """
+        batch, self._batch = self._batch, []
+        previous, deployment = self._committed, self._deployment
+        self._committing = True
+        if self._threadpool is None:
+            d = maybeDeferred(self._write, previous, deployment, self._encoded)
+        else:
+            d = deferToThreadPool(
+                self._reactor, self._threadpool, self._write, previous,
+                deployment, self._encoded,
+            )
+
+        def committed(_):
+            self._committed = deployment
+            # At some future point this will likely involve talking to a
+            # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
+            # guarantee immediate saving of the data.
+            self._notify_changed()
+
+        def finished(result):
+            self._committing = False
+            done = batch
+            if isinstance(result, Failure):
+                write_failure(result, self.logger)
+                if deployment is self._deployment:
+                    self._deployment = previous
+                    self._generation += 1
+                    self._encoded, self._hash = _encode_configuration(
+                        previous)
+                    self._notify_changed()
+                else:
+                    self._batch = batch + self._batch
+                    done = []
+            for waiting in done:
+                waiting.callback(result)
+            if self._batch:
+                self._commit()
+            else:
+                idle, self._idle_waiters = self._idle_waiters, []
+                for waiting in idle:
+                    waiting.callback(None)
+        d.addCallback(committed)
+        d.addBoth(finished)
+
+    def _wait_for_commits(self):
+        """
+        :return Deferred: Fires once there are no commits being written or
+            waiting to be.
+        """
+        if not self._committing:
+            return succeed(None)
+        d = Deferred()
+        self._idle_waiters.append(d)
+        return d
 
     def save(self, deployment):
         """
@@ -446,24 +1574,34 @@ class ConfigurationPersistenceService(MultiService):
 
         :return Deferred: Fires when write is finished.
         """
-        if deployment == self._deployment:
+        # Unchanged deployments are usually the very same object.  Otherwise
+        # the cached hashes of deployments make the comparison cheap unless
+        # they are equal.
+        if deployment is self._deployment or deployment == self._deployment:
             _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED().write(self.logger)
             return succeed(None)
 
         with _LOG_SAVE(self.logger, configuration=deployment):
-            self._sync_save(deployment)
             self._deployment = deployment
-            # At some future point this will likely involve talking to a
-            # distributed system (e.g. ZooKeeper or etcd), so the API doesn't
-            # guarantee immediate saving of the data.
-            for callback in self._change_callbacks:
-                try:
-                    callback()
-                except:
-                    # Second argument will be ignored in next Eliot release, so
-                    # not bothering with particular value.
-                    write_traceback(self.logger, u"")
-            return succeed(None)
+            self._generation += 1
+            # The configuration is encoded here rather than when it is
+            # written, so that its hash changes as soon as it does and equal
+            # configurations have the same hash however they are written.
+            # The encodings of unchanged nodes are memoized, so only the
+            # changed ones are encoded again:
+            self._encoded, self._hash = _encode_configuration(deployment)
+            result = Deferred()
+            self._batch.append(result)
+            if not self._committing:
+                if self._threadpool is None:
+                    # Commit once the saves made in this reactor turn are all
+                    # in the batch, so they share a single write:
+                    self._committing = True
+                    self._commit_call = self._reactor.callLater(
+                        0, self._commit)
+                else:
+                    self._commit()
+            return result
 
     def get(self):
         """
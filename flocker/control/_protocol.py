@@ -21,7 +21,26 @@ Interactions:
   the control service receives an update to the state of a specific node via a
   ``NodeStateCommand``, the control service integrates that update into a
   cluster-wide state representation (the state of all of the nodes) and sends a
-  ``ClusterStatusCommand`` to all convergence agents.
+  ``ClusterStatusCommand`` to all convergence agents.  Updates received in
+  quick succession are coalesced into one ``ClusterStatusCommand`` (see
+  ``NODE_CHANGED_COALESCE_WINDOW``).
+
+* Convergence agents announce the optional protocol features they support
+  using ``VersionCommand``.  Once an agent has announced
+  ``FEATURE_CLUSTER_STATUS_DIFFS`` and acknowledged a complete
+  ``ClusterStatusCommand``, later updates are sent to it as a
+  ``ClusterStatusDiffCommand`` carrying only the changes since the last
+  update it acknowledged.  Peers which both announce
+  ``FEATURE_BINARY_WIRE_FORMAT`` send model objects to each other in the
+  compact binary format of ``flocker.control._binary`` instead of JSON.
+  Agents which announce ``FEATURE_NODE_STATE_DIFFS`` number their node state
+  updates and, once an update has been acknowledged, send the next one as a
+  ``NodeStateDiffCommand`` carrying only the changes since then.
+
+* Convergence agents may declare, using ``SetNodeEraCommand``, that they only
+  need part of the cluster configuration and state (see ``ClusterScope``).
+  Such agents are only sent that part, and are not sent anything when an
+  update doesn't change it.
 
 Eliot contexts are transferred along with AMP commands, allowing tracing
 of logged actions across processes (see
@@ -29,17 +48,22 @@ http://eliot.readthedocs.org/en/0.6.0/threads.html).
 
 :var _wire_encode_cache: ``LRUCache`` mapping serializable objects to
     their ``wire_encode`` output.
+:var _binary_wire_encode_cache: ``LRUCache`` mapping serializable objects to
+    their ``binary_wire_encode`` output.
+:var _chunks_cache: ``LRUCache`` mapping the names and serialized values of
+    ``Big`` arguments to their chunks.
 """
 
 from datetime import timedelta
-from io import BytesIO
 from itertools import count
+from struct import pack
 from twisted.internet.defer import maybeDeferred
+from twisted.internet.threads import deferToThreadPool
 from uuid import UUID
 from functools import partial
 
 from eliot import (
-    Logger, ActionType, Action, Field, MessageType,
+    Logger, ActionType, Action, Field, MessageType, write_failure,
 )
 from eliot.twisted import DeferredContext
 
@@ -53,10 +77,9 @@ from zope.interface import Interface, Attribute
 
 from twisted.application.service import Service
 from twisted.protocols.amp import (
-    Argument, Command, Integer, CommandLocator, AMP, Unicode,
-    MAX_VALUE_LENGTH,
+    Argument, Command, Integer, CommandLocator, AMP, Unicode, ListOf,
+    AmpBox, MAX_VALUE_LENGTH,
 )
-from twisted.internet.task import LoopingCall
 from twisted.internet.protocol import ServerFactory
 from twisted.application.internet import StreamServerEndpointService
 from twisted.protocols.tls import TLSMemoryBIOFactory
@@ -66,9 +89,132 @@ from ._model import (
     Deployment, DeploymentState, ChangeSource, UpdateNodeStateEra,
     BlockDeviceOwnership, DatasetAlreadyOwned,
 )
+from ._diffing import Diff, create_diff
+from ._clusterstate import ResyncRequired
+from ._binary import (
+    BINARY_WIRE_FORMAT_SIGNATURE, binary_wire_encode, binary_wire_decode,
+    is_binary_wire_encoded,
+)
+from ._scope import AgentScope, ClusterScope, ClusterViews
+from ..common import TimerWheel
 
 PING_INTERVAL = timedelta(seconds=30)
 
+# When a node state change is received, how long the control service waits for
+# more changes before sending the new cluster state to agents, and the longest
+# it will keep delaying the first of several changes:
+NODE_CHANGED_COALESCE_WINDOW = timedelta(milliseconds=200)
+NODE_CHANGED_MAX_LATENCY = timedelta(seconds=1)
+
+# Optional protocol features, announced by each side of a connection using
+# ``VersionCommand``.  A feature is only used if both sides announce it.
+
+# The convergence agent understands ``ClusterStatusDiffCommand``:
+FEATURE_CLUSTER_STATUS_DIFFS = u"cluster-status-diffs"
+
+# The peer can decode ``SerializableArgument`` values in the binary wire
+# format.  The signature ensures both peers have the same model classes:
+FEATURE_BINARY_WIRE_FORMAT = (
+    u"binary-wire-format-" + BINARY_WIRE_FORMAT_SIGNATURE
+)
+
+# The control service understands ``NodeStateDiffCommand``:
+FEATURE_NODE_STATE_DIFFS = u"node-state-diffs"
+
+# The features supported by this implementation of the protocol:
+SUPPORTED_FEATURES = frozenset([
+    FEATURE_CLUSTER_STATUS_DIFFS, FEATURE_BINARY_WIRE_FORMAT,
+    FEATURE_NODE_STATE_DIFFS,
+])
+
+
+# Only values which need more than one chunk are cached.  These are the
+# complete configuration and state (and the occasional large diff) sent to
+# every agent, so only a few are needed at any one time:
+_chunks_cache = LRUCache(20)
+
+
+def _chunk(name, value):
+    """
+    Split the serialized value of a ``Big`` argument into chunks of at most
+    ``MAX_VALUE_LENGTH`` bytes.
+
+    Values which need more than one chunk also have the AMP wire encoding of
+    their chunks pre-computed, and the result is cached.
+
+    :param bytes name: The name of the argument.
+    :param bytes value: The serialized value of the argument.
+
+    :return: A tuple of a ``dict`` mapping indexed key names to the chunks
+        and either ``None`` or the ``bytes`` encoding those keys and chunks as
+        they appear in a serialized ``AmpBox``.
+    """
+    if len(value) <= MAX_VALUE_LENGTH:
+        return {"%s.0" % (name,): value}, None
+    key = (name, value)
+    result = _chunks_cache.get(key)
+    if result is None:
+        chunks = {}
+        framed = []
+        for counter, offset in enumerate(
+            range(0, len(value), MAX_VALUE_LENGTH)
+        ):
+            chunk_name = "%s.%d" % (name, counter)
+            chunk = value[offset:offset + MAX_VALUE_LENGTH]
+            chunks[chunk_name] = chunk
+            framed.extend([
+                pack("!H", len(chunk_name)), chunk_name,
+                pack("!H", len(chunk)), chunk,
+            ])
+        result = (chunks, b"".join(framed))
+        _chunks_cache.put(key, result)
+    return result
+
+
+class _FramedBox(AmpBox):
+    """
+    An ``AmpBox`` for commands which are sent with the same large arguments
+    to many connections.
+
+    The chunks added by ``Big`` arguments are serialized using the wire
+    encoding computed once by ``_chunk``, so sending a box only needs to
+    encode its other, small, values (e.g. the tag and the Eliot context).
+    The chunks themselves are shared by every box they are added to.
+    """
+    def __init__(self, *args, **kwargs):
+        AmpBox.__init__(self, *args, **kwargs)
+        self._framed = []
+
+    def add_framed(self, chunks, framed):
+        """
+        Add the chunks of a ``Big`` argument along with their encoding.
+
+        :param chunks: See ``_chunk``.
+        :param framed: See ``_chunk``.
+        """
+        self.update(chunks)
+        if framed is not None:
+            self._framed.append((chunks, framed))
+
+    def serialize(self):
+        rest = AmpBox(self)
+        framed = []
+        for chunks, encoded in self._framed:
+            # Only use the pre-computed encoding if the box still has the
+            # chunks it encodes:
+            if all(rest.get(key) is chunk
+                   for (key, chunk) in chunks.iteritems()):
+                for key in chunks:
+                    del rest[key]
+                framed.append(encoded)
+        serialized = rest.serialize()
+        if not framed:
+            return serialized
+        # The serialized box ends with an empty key marking its end:
+        framed.insert(0, serialized[:-2])
+        framed.append(serialized[-2:])
+        return b"".join(framed)
+
 
 class Big(Argument):
     """
@@ -92,17 +238,18 @@ class Big(Argument):
         dictionary with indexed key names so that the chunks can be put back
         together in the correct order during deserialization.
 
+        The chunks of a value which needs more than one are computed once and
+        shared by all the boxes it is sent in.  If ``strings`` is a
+        ``_FramedBox`` their wire encoding is shared too.
+
         See ``IArgumentType`` for argument and return type documentation.
         """
         self.another_argument.toBox(name, strings, objects, proto)
-        value = BytesIO(strings.pop(name))
-        counter = 0
-        while True:
-            nextChunk = value.read(MAX_VALUE_LENGTH)
-            if not nextChunk:
-                break
-            strings["%s.%d" % (name, counter)] = nextChunk
-            counter += 1
+        chunks, framed = _chunk(name, strings.pop(name))
+        if isinstance(strings, _FramedBox):
+            strings.add_framed(chunks, framed)
+        else:
+            strings.update(chunks)
 
     def fromBox(self, name, strings, objects, proto):
         """
@@ -115,19 +262,63 @@ class Big(Argument):
 
         See ``IArgumentType`` for argument and return type documentation.
         """
-
-        value = BytesIO()
+        chunks = []
         for counter in count(0):
             chunk = strings.get("%s.%d" % (name, counter))
             if chunk is None:
                 break
-            value.write(chunk)
-            strings[name] = value.getvalue()
+            chunks.append(chunk)
+        if chunks:
+            strings[name] = b"".join(chunks)
         self.another_argument.fromBox(name, strings, objects, proto)
 
 
 # The configuration and state can get pretty big, so don't want too many:
 _wire_encode_cache = LRUCache(50)
+_binary_wire_encode_cache = LRUCache(50)
+
+# Looking objects up in the caches above means hashing them, which for a
+# large configuration or state costs about as much as encoding them.  So the
+# results are also cached by the identity of the encoded object (and of the
+# cache above they belong to), which is cheap to look up when the same object
+# is sent to many agents.  The values are tuples of the object, which keeps it
+# alive so its identity isn't reused, and the result:
+_identity_encode_cache = LRUCache(100)
+
+
+def _encoding_cached(obj, cache):
+    """
+    :param obj: An object to encode.
+    :param LRUCache cache: ``_wire_encode_cache`` or
+        ``_binary_wire_encode_cache``.
+
+    :return bool: Whether the encoding of ``obj`` can be looked up without
+        hashing ``obj``.
+    """
+    cached = _identity_encode_cache.get((id(obj), cache))
+    return cached is not None and cached[0] is obj
+
+
+def _cached_encode(obj, cache, encode):
+    """
+    Encode an object to bytes and cache the result, or return the cached
+    result if available.
+
+    :param obj: Object to encode.
+    :param LRUCache cache: The cache of results of ``encode``.
+    :param encode: The function to encode ``obj`` with.
+    :return: Resulting ``bytes``.
+    """
+    identity = (id(obj), cache)
+    cached = _identity_encode_cache.get(identity)
+    if cached is not None and cached[0] is obj:
+        return cached[1]
+    result = cache.get(obj)
+    if result is None:
+        result = encode(obj)
+        cache.put(obj, result)
+    _identity_encode_cache.put(identity, (obj, result))
+    return result
 
 
 def caching_wire_encode(obj):
@@ -142,17 +333,41 @@ def caching_wire_encode(obj):
     :param obj: Object to encode.
     :return: Resulting ``bytes``.
     """
-    result = _wire_encode_cache.get(obj)
-    if result is None:
-        result = wire_encode(obj)
-        _wire_encode_cache.put(obj, result)
-    return result
+    return _cached_encode(obj, _wire_encode_cache, wire_encode)
+
+
+def caching_binary_wire_encode(obj):
+    """
+    Like ``caching_wire_encode`` but using ``binary_wire_encode``.
+
+    :param obj: Object to encode.
+    :return: Resulting ``bytes``.
+    """
+    return _cached_encode(obj, _binary_wire_encode_cache, binary_wire_encode)
+
+
+def _encode_all(encodings):
+    """
+    Encode objects, caching the results.
+
+    This is run in a thread, so that the reactor thread can later send the
+    encoded objects without having to encode them itself.
+
+    :param encodings: A ``list`` of tuples of ``caching_wire_encode`` or
+        ``caching_binary_wire_encode`` and an object to encode with it.
+    """
+    for caching_encode, obj in encodings:
+        caching_encode(obj)
 
 
 class SerializableArgument(Argument):
     """
     AMP argument that takes an object that can be serialized by the
     configuration persistence layer.
+
+    Objects are sent as JSON, unless the protocol they are sent over has a
+    true ``binary_wire_format`` attribute, in which case they are sent in the
+    binary wire format.  Either format is accepted when receiving.
     """
     def __init__(self, *classes):
         """
@@ -164,7 +379,10 @@ class SerializableArgument(Argument):
         self._expected_classes = classes
 
     def fromString(self, in_bytes):
-        obj = wire_decode(in_bytes)
+        if is_binary_wire_encoded(in_bytes):
+            obj = binary_wire_decode(in_bytes)
+        else:
+            obj = wire_decode(in_bytes)
         if not isinstance(obj, self._expected_classes):
             raise TypeError(
                 "{} is none of {}".format(obj, self._expected_classes)
@@ -178,6 +396,15 @@ class SerializableArgument(Argument):
             )
         return caching_wire_encode(obj)
 
+    def toStringProto(self, obj, proto):
+        if not getattr(proto, "binary_wire_format", False):
+            return self.toString(obj)
+        if not isinstance(obj, self._expected_classes):
+            raise TypeError(
+                "{} is none of {}".format(obj, self._expected_classes)
+            )
+        return caching_binary_wire_encode(obj)
+
 
 class _EliotActionArgument(Unicode):
     """
@@ -197,9 +424,14 @@ class VersionCommand(Command):
     Return configuration protocol version of the control service.
 
     Semantic versioning: Major version changes implies incompatibility.
+
+    The caller may also list the optional protocol features it supports, in
+    which case the response lists the features supported by the control
+    service.  Peers which predate feature negotiation omit both lists.
     """
-    arguments = []
-    response = [('major', Integer())]
+    arguments = [('features', ListOf(Unicode(), optional=True))]
+    response = [('major', Integer()),
+                ('features', ListOf(Unicode(), optional=True))]
 
 
 class NoOp(Command):
@@ -220,13 +452,44 @@ class ClusterStatusCommand(Command):
 
     Having both as a single command simplifies the decision making process
     in the convergence agent during startup.
+
+    The same configuration and state are usually sent to many agents at once,
+    so the command is sent as a ``_FramedBox``.
     """
+    commandType = _FramedBox
     arguments = [('configuration', Big(SerializableArgument(Deployment))),
                  ('state', Big(SerializableArgument(DeploymentState))),
                  ('eliot_context', _EliotActionArgument())]
     response = []
 
 
+class MissingClusterStatus(Exception):
+    """
+    A ``ClusterStatusDiffCommand`` was received over a connection which has
+    not yet received a complete ``ClusterStatusCommand``, so there is nothing
+    to apply the diff to.
+    """
+
+
+class ClusterStatusDiffCommand(Command):
+    """
+    Used by the control service to inform a convergence agent of the changes
+    to the cluster state and desired configuration since the last update the
+    agent acknowledged on the same connection.
+
+    This is only sent to agents which announced
+    ``FEATURE_CLUSTER_STATUS_DIFFS``.  If the agent cannot apply the diffs the
+    control service falls back to sending a complete
+    ``ClusterStatusCommand``.
+    """
+    commandType = _FramedBox
+    arguments = [('configuration_diff', Big(SerializableArgument(Diff))),
+                 ('state_diff', Big(SerializableArgument(Diff))),
+                 ('eliot_context', _EliotActionArgument())]
+    response = []
+    errors = {MissingClusterStatus: 'MISSING_CLUSTER_STATUS'}
+
+
 class SetNodeEraCommand(Command):
     """
     Tell the control service the current era for a node.
@@ -235,9 +498,15 @@ class SetNodeEraCommand(Command):
     era. Updates to the node should only be sent after this command, to
     ensure it doesn't get stale pre-reboot information (i.e. NodeState
     with wrong era).
+
+    The agent may also give the value of the ``ClusterScope`` it needs, in
+    which case later cluster updates sent to it are restricted to that scope
+    of the given node.  Unknown scopes are treated as
+    ``ClusterScope.CLUSTER``.
     """
     arguments = [('era', Unicode()),
-                 ('node_uuid', Unicode())]
+                 ('node_uuid', Unicode()),
+                 ('cluster_scope', Unicode(optional=True))]
     response = []
 
 
@@ -245,6 +514,9 @@ class NodeStateCommand(Command):
     """
     Used by a convergence agent to update the control service about the
     status of a particular node.
+
+    Agents using ``NodeStateDiffCommand`` also give the sequence number of
+    the update, so that later updates can be sent as diffs against it.
     """
     arguments = [
         # A state change might be large enough not to fit into a single AMP
@@ -266,10 +538,34 @@ class NodeStateCommand(Command):
         # data.  See FLOC-3113.
         ('state_changes', Big(SerializableArgument(list, tuple))),
         ('eliot_context', _EliotActionArgument()),
+        ('sequence', Integer(optional=True)),
     ]
     response = []
 
 
+class NodeStateDiffCommand(Command):
+    """
+    Used by a convergence agent to update the control service about the
+    status of a particular node, by sending the differences from the last
+    update acknowledged over the same connection.
+
+    This is only sent to control services which announced
+    ``FEATURE_NODE_STATE_DIFFS``.  Each update's sequence number is one more
+    than that of the previous update.  If the control service doesn't have
+    the previous update it fails with ``ResyncRequired`` and the agent sends
+    a complete ``NodeStateCommand`` instead.
+    """
+    arguments = [
+        # A diff created by ``create_sequence_diff`` from the previous
+        # ``state_changes`` to the new ones:
+        ('state_diff', Big(SerializableArgument(Diff))),
+        ('sequence', Integer()),
+        ('eliot_context', _EliotActionArgument()),
+    ]
+    response = []
+    errors = {ResyncRequired: 'RESYNC_REQUIRED'}
+
+
 class SetBlockDeviceIdForDatasetId(Command):
     """
     Indicate a specific block device id is the one for given dataset id.
@@ -285,23 +581,32 @@ class SetBlockDeviceIdForDatasetId(Command):
 class Timeout(object):
     """
     Call the specified action after the specified delay in seconds.
+
+    The timeout is reset whenever a connection receives anything, so it is
+    scheduled using a ``TimerWheel`` for which resetting is cheap.
     """
-    def __init__(self, reactor, timeout, action):
+    def __init__(self, timer_wheel, timeout, action):
         """
-        :param IReactorTime reactor: A reactor to use to control when
+        :param TimerWheel timer_wheel: The timer wheel to use to control when
             the action is called.
         :param int timeout: Interval in seconds to trigger the action.
         :param callable action: The function to execute upon reaching the
             timeout.
         """
-        self._delay_call = reactor.callLater(timeout, action)
-        self._timeout = timeout
+        self._timer = timer_wheel.call_later(timeout, action)
 
     def reset(self):
         """
         Reset the delayed call to this ``Timeout``'s ``action``.
         """
-        self._delay_call.reset(self._timeout)
+        self._timer.reset()
+
+    def cancel(self):
+        """
+        Don't call this ``Timeout``'s ``action``.
+        """
+        if self._timer.active():
+            self._timer.cancel()
 
 
 class ControlServiceLocator(CommandLocator):
@@ -311,8 +616,10 @@ class ControlServiceLocator(CommandLocator):
     :ivar IClusterStateSource _source: The change source uniquely representing
         the AMP connection for which this locator is being used.
     :ivar _reactor: See ``reactor`` parameter of ``__init__``
+    :ivar _connection: See ``connection`` parameter of ``__init__``
     """
-    def __init__(self, reactor, control_amp_service, timeout):
+    def __init__(self, reactor, control_amp_service, timeout,
+                 connection=None):
         """
         :param IReactorTime reactor: A reactor to use to tell the time for
             activity/inactivity reporting.
@@ -320,6 +627,9 @@ class ControlServiceLocator(CommandLocator):
             connections to the control service.
         :param Timeout timeout: A ``Timeout`` object to reset when a message
             is received.
+        :param ControlAMP connection: The protocol this locator handles
+            commands for, or ``None`` if there is no such protocol.  Features
+            announced by the agent are recorded against this connection.
         """
         CommandLocator.__init__(self)
 
@@ -330,6 +640,7 @@ class ControlServiceLocator(CommandLocator):
         # it.
         self._source = ChangeSource()
         self._timeout = timeout
+        self._connection = connection
 
         self._reactor = reactor
         self.control_amp_service = control_amp_service
@@ -355,23 +666,46 @@ class ControlServiceLocator(CommandLocator):
         return {}
 
     @VersionCommand.responder
-    def version(self):
-        return {"major": 1}
+    def version(self, features=None):
+        if features is not None and self._connection is not None:
+            self.control_amp_service.set_agent_features(
+                self._connection, features,
+            )
+            if FEATURE_BINARY_WIRE_FORMAT in features:
+                self._connection.binary_wire_format = True
+        return {"major": 1, "features": sorted(SUPPORTED_FEATURES)}
 
     @NodeStateCommand.responder
-    def node_changed(self, eliot_context, state_changes):
+    def node_changed(self, eliot_context, state_changes, sequence=None):
         with eliot_context:
             self.control_amp_service.node_changed(
-                self._source, state_changes,
+                self._source, state_changes, sequence,
+            )
+            return {}
+
+    @NodeStateDiffCommand.responder
+    def node_changed_diff(self, eliot_context, state_diff, sequence):
+        with eliot_context:
+            self.control_amp_service.node_changed_diff(
+                self._source, state_diff, sequence,
             )
             return {}
 
     @SetNodeEraCommand.responder
-    def set_node_era(self, era, node_uuid):
+    def set_node_era(self, era, node_uuid, cluster_scope=None):
         # Further work will be done in FLOC-3380
         self.control_amp_service.cluster_state.apply_changes_from_source(
             self._source, [UpdateNodeStateEra(era=UUID(era),
                                               uuid=UUID(node_uuid))])
+        if cluster_scope is not None and self._connection is not None:
+            try:
+                scope = ClusterScope.lookupByValue(cluster_scope)
+            except ValueError:
+                scope = ClusterScope.CLUSTER
+            self.control_amp_service.set_agent_scope(
+                self._connection,
+                AgentScope(scope=scope, node_uuid=UUID(node_uuid)),
+            )
         # We don't bother sending an update to other nodes because this
         # command will immediately be followed by a ``NodeStateCommand``
         # with more interesting information.
@@ -393,17 +727,17 @@ class ControlServiceLocator(CommandLocator):
         return {}
 
 
-def timeout_for_protocol(reactor, protocol):
+def timeout_for_protocol(timer_wheel, protocol):
     """
     Create a timeout for inactive AMP connections that will abort the
     connection when the timeout is reached.
 
-    :param IReactorTime reactor: A reactor to use to control when
+    :param TimerWheel timer_wheel: The timer wheel to use to control when
         the action is called.
     :param AMP protocol: The protocol on which inactive connections will
         be aborted.
     """
-    return Timeout(reactor, 2 * PING_INTERVAL.seconds,
+    return Timeout(timer_wheel, 2 * PING_INTERVAL.seconds,
                    lambda: protocol.transport.abortConnection())
 
 
@@ -413,19 +747,28 @@ class ControlAMP(AMP):
 
     :ivar Pinger _pinger: Helper which periodically pings this protocol's peer
         to verify it's still alive.
+    :ivar Timeout _timeout: The timeout which aborts the connection if
+        nothing is received over it.
+    :ivar bool binary_wire_format: Whether to send model objects in the
+        binary wire format.  Set once the agent announces support for it.
     """
+    binary_wire_format = False
+
     def __init__(self, reactor, control_amp_service):
         """
         :param reactor: See ``ControlServiceLocator.__init__``.
         :param ControlAMPService control_amp_service: The service managing AMP
-            connections to the control service.
+            connections to the control service.  Pings and timeouts are
+            scheduled using its ``timer_wheel``.
         """
+        timer_wheel = control_amp_service.timer_wheel
+        self._timeout = timeout_for_protocol(timer_wheel, self)
         locator = ControlServiceLocator(reactor, control_amp_service,
-                                        timeout_for_protocol(reactor, self))
+                                        self._timeout, connection=self)
         AMP.__init__(self, locator=locator)
 
         self.control_amp_service = control_amp_service
-        self._pinger = Pinger(reactor)
+        self._pinger = Pinger(timer_wheel)
 
     def connectionMade(self):
         AMP.connectionMade(self)
@@ -436,6 +779,7 @@ class ControlAMP(AMP):
         AMP.connectionLost(self, reason)
         self.control_amp_service.disconnected(self)
         self._pinger.stop()
+        self._timeout.cancel()
 
 
 # These two logging fields use caching_wire_encode as the serializer so
@@ -475,6 +819,13 @@ LOG_SEND_TO_AGENT = ActionType(
     [],
     "Send the configuration and state of the cluster to a specific agent.")
 
+LOG_SEND_DIFF_TO_AGENT = ActionType(
+    "flocker:controlservice:send_state_diff_to_agent",
+    [AGENT],
+    [],
+    "Send the changes to the configuration and state of the cluster since "
+    "the last acknowledged update to a specific agent.")
+
 AGENT_CONNECTED = ActionType(
     "flocker:controlservice:agent_connected",
     [AGENT],
@@ -489,6 +840,25 @@ AGENT_UPDATE_ELIDED = MessageType(
     u"it.",
 )
 
+AGENT_UPDATE_UNCHANGED = MessageType(
+    "flocker:controlservice:agent_update_unchanged",
+    [AGENT],
+    u"An update to an agent was skipped because the part of the cluster the "
+    u"agent needs has not changed since the last update it acknowledged.",
+)
+
+LOG_COALESCED_NODE_CHANGES = MessageType(
+    "flocker:controlservice:coalesced_node_changes",
+    [Field.for_types("node_changes", [int, long],
+                     u"The number of node state changes received since the "
+                     u"cluster state was last sent to all agents."),
+     Field.for_types("broadcasts_saved", [int, long],
+                     u"The total number of times the cluster state was not "
+                     u"sent to all agents because of coalescing.")],
+    u"The cluster state is being sent to all agents after node state changes "
+    u"were coalesced.",
+)
+
 AGENT_UPDATE_DELAYED = MessageType(
     "flocker:controlservice:agent_update_delayed",
     [AGENT],
@@ -510,6 +880,17 @@ class _UpdateState(PClass):
     next_scheduled = field()
 
 
+class _ClusterStatus(PClass):
+    """
+    The configuration and state most recently acknowledged by an agent.
+
+    :ivar Deployment configuration: The acknowledged configuration.
+    :ivar DeploymentState state: The acknowledged state.
+    """
+    configuration = field(mandatory=True)
+    state = field(mandatory=True)
+
+
 class ControlAMPService(Service):
     """
     Control Service AMP server.
@@ -519,11 +900,45 @@ class ControlAMPService(Service):
     :ivar dict _current_command: A dictionary containing information about
         connections to which state updates are currently in progress.  The keys
         are protocol instances.  The values are ``_UpdateState`` instances.
+    :ivar dict _agent_features: Map connections to the ``frozenset`` of
+        optional protocol features announced by the agent on the other end.
+    :ivar dict _last_acknowledged: Map connections to the ``_ClusterStatus``
+        the agent most recently acknowledged.  Connections with no entry will
+        be sent a complete ``ClusterStatusCommand`` next.
+    :ivar dict _agent_scopes: Map connections to the ``AgentScope`` declared
+        by the agent on the other end.  Agents with no entry are sent the
+        whole cluster.
+    :ivar _coalesced_broadcast: The ``IDelayedCall`` which will send the
+        cluster state to all agents after node state changes, or ``None`` if
+        there have been no changes since the cluster state was last sent to
+        all agents.
+    :ivar float _coalescing_since: When the first of the node state changes
+        waiting for ``_coalesced_broadcast`` was received.
+    :ivar int _pending_node_changes: The number of node state changes waiting
+        for ``_coalesced_broadcast``.
+    :ivar _threadpool: See ``__init__``.
+    :ivar _serializing: A ``Deferred`` which fires when the configuration and
+        state being sent to ``_serializing_connections`` have been serialized
+        in ``_threadpool``, or ``None`` if nothing is being serialized.
+    :ivar set _waiting_connections: Connections to send the configuration and
+        state to once the current serialization is done.
+
+    :ivar int node_changes: The number of node state changes received.
+    :ivar int broadcasts: The number of times the cluster state has been sent
+        to all agents.
+    :ivar int broadcasts_saved: The number of node state changes which did not
+        cause the cluster state to be sent to all agents because they were
+        coalesced with other changes.
+    :ivar TimerWheel timer_wheel: The timer wheel shared by all connections
+        to schedule pings and idle timeouts.
     """
     logger = Logger()
 
     def __init__(self, reactor, cluster_state, configuration_service, endpoint,
-                 context_factory):
+                 context_factory,
+                 coalesce_window=NODE_CHANGED_COALESCE_WINDOW,
+                 max_coalesce_latency=NODE_CHANGED_MAX_LATENCY,
+                 threadpool=None):
         """
         :param reactor: See ``ControlServiceLocator.__init__``.
         :param ClusterStateService cluster_state: Object that records known
@@ -532,9 +947,36 @@ class ControlAMPService(Service):
             Persistence service for desired cluster configuration.
         :param endpoint: Endpoint to listen on.
         :param context_factory: TLS context factory.
+        :param timedelta coalesce_window: How long to wait for more node state
+            changes after one is received before sending the cluster state to
+            all agents.  If zero, it is sent immediately.
+        :param timedelta max_coalesce_latency: The longest to wait after a
+            node state change is received before sending the cluster state to
+            all agents, however many more changes are received.
+        :param threadpool: A ``twisted.python.threadpool.ThreadPool`` in which
+            to serialize the configuration and state before sending them to
+            agents, so that the reactor thread isn't blocked by serializing
+            them itself.  If ``None`` they are serialized in the reactor
+            thread as they are sent.
         """
+        self._reactor = reactor
+        self.timer_wheel = TimerWheel(reactor)
+        self._threadpool = threadpool
+        self._serializing = None
+        self._waiting_connections = set()
+        self._coalesce_window = coalesce_window.total_seconds()
+        self._max_coalesce_latency = max_coalesce_latency.total_seconds()
+        self._coalesced_broadcast = None
+        self._coalescing_since = None
+        self._pending_node_changes = 0
+        self.node_changes = 0
+        self.broadcasts = 0
+        self.broadcasts_saved = 0
         self.connections = set()
         self._current_command = {}
+        self._agent_features = {}
+        self._last_acknowledged = {}
+        self._agent_scopes = {}
         self.cluster_state = cluster_state
         self.configuration_service = configuration_service
         self.endpoint_service = StreamServerEndpointService(
@@ -546,26 +988,179 @@ class ControlAMPService(Service):
             )
         )
         # When configuration changes, notify all connected clients:
-        self.configuration_service.register(
-            lambda: self._send_state_to_connections(self.connections))
+        self.configuration_service.register(self._broadcast)
 
     def startService(self):
         self.endpoint_service.startService()
 
     def stopService(self):
+        self._cancel_coalesced_broadcast()
         self.endpoint_service.stopService()
         for connection in self.connections:
             connection.transport.loseConnection()
 
+    def _cancel_coalesced_broadcast(self):
+        """
+        Cancel the pending ``_coalesced_broadcast``, if any.
+
+        :return: The number of node state changes it would have sent.
+        """
+        pending = self._pending_node_changes
+        if self._coalesced_broadcast is not None:
+            self._coalesced_broadcast.cancel()
+            self._coalesced_broadcast = None
+        self._coalescing_since = None
+        self._pending_node_changes = 0
+        return pending
+
+    def _broadcast(self, coalesced=False):
+        """
+        Send desired configuration and cluster state to all connections.
+
+        This includes any node state changes still being coalesced, so there
+        is no need to send them separately.
+
+        :param bool coalesced: Whether this is the ``_coalesced_broadcast``.
+        """
+        if coalesced:
+            # The delayed call has been called, so it can't be cancelled:
+            self._coalesced_broadcast = None
+        node_changes = self._cancel_coalesced_broadcast()
+        if node_changes:
+            # Without coalescing each change would have been sent on its own.
+            # One of those broadcasts is this one, unless it is happening for
+            # some other reason.
+            self.broadcasts_saved += node_changes - 1 if coalesced else (
+                node_changes)
+            LOG_COALESCED_NODE_CHANGES(
+                node_changes=node_changes,
+                broadcasts_saved=self.broadcasts_saved,
+            ).write()
+        self.broadcasts += 1
+        self._send_state_to_connections(self.connections)
+
+    def _coalesce_node_change(self):
+        """
+        Arrange for the cluster state to be sent to all connections after a
+        node state change, once no more changes have been received for
+        ``_coalesce_window`` or once the first of the changes has waited
+        ``_max_coalesce_latency``, whichever comes first.
+        """
+        if not self._coalesce_window:
+            self._broadcast()
+            return
+        now = self._reactor.seconds()
+        if self._coalesced_broadcast is None:
+            self._coalescing_since = now
+            self._coalesced_broadcast = self._reactor.callLater(
+                self._coalesce_window, self._broadcast, coalesced=True,
+            )
+        else:
+            self._coalesced_broadcast.reset(max(0, min(
+                self._coalesce_window,
+                self._coalescing_since + self._max_coalesce_latency - now,
+            )))
+        self._pending_node_changes += 1
+
     def _send_state_to_connections(self, connections):
         """
         Send desired configuration and cluster state to all given connections.
 
+        If the service has a threadpool, the configuration and state are
+        serialized there first and then sent.  Only one serialization happens
+        at a time, so that agents are sent updates in order; connections
+        which need updating in the meantime are sent the latest configuration
+        and state once it is done.
+
         :param connections: A collection of ``AMP`` instances.
         """
+        if self._serializing is not None:
+            self._waiting_connections.update(connections)
+            return
+
         configuration = self.configuration_service.get()
         state = self.cluster_state.as_deployment()
+        if self._threadpool is None:
+            self._send_cluster_status(connections, configuration, state)
+            return
+
+        encodings = self._encodings_needed(connections, configuration, state)
+        if not encodings:
+            self._send_cluster_status(connections, configuration, state)
+            return
+
+        connections = set(connections)
+        d = deferToThreadPool(
+            self._reactor, self._threadpool, _encode_all, encodings,
+        )
+        # If serialization failed it will fail again when sending, where the
+        # error is handled:
+        d.addErrback(write_failure, self.logger)
+
+        def serialized(ignored):
+            self._serializing = None
+            self._send_cluster_status(
+                connections & self.connections, configuration, state,
+            )
+            waiting = self._waiting_connections & self.connections
+            self._waiting_connections = set()
+            if waiting:
+                self._send_state_to_connections(waiting)
+        d.addCallback(serialized)
+        # The callback may have been called already:
+        if not d.called:
+            self._serializing = d
+
+    def _encodings_needed(self, connections, configuration, state):
+        """
+        Find the serializations of the configuration and state that would be
+        done in the reactor thread when sending them to connections.
+
+        Scoped views and diffs are not included, since they are usually
+        small.
 
+        :param connections: A collection of ``AMP`` instances.
+        :param Deployment configuration: The configuration to send.
+        :param DeploymentState state: The state to send.
+
+        :return: A ``list`` suitable for ``_encode_all``.
+        """
+        if not connections:
+            # Nothing is sent, and so nothing is logged either.
+            return []
+        # The configuration and state are logged as JSON:
+        formats = {(caching_wire_encode, _wire_encode_cache)}
+        for connection in connections:
+            agent_scope = self._agent_scopes.get(connection)
+            if agent_scope is not None and (
+                agent_scope.scope is not ClusterScope.CLUSTER
+            ):
+                continue
+            if connection in self._last_acknowledged and (
+                FEATURE_CLUSTER_STATUS_DIFFS in
+                self._agent_features.get(connection, frozenset())
+            ):
+                continue
+            if getattr(connection, "binary_wire_format", False):
+                formats.add(
+                    (caching_binary_wire_encode, _binary_wire_encode_cache)
+                )
+        return [
+            (caching_encode, obj)
+            for (caching_encode, cache) in formats
+            for obj in (configuration, state)
+            if not _encoding_cached(obj, cache)
+        ]
+
+    def _send_cluster_status(self, connections, configuration, state):
+        """
+        Send the given configuration and cluster state to all given
+        connections.
+
+        :param connections: A collection of ``AMP`` instances.
+        :param Deployment configuration: The configuration to send.
+        :param DeploymentState state: The state to send.
+        """
         # Connections are separated into three groups to support a scheme which
         # lets us avoid sending certain updates which we know are not
         # necessary.  This reduces traffic and associated costs (CPU, memory).
@@ -632,8 +1227,13 @@ class ControlAMPService(Service):
                 # Eliot wants those fields though.
                 action.add_success_fields(configuration=None, state=None)
 
+            # Agents with the same scope share their view of the cluster, and
+            # agents which acknowledged the same view share the resulting
+            # diffs.
+            views = ClusterViews(configuration, state)
+            diffs = {}
             for connection in can_update:
-                self._update_connection(connection, configuration, state)
+                self._update_connection(connection, views, diffs)
 
             for connection in elided_update:
                 AGENT_UPDATE_ELIDED(agent=connection).write()
@@ -641,38 +1241,95 @@ class ControlAMPService(Service):
             for connection in delayed_update:
                 self._delayed_update_connection(connection)
 
-    def _update_connection(self, connection, configuration, state):
+    def _update_connection(self, connection, views, diffs):
         """
-        Send a ``ClusterStatusCommand`` to an agent.
+        Send a ``ClusterStatusCommand`` or a ``ClusterStatusDiffCommand`` to
+        an agent.
 
         :param ControlAMP connection: The connection to use to send the
             command.
 
-        :param Deployment configuration: The cluster configuration to send.
-        :param DeploymentState state: The current cluster state to send.
+        :param ClusterViews views: The views of the cluster configuration and
+            state to send.
+        :param dict diffs: Cache of diffs already computed for this update,
+            keyed by the identities of the acknowledged configuration and
+            state they apply to and of the view they lead to.  Values are
+            tuples of the acknowledged ``_ClusterStatus`` and the two diffs.
         """
-        action = LOG_SEND_TO_AGENT(agent=connection)
+        agent_scope = self._agent_scopes.get(connection)
+        configuration, state = views.view(agent_scope)
+        last = self._last_acknowledged.get(connection)
+        if agent_scope is not None and last is not None and (
+            last.configuration == configuration and last.state == state
+        ):
+            # Scoped views are small enough to compare cheaply, and usually
+            # unaffected by changes elsewhere in the cluster.
+            AGENT_UPDATE_UNCHANGED(agent=connection).write()
+            return
+        if last is None or (
+            FEATURE_CLUSTER_STATUS_DIFFS not in
+            self._agent_features.get(connection, frozenset())
+        ):
+            action = LOG_SEND_TO_AGENT(agent=connection)
+            command = ClusterStatusCommand
+            arguments = dict(configuration=configuration, state=state)
+        else:
+            action = LOG_SEND_DIFF_TO_AGENT(agent=connection)
+            command = ClusterStatusDiffCommand
+            key = (id(last.configuration), id(last.state),
+                   id(configuration), id(state))
+            try:
+                _, configuration_diff, state_diff = diffs[key]
+            except KeyError:
+                configuration_diff = create_diff(
+                    last.configuration, configuration)
+                state_diff = create_diff(last.state, state)
+                # Keep the acknowledged status alive for as long as the
+                # cache so that its identities can't be reused.
+                diffs[key] = (last, configuration_diff, state_diff)
+            arguments = dict(
+                configuration_diff=configuration_diff, state_diff=state_diff,
+            )
+        # Until this update is acknowledged we don't know what the agent has.
+        self._last_acknowledged.pop(connection, None)
+
         with action.context():
             # Use ``maybeDeferred`` so if an exception happens,
             # it will be wrapped in a ``Failure`` - see FLOC-3221
             d = DeferredContext(maybeDeferred(
                 connection.callRemote,
-                ClusterStatusCommand,
-                configuration=configuration,
-                state=state,
-                eliot_context=action
+                command,
+                eliot_context=action,
+                **arguments
             ))
             d.addActionFinish()
-            d.result.addErrback(lambda _: None)
 
-        update = self._current_command[connection] = _UpdateState(
+        def acknowledged(ignored):
+            if connection in self.connections:
+                self._last_acknowledged[connection] = _ClusterStatus(
+                    configuration=configuration, state=state,
+                )
+            return False
+
+        def failed(reason):
+            # If a diff could not be applied the agent needs a complete
+            # update right away.  Since no acknowledged status is recorded
+            # for this connection, the next update will be a complete one.
+            return command is ClusterStatusDiffCommand
+        d.result.addCallbacks(acknowledged, failed)
+
+        self._current_command[connection] = _UpdateState(
             response=d.result,
             next_scheduled=False,
         )
 
-        def finished_update(ignored):
-            del self._current_command[connection]
-        update.response.addCallback(finished_update)
+        def finished_update(resync):
+            update = self._current_command.pop(connection)
+            # If another update is already scheduled it will do the resync.
+            if resync and not update.next_scheduled and (
+                    connection in self.connections):
+                self._send_state_to_connections([connection])
+        d.result.addCallback(finished_update)
 
     def _delayed_update_connection(self, connection):
         """
@@ -691,6 +1348,26 @@ class ControlAMPService(Service):
         )
         self._current_command[connection] = update.set(next_scheduled=True)
 
+    def set_agent_features(self, connection, features):
+        """
+        Record the optional protocol features an agent has announced.
+
+        :param ControlAMP connection: The connection to the agent.
+        :param features: An iterable of ``unicode`` feature names.
+        """
+        if connection in self.connections:
+            self._agent_features[connection] = frozenset(features)
+
+    def set_agent_scope(self, connection, agent_scope):
+        """
+        Record the part of the cluster an agent needs.
+
+        :param ControlAMP connection: The connection to the agent.
+        :param AgentScope agent_scope: The part of the cluster it needs.
+        """
+        if connection in self.connections:
+            self._agent_scopes[connection] = agent_scope
+
     def connected(self, connection):
         """
         A new connection has been made to the server.
@@ -708,8 +1385,11 @@ class ControlAMPService(Service):
         :param ControlAMP connection: The lost connection.
         """
         self.connections.remove(connection)
+        self._agent_features.pop(connection, None)
+        self._last_acknowledged.pop(connection, None)
+        self._agent_scopes.pop(connection, None)
 
-    def node_changed(self, source, state_changes):
+    def node_changed(self, source, state_changes, sequence=None):
         """
         We've received a node state update from a connected client.
 
@@ -717,9 +1397,33 @@ class ControlAMPService(Service):
             changes were received from.
         :param list state_changes: One or more ``IClusterStateChange``
             providers representing the state change which has taken place.
+        :param sequence: The ``int`` sequence number of the update, or
+            ``None`` if the client doesn't number its updates.
         """
-        self.cluster_state.apply_changes_from_source(source, state_changes)
-        self._send_state_to_connections(self.connections)
+        self.cluster_state.apply_changes_from_source(
+            source, state_changes, sequence,
+        )
+        self.node_changes += 1
+        self._coalesce_node_change()
+
+    def node_changed_diff(self, source, state_diff, sequence):
+        """
+        We've received a node state update from a connected client, as a diff
+        against its previous update.
+
+        :param IClusterStateSource source: Representation of where these
+            changes were received from.
+        :param Diff state_diff: The diff from the previous ``state_changes``
+            to the new ones.
+        :param int sequence: The sequence number of the update.
+
+        :raise ResyncRequired: If the diff can't be applied.
+        """
+        self.cluster_state.apply_diff_from_source(
+            source, state_diff, sequence,
+        )
+        self.node_changes += 1
+        self._coalesce_node_change()
 
 
 class IConvergenceAgent(Interface):
@@ -758,6 +1462,11 @@ class IConvergenceAgent(Interface):
 class _AgentLocator(CommandLocator):
     """
     Command locator for convergence agent.
+
+    :ivar _configuration: The last ``Deployment`` received from the control
+        service over this connection, or ``None``.
+    :ivar _state: The last ``DeploymentState`` received from the control
+        service over this connection, or ``None``.
     """
     def __init__(self, agent, timeout):
         """
@@ -768,6 +1477,8 @@ class _AgentLocator(CommandLocator):
         CommandLocator.__init__(self)
         self.agent = agent
         self._timeout = timeout
+        self._configuration = None
+        self._state = None
 
     def locateResponder(self, name):
         """
@@ -793,9 +1504,23 @@ class _AgentLocator(CommandLocator):
     @ClusterStatusCommand.responder
     def cluster_updated(self, eliot_context, configuration, state):
         with eliot_context:
+            self._configuration = configuration
+            self._state = state
             self.agent.cluster_updated(configuration, state)
             return {}
 
+    @ClusterStatusDiffCommand.responder
+    def cluster_updated_diff(self, eliot_context, configuration_diff,
+                             state_diff):
+        with eliot_context:
+            if self._configuration is None or self._state is None:
+                raise MissingClusterStatus()
+            self._configuration = configuration_diff.apply(
+                self._configuration)
+            self._state = state_diff.apply(self._state)
+            self.agent.cluster_updated(self._configuration, self._state)
+            return {}
+
 
 class AgentAMP(AMP):
     """
@@ -805,38 +1530,77 @@ class AgentAMP(AMP):
 
     :ivar Pinger _pinger: Helper which periodically pings this protocol's peer
         to verify it's still alive.
+    :ivar Timeout _timeout: The timeout which aborts the connection if
+        nothing is received over it.
+    :ivar bool binary_wire_format: Whether to send model objects in the
+        binary wire format.  Set once the control service announces support
+        for it.
+    :ivar bool node_state_diffs: Whether the control service accepts
+        ``NodeStateDiffCommand``.  Set once the control service announces
+        support for it.
     """
-    def __init__(self, reactor, agent):
+    binary_wire_format = False
+    node_state_diffs = False
+
+    def __init__(self, reactor, agent, timer_wheel=None):
         """
         :param IReactorTime reactor: A reactor to use to schedule periodic ping
             operations.root@52.28.55.192
         :param IConvergenceAgent agent: Convergence agent to notify of changes.
+        :param TimerWheel timer_wheel: The timer wheel to use to schedule
+            pings and timeouts, or ``None`` to use a new one.
         """
-        locator = _AgentLocator(agent, timeout_for_protocol(reactor, self))
+        if timer_wheel is None:
+            timer_wheel = TimerWheel(reactor)
+        self._timeout = timeout_for_protocol(timer_wheel, self)
+        locator = _AgentLocator(agent, self._timeout)
         AMP.__init__(self, locator=locator)
         self.agent = agent
-        self._pinger = Pinger(reactor)
+        self._pinger = Pinger(timer_wheel)
 
     def connectionMade(self):
         AMP.connectionMade(self)
         self.agent.connected(self)
         self._pinger.start(self, PING_INTERVAL)
+        # Tell the control service which optional features we support.  A
+        # control service which predates feature negotiation ignores them,
+        # and if the command fails entirely the features just aren't used.
+        d = self.callRemote(
+            VersionCommand, features=sorted(SUPPORTED_FEATURES),
+        )
+        d.addCallback(self._got_version)
+        d.addErrback(lambda _: None)
+
+    def _got_version(self, response):
+        """
+        Start using the optional features the control service supports.
+
+        :param dict response: The response to ``VersionCommand``.
+        """
+        features = response.get("features") or ()
+        if FEATURE_BINARY_WIRE_FORMAT in features:
+            self.binary_wire_format = True
+        if FEATURE_NODE_STATE_DIFFS in features:
+            self.node_state_diffs = True
 
     def connectionLost(self, reason):
         AMP.connectionLost(self, reason)
         self.agent.disconnected()
         self._pinger.stop()
+        self._timeout.cancel()
 
 
 class Pinger(object):
     """
     An periodic AMP ping helper.
     """
-    def __init__(self, reactor):
+    def __init__(self, timer_wheel):
         """
-        :param IReactorTime reactor: The reactor to use to schedule the pings.
+        :param TimerWheel timer_wheel: The timer wheel to use to schedule the
+            pings.  Pings due at about the same time on all the connections
+            using the same wheel are sent together.
         """
-        self.reactor = reactor
+        self.timer_wheel = timer_wheel
 
     def start(self, protocol, interval):
         """
@@ -847,12 +1611,12 @@ class Pinger(object):
         """
         def ping():
             protocol.callRemote(NoOp)
-        self._pinging = LoopingCall(ping)
-        self._pinging.clock = self.reactor
-        self._pinging.start(interval.total_seconds(), now=False)
+        self._pinging = self.timer_wheel.call_repeatedly(
+            interval.total_seconds(), ping,
+        )
 
     def stop(self):
         """
         Stop sending the pings.
         """
-        self._pinging.stop()
+        self._pinging.cancel()
@@ -0,0 +1,205 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+# -*- test-case-name: flocker.control.test.test_scope -*-
+
+"""
+Node-scoped views of the cluster configuration and state.
+
+Most convergence agents only need the configuration and state of the node
+they are running on, not of the whole cluster.  An agent declares which part
+of the cluster it needs using a ``ClusterScope`` and the control service then
+only sends it a view of the cluster restricted to that scope.
+"""
+
+from uuid import UUID
+
+from twisted.python.constants import Values, ValueConstant
+
+from pyrsistent import PClass, field
+
+from ._model import (
+    Application, Deployment, DeploymentState, Leases, Node, NodeState,
+)
+
+
+class ClusterScope(Values):
+    """
+    The parts of the cluster configuration and state a convergence agent
+    needs.
+
+    :cvar CLUSTER: The whole configuration and state of the cluster.
+    :cvar NODE_DATASETS: The configuration and state of the agent's own node,
+        the leases held by that node and the persistent state of the cluster.
+    :cvar NODE_APPLICATIONS: The configuration and state of the agent's own
+        node, plus the exposed ports and addresses of applications running on
+        other nodes.
+    """
+    CLUSTER = ValueConstant(u"cluster")
+    NODE_DATASETS = ValueConstant(u"node-datasets")
+    NODE_APPLICATIONS = ValueConstant(u"node-applications")
+
+
+class AgentScope(PClass):
+    """
+    The part of the cluster a particular convergence agent needs.
+
+    :ivar ClusterScope scope: The scope requested by the agent.
+    :ivar UUID node_uuid: The node the agent is running on.
+    """
+    scope = field(mandatory=True)
+    node_uuid = field(type=UUID, mandatory=True)
+
+
+def _proxy_node(node):
+    """
+    Reduce the configuration of a node to the applications with exposed
+    ports, as needed by agents on other nodes to set up proxies.
+
+    :param Node node: The node configuration.
+
+    :return: A ``Node`` with only the names, images and ports of
+        applications that expose ports, or ``None`` if there are no such
+        applications.
+    """
+    applications = [
+        Application(name=app.name, image=app.image, ports=app.ports)
+        for app in node.applications if app.ports
+    ]
+    if not applications:
+        return None
+    return Node(uuid=node.uuid, applications=applications)
+
+
+class ClusterViews(object):
+    """
+    Compute and memoize scoped views of one configuration and state.
+
+    A single instance is used for all the agents being sent a particular
+    update, so that the indexes needed to build each view are only built once
+    and agents with the same scope on the same node share their view.
+
+    :ivar Deployment configuration: The cluster configuration.
+    :ivar DeploymentState state: The cluster state.
+    """
+    def __init__(self, configuration, state):
+        self.configuration = configuration
+        self.state = state
+        self._views = {}
+        self._indexed = False
+
+    def _index(self):
+        """
+        Build, once, the indexes of the configuration and state by node.
+        """
+        if self._indexed:
+            return
+        self._indexed = True
+        self._configuration_nodes = {
+            node.uuid: node for node in self.configuration.nodes
+        }
+        self._state_nodes = {node.uuid: node for node in self.state.nodes}
+
+        self._leases = {}
+        for dataset_id, lease in self.configuration.leases.items():
+            self._leases.setdefault(lease.node_id, {})[dataset_id] = lease
+
+        self._proxy_nodes = {}
+        for node in self.configuration.nodes:
+            proxy_node = _proxy_node(node)
+            if proxy_node is not None:
+                self._proxy_nodes[node.uuid] = proxy_node
+        self._proxy_states = {
+            uuid: NodeState(
+                uuid=uuid, hostname=self._state_nodes[uuid].hostname,
+            )
+            for uuid in self._proxy_nodes if uuid in self._state_nodes
+        }
+        # Typed sets shared by every NODE_APPLICATIONS view, which each only
+        # differ in their own node:
+        self._all_proxy_nodes = Deployment(
+            nodes=self._proxy_nodes.values()).nodes
+        self._all_proxy_states = DeploymentState(
+            nodes=self._proxy_states.values()).nodes
+
+    def _own_node(self, node_uuid):
+        """
+        :param UUID node_uuid: A node.
+
+        :return: A tuple of the ``Node`` and the ``NodeState`` of the given
+            node (either of which may be ``None``) and a ``dict`` mapping the
+            node's UUID to its era, if it is known.
+        """
+        self._index()
+        eras = {}
+        era = self.state.node_uuid_to_era.get(node_uuid)
+        if era is not None:
+            eras[node_uuid] = era
+        return (
+            self._configuration_nodes.get(node_uuid),
+            self._state_nodes.get(node_uuid),
+            eras,
+        )
+
+    def _node_datasets(self, node_uuid):
+        """
+        Build the ``ClusterScope.NODE_DATASETS`` view for a node.
+        """
+        node, node_state, eras = self._own_node(node_uuid)
+        configuration = Deployment(
+            nodes=[node] if node is not None else [],
+            leases=Leases(self._leases.get(node_uuid, {})),
+            persistent_state=self.configuration.persistent_state,
+        )
+        state = DeploymentState(
+            nodes=[node_state] if node_state is not None else [],
+            node_uuid_to_era=eras,
+        )
+        return configuration, state
+
+    def _node_applications(self, node_uuid):
+        """
+        Build the ``ClusterScope.NODE_APPLICATIONS`` view for a node.
+        """
+        node, node_state, eras = self._own_node(node_uuid)
+
+        nodes = self._all_proxy_nodes
+        if node_uuid in self._proxy_nodes:
+            nodes = nodes.discard(self._proxy_nodes[node_uuid])
+        if node is not None:
+            nodes = nodes.add(node)
+
+        node_states = self._all_proxy_states
+        if node_uuid in self._proxy_states:
+            node_states = node_states.discard(self._proxy_states[node_uuid])
+        if node_state is not None:
+            node_states = node_states.add(node_state)
+
+        configuration = Deployment(
+            nodes=nodes,
+            persistent_state=self.configuration.persistent_state,
+        )
+        state = DeploymentState(nodes=node_states, node_uuid_to_era=eras)
+        return configuration, state
+
+    def view(self, agent_scope):
+        """
+        Get the view of the cluster for an agent.
+
+        :param agent_scope: The ``AgentScope`` of the agent, or ``None`` if
+            the agent has not declared one.
+
+        :return: A tuple of the ``Deployment`` and ``DeploymentState`` the
+            agent should be sent.  Agents that need the whole cluster are
+            given the original objects.
+        """
+        if agent_scope is None or agent_scope.scope is ClusterScope.CLUSTER:
+            return self.configuration, self.state
+        try:
+            return self._views[agent_scope]
+        except KeyError:
+            pass
+        if agent_scope.scope is ClusterScope.NODE_DATASETS:
+            result = self._node_datasets(agent_scope.node_uuid)
+        else:
+            result = self._node_applications(agent_scope.node_uuid)
+        self._views[agent_scope] = result
+        return result
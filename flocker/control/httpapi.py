@@ -6,25 +6,28 @@ A HTTP REST API for controlling the Dataset Manager.
 from uuid import uuid4, UUID
 from datetime import datetime
 from functools import wraps
+from heapq import nsmallest
 from json import dumps
+from operator import itemgetter
 
 from pytz import UTC
 
 import yaml
 
-from pyrsistent import pmap, thaw
+from pyrsistent import PClass, field, pmap, pmap_field, thaw
 
 from twisted.protocols.tls import TLSMemoryBIOFactory
 
 from twisted.python.filepath import FilePath
 from twisted.web.http import (
     CONFLICT, CREATED, NOT_FOUND, OK, NOT_ALLOWED as METHOD_NOT_ALLOWED,
-    BAD_REQUEST, PRECONDITION_FAILED,
+    BAD_REQUEST, PRECONDITION_FAILED, NOT_MODIFIED,
 )
 from twisted.web.server import Site
 from twisted.web.resource import Resource
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet import reactor
+from twisted.internet.defer import Deferred
 
 from klein import Klein
 
@@ -32,7 +35,7 @@ from pyrsistent import discard
 
 from ..restapi import (
     EndpointResponse, structured, user_documentation, make_bad_request,
-    private_api
+    private_api, BadRequest,
 )
 from . import (
     Dataset, Manifestation, Application, DockerImage, Port,
@@ -43,7 +46,6 @@ from ._config import (
     model_from_configuration, FigConfiguration, FlockerConfiguration,
     ConfigurationError
 )
-from ._persistence import update_leases
 from ._model import LeaseError
 
 from .. import __version__, REST_API_PORT as _port
@@ -96,6 +98,12 @@ NODE_BY_ERA_NOT_FOUND = make_bad_request(
 _UNDEFINED_MAXIMUM_SIZE = object()
 
 IF_MATCHES_HEADER = b"X-If-Configuration-Matches"
+NEXT_CURSOR_HEADER = b"X-Next-Cursor"
+
+# How long the watch endpoint waits for a change by default, and at most, in
+# seconds:
+DEFAULT_WATCH_TIMEOUT = 30
+MAXIMUM_WATCH_TIMEOUT = 300
 
 
 def get_configuration_tag(api):
@@ -134,6 +142,396 @@ def _if_configuration_matches(original):
     return render_if_matches
 
 
+def get_state_tag(api):
+    """
+    Return tag value for the cluster state.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: Tag as ``bytes``.
+    """
+    # Generations are only unique during the lifetime of the cluster state
+    # service:
+    return b"%s-%d" % (
+        api.instance_id, api.cluster_state_service.state_generation())
+
+
+def get_version_tag(api):
+    """
+    Return tag value for the version of Flocker.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: Tag as ``bytes``.
+    """
+    return __version__.encode("ascii")
+
+
+def _none_match(request, tag):
+    """
+    :param request: The request.
+    :param bytes tag: The entity tag of the resource, including quotes.
+
+    :return bool: Whether the request has an ``If-None-Match`` header which
+        matches ``tag``, using the weak comparison function.
+    """
+    for header in request.requestHeaders.getRawHeaders(b"if-none-match", []):
+        for candidate in header.split(b","):
+            candidate = candidate.strip()
+            if candidate.startswith(b"W/"):
+                candidate = candidate[2:]
+            if candidate in (b"*", tag):
+                return True
+    return False
+
+
+def _entity_tag(get_tag):
+    """
+    Decorator that adds an ``ETag`` header with the result of ``get_tag`` to
+    responses, and responds with ``304 Not Modified`` without calling the
+    original function if it matches the request's ``If-None-Match`` header.
+
+    :param get_tag: A function taking the API instance and returning a tag
+        identifying the version of everything the original function's
+        response depends on.
+    :return: Decorator.
+    """
+    def decorator(original):
+        @wraps(original)
+        def render_unless_none_match(self, request, **route_arguments):
+            tag = b'"' + get_tag(self) + b'"'
+            request.responseHeaders.setRawHeaders(b"etag", [tag])
+            if _none_match(request, tag):
+                request.setResponseCode(NOT_MODIFIED)
+                return b""
+            return original(self, request, **route_arguments)
+        return render_unless_none_match
+    return decorator
+
+
+def get_configuration_generation(api):
+    """
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return int: The generation of the configuration.
+    """
+    return api.persistence_service.configuration_generation()
+
+
+def get_configuration_version(api):
+    """
+    Return the version of the configuration for caching responses derived
+    from it.
+
+    Responses include the configuration's tag, so it is part of the version
+    along with the generation, which only identifies the configuration
+    during the lifetime of the persistence service.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: ``tuple`` of the generation and the tag of the configuration.
+    """
+    return (get_configuration_generation(api), get_configuration_tag(api))
+
+
+def get_state_generation(api):
+    """
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return int: The generation of the cluster state.
+    """
+    return api.cluster_state_service.state_generation()
+
+
+def get_watch_tags(api):
+    """
+    Return the tags identifying the current configuration and cluster state
+    for the watch endpoint.
+
+    Unlike ``get_configuration_tag`` the configuration's tag doesn't require
+    hashing it, but it is only unique during the lifetime of the API
+    instance.
+
+    :param ConfigurationAPIUserV1 api: API instance.
+    :return: ``dict`` mapping ``u"configuration"`` and ``u"state"`` to
+        ``unicode`` tags.
+    """
+    return {
+        u"configuration": u"%s-%d" % (
+            api.instance_id, get_configuration_generation(api)),
+        u"state": get_state_tag(api).decode("ascii"),
+    }
+
+
+class _CachedResponse(PClass):
+    """
+    A response rendered by an endpoint.
+
+    :ivar generation: The generation of the information the response was
+        rendered from.
+    :ivar list headers: The ``(name, values)`` of the response's headers.
+    :ivar bytes body: The encoded response body.
+    """
+    generation = field(mandatory=True)
+    headers = field(type=list, mandatory=True)
+    body = field(type=bytes, mandatory=True)
+
+
+def _cached_response(get_generation):
+    """
+    Decorator that caches the encoded successful response of an endpoint
+    requested without query arguments, so that it is only rendered once for
+    each generation of the information it is rendered from however many
+    times it is requested.
+
+    :param get_generation: A function taking the API instance and returning
+        the generation of the information the original function's response
+        depends on.
+    :return: Decorator.
+    """
+    def decorator(original):
+        name = original.__name__
+
+        @wraps(original)
+        def render_cached(self, request, **route_arguments):
+            if request.args:
+                # Filtered and paged responses are rendered every time:
+                return original(self, request, **route_arguments)
+            generation = get_generation(self)
+            cached = self._response_cache.get(name)
+            if cached is not None and cached.generation == generation:
+                for header, values in cached.headers:
+                    request.responseHeaders.setRawHeaders(header, values)
+                return cached.body
+
+            def rendered(body):
+                if request.code == OK:
+                    self._response_cache[name] = _CachedResponse(
+                        generation=generation,
+                        headers=list(
+                            request.responseHeaders.getAllRawHeaders()),
+                        body=body,
+                    )
+                return body
+            result = original(self, request, **route_arguments)
+            if isinstance(result, Deferred):
+                return result.addCallback(rendered)
+            return rendered(result)
+        return render_cached
+    return decorator
+
+
+def _query_arguments(original):
+    """
+    Decorator that passes the arguments in the request's query string to the
+    original function as its ``query`` keyword argument, a ``dict`` mapping
+    each argument's name to the ``list`` of ``bytes`` values given for it.
+
+    :param original: Original function.
+    :return: Wrapped function.
+    """
+    @wraps(original)
+    def render_with_query(self, request, **route_arguments):
+        return original(self, request, query=request.args, **route_arguments)
+    return render_with_query
+
+
+def _request_finished(original):
+    """
+    Decorator that passes the ``Deferred`` returned by the request's
+    ``notifyFinish`` to the original function as its ``finished`` keyword
+    argument.  It fails if the connection is lost before the response has
+    been sent, so the original function can stop working on the response.
+
+    :param original: Original function.
+    :return: Wrapped function.
+    """
+    @wraps(original)
+    def render_with_finished(self, request, **route_arguments):
+        return original(
+            self, request, finished=request.notifyFinish(), **route_arguments)
+    return render_with_finished
+
+
+class _ListingQuery(PClass):
+    """
+    The part of a listing requested by the query arguments of a request.
+
+    :ivar filters: ``pmap`` mapping the names of filter arguments to the
+        ``unicode`` value they were given.
+    :ivar metadata: ``pmap`` mapping metadata keys to the ``unicode`` value
+        listed datasets must have for them.
+    :ivar cursor: ``None``, or the ``unicode`` sort key of the last item of
+        the previous page; only items after it are listed.
+    :ivar limit: ``None``, or the maximum number of items to list.
+    """
+    filters = pmap_field(unicode, unicode)
+    metadata = pmap_field(unicode, unicode)
+    cursor = field(type=(unicode, type(None)), initial=None)
+    limit = field(type=(int, type(None)), initial=None)
+
+    def get(self, name):
+        """
+        :param unicode name: The name of a filter argument.
+        :return: The ``unicode`` value of the filter, or ``None`` if it was
+            not given.
+        """
+        return self.filters.get(name)
+
+    def page(self, items):
+        """
+        Select the requested page of a listing.
+
+        Without a limit the items after the cursor are listed in their
+        original order; otherwise they are listed in order of their sort
+        keys.
+
+        :param items: Iterable of ``(sort_key, item)`` tuples, where
+            ``sort_key`` is ``unicode``.
+        :return: ``tuple`` of a ``list`` of the items on the page and the
+            cursor for the next page, or ``None`` if this is the last page.
+        """
+        if self.cursor is not None:
+            items = ((key, item) for (key, item) in items
+                     if key > self.cursor)
+        if self.limit is None:
+            return [item for (key, item) in items], None
+        page = nsmallest(self.limit + 1, items, key=itemgetter(0))
+        if len(page) <= self.limit:
+            return [item for (key, item) in page], None
+        page = page[:self.limit]
+        return [item for (key, item) in page], page[-1][0]
+
+
+def _parse_listing_query(query, filters, metadata=False):
+    """
+    Parse the query arguments of a request for a listing.
+
+    :param dict query: The query arguments, as passed by
+        ``_query_arguments``.
+    :param filters: The names of the filter arguments the listing supports.
+    :param bool metadata: Whether the listing supports the ``metadata``
+        argument, given as ``key=value`` and repeatable.
+
+    :raise BadRequest: If the query arguments are not valid.
+    :return _ListingQuery: The parsed query.
+    """
+    parsed = {}
+    for name, values in query.items():
+        try:
+            name = name.decode("utf-8")
+            values = [value.decode("utf-8") for value in values]
+        except UnicodeDecodeError:
+            raise make_bad_request(
+                description=u"Query arguments must be UTF-8 encoded.")
+        if name == u"metadata" and metadata:
+            pairs = {}
+            for value in values:
+                key, separator, value = value.partition(u"=")
+                if not separator:
+                    raise make_bad_request(
+                        description=u"metadata must be given as key=value.")
+                pairs[key] = value
+            parsed[name] = pairs
+            continue
+        if name not in filters and name not in (u"cursor", u"limit"):
+            raise make_bad_request(
+                description=u"Unknown query argument: {}.".format(name))
+        if len(values) != 1:
+            raise make_bad_request(
+                description=u"{} may only be given once.".format(name))
+        parsed[name] = values[0]
+
+    limit = parsed.pop(u"limit", None)
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise make_bad_request(
+                description=u"limit must be a positive integer.")
+    return _ListingQuery(
+        metadata=parsed.pop(u"metadata", {}),
+        cursor=parsed.pop(u"cursor", None),
+        limit=limit,
+        filters=parsed,
+    )
+
+
+def _listing_response(query, items, render=None, headers=None):
+    """
+    Respond with the requested page of a listing.
+
+    :param _ListingQuery query: The requested part of the listing.
+    :param items: Iterable of ``(sort_key, item)`` tuples, as accepted by
+        ``_ListingQuery.page``.
+    :param render: ``None``, or a function converting an item to its API
+        representation, which is only called for the items on the page.
+    :param dict headers: Additional headers for the response.
+
+    :return EndpointResponse: The page of items, with a
+        ``X-Next-Cursor`` header if there are more.
+    """
+    if headers is None:
+        headers = {}
+    page, next_cursor = query.page(items)
+    if render is not None:
+        page = [render(item) for item in page]
+    if next_cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = next_cursor.encode("utf-8")
+    return EndpointResponse(OK, page, headers=headers)
+
+
+def _parse_watch_query(query):
+    """
+    Parse the query arguments of a request to the watch endpoint.
+
+    :param dict query: The query arguments, as passed by
+        ``_query_arguments``.
+
+    :raise BadRequest: If the query arguments are not valid.
+    :return: ``tuple`` of a ``dict`` mapping ``u"configuration"`` and
+        ``u"state"`` to the ``unicode`` tags given for them, if any, and the
+        ``float`` number of seconds to wait for them to change.
+    """
+    tags = {}
+    timeout = DEFAULT_WATCH_TIMEOUT
+    for name, values in query.items():
+        try:
+            name = name.decode("utf-8")
+            values = [value.decode("utf-8") for value in values]
+        except UnicodeDecodeError:
+            raise make_bad_request(
+                description=u"Query arguments must be UTF-8 encoded.")
+        if name not in (u"configuration", u"state", u"timeout"):
+            raise make_bad_request(
+                description=u"Unknown query argument: {}.".format(name))
+        if len(values) != 1:
+            raise make_bad_request(
+                description=u"{} may only be given once.".format(name))
+        if name == u"timeout":
+            try:
+                timeout = float(values[0])
+            except ValueError:
+                timeout = -1
+            if not 0 <= timeout <= MAXIMUM_WATCH_TIMEOUT:
+                raise make_bad_request(
+                    description=u"timeout must be a number of seconds "
+                                u"between 0 and {}.".format(
+                                    MAXIMUM_WATCH_TIMEOUT))
+        else:
+            tags[name] = values[0]
+    return tags, timeout
+
+
+def _tags_changed(tags, current):
+    """
+    :param dict tags: Tags given to the watch endpoint.
+    :param dict current: The current tags, as returned by
+        ``get_watch_tags``.
+
+    :return bool: Whether any of the given tags differ from the current
+        ones.
+    """
+    return any(current[name] != tag for (name, tag) in tags.items())
+
+
 class ConfigurationAPIUserV1(object):
     """
     A user accessing the API.
@@ -159,6 +557,80 @@ class ConfigurationAPIUserV1(object):
         self.persistence_service = persistence_service
         self.cluster_state_service = cluster_state_service
         self.clock = clock
+        self.instance_id = uuid4().hex
+        self._response_cache = {}
+        self._watchers = set()
+        persistence_service.register(self._notify_watchers)
+        cluster_state_service.register(self._notify_watchers)
+
+    def _now(self):
+        """
+        :return datetime: The current time.
+        """
+        return datetime.fromtimestamp(self.clock.seconds(), UTC)
+
+    def _save_change(self, change, *args):
+        """
+        Change the configuration and save it.
+
+        :param change: A function taking the current ``Deployment`` and
+            ``args``, and returning a tuple of the changed ``Deployment`` and
+            the response to give once it is saved.  It may raise
+            ``BadRequest``.
+        :param args: Additional arguments for ``change``.
+
+        :return: ``Deferred`` firing with the response once the changed
+            configuration is saved.
+        """
+        deployment, response = change(self.persistence_service.get(), *args)
+        saving = self.persistence_service.save(deployment)
+        saving.addCallback(lambda _: response)
+        return saving
+
+    def _notify_watchers(self):
+        """
+        Let the requests waiting for the configuration or the cluster state
+        to change check whether they have.
+        """
+        for check in list(self._watchers):
+            check()
+
+    def _wait_for_change(self, tags, timeout, finished):
+        """
+        Wait for the configuration or the cluster state to change.
+
+        :param dict tags: Tags given to the watch endpoint.
+        :param float timeout: The number of seconds to wait.
+        :param Deferred finished: Fires when the request is finished, and
+            fails if the client goes away first, in which case the wait is
+            abandoned.
+
+        :return: ``Deferred`` firing with the current tags, as returned by
+            ``get_watch_tags``, once any of ``tags`` differ from them or
+            when ``timeout`` has passed.
+        """
+        waiting = Deferred()
+
+        def check():
+            current = get_watch_tags(self)
+            if _tags_changed(tags, current):
+                self._watchers.discard(check)
+                expiry.cancel()
+                waiting.callback(current)
+
+        def expire():
+            self._watchers.discard(check)
+            waiting.callback(get_watch_tags(self))
+
+        def abandon(reason):
+            if not waiting.called:
+                self._watchers.discard(check)
+                expiry.cancel()
+
+        self._watchers.add(check)
+        expiry = self.clock.callLater(timeout, expire)
+        finished.addErrback(abandon)
+        return waiting
 
     @app.route("/version", methods=['GET'])
     @user_documentation(
@@ -168,6 +640,7 @@ class ConfigurationAPIUserV1(object):
         section=u"common",
         header=u"Get Flocker version",
         examples=[u"get version"])
+    @_entity_tag(get_version_tag)
     @structured(
         inputSchema={},
         outputSchema={'$ref': '/v1/endpoints.json#/definitions/versions'},
@@ -186,11 +659,21 @@ class ConfigurationAPIUserV1(object):
 
         Includes a ``X-Configuration-Tag`` header in the response for use
         with operations that support ``X-If-Configuration-Matches``.
+
+        The listing can be filtered with the ``dataset_id`` and ``primary``
+        query arguments, and with ``metadata`` arguments of the form
+        ``key=value`` which listed datasets must all match.  If a ``limit``
+        is given the datasets are listed in order of their IDs, and a
+        ``X-Next-Cursor`` header is included if there are more; pass its
+        value as the ``cursor`` argument to get the next page.
         """,
         header=u"Get the cluster's dataset configuration",
         examples=[u"get configured datasets"],
         section=u"dataset",
     )
+    @_entity_tag(get_configuration_tag)
+    @_cached_response(get_configuration_version)
+    @_query_arguments
     @structured(
         inputSchema={},
         outputSchema={
@@ -199,17 +682,28 @@ class ConfigurationAPIUserV1(object):
         },
         schema_store=SCHEMAS,
     )
-    def get_dataset_configuration(self):
+    def get_dataset_configuration(self, query):
         """
         Get the configured datasets.
 
+        :param dict query: The query arguments of the request.
+
         :return: A ``list`` of ``dict`` representing each of dataset
             that is configured to exist anywhere on the cluster.
         """
         tag = get_configuration_tag(self)
-        return EndpointResponse(
-            OK, list(datasets_from_deployment(self.persistence_service.get())),
-            headers={b"X-Configuration-Tag": tag})
+        deployment = self.persistence_service.get()
+        headers = {b"X-Configuration-Tag": tag}
+        if not query:
+            return EndpointResponse(
+                OK, list(datasets_from_deployment(deployment)),
+                headers=headers)
+        query = _parse_listing_query(
+            query, [u"dataset_id", u"primary"], metadata=True)
+        return _listing_response(
+            query, _filtered_datasets_from_deployment(deployment, query),
+            render=lambda item: api_dataset_from_dataset_and_node(*item),
+            headers=headers)
 
     @app.route("/configuration/datasets", methods=['POST'])
     @user_documentation(
@@ -269,46 +763,8 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        if dataset_id is None:
-            dataset_id = unicode(uuid4())
-        dataset_id = dataset_id.lower()
-
-        if metadata is None:
-            metadata = {}
-
-        primary = UUID(hex=primary)
-
-        # Use persistence_service to get a Deployment for the cluster
-        # configuration.
-        deployment = self.persistence_service.get()
-        for node in deployment.nodes:
-            for manifestation in node.manifestations.values():
-                if manifestation.dataset.dataset_id == dataset_id:
-                    raise DATASET_ID_COLLISION
-
-        # XXX Check cluster state to determine if the given primary node
-        # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
-        # See FLOC-1278
-
-        dataset = Dataset(
-            dataset_id=dataset_id,
-            maximum_size=maximum_size,
-            metadata=pmap(metadata)
-        )
-        manifestation = Manifestation(dataset=dataset, primary=True)
-
-        primary_node = deployment.get_node(primary)
-
-        new_node_config = primary_node.transform(
-            ("manifestations", manifestation.dataset_id), manifestation)
-        new_deployment = deployment.update_node(new_node_config)
-        saving = self.persistence_service.save(new_deployment)
-
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(dataset, primary)
-            return EndpointResponse(CREATED, result)
-        saving.addCallback(saved)
-        return saving
+        return self._save_change(
+            _create_dataset, primary, dataset_id, maximum_size, metadata)
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['DELETE'])
     @user_documentation(
@@ -345,27 +801,7 @@ class ConfigurationAPIUserV1(object):
             as deleted in the cluster configuration or giving error
             information if this is not possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # XXX this doesn't handle replicas
-        # https://clusterhq.atlassian.net/browse/FLOC-1240
-        _, origin_node = _find_manifestation_and_node(
-            deployment, dataset_id)
-
-        new_node = origin_node.transform(
-            ("manifestations", dataset_id, "dataset", "deleted"), True)
-        deployment = deployment.update_node(new_node)
-
-        saving = self.persistence_service.save(deployment)
-
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                new_node.manifestations[dataset_id].dataset, new_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
-        return saving
+        return self._save_change(_delete_dataset, dataset_id)
 
     @app.route("/configuration/datasets/<dataset_id>", methods=['POST'])
     @user_documentation(
@@ -412,38 +848,7 @@ class ConfigurationAPIUserV1(object):
             cluster configuration or giving error information if this is not
             possible.
         """
-        # Get the current configuration.
-        deployment = self.persistence_service.get()
-
-        # Raises DATASET_NOT_FOUND if the ``dataset_id`` is not found.
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
-
-        if primary_manifestation.dataset.deleted:
-            raise DATASET_DELETED
-
-        if primary is not None:
-            deployment = _update_dataset_primary(
-                deployment, dataset_id, UUID(hex=primary)
-            )
-
-        saving = self.persistence_service.save(deployment)
-
-        primary_manifestation, current_node = _find_manifestation_and_node(
-            deployment, dataset_id
-        )
-
-        # Return an API response dictionary containing the dataset with updated
-        # primary address.
-        def saved(ignored):
-            result = api_dataset_from_dataset_and_node(
-                primary_manifestation.dataset,
-                current_node.uuid,
-            )
-            return EndpointResponse(OK, result)
-        saving.addCallback(saved)
-        return saving
+        return self._save_change(_update_dataset, dataset_id, primary)
 
     @app.route("/state/datasets", methods=['GET'])
     @user_documentation(
@@ -451,11 +856,18 @@ class ConfigurationAPIUserV1(object):
         The result reflects the control service's knowledge, which may be
         out of date or incomplete. E.g. a dataset agent has not connected
         or updated the control service yet.
+
+        The listing can be filtered with the ``dataset_id`` and ``primary``
+        query arguments, and paged with the ``limit`` and ``cursor``
+        arguments as for the dataset configuration.
         """,
         header=u"Get current cluster datasets",
         examples=[u"get state datasets"],
         section=u"dataset",
     )
+    @_entity_tag(get_state_tag)
+    @_cached_response(get_state_generation)
+    @_query_arguments
     @structured(
         inputSchema={},
         outputSchema={
@@ -463,11 +875,13 @@ class ConfigurationAPIUserV1(object):
             },
         schema_store=SCHEMAS
     )
-    def state_datasets(self):
+    def state_datasets(self, query):
         """
         Return all primary manifest datasets and all non-manifest datasets in
         the cluster.
 
+        :param dict query: The query arguments of the request.
+
         :return: A ``list`` containing all datasets in the cluster.
         """
         # XXX This duplicates code in datasets_from_deployment, but that
@@ -476,11 +890,19 @@ class ConfigurationAPIUserV1(object):
         # includes metadata and deleted flags which should not be part of the
         # dataset state response.
         # Refactor. See FLOC-2207.
+        query = _parse_listing_query(query, [u"dataset_id", u"primary"])
+        dataset_id = query.get(u"dataset_id")
+        primary = _parse_node_uuid(query, u"primary")
         response = []
         deployment_state = self.cluster_state_service.as_deployment()
         get_manifestation_path = self.cluster_state_service.manifestation_path
 
         for dataset, node in deployment_state.all_datasets():
+            if dataset_id is not None and dataset.dataset_id != dataset_id:
+                continue
+            if primary is not None and (node is None or
+                                        node.uuid != primary):
+                continue
             response_dataset = dict(
                 dataset_id=dataset.dataset_id,
             )
@@ -495,19 +917,28 @@ class ConfigurationAPIUserV1(object):
             if dataset.maximum_size is not None:
                 response_dataset[u"maximum_size"] = dataset.maximum_size
 
-            response.append(response_dataset)
-        return response
+            response.append((dataset.dataset_id, response_dataset))
+        return _listing_response(query, response)
 
     @app.route("/configuration/containers", methods=['GET'])
     @user_documentation(
         u"""
         These containers may or may not actually exist on the
         cluster.
+
+        The listing can be filtered with the ``node_uuid`` query argument.
+        If a ``limit`` is given the containers are listed in order of their
+        names, and a ``X-Next-Cursor`` header is included if there are
+        more; pass its value as the ``cursor`` argument to get the next
+        page.
         """,
         header=u"Get the cluster's container configuration",
         examples=[u"get configured containers"],
         section=u"container",
     )
+    @_entity_tag(get_configuration_tag)
+    @_cached_response(get_configuration_version)
+    @_query_arguments
     @structured(
         inputSchema={},
         outputSchema={
@@ -516,14 +947,26 @@ class ConfigurationAPIUserV1(object):
         },
         schema_store=SCHEMAS,
     )
-    def get_containers_configuration(self):
+    def get_containers_configuration(self, query):
         """
         Get the configured containers.
 
+        :param dict query: The query arguments of the request.
+
         :return: A ``list`` of ``dict`` representing each of the containers
             that are configured to exist anywhere on the cluster.
         """
-        return list(containers_from_deployment(self.persistence_service.get()))
+        deployment = self.persistence_service.get()
+        if not query:
+            return list(containers_from_deployment(deployment))
+        query = _parse_listing_query(query, [u"node_uuid"])
+        node_uuid = _parse_node_uuid(query, u"node_uuid")
+        return _listing_response(query, (
+            (application.name, (application, node.uuid))
+            for node in deployment.nodes
+            if node_uuid is None or node.uuid == node_uuid
+            for application in node.applications
+        ), render=lambda item: container_configuration_response(*item))
 
     @app.route("/state/containers", methods=['GET'])
     @user_documentation(
@@ -536,6 +979,8 @@ class ConfigurationAPIUserV1(object):
         examples=[u"get actual containers"],
         section=u"container",
     )
+    @_entity_tag(get_state_tag)
+    @_cached_response(get_state_generation)
     @structured(
         inputSchema={},
         outputSchema={
@@ -885,6 +1330,8 @@ class ConfigurationAPIUserV1(object):
         ],
         section=u"common",
     )
+    @_entity_tag(get_state_tag)
+    @_cached_response(get_state_generation)
     @structured(
         inputSchema={},
         outputSchema={"$ref":
@@ -917,6 +1364,7 @@ class ConfigurationAPIUserV1(object):
         ],
         section=u"common",
     )
+    @_entity_tag(get_state_tag)
     @structured(
         inputSchema={},
         outputSchema={"$ref":
@@ -935,6 +1383,50 @@ class ConfigurationAPIUserV1(object):
             raise NODE_BY_ERA_NOT_FOUND
         return {u"uuid": unicode(node_uuid)}
 
+    @app.route("/watch", methods=['GET'])
+    @user_documentation(
+        u"""
+        Wait for the configuration or the cluster state to change.
+
+        The response includes tags identifying the current configuration
+        and cluster state.  Pass them back as the ``configuration`` and
+        ``state`` query arguments of the next request to wait until either
+        of them moves on, instead of polling the other endpoints.  If no
+        tags are given, or a given tag is already out of date, the response
+        is immediate.  Otherwise it is sent as soon as there is a change, or
+        with the unchanged tags once the number of seconds given as the
+        ``timeout`` argument have passed (by default 30, at most 300).
+        """,
+        header=u"Wait for changes",
+        examples=[
+            u"wait for the cluster state to change",
+        ],
+        section=u"common",
+    )
+    @_query_arguments
+    @_request_finished
+    @structured(
+        inputSchema={},
+        outputSchema={"$ref":
+                      '/v1/endpoints.json#/definitions/watch_tags'},
+        schema_store=SCHEMAS
+    )
+    def watch(self, query, finished):
+        """
+        Wait for the configuration or the cluster state to change.
+
+        :param dict query: The query arguments of the request.
+        :param Deferred finished: The ``notifyFinish`` result of the request.
+
+        :return: The current tags, or a ``Deferred`` firing with them once
+            they change or the timeout passes.
+        """
+        tags, timeout = _parse_watch_query(query)
+        current = get_watch_tags(self)
+        if not tags or _tags_changed(tags, current) or not timeout:
+            return current
+        return self._wait_for_change(tags, timeout, finished)
+
     @app.route("/configuration/_compose", methods=['POST'])
     @private_api
     @structured(
@@ -991,7 +1483,7 @@ class ConfigurationAPIUserV1(object):
         """
         List the current leases in the configuration.
         """
-        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
+        now = self._now()
         result = []
         for lease in self.persistence_service.get().leases.values():
             result.append(lease_response(lease, now))
@@ -1026,23 +1518,7 @@ class ConfigurationAPIUserV1(object):
         :return: A ``Deferred`` firing with an ``EndpointResponse`` or
             serializable JSON.
         """
-        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
-        leases = self.persistence_service.get().leases
-        dataset_id = UUID(dataset_id)
-
-        lease = leases.get(dataset_id, None)
-        if lease is not None:
-            d = update_leases(
-                # We could choose to design a REST endpoint that requires
-                # taking the node UUID, but it's not clear what particular
-                # safety that adds... so just accept all releases.
-                lambda leases: leases.release(dataset_id, lease.node_id),
-                self.persistence_service)
-            d.addCallback(lambda _: lease_response(lease, now))
-            return d
-        else:
-            # Didn't find the lease:
-            raise LEASE_NOT_FOUND
+        return self._save_change(_release_lease, self._now(), dataset_id)
 
     @app.route("/configuration/leases", methods=['POST'])
     @user_documentation(
@@ -1078,27 +1554,80 @@ class ConfigurationAPIUserV1(object):
         :return: A ``Deferred`` firing with an ``EndpointResponse`` or
             serializable JSON.
         """
-        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
-        dataset_id = UUID(dataset_id)
-        node_uuid = UUID(node_uuid)
+        return self._save_change(
+            _acquire_lease, self._now(), dataset_id, node_uuid, expires)
 
-        # Check if already exists or not:
-        if self.persistence_service.get().leases.get(dataset_id) is None:
-            response_code = CREATED
-        else:
-            response_code = OK
+    @app.route("/configuration/batch", methods=['POST'])
+    @user_documentation(
+        u"""
+        Apply many changes to the dataset configuration in one request.
 
-        def acquire(leases):
-            try:
-                return leases.acquire(now, dataset_id, node_uuid, expires)
-            except LeaseError:
-                raise LEASE_HELD
+        Each operation creates, moves, resizes or deletes a dataset, or
+        acquires or releases a lease, and takes the same arguments as the
+        corresponding endpoint.  The operations are applied in order and
+        the configuration is saved once.  The response lists the code and
+        result (or error) of each operation.
+
+        Operations which fail leave the configuration unchanged.  If
+        ``atomic`` is true the configuration is only saved if every
+        operation succeeds; the response's ``committed`` is false if it
+        wasn't.
+
+        Supports ``X-If-Configuration-Matches`` header in the request to
+        ensure the changes only happen if the configuration hasn't changed.
+        """,
+        header=u"Apply a batch of changes to the configuration",
+        examples=[
+            u"apply a batch of changes",
+            u"apply an atomic batch of changes with a failure",
+        ],
+        section=u"dataset",
+    )
+    @_if_configuration_matches
+    @structured(
+        inputSchema={
+            '$ref': '/v1/endpoints.json#/definitions/configuration_batch'},
+        outputSchema={
+            '$ref':
+            '/v1/endpoints.json#/definitions/configuration_batch_results'},
+        schema_store=SCHEMAS,
+    )
+    def apply_batch(self, operations, atomic=False):
+        """
+        Apply a batch of changes to the cluster configuration.
 
-        d = update_leases(acquire, self.persistence_service)
-        d.addCallback(
-            lambda leases: EndpointResponse(
-                response_code, lease_response(leases[dataset_id], now)))
-        return d
+        :param list operations: ``dict`` describing each change, with the
+            name of the change as ``operation`` and its arguments.
+        :param bool atomic: Whether to only save the configuration if every
+            change succeeds.
+
+        :return: A ``Deferred`` firing with a ``dict`` giving whether the
+            configuration was saved and the result of each change.
+        """
+        now = self._now()
+        original = deployment = self.persistence_service.get()
+        results = []
+        for operation in operations:
+            operation = operation.copy()
+            name = operation.pop(u"operation")
+            try:
+                deployment, response = _apply_batch_operation(
+                    deployment, now, name, operation)
+            except BadRequest as e:
+                results.append({u"code": e.code, u"result": e.result})
+            else:
+                results.append(
+                    {u"code": response.code, u"result": response.result})
+
+        if atomic and any(
+                result[u"code"] >= BAD_REQUEST for result in results):
+            return {u"committed": False, u"results": results}
+        if deployment is original:
+            return {u"committed": True, u"results": results}
+        saving = self.persistence_service.save(deployment)
+        saving.addCallback(
+            lambda _: {u"committed": True, u"results": results})
+        return saving
 
 
 def _find_manifestation_and_node(deployment, dataset_id):
@@ -1179,12 +1708,228 @@ def _update_dataset_maximum_size(deployment, dataset_id, maximum_size):
     :returns: An updated ``Deployment``.
     """
     _, node = _find_manifestation_and_node(deployment, dataset_id)
-    deployment = deployment.set(nodes=deployment.nodes.discard(node))
     node = node.transform(
         ['manifestations', dataset_id, 'dataset', 'maximum_size'],
         maximum_size
     )
-    return deployment.set(nodes=deployment.nodes.add(node))
+    return deployment.update_node(node)
+
+
+def _create_dataset(deployment, primary, dataset_id=None, maximum_size=None,
+                    metadata=None):
+    """
+    Add a new dataset to the ``deployment``.
+
+    The arguments are as for
+    ``ConfigurationAPIUserV1.create_dataset_configuration``.
+
+    :param Deployment deployment: The configuration to change.
+
+    :raise BadRequest: If the dataset can't be created.
+    :return: Tuple of the updated ``Deployment`` and the
+        ``EndpointResponse`` describing the new dataset.
+    """
+    if dataset_id is None:
+        dataset_id = unicode(uuid4())
+    dataset_id = dataset_id.lower()
+
+    if metadata is None:
+        metadata = {}
+
+    primary = UUID(hex=primary)
+
+    if deployment.get_dataset_manifestations(dataset_id):
+        raise DATASET_ID_COLLISION
+
+    # XXX Check cluster state to determine if the given primary node
+    # actually exists.  If not, raise PRIMARY_NODE_NOT_FOUND.
+    # See FLOC-1278
+
+    dataset = Dataset(
+        dataset_id=dataset_id,
+        maximum_size=maximum_size,
+        metadata=pmap(metadata)
+    )
+    manifestation = Manifestation(dataset=dataset, primary=True)
+
+    primary_node = deployment.get_node(primary)
+
+    new_node_config = primary_node.transform(
+        ("manifestations", manifestation.dataset_id), manifestation)
+    deployment = deployment.update_node(new_node_config)
+    return deployment, EndpointResponse(
+        CREATED, api_dataset_from_dataset_and_node(dataset, primary))
+
+
+def _delete_dataset(deployment, dataset_id):
+    """
+    Mark a dataset in the ``deployment`` as deleted.
+
+    :param Deployment deployment: The configuration to change.
+    :param unicode dataset_id: The ID of the dataset to delete.
+
+    :raise BadRequest: If the dataset doesn't exist.
+    :return: Tuple of the updated ``Deployment`` and the
+        ``EndpointResponse`` describing the deleted dataset.
+    """
+    # XXX this doesn't handle replicas
+    # https://clusterhq.atlassian.net/browse/FLOC-1240
+    _, origin_node = _find_manifestation_and_node(
+        deployment, dataset_id)
+
+    new_node = origin_node.transform(
+        ("manifestations", dataset_id, "dataset", "deleted"), True)
+    deployment = deployment.update_node(new_node)
+    return deployment, EndpointResponse(
+        OK, api_dataset_from_dataset_and_node(
+            new_node.manifestations[dataset_id].dataset, new_node.uuid))
+
+
+def _update_dataset(deployment, dataset_id, primary=None,
+                    maximum_size=_UNDEFINED_MAXIMUM_SIZE):
+    """
+    Move or resize a dataset in the ``deployment``.
+
+    :param Deployment deployment: The configuration to change.
+    :param unicode dataset_id: The ID of the dataset to update.
+    :param primary: The ``unicode`` UUID of the node to which the dataset
+        will be moved, or ``None`` indicating no change.
+    :param maximum_size: The new maximum size of the dataset, or ``None``
+        to remove the size limit.  By default the size isn't changed.
+
+    :raise BadRequest: If the dataset doesn't exist or has been deleted.
+    :return: Tuple of the updated ``Deployment`` and the
+        ``EndpointResponse`` describing the updated dataset.
+    """
+    # Raises DATASET_NOT_FOUND if the ``dataset_id`` is not found.
+    primary_manifestation, current_node = _find_manifestation_and_node(
+        deployment, dataset_id
+    )
+
+    if primary_manifestation.dataset.deleted:
+        raise DATASET_DELETED
+
+    if primary is not None:
+        deployment = _update_dataset_primary(
+            deployment, dataset_id, UUID(hex=primary)
+        )
+
+    if maximum_size is not _UNDEFINED_MAXIMUM_SIZE:
+        deployment = _update_dataset_maximum_size(
+            deployment, dataset_id, maximum_size
+        )
+
+    primary_manifestation, current_node = _find_manifestation_and_node(
+        deployment, dataset_id
+    )
+    return deployment, EndpointResponse(
+        OK, api_dataset_from_dataset_and_node(
+            primary_manifestation.dataset, current_node.uuid))
+
+
+def _acquire_lease(deployment, now, dataset_id, node_uuid, expires):
+    """
+    Acquire or renew a lease in the ``deployment``.
+
+    :param Deployment deployment: The configuration to change.
+    :param datetime now: The current time.
+    :param unicode dataset_id: The dataset whose lease is being acquired.
+    :param unicode node_uuid: The node on which the lease is being aquired.
+    :param expires: ``None`` if no expiration, otherwise number of
+        seconds to expiration.
+
+    :raise BadRequest: If the lease is held by another node.
+    :return: Tuple of the updated ``Deployment`` and the
+        ``EndpointResponse`` describing the lease.
+    """
+    dataset_id = UUID(dataset_id)
+    node_uuid = UUID(node_uuid)
+
+    # Check if already exists or not:
+    if deployment.leases.get(dataset_id) is None:
+        response_code = CREATED
+    else:
+        response_code = OK
+
+    try:
+        leases = deployment.leases.acquire(
+            now, dataset_id, node_uuid, expires)
+    except LeaseError:
+        raise LEASE_HELD
+    return deployment.set(leases=leases), EndpointResponse(
+        response_code, lease_response(leases[dataset_id], now))
+
+
+def _release_lease(deployment, now, dataset_id):
+    """
+    Remove a lease from the ``deployment``.
+
+    :param Deployment deployment: The configuration to change.
+    :param datetime now: The current time.
+    :param unicode dataset_id: The dataset whose lease is being removed.
+
+    :raise BadRequest: If there is no lease on the dataset.
+    :return: Tuple of the updated ``Deployment`` and the
+        ``EndpointResponse`` describing the released lease.
+    """
+    dataset_id = UUID(dataset_id)
+    lease = deployment.leases.get(dataset_id, None)
+    if lease is None:
+        raise LEASE_NOT_FOUND
+    # We could choose to design a REST endpoint that requires taking the
+    # node UUID, but it's not clear what particular safety that adds... so
+    # just accept all releases.
+    leases = deployment.leases.release(dataset_id, lease.node_id)
+    return deployment.set(leases=leases), EndpointResponse(
+        OK, lease_response(lease, now))
+
+
+# Maps the name of each batch operation to the function making the change,
+# the arguments which must be given for it and those which may be:
+_BATCH_OPERATIONS = {
+    u"create_dataset": (
+        _create_dataset, {u"primary"},
+        {u"dataset_id", u"maximum_size", u"metadata"}),
+    u"move_dataset": (_update_dataset, {u"dataset_id", u"primary"}, set()),
+    u"resize_dataset": (
+        _update_dataset, {u"dataset_id", u"maximum_size"}, set()),
+    u"delete_dataset": (_delete_dataset, {u"dataset_id"}, set()),
+    u"acquire_lease": (
+        _acquire_lease, {u"dataset_id", u"node_uuid", u"expires"}, set()),
+    u"release_lease": (_release_lease, {u"dataset_id"}, set()),
+}
+
+# Batch operations whose functions also take the current time:
+_TIMED_BATCH_OPERATIONS = {u"acquire_lease", u"release_lease"}
+
+
+def _apply_batch_operation(deployment, now, name, arguments):
+    """
+    Apply one operation of a batch to the ``deployment``.
+
+    :param Deployment deployment: The configuration to change.
+    :param datetime now: The current time.
+    :param unicode name: The name of the operation.
+    :param dict arguments: The arguments of the operation.
+
+    :raise BadRequest: If the operation fails.
+    :return: Tuple of the updated ``Deployment`` and the
+        ``EndpointResponse`` describing the result of the operation.
+    """
+    change, required, optional = _BATCH_OPERATIONS[name]
+    missing = required - set(arguments)
+    if missing:
+        raise make_bad_request(
+            description=u"{} requires {}.".format(
+                name, u", ".join(sorted(missing))))
+    unexpected = set(arguments) - required - optional
+    if unexpected:
+        raise make_bad_request(
+            description=u"{} doesn't take {}.".format(
+                name, u", ".join(sorted(unexpected))))
+    if name in _TIMED_BATCH_OPERATIONS:
+        arguments[u"now"] = now
+    return change(deployment, **arguments)
 
 
 def manifestations_from_deployment(deployment, dataset_id):
@@ -1199,9 +1944,9 @@ def manifestations_from_deployment(deployment, dataset_id):
     :return: Iterable returning all manifestations of the supplied
         ``dataset_id``.
     """
-    for node in deployment.nodes:
-        if dataset_id in node.manifestations:
-            yield node.manifestations[dataset_id], node
+    manifestations = deployment.get_dataset_manifestations(dataset_id)
+    for node_uuid, manifestation in manifestations.items():
+        yield manifestation, deployment.get_node(node_uuid)
 
 
 def datasets_from_deployment(deployment):
@@ -1231,6 +1976,70 @@ def datasets_from_deployment(deployment):
                 )
 
 
+def _parse_node_uuid(query, name):
+    """
+    :param _ListingQuery query: A parsed query.
+    :param unicode name: The name of a filter argument identifying a node.
+
+    :raise BadRequest: If the argument is not a valid node UUID.
+    :return: The ``UUID`` given for the argument, or ``None`` if it was not
+        given.
+    """
+    value = query.get(name)
+    if value is None:
+        return None
+    try:
+        return UUID(value)
+    except ValueError:
+        raise make_bad_request(
+            description=u"{} must be a node UUID.".format(name))
+
+
+def _filtered_datasets_from_deployment(deployment, query):
+    """
+    Find the primary datasets matching a query in the supplied deployment
+    instance.
+
+    The datasets aren't converted to their API representation, so that only
+    those on the requested page need to be.  A ``dataset_id`` filter is
+    looked up in the deployment's dataset index rather than by examining
+    every node.
+
+    :param Deployment deployment: A ``Deployment`` describing the state
+        of the cluster.
+    :param _ListingQuery query: The filters the datasets must match.
+
+    :return: Iterable of ``(dataset_id, (dataset, node_uuid))`` tuples, as
+        accepted by ``_ListingQuery.page``.
+    """
+    dataset_id = query.get(u"dataset_id")
+    primary = _parse_node_uuid(query, u"primary")
+    metadata = query.metadata.items()
+    if dataset_id is None:
+        manifestations = (
+            (node.uuid, manifestation)
+            for node in deployment.nodes
+            if node.manifestations is not None and (
+                primary is None or node.uuid == primary)
+            for manifestation in node.manifestations.itervalues()
+        )
+    else:
+        manifestations = (
+            (node_uuid, manifestation)
+            for (node_uuid, manifestation)
+            in deployment.get_dataset_manifestations(dataset_id).items()
+            if primary is None or node_uuid == primary
+        )
+    for node_uuid, manifestation in manifestations:
+        if not manifestation.primary:
+            continue
+        dataset = manifestation.dataset
+        if any(dataset.metadata.get(key) != value
+               for (key, value) in metadata):
+            continue
+        yield dataset.dataset_id, (dataset, node_uuid)
+
+
 def containers_from_deployment(deployment):
     """
     Extract the containers from the supplied deployment instance.
@@ -8,8 +8,9 @@ Script for starting control service server.
 import cProfile
 import signal
 import time
+from datetime import timedelta
 
-from twisted.python.usage import Options
+from twisted.python.usage import Options, UsageError
 from twisted.internet.endpoints import serverFromString
 from twisted.python.filepath import FilePath
 from twisted.application.service import MultiService
@@ -20,7 +21,9 @@ from ._persistence import ConfigurationPersistenceService
 from ._clusterstate import ClusterStateService
 from ..common.script import (
     flocker_standard_options, FlockerScriptRunner, main_for_service)
-from ._protocol import ControlAMPService
+from ._protocol import (
+    ControlAMPService, NODE_CHANGED_COALESCE_WINDOW, NODE_CHANGED_MAX_LATENCY,
+)
 from ..ca import (
     rest_api_context_factory, ControlCredential, amp_server_context_factory,
 )
@@ -44,8 +47,41 @@ class ControlOptions(Options):
          ("Absolute path to directory containing the cluster "
           "root certificate (cluster.crt) and control service certificate "
           "and private key (control-service.crt and control-service.key).")],
+        ["node-state-coalesce-window", None,
+         NODE_CHANGED_COALESCE_WINDOW.total_seconds(),
+         ("Seconds to wait for more node state changes after one is "
+          "received before sending the cluster state to all agents.  "
+          "Use 0 to send it immediately."), float],
+        ["node-state-max-latency", None,
+         NODE_CHANGED_MAX_LATENCY.total_seconds(),
+         ("The most seconds to delay sending the cluster state to all agents "
+          "after a node state change is received, however many more "
+          "changes are received."), float],
+    ]
+
+    optFlags = [
+        ["serialize-in-thread", None,
+         ("Serialize the configuration and state sent to convergence agents "
+          "in a thread, rather than in the thread handling network traffic.")],
+        ["save-in-thread", None,
+         ("Write configuration changes in a thread.  Changes made while a "
+          "write is in progress are written together.")],
+        ["journal-configuration", None,
+         ("Save configuration changes by appending them to a journal, "
+          "rather than rewriting the whole configuration for each change.")],
+        ["configuration-database", None,
+         ("Keep the configuration in a SQLite database, so that each change "
+          "only updates the rows of the datasets it affects.  The existing "
+          "configuration is imported into the database, and is exported "
+          "back when this option is no longer given.")],
     ]
 
+    def postOptions(self):
+        if self["journal-configuration"] and self["configuration-database"]:
+            raise UsageError(
+                "--journal-configuration and --configuration-database can't "
+                "be used together.")
+
 
 class ControlScript(object):
     """
@@ -63,7 +99,14 @@ class ControlScript(object):
 
         top_service = MultiService()
         persistence = ConfigurationPersistenceService(
-            reactor, options["data-path"])
+            reactor, options["data-path"],
+            journal=bool(options["journal-configuration"]),
+            database=bool(options["configuration-database"]),
+            threadpool=(
+                reactor.getThreadPool() if options["save-in-thread"]
+                else None
+            ),
+        )
         persistence.setServiceParent(top_service)
         cluster_state = ClusterStateService(reactor)
         cluster_state.setServiceParent(top_service)
@@ -75,7 +118,16 @@ class ControlScript(object):
         amp_service = ControlAMPService(
             reactor, cluster_state, persistence, serverFromString(
                 reactor, options["agent-port"]),
-            amp_server_context_factory(ca, control_credential))
+            amp_server_context_factory(ca, control_credential),
+            coalesce_window=timedelta(
+                seconds=options["node-state-coalesce-window"]),
+            max_coalesce_latency=timedelta(
+                seconds=options["node-state-max-latency"]),
+            threadpool=(
+                reactor.getThreadPool() if options["serialize-in-thread"]
+                else None
+            ),
+        )
         amp_service.setServiceParent(top_service)
         return main_for_service(reactor, top_service)
 
@@ -0,0 +1,135 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._benchmarks``.
+"""
+
+from ...testtools import TestCase
+from .._benchmarks import (
+    synthetic_cluster, benchmark_wire_format, benchmark_connection_timers,
+    benchmark_node_index, benchmark_migration, synthetic_v1_configuration,
+)
+from .._persistence import (
+    ConfigurationMigration, migrate_configuration, wire_decode,
+    _CONFIG_VERSION,
+)
+
+
+class SyntheticClusterTests(TestCase):
+    """
+    Tests for ``synthetic_cluster``.
+    """
+    def test_datasets(self):
+        """
+        The requested number of datasets are spread across the requested
+        number of nodes, in both the configuration and the state.
+        """
+        configuration, state = synthetic_cluster(datasets=25, nodes=4)
+        self.assertEqual(
+            ([7, 6, 6, 6], [7, 6, 6, 6]),
+            (sorted(len(node.manifestations)
+                    for node in configuration.nodes)[::-1],
+             sorted(len(node.manifestations) for node in state.nodes)[::-1]),
+        )
+
+    def test_matching_state(self):
+        """
+        Every configured dataset is manifest on the node it is configured
+        on.
+        """
+        configuration, state = synthetic_cluster(datasets=25, nodes=4)
+        self.assertEqual(
+            {node.uuid: node.manifestations for node in configuration.nodes},
+            {node.uuid: node.manifestations for node in state.nodes},
+        )
+
+
+class BenchmarkWireFormatTests(TestCase):
+    """
+    Tests for ``benchmark_wire_format``.
+    """
+    def test_results(self):
+        """
+        There is a result for each format and object, and the binary format
+        is smaller than JSON.
+        """
+        results = benchmark_wire_format(datasets=20, nodes=2, repeat=1)
+        sizes = {
+            (result[u"object"], result[u"format"]): result[u"bytes"]
+            for result in results
+        }
+        self.assertEqual(
+            (4, True, True),
+            (len(results),
+             sizes[(u"configuration", u"binary")] <
+             sizes[(u"configuration", u"json")],
+             sizes[(u"state", u"binary")] < sizes[(u"state", u"json")]),
+        )
+
+
+class BenchmarkConnectionTimersTests(TestCase):
+    """
+    Tests for ``benchmark_connection_timers``.
+    """
+    def test_results(self):
+        """
+        Both ways of scheduling timers send the same number of pings, and the
+        timer wheel needs only one delayed call.
+        """
+        results = benchmark_connection_timers(connections=10, seconds=65)
+        self.assertEqual(
+            {u"delayed-calls": (20, 20), u"timer-wheel": (20, 1)},
+            {result[u"strategy"]: (result[u"pings"], result[u"delayed_calls"])
+             for result in results},
+        )
+
+
+class BenchmarkNodeIndexTests(TestCase):
+    """
+    Tests for ``benchmark_node_index``.
+    """
+    def test_results(self):
+        """
+        There is a result for each operation on each of the configuration and
+        the state using each way of finding nodes.
+        """
+        results = benchmark_node_index(nodes=5, operations=3, repeat=1)
+        self.assertEqual(
+            {(obj, operation, strategy)
+             for obj in [u"configuration", u"state"]
+             for operation in [u"get_node", u"update_node"]
+             for strategy in [u"scan", u"index"]},
+            {(result[u"object"], result[u"operation"], result[u"strategy"])
+             for result in results},
+        )
+
+
+class SyntheticV1ConfigurationTests(TestCase):
+    """
+    Tests for ``synthetic_v1_configuration``.
+    """
+    def test_migrates(self):
+        """
+        The version 1 configuration migrates to the synthetic cluster's
+        configuration.
+        """
+        config = migrate_configuration(
+            1, _CONFIG_VERSION, synthetic_v1_configuration(25, 4),
+            ConfigurationMigration)
+        self.assertEqual(
+            synthetic_cluster(25, 4)[0], wire_decode(config).deployment)
+
+
+class BenchmarkMigrationTests(TestCase):
+    """
+    Tests for ``benchmark_migration``.
+    """
+    def test_results(self):
+        """
+        There is a result for each way of migrating.
+        """
+        results = benchmark_migration(datasets=5, nodes=2, repeat=1)
+        self.assertEqual(
+            {u"reserializing", u"single-parse", u"single-parse-file"},
+            {result[u"strategy"] for result in results},
+        )
@@ -0,0 +1,136 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._binary``.
+"""
+
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from pytz import UTC
+
+from hypothesis import given
+
+from twisted.python.filepath import FilePath
+
+from ...testtools import TestCase
+from .._binary import (
+    binary_wire_encode, binary_wire_decode, is_binary_wire_encoded,
+)
+from .._persistence import wire_encode, wire_decode
+from .._diffing import create_diff
+from .._model import NodeState, DeploymentState
+from .test_persistence import DEPLOYMENTS, TEST_DEPLOYMENT
+
+
+class BinaryWireEncodeDecodeTests(TestCase):
+    """
+    Tests for ``binary_wire_encode`` and ``binary_wire_decode``.
+    """
+    def test_encode_to_bytes(self):
+        """
+        ``binary_wire_encode`` converts the given object to ``bytes`` which
+        ``is_binary_wire_encoded`` recognizes.
+        """
+        data = binary_wire_encode(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (bytes, True), (type(data), is_binary_wire_encoded(data)),
+        )
+
+    def test_json_is_not_binary(self):
+        """
+        ``is_binary_wire_encoded`` doesn't recognize the output of
+        ``wire_encode``.
+        """
+        self.assertFalse(is_binary_wire_encoded(wire_encode(TEST_DEPLOYMENT)))
+
+    @given(DEPLOYMENTS)
+    def test_roundtrip(self, deployment):
+        """
+        A range of generated configurations (deployments) can be
+        roundtripped via the binary wire encode/decode.
+        """
+        self.assertEqual(
+            deployment, binary_wire_decode(binary_wire_encode(deployment)),
+        )
+
+    @given(DEPLOYMENTS)
+    def test_same_as_json(self, deployment):
+        """
+        Decoding the binary encoding of an object gives the same result as
+        decoding its JSON encoding.
+        """
+        self.assertEqual(
+            wire_decode(wire_encode(deployment)),
+            binary_wire_decode(binary_wire_encode(deployment)),
+        )
+
+    @given(DEPLOYMENTS)
+    def test_smaller_than_json(self, deployment):
+        """
+        The binary encoding is smaller than the JSON encoding.
+        """
+        self.assertTrue(
+            len(binary_wire_encode(deployment)) <
+            len(wire_encode(deployment))
+        )
+
+    def test_complex_keys(self):
+        """
+        Objects with attributes that are ``PMap``\s with complex keys
+        (i.e. not strings) and unset fields can be roundtripped.
+        """
+        node_state = NodeState(hostname=u'127.0.0.1', uuid=uuid4(),
+                               manifestations={}, paths={},
+                               devices={uuid4(): FilePath(b"/tmp")})
+        self.assertEqual(
+            node_state, binary_wire_decode(binary_wire_encode(node_state)),
+        )
+
+    def test_diff(self):
+        """
+        A ``Diff`` can be roundtripped.
+        """
+        state = DeploymentState(
+            nodes={NodeState(hostname=u'127.0.0.1', uuid=uuid4())},
+        )
+        diff = create_diff(DeploymentState(), state)
+        self.assertEqual(
+            state,
+            binary_wire_decode(binary_wire_encode(diff)).apply(
+                DeploymentState()
+            ),
+        )
+
+    def test_datetime(self):
+        """
+        A datetime with a timezone can be roundtripped (with potential loss of
+        less-than-second resolution).
+        """
+        dt = datetime.now(tz=UTC)
+        self.assertTrue(
+            abs(binary_wire_decode(binary_wire_encode(dt)) - dt) <
+            timedelta(seconds=1)
+        )
+
+    def test_naive_datetime(self):
+        """
+        A naive datetime will fail.
+        """
+        self.assertRaises(ValueError, binary_wire_encode, datetime.now())
+
+    def test_unknown_type(self):
+        """
+        Objects which aren't part of the configuration model can't be
+        encoded.
+        """
+        self.assertRaises(TypeError, binary_wire_encode, object())
+
+    def test_big_integers(self):
+        """
+        Integers too big for msgpack can be roundtripped.
+        """
+        values = [2 ** 64, -2 ** 63 - 1, 2 ** 64 - 1, -2 ** 63]
+        self.assertEqual(
+            values, binary_wire_decode(binary_wire_encode(values)),
+        )
@@ -6,11 +6,14 @@ Tests for ``flocker.control._clusterstate``.
 
 from uuid import uuid4
 
+from eliot.testing import capture_logging
+
 from twisted.python.filepath import FilePath
 from twisted.internet.task import Clock
 
 from .._model import ChangeSource
-from .._clusterstate import ClusterStateService
+from .._clusterstate import ClusterStateService, ResyncRequired
+from .._diffing import create_sequence_diff
 from .. import (
     Application, DockerImage, NodeState, DeploymentState, Manifestation,
     Dataset,
@@ -253,3 +256,232 @@ class ClusterStateServiceTests(TestCase):
             service.as_deployment(),
             DeploymentState(nodes=[self.WITH_APPS]),
         )
+
+    def test_other_source_takes_over(self):
+        """
+        Information replaced by information from another source is not wiped
+        when the first source expires.
+        """
+        service = self.service()
+        first = ChangeSource()
+        second = ChangeSource()
+        first.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_source(first, [self.WITH_APPS])
+
+        advance_some(self.clock)
+        second.set_last_activity(self.clock.seconds())
+        service.apply_changes_from_source(second, [self.WITH_APPS])
+
+        advance_rest(self.clock)
+        before_wipe_state = service.as_deployment()
+        advance_some(self.clock)
+        after_wipe_state = service.as_deployment()
+        self.assertEqual(
+            [before_wipe_state, after_wipe_state],
+            [DeploymentState(nodes=[self.WITH_APPS]), DeploymentState()],
+        )
+
+    def test_unexpired_sources_not_examined(self):
+        """
+        Sources whose information can't have expired yet aren't asked for
+        their last activity when looking for expired information.
+        """
+        service = self.service()
+        sources = []
+        for _ in range(3):
+            source = _CountingChangeSource()
+            source.set_last_activity(self.clock.seconds())
+            service.apply_changes_from_source(source, [
+                NodeState(hostname=u"192.0.2.1", uuid=uuid4()),
+            ])
+            sources.append(source)
+        calls_before = [counted.calls for counted in sources]
+        for _ in range(10):
+            advance_some(self.clock)
+        self.assertEqual(
+            calls_before, [counted.calls for counted in sources],
+        )
+
+    def test_generation_changed(self):
+        """
+        ``ClusterStateService.state_generation`` increases when changes are
+        applied.
+        """
+        service = self.service()
+        before = service.state_generation()
+        service.apply_changes([self.WITH_APPS])
+        self.assertTrue(before < service.state_generation())
+
+    def test_generation_unchanged(self):
+        """
+        ``ClusterStateService.state_generation`` doesn't change when changes
+        which leave the state as it was are applied.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        before = service.state_generation()
+        service.apply_changes([self.WITH_APPS.set(applications=[APP2, APP1])])
+        self.assertEqual(before, service.state_generation())
+
+    def test_generation_expired(self):
+        """
+        ``ClusterStateService.state_generation`` increases when information
+        expires.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        before = service.state_generation()
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        self.assertTrue(before < service.state_generation())
+
+    def test_register_for_callback(self):
+        """
+        Callbacks registered with ``ClusterStateService.register`` are called
+        every time the state changes, including when information expires.
+        """
+        service = self.service()
+        callbacks = []
+        service.register(lambda: callbacks.append(service.state_generation()))
+        service.apply_changes([self.WITH_APPS])
+        advance_rest(self.clock)
+        advance_some(self.clock)
+        self.assertEqual(callbacks, [1, 2])
+
+    def test_register_for_callback_unchanged(self):
+        """
+        Callbacks registered with ``ClusterStateService.register`` aren't
+        called when changes which leave the state as it was are applied.
+        """
+        service = self.service()
+        service.apply_changes([self.WITH_APPS])
+        callbacks = []
+        service.register(lambda: callbacks.append(1))
+        service.apply_changes([self.WITH_APPS.set(applications=[APP2, APP1])])
+        self.assertEqual(callbacks, [])
+
+    @capture_logging(
+        lambda test, logger:
+        test.assertEqual(len(logger.flush_tracebacks(ZeroDivisionError)), 1))
+    def test_register_for_callback_failure(self, logger):
+        """
+        Failed callbacks don't prevent later callbacks from being called, or
+        the changes from being applied.
+        """
+        service = self.service()
+        callbacks = []
+        service.register(lambda: 1/0)
+        service.register(lambda: callbacks.append(1))
+        service.apply_changes([self.WITH_APPS])
+        self.assertEqual(
+            (callbacks, service.as_deployment().get_node(
+                self.WITH_APPS.uuid).applications),
+            ([1], self.WITH_APPS.applications))
+
+
+class _CountingChangeSource(ChangeSource):
+    """
+    A ``ChangeSource`` which counts calls to ``last_activity``.
+    """
+    calls = 0
+
+    def last_activity(self):
+        self.calls += 1
+        return ChangeSource.last_activity(self)
+
+
+class ApplyDiffFromSourceTests(TestCase):
+    """
+    Tests for ``ClusterStateService.apply_diff_from_source``.
+    """
+    NODE_STATE = NodeState(hostname=u"192.0.2.56", uuid=uuid4())
+    CHANGED = NODE_STATE.set(applications=[APP1])
+
+    def setUp(self):
+        super(ApplyDiffFromSourceTests, self).setUp()
+        self.service = ClusterStateService(Clock())
+        self.source = ChangeSource()
+        self.diff = create_sequence_diff([self.NODE_STATE], [self.CHANGED])
+
+    def test_applied(self):
+        """
+        A diff against the last changes from the source is applied to those
+        changes, and the result is applied to the cluster state.
+        """
+        self.service.apply_changes_from_source(
+            self.source, [self.NODE_STATE], 1,
+        )
+        changes = self.service.apply_diff_from_source(
+            self.source, self.diff, 2,
+        )
+        self.assertEqual(
+            ([self.CHANGED], DeploymentState(nodes=[self.CHANGED])),
+            (changes, self.service.as_deployment()),
+        )
+
+    def test_following_diff(self):
+        """
+        Another diff can be applied against the changes resulting from a
+        diff.
+        """
+        self.service.apply_changes_from_source(
+            self.source, [self.NODE_STATE], 1,
+        )
+        self.service.apply_diff_from_source(self.source, self.diff, 2)
+        changed_again = self.CHANGED.set(applications=[APP2])
+        self.service.apply_diff_from_source(
+            self.source,
+            create_sequence_diff([self.CHANGED], [changed_again]), 3,
+        )
+        self.assertEqual(
+            DeploymentState(nodes=[changed_again]),
+            self.service.as_deployment(),
+        )
+
+    def test_unsequenced_changes(self):
+        """
+        ``ResyncRequired`` is raised if the last changes from the source had
+        no sequence number.
+        """
+        self.service.apply_changes_from_source(
+            self.source, [self.NODE_STATE],
+        )
+        self.assertRaises(
+            ResyncRequired,
+            self.service.apply_diff_from_source, self.source, self.diff, 2,
+        )
+
+    def test_other_source(self):
+        """
+        ``ResyncRequired`` is raised if the changes the diff is against came
+        from another source.
+        """
+        self.service.apply_changes_from_source(
+            ChangeSource(), [self.NODE_STATE], 1,
+        )
+        self.assertRaises(
+            ResyncRequired,
+            self.service.apply_diff_from_source, self.source, self.diff, 2,
+        )
+
+    def test_gap(self):
+        """
+        ``ResyncRequired`` is raised if the sequence number shows that changes
+        were missed, and the cluster state is unchanged.  Later diffs also
+        need a resync.
+        """
+        self.service.apply_changes_from_source(
+            self.source, [self.NODE_STATE], 1,
+        )
+        self.assertRaises(
+            ResyncRequired,
+            self.service.apply_diff_from_source, self.source, self.diff, 3,
+        )
+        self.assertRaises(
+            ResyncRequired,
+            self.service.apply_diff_from_source, self.source, self.diff, 2,
+        )
+        self.assertEqual(
+            DeploymentState(nodes=[self.NODE_STATE]),
+            self.service.as_deployment(),
+        )
@@ -0,0 +1,249 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._diffing``.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+from pytz import UTC
+
+from twisted.python.filepath import FilePath
+
+from .._diffing import (
+    create_diff, compose_diffs, create_sequence_diff, apply_sequence_diff,
+)
+from .._persistence import wire_encode, wire_decode
+from .._model import (
+    Deployment, DeploymentState, Node, NodeState, Manifestation, Dataset,
+    Application, DockerImage, Leases, NonManifestDatasets,
+)
+
+from ...testtools import TestCase
+
+DATASET = Dataset(dataset_id=unicode(uuid4()), metadata={u"name": u"db"})
+MANIFESTATION = Manifestation(dataset=DATASET, primary=True)
+APPLICATION = Application(
+    name=u"app", image=DockerImage.from_string(u"postgres"),
+)
+NODE = Node(
+    uuid=uuid4(),
+    applications={APPLICATION},
+    manifestations={DATASET.dataset_id: MANIFESTATION},
+)
+DEPLOYMENT = Deployment(nodes={NODE, Node(uuid=uuid4())})
+
+NODE_STATE = NodeState(
+    uuid=uuid4(), hostname=u"192.0.2.1",
+    applications=[APPLICATION],
+    manifestations={DATASET.dataset_id: MANIFESTATION},
+    paths={DATASET.dataset_id: FilePath(b"/flocker/db")},
+    devices={},
+)
+DEPLOYMENT_STATE = DeploymentState(
+    nodes={NODE_STATE},
+    node_uuid_to_era={NODE_STATE.uuid: uuid4()},
+)
+
+
+class DiffTests(TestCase):
+    """
+    Tests for ``create_diff`` and ``Diff``.
+    """
+    def assert_diff_roundtrips(self, a, b):
+        """
+        The diff from ``a`` to ``b``, applied to ``a``, results in ``b``,
+        including after the diff has been serialized and deserialized.
+
+        :return: The ``Diff`` from ``a`` to ``b``.
+        """
+        diff = create_diff(a, b)
+        self.assertEqual(
+            (b, b),
+            (diff.apply(a), wire_decode(wire_encode(diff)).apply(a)),
+        )
+        return diff
+
+    def test_equal_objects(self):
+        """
+        The diff between two equal objects is empty.
+        """
+        diff = create_diff(DEPLOYMENT, Deployment(nodes=DEPLOYMENT.nodes))
+        self.assertEqual((True, DEPLOYMENT),
+                         (diff.is_empty(), diff.apply(DEPLOYMENT)))
+
+    def test_different_types(self):
+        """
+        An object can be replaced by one of a different type.
+        """
+        self.assert_diff_roundtrips(DEPLOYMENT, DEPLOYMENT_STATE)
+
+    def test_add_node(self):
+        """
+        A diff can add an item to a set.
+        """
+        self.assert_diff_roundtrips(
+            DEPLOYMENT, DEPLOYMENT.update_node(Node(uuid=uuid4())),
+        )
+
+    def test_remove_node(self):
+        """
+        A diff can remove an item from a set.
+        """
+        self.assert_diff_roundtrips(
+            DEPLOYMENT, DEPLOYMENT.set(nodes={NODE}),
+        )
+
+    def test_change_map_value(self):
+        """
+        A diff can change a value in a map nested within a set item.
+        """
+        self.assert_diff_roundtrips(
+            DEPLOYMENT_STATE,
+            DEPLOYMENT_STATE.transform(
+                ["node_uuid_to_era", NODE_STATE.uuid], uuid4(),
+            ),
+        )
+
+    def test_remove_map_key(self):
+        """
+        A diff can remove a key from a map.
+        """
+        self.assert_diff_roundtrips(
+            DEPLOYMENT_STATE, DEPLOYMENT_STATE.set(node_uuid_to_era={}),
+        )
+
+    def test_change_record_field(self):
+        """
+        A diff can change the fields of a ``PRecord``.
+        """
+        self.assert_diff_roundtrips(
+            NODE_STATE,
+            NODE_STATE.set(
+                applications=None, manifestations=None, paths=None,
+                devices=None,
+            ),
+        )
+
+    def test_change_leases(self):
+        """
+        A diff can add entries to a ``CheckedPMap`` keyed by ``UUID``.
+        """
+        leases = Leases().acquire(
+            datetime(2016, 1, 1, tzinfo=UTC), uuid4(), NODE.uuid, expires=60,
+        )
+        self.assert_diff_roundtrips(
+            DEPLOYMENT, DEPLOYMENT.set(leases=leases),
+        )
+
+    def test_nonmanifest_datasets(self):
+        """
+        A diff can set values in a map of datasets.
+        """
+        updated = NonManifestDatasets(
+            datasets={DATASET.dataset_id: DATASET},
+        ).update_cluster_state(DEPLOYMENT_STATE)
+        self.assert_diff_roundtrips(DEPLOYMENT_STATE, updated)
+
+    def test_diff_is_smaller(self):
+        """
+        The diff for a small change to a large object is smaller than the
+        object.
+        """
+        nodes = list(
+            Node(
+                uuid=uuid4(),
+                manifestations={
+                    m.dataset_id: m for m in (
+                        Manifestation(
+                            dataset=Dataset(dataset_id=unicode(uuid4())),
+                            primary=True,
+                        ) for _ in range(10)
+                    )
+                }
+            ) for _ in range(20)
+        )
+        deployment = Deployment(nodes=nodes)
+        diff = self.assert_diff_roundtrips(
+            deployment, deployment.update_node(Node(uuid=uuid4())),
+        )
+        self.assertTrue(
+            len(wire_encode(diff)) * 10 < len(wire_encode(deployment))
+        )
+
+    def test_record_invariants_kept(self):
+        """
+        Several fields of a record with invariants are changed one at a time
+        if none of the intermediate records violates the invariants.
+        """
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        diff = self.assert_diff_roundtrips(
+            NODE_STATE,
+            NODE_STATE.transform(
+                ["manifestations", dataset.dataset_id],
+                Manifestation(dataset=dataset, primary=True),
+                ["paths", dataset.dataset_id], FilePath(b"/flocker/other"),
+            ),
+        )
+        self.assertEqual(2, len(diff.changes))
+
+    def test_compose_diffs(self):
+        """
+        Applying the composition of two diffs is the same as applying each of
+        them in turn.
+        """
+        first = DEPLOYMENT.update_node(Node(uuid=uuid4()))
+        second = first.set(nodes={NODE})
+        composed = compose_diffs([
+            create_diff(DEPLOYMENT, first), create_diff(first, second),
+        ])
+        self.assertEqual(second, composed.apply(DEPLOYMENT))
+
+
+class SequenceDiffTests(TestCase):
+    """
+    Tests for ``create_sequence_diff`` and ``apply_sequence_diff``.
+    """
+    def test_roundtrip(self):
+        """
+        Applying the diff between two sequences to the first gives a list of
+        the items of the second, including after the diff has been
+        serialized and deserialized.
+        """
+        before = (NODE_STATE, NonManifestDatasets())
+        after = (
+            NODE_STATE.set(hostname=u"192.0.2.2"),
+            NonManifestDatasets(datasets={DATASET.dataset_id: DATASET}),
+        )
+        diff = create_sequence_diff(before, after)
+        self.assertEqual(
+            (list(after), list(after)),
+            (apply_sequence_diff(diff, before),
+             apply_sequence_diff(wire_decode(wire_encode(diff)), before)),
+        )
+
+    def test_changed_length(self):
+        """
+        Items can be added to and removed from the sequence.
+        """
+        diffs = [
+            create_sequence_diff([NODE_STATE], [NODE_STATE, NODE]),
+            create_sequence_diff([NODE_STATE, NODE], [NODE]),
+        ]
+        self.assertEqual(
+            ([NODE_STATE, NODE], [NODE]),
+            (apply_sequence_diff(diffs[0], [NODE_STATE]),
+             apply_sequence_diff(diffs[1], [NODE_STATE, NODE])),
+        )
+
+    def test_item_changes_only(self):
+        """
+        The diff only describes the changes within items.
+        """
+        diff = create_sequence_diff(
+            [NODE_STATE], [NODE_STATE.set(hostname=u"192.0.2.2")],
+        )
+        self.assertEqual(
+            [[0, u"hostname"]], [list(change.path) for change in diff.changes],
+        )
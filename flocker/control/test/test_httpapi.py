@@ -14,19 +14,19 @@ from pytz import UTC
 
 from zope.interface.verify import verifyObject
 
-from twisted.internet import reactor
-from twisted.internet.defer import gatherResults
+from twisted.internet.defer import Deferred, gatherResults
+from twisted.internet.error import ConnectionDone
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.test.proto_helpers import MemoryReactor
 from twisted.web.http import (
     CREATED, OK, CONFLICT, BAD_REQUEST, NOT_FOUND,
-    NOT_ALLOWED as METHOD_NOT_ALLOWED, PRECONDITION_FAILED,
+    NOT_ALLOWED as METHOD_NOT_ALLOWED, PRECONDITION_FAILED, NOT_MODIFIED,
 )
 from twisted.web.client import readBody
 from twisted.application.service import IService
 from twisted.python.filepath import FilePath
 from twisted.internet.ssl import ClientContextFactory
-from twisted.internet.task import Clock
+from twisted.internet.task import Clock, LoopingCall
 
 from ...restapi.testtools import (
     buildIntegrationTests, loads, APIAssertionsMixin)
@@ -37,13 +37,15 @@ from .. import (
     RestartAlways, RestartNever, Link, same_node, DeploymentState,
     NonManifestDatasets, Leases, Lease, UpdateNodeStateEra,
 )
+from .. import httpapi
 from ..httpapi import (
     ConfigurationAPIUserV1, create_api_service, datasets_from_deployment,
     api_dataset_from_dataset_and_node, container_configuration_response,
-    IF_MATCHES_HEADER,
+    IF_MATCHES_HEADER, NEXT_CURSOR_HEADER, get_watch_tags,
 )
 from .._persistence import ConfigurationPersistenceService
 from .._clusterstate import ClusterStateService
+from ..testtools import EagerClock
 from .._config import (
     FlockerConfiguration, FigConfiguration, model_from_configuration)
 from .test_config import COMPLEX_APPLICATION_YAML, COMPLEX_DEPLOYMENT_YAML
@@ -67,12 +69,12 @@ class APITestsMixin(APIAssertionsMixin):
         """
         Create initial objects for the ``ConfigurationAPIUserV1``.
         """
+        self.clock = EagerClock()
         self.persistence_service = ConfigurationPersistenceService(
-            reactor, FilePath(self.mktemp()))
+            self.clock, FilePath(self.mktemp()))
         self.persistence_service.startService()
         self.cluster_state_service = ClusterStateService(Clock())
         self.cluster_state_service.startService()
-        self.clock = Clock()
         self.addCleanup(self.cluster_state_service.stopService)
         self.addCleanup(self.persistence_service.stopService)
 
@@ -1939,6 +1941,33 @@ class CreateDatasetTestsMixin(APITestsMixin):
                 IF_MATCHES_HEADER:
                 [self.persistence_service.configuration_hash()]})
 
+    def test_if_matches_after_commit(self):
+        """
+        A tag given while a save is waiting to be committed still matches
+        once it has been.
+        """
+        # Leave the commit scheduled rather than running it straight away:
+        self.patch(self.clock, "callLater",
+                   lambda *args, **kwargs: Clock.callLater(
+                       self.clock, *args, **kwargs))
+        self.persistence_service.save(Deployment(
+            nodes={Node(uuid=self.NODE_A_UUID)}))
+        d = self.assertResponseCode(
+            b"GET", b"/configuration/datasets", None, OK)
+
+        def got_tag(response):
+            self.clock.advance(0)
+            # Commit the creation's save straight away again:
+            del self.clock.callLater
+            return self.assertResponseCode(
+                b"POST", b"/configuration/datasets",
+                {u"primary": self.NODE_A}, CREATED,
+                additional_headers={
+                    IF_MATCHES_HEADER:
+                    response.headers.getRawHeaders(b"X-Configuration-Tag")})
+        d.addCallback(got_tag)
+        return d
+
     def test_if_matches_failure(self):
         """
         If an ``X-If-Configuration-Matches`` header is sent with a
@@ -3275,6 +3304,689 @@ RealTestsNodesStateAPI, MemoryTestsNodesStateAPI = (
                           _build_app))
 
 
+class EntityTagTestsMixin(APITestsMixin):
+    """
+    Tests for ``ETag`` and ``If-None-Match`` support in ``GET`` endpoints.
+    """
+    def get_tag(self, path):
+        """
+        Request a resource.
+
+        :param bytes path: The resource path.
+
+        :return: ``Deferred`` firing with the resource's ``ETag``.
+        """
+        d = self.assertResponseCode(b"GET", path, None, OK)
+        d.addCallback(
+            lambda response: response.headers.getRawHeaders(b"etag")[0])
+        return d
+
+    def assertConditionalResponse(self, path, tag, expected_code):
+        """
+        Assert the response code of a conditional request for a resource.
+
+        :param bytes path: The resource path.
+        :param bytes tag: The value of the ``If-None-Match`` header.
+        :param int expected_code: The response code expected.
+
+        :return: ``Deferred`` firing with the response body.
+        """
+        d = self.assertResponseCode(
+            b"GET", path, None, expected_code, {b"If-None-Match": [tag]})
+        d.addCallback(readBody)
+        return d
+
+    def test_configuration_tag(self):
+        """
+        The ``ETag`` of the dataset configuration is the configuration hash.
+        """
+        d = self.get_tag(b"/configuration/datasets")
+        d.addCallback(
+            self.assertEqual,
+            b'"%s"' % (self.persistence_service.configuration_hash(),),
+        )
+        return d
+
+    def test_not_modified(self):
+        """
+        A request whose ``If-None-Match`` header matches the ``ETag`` gets a
+        ``304 Not Modified`` response with no body.
+        """
+        d = self.get_tag(b"/configuration/datasets")
+        d.addCallback(
+            lambda tag: self.assertConditionalResponse(
+                b"/configuration/datasets", tag, NOT_MODIFIED))
+        d.addCallback(self.assertEqual, b"")
+        return d
+
+    def test_configuration_modified(self):
+        """
+        Once the configuration changes, a request with the old ``ETag`` gets
+        the new configuration.
+        """
+        d = self.get_tag(b"/configuration/containers")
+
+        def got_tag(tag):
+            saving = self.persistence_service.save(Deployment(nodes={
+                Node(uuid=self.NODE_A_UUID),
+            }))
+            saving.addCallback(
+                lambda _: self.assertConditionalResponse(
+                    b"/configuration/containers", tag, OK))
+            return saving
+        d.addCallback(got_tag)
+        return d
+
+    def test_state_not_modified(self):
+        """
+        State endpoints respond with ``304 Not Modified`` while the cluster
+        state is unchanged.
+        """
+        d = self.get_tag(b"/state/nodes")
+        d.addCallback(
+            lambda tag: self.assertConditionalResponse(
+                b"/state/nodes", tag, NOT_MODIFIED))
+        return d
+
+    def test_state_modified(self):
+        """
+        Once the cluster state changes, a request with the old ``ETag`` gets
+        the new state.
+        """
+        d = self.get_tag(b"/state/datasets")
+
+        def got_tag(tag):
+            self.cluster_state_service.apply_changes([
+                NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP),
+            ])
+            return self.assertConditionalResponse(
+                b"/state/datasets", tag, OK)
+        d.addCallback(got_tag)
+        return d
+
+    def test_weak_and_listed(self):
+        """
+        ``If-None-Match`` matches weak tags and lists of tags.
+        """
+        d = self.get_tag(b"/version")
+        d.addCallback(
+            lambda tag: self.assertConditionalResponse(
+                b"/version", b'"other", W/' + tag, NOT_MODIFIED))
+        return d
+
+    def test_no_match(self):
+        """
+        A request whose ``If-None-Match`` header doesn't match the ``ETag``
+        gets the resource.
+        """
+        return self.assertConditionalResponse(
+            b"/state/containers", b'"other"', OK)
+
+
+RealTestsEntityTag, MemoryTestsEntityTag = (
+    buildIntegrationTests(EntityTagTestsMixin, "EntityTag", _build_app))
+
+
+class ResponseCacheTestsMixin(APITestsMixin):
+    """
+    Tests for the caching of responses by ``GET`` endpoints.
+    """
+    def count_calls(self, name):
+        """
+        Count the calls to a function of ``flocker.control.httpapi``.
+
+        :param str name: The name of the function.
+
+        :return: A ``list`` which gets an item for every call.
+        """
+        calls = []
+        original = getattr(httpapi, name)
+
+        def counting(*args, **kwargs):
+            calls.append(None)
+            return original(*args, **kwargs)
+        self.patch(httpapi, name, counting)
+        return calls
+
+    def get(self, path):
+        """
+        Request a resource.
+
+        :param bytes path: The resource path.
+
+        :return: ``Deferred`` firing with the response and its body.
+        """
+        d = self.assertResponseCode(b"GET", path, None, OK)
+        d.addCallback(
+            lambda response: readBody(response).addCallback(
+                lambda body: (response, body)))
+        return d
+
+    def test_rendered_once(self):
+        """
+        A response is only rendered once while the information it depends on
+        is unchanged, and the same response is given each time.
+        """
+        calls = self.count_calls("datasets_from_deployment")
+        d = gatherResults([
+            self.get(b"/configuration/datasets") for _ in range(3)])
+
+        def got_responses(responses):
+            self.assertEqual(
+                (1, 1, [(self.persistence_service.configuration_hash(),)]),
+                (len(calls),
+                 len(set(body for (response, body) in responses)),
+                 list(set(
+                     tuple(response.headers.getRawHeaders(
+                         b"X-Configuration-Tag"))
+                     for (response, body) in responses))),
+            )
+        d.addCallback(got_responses)
+        return d
+
+    def test_configuration_changed(self):
+        """
+        Once the configuration changes the response is rendered again.
+        """
+        d = self.get(b"/configuration/containers")
+        application = Application(
+            name=u"webserver", image=DockerImage.from_string(u"nginx"))
+        d.addCallback(lambda _: self.persistence_service.save(Deployment(
+            nodes={Node(uuid=self.NODE_A_UUID, applications={application})}
+        )))
+        d.addCallback(
+            lambda _: self.assertResult(
+                b"GET", b"/configuration/containers", None, OK,
+                [container_configuration_response(
+                    application, self.NODE_A_UUID)],
+            )
+        )
+        return d
+
+    def test_configuration_committed(self):
+        """
+        Responses given once a save has been committed have the tag of the
+        configuration, as those given while it was waiting to be did.
+        """
+        # Leave the commit scheduled rather than running it straight away:
+        self.patch(self.clock, "callLater",
+                   lambda *args, **kwargs: Clock.callLater(
+                       self.clock, *args, **kwargs))
+        self.persistence_service.save(Deployment(
+            nodes={Node(uuid=self.NODE_A_UUID)}))
+        d = self.get(b"/configuration/datasets")
+
+        def got_pending(_):
+            self.clock.advance(0)
+            return self.get(b"/configuration/datasets")
+        d.addCallback(got_pending)
+
+        def got_committed((response, body)):
+            tag = self.persistence_service.configuration_hash()
+            self.assertEqual(
+                ([tag], [b'"' + tag + b'"']),
+                (response.headers.getRawHeaders(b"X-Configuration-Tag"),
+                 response.headers.getRawHeaders(b"ETag")),
+            )
+        d.addCallback(got_committed)
+        return d
+
+    def test_state_changed(self):
+        """
+        Once the cluster state changes the response is rendered again.
+        """
+        d = self.get(b"/state/nodes")
+
+        def got_response(_):
+            self.cluster_state_service.apply_changes([
+                NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP),
+            ])
+            return self.assertResult(
+                b"GET", b"/state/nodes", None, OK,
+                [{u"host": self.NODE_A_IP, u"uuid": self.NODE_A}],
+            )
+        d.addCallback(got_response)
+        return d
+
+
+RealTestsResponseCache, MemoryTestsResponseCache = (
+    buildIntegrationTests(ResponseCacheTestsMixin, "ResponseCache",
+                          _build_app))
+
+
+class ListingQueryTestsMixin(APITestsMixin):
+    """
+    Tests for the filtering and paging of listings by query arguments.
+    """
+    # In order of their IDs:
+    DATASETS = list(
+        Dataset(dataset_id=dataset_id, metadata=metadata)
+        for (dataset_id, metadata) in zip(
+            sorted(unicode(uuid4()) for _ in range(3)),
+            [{u"name": u"alpha", u"tier": u"gold"},
+             {u"name": u"beta", u"tier": u"gold"},
+             {u"name": u"gamma"}])
+    )
+
+    def save_datasets(self):
+        """
+        Configure the first two of ``DATASETS`` on node A and the third on
+        node B.
+
+        :return: ``Deferred`` firing when the configuration is saved.
+        """
+        def manifestations(datasets):
+            return {
+                dataset.dataset_id: Manifestation(
+                    dataset=dataset, primary=True)
+                for dataset in datasets
+            }
+        return self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID,
+                 manifestations=manifestations(self.DATASETS[:2])),
+            Node(uuid=self.NODE_B_UUID,
+                 manifestations=manifestations(self.DATASETS[2:])),
+        }))
+
+    def expected_configuration(self, *indexes):
+        """
+        :param indexes: Indexes of ``DATASETS``.
+        :return: The API representation of the datasets' configuration.
+        """
+        return [
+            api_dataset_from_dataset_and_node(
+                self.DATASETS[index],
+                self.NODE_A_UUID if index < 2 else self.NODE_B_UUID)
+            for index in indexes
+        ]
+
+    def assertPage(self, path, expected_result, expected_cursor):
+        """
+        Assert a page of a listing and its ``X-Next-Cursor`` header.
+
+        :param bytes path: The path of the page.
+        :param list expected_result: The items expected on the page.
+        :param expected_cursor: The ``bytes`` expected as the next cursor,
+            or ``None`` if there should be no more pages.
+
+        :return: ``Deferred`` firing when the assertion is done.
+        """
+        d = self.assertResponseCode(b"GET", path, None, OK)
+
+        def got_response(response):
+            self.assertEqual(
+                expected_cursor,
+                response.headers.getRawHeaders(
+                    NEXT_CURSOR_HEADER, [None])[0])
+            return readBody(response).addCallback(loads)
+        d.addCallback(got_response)
+        d.addCallback(self.assertEqual, expected_result)
+        return d
+
+    def test_dataset_id(self):
+        """
+        Only the dataset given by the ``dataset_id`` argument is listed.
+        """
+        d = self.save_datasets()
+        d.addCallback(lambda _: self.assertResult(
+            b"GET",
+            b"/configuration/datasets?dataset_id=" +
+            self.DATASETS[1].dataset_id.encode("ascii"),
+            None, OK, self.expected_configuration(1)))
+        return d
+
+    def test_primary(self):
+        """
+        Only the datasets on the node given by the ``primary`` argument are
+        listed.
+        """
+        d = self.save_datasets()
+        d.addCallback(lambda _: self.assertResult(
+            b"GET",
+            b"/configuration/datasets?primary=" + self.NODE_B.encode("ascii"),
+            None, OK, self.expected_configuration(2)))
+        return d
+
+    def test_metadata(self):
+        """
+        Only the datasets whose metadata includes every ``key=value`` given
+        by ``metadata`` arguments are listed.
+        """
+        d = self.save_datasets()
+        d.addCallback(lambda _: self.assertResultItems(
+            b"GET", b"/configuration/datasets?metadata=tier%3Dgold",
+            None, OK, self.expected_configuration(0, 1)))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET",
+            b"/configuration/datasets?metadata=tier%3Dgold"
+            b"&metadata=name%3Dbeta",
+            None, OK, self.expected_configuration(1)))
+        return d
+
+    def test_filtered_after_unfiltered(self):
+        """
+        A filtered listing isn't answered with the cached unfiltered
+        listing.
+        """
+        d = self.save_datasets()
+        d.addCallback(lambda _: self.assertResultItems(
+            b"GET", b"/configuration/datasets", None, OK,
+            self.expected_configuration(0, 1, 2)))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/configuration/datasets?metadata=name%3Dgamma", None,
+            OK, self.expected_configuration(2)))
+        return d
+
+    def test_pages(self):
+        """
+        Given a ``limit``, datasets are listed in order of their IDs and the
+        ``X-Next-Cursor`` header gives the ``cursor`` of the next page.
+        """
+        cursor = self.DATASETS[1].dataset_id.encode("ascii")
+        d = self.save_datasets()
+        d.addCallback(lambda _: self.assertPage(
+            b"/configuration/datasets?limit=2",
+            self.expected_configuration(0, 1), cursor))
+        d.addCallback(lambda _: self.assertPage(
+            b"/configuration/datasets?limit=2&cursor=" + cursor,
+            self.expected_configuration(2), None))
+        return d
+
+    def test_page_converted(self):
+        """
+        Only the datasets on the requested page are converted to their API
+        representation.
+        """
+        converted = []
+        original = httpapi.api_dataset_from_dataset_and_node
+
+        def convert(dataset, node_uuid):
+            converted.append(dataset)
+            return original(dataset, node_uuid)
+        d = self.save_datasets()
+        d.addCallback(lambda _: self.patch(
+            httpapi, "api_dataset_from_dataset_and_node", convert))
+        d.addCallback(lambda _: self.assertPage(
+            b"/configuration/datasets?limit=1",
+            self.expected_configuration(0),
+            self.DATASETS[0].dataset_id.encode("ascii")))
+        d.addCallback(
+            lambda _: self.assertEqual([self.DATASETS[0]], converted))
+        return d
+
+    def test_dataset_id_primary(self):
+        """
+        Given both ``dataset_id`` and ``primary`` arguments, the dataset is
+        only listed if it is on the given node.
+        """
+        path = (b"/configuration/datasets?dataset_id=" +
+                self.DATASETS[2].dataset_id.encode("ascii") + b"&primary=")
+        d = self.save_datasets()
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", path + self.NODE_A.encode("ascii"), None, OK, []))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", path + self.NODE_B.encode("ascii"), None, OK,
+            self.expected_configuration(2)))
+        return d
+
+    def test_state(self):
+        """
+        The dataset state can be filtered by ``dataset_id`` and ``primary``,
+        and paged.
+        """
+        dataset = self.DATASETS[0]
+        nonmanifest = self.DATASETS[1]
+        self.cluster_state_service.apply_changes([
+            NodeState(
+                uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP,
+                manifestations={dataset.dataset_id: Manifestation(
+                    dataset=dataset, primary=True)},
+                paths={dataset.dataset_id: FilePath(b"/path/dataset")},
+                devices={},
+            ),
+            NonManifestDatasets(datasets={
+                nonmanifest.dataset_id: nonmanifest}),
+        ])
+        manifest_dict = dict(
+            dataset_id=dataset.dataset_id, primary=self.NODE_A,
+            path=u"/path/dataset")
+        nonmanifest_dict = dict(dataset_id=nonmanifest.dataset_id)
+        d = self.assertResult(
+            b"GET", b"/state/datasets?dataset_id=" +
+            nonmanifest.dataset_id.encode("ascii"),
+            None, OK, [nonmanifest_dict])
+        d.addCallback(lambda _: self.assertResult(
+            b"GET", b"/state/datasets?primary=" + self.NODE_A.encode("ascii"),
+            None, OK, [manifest_dict]))
+        d.addCallback(lambda _: self.assertPage(
+            b"/state/datasets?limit=1", [manifest_dict],
+            dataset.dataset_id.encode("ascii")))
+        return d
+
+    def test_containers(self):
+        """
+        The container configuration can be filtered by ``node_uuid``, and
+        paged in order of container names.
+        """
+        applications = [
+            Application(name=name, image=DockerImage.from_string(u"nginx"))
+            for name in [u"app-a", u"app-b", u"app-c"]
+        ]
+        d = self.persistence_service.save(Deployment(nodes={
+            Node(uuid=self.NODE_A_UUID, applications=applications[:2]),
+            Node(uuid=self.NODE_B_UUID, applications=applications[2:]),
+        }))
+        d.addCallback(lambda _: self.assertResult(
+            b"GET",
+            b"/configuration/containers?node_uuid=" +
+            self.NODE_B.encode("ascii"),
+            None, OK, [container_configuration_response(
+                applications[2], self.NODE_B_UUID)]))
+        d.addCallback(lambda _: self.assertPage(
+            b"/configuration/containers?limit=2&cursor=app-a",
+            [container_configuration_response(
+                applications[1], self.NODE_A_UUID),
+             container_configuration_response(
+                 applications[2], self.NODE_B_UUID)],
+            None))
+        return d
+
+    def test_invalid(self):
+        """
+        Unknown, repeated or malformed query arguments get a
+        ``400 Bad Request`` response.
+        """
+        return gatherResults([
+            self.assertResponseCode(b"GET", path, None, BAD_REQUEST)
+            for path in [
+                b"/configuration/datasets?unknown=1",
+                b"/configuration/datasets?primary=1&primary=2",
+                b"/configuration/datasets?primary=node",
+                b"/configuration/datasets?metadata=name",
+                b"/configuration/datasets?limit=0",
+                b"/configuration/containers?limit=many",
+                b"/state/datasets?metadata=name%3Dalpha",
+            ]
+        ])
+
+
+RealTestsListingQuery, MemoryTestsListingQuery = (
+    buildIntegrationTests(ListingQueryTestsMixin, "ListingQuery", _build_app))
+
+
+class BatchTestsMixin(APITestsMixin):
+    """
+    Tests for the batch configuration endpoint at ``/configuration/batch``.
+    """
+    def apply_batch(self, operations, expected_results, committed=True,
+                    atomic=None, additional_headers=pmap()):
+        """
+        Apply a batch and assert its results.
+
+        :param list operations: The operations of the batch.
+        :param list expected_results: The ``(code, result)`` expected for
+            each operation.
+        :param bool committed: Whether the batch is expected to be saved.
+        :param atomic: The ``atomic`` argument of the batch, or ``None`` to
+            leave it out.
+        :param additional_headers: Additional HTTP headers to send.
+
+        :return: ``Deferred`` firing when the assertion is done.
+        """
+        body = {u"operations": operations}
+        if atomic is not None:
+            body[u"atomic"] = atomic
+        return self.assertResult(
+            b"POST", b"/configuration/batch", body, OK,
+            {u"committed": committed,
+             u"results": [{u"code": code, u"result": result}
+                          for (code, result) in expected_results]},
+            additional_headers)
+
+    def test_create_many(self):
+        """
+        Datasets created by a batch are all saved with a single change to
+        the configuration.
+        """
+        dataset_ids = [unicode(uuid4()) for _ in range(3)]
+        generation = self.persistence_service.configuration_generation()
+        expected = [
+            api_dataset_from_dataset_and_node(
+                Dataset(dataset_id=dataset_id), self.NODE_A_UUID)
+            for dataset_id in dataset_ids
+        ]
+        d = self.apply_batch(
+            [{u"operation": u"create_dataset", u"primary": self.NODE_A,
+              u"dataset_id": dataset_id} for dataset_id in dataset_ids],
+            [(CREATED, dataset) for dataset in expected])
+        d.addCallback(lambda _: self.assertEqual(
+            (generation + 1, sorted(expected)),
+            (self.persistence_service.configuration_generation(),
+             sorted(datasets_from_deployment(
+                 self.persistence_service.get())))))
+        return d
+
+    def test_sequential(self):
+        """
+        Each operation applies to the configuration changed by the previous
+        ones.
+        """
+        dataset_id = unicode(uuid4())
+        dataset = Dataset(dataset_id=dataset_id)
+        resized = dataset.set(maximum_size=1024 * 1024 * 1024)
+        lease = {u"dataset_id": dataset_id, u"node_uuid": self.NODE_B,
+                 u"expires": None}
+        d = self.apply_batch(
+            [{u"operation": u"create_dataset", u"primary": self.NODE_A,
+              u"dataset_id": dataset_id},
+             {u"operation": u"move_dataset", u"primary": self.NODE_B,
+              u"dataset_id": dataset_id},
+             {u"operation": u"resize_dataset", u"dataset_id": dataset_id,
+              u"maximum_size": resized.maximum_size},
+             dict(lease, operation=u"acquire_lease"),
+             {u"operation": u"release_lease", u"dataset_id": dataset_id},
+             {u"operation": u"delete_dataset", u"dataset_id": dataset_id}],
+            [(CREATED,
+              api_dataset_from_dataset_and_node(dataset, self.NODE_A_UUID)),
+             (OK,
+              api_dataset_from_dataset_and_node(dataset, self.NODE_B_UUID)),
+             (OK,
+              api_dataset_from_dataset_and_node(resized, self.NODE_B_UUID)),
+             (CREATED, lease),
+             (OK, lease),
+             (OK, api_dataset_from_dataset_and_node(
+                 resized.set(deleted=True), self.NODE_B_UUID))])
+        d.addCallback(lambda _: self.assertEqual(
+            [api_dataset_from_dataset_and_node(
+                resized.set(deleted=True), self.NODE_B_UUID)],
+            list(datasets_from_deployment(self.persistence_service.get()))))
+        return d
+
+    def test_failures(self):
+        """
+        Operations which fail get the error their endpoint would have given,
+        without preventing the other operations from being saved.
+        """
+        dataset_id = unicode(uuid4())
+        expected = api_dataset_from_dataset_and_node(
+            Dataset(dataset_id=dataset_id), self.NODE_A_UUID)
+        d = self.apply_batch(
+            [{u"operation": u"create_dataset", u"primary": self.NODE_A,
+              u"dataset_id": dataset_id},
+             {u"operation": u"create_dataset", u"primary": self.NODE_B,
+              u"dataset_id": dataset_id},
+             {u"operation": u"delete_dataset",
+              u"dataset_id": unicode(uuid4())},
+             {u"operation": u"release_lease", u"dataset_id": dataset_id},
+             {u"operation": u"move_dataset", u"dataset_id": dataset_id},
+             {u"operation": u"delete_dataset", u"dataset_id": dataset_id,
+              u"primary": self.NODE_B}],
+            [(CREATED, expected),
+             (CONFLICT, {u"description":
+                         u"The provided dataset_id is already in use."}),
+             (NOT_FOUND, {u"description": u"Dataset not found."}),
+             (NOT_FOUND, {u"description": u"Lease not found."}),
+             (BAD_REQUEST, {u"description":
+                            u"move_dataset requires primary."}),
+             (BAD_REQUEST, {u"description":
+                            u"delete_dataset doesn't take primary."})])
+        d.addCallback(lambda _: self.assertEqual(
+            [expected],
+            list(datasets_from_deployment(self.persistence_service.get()))))
+        return d
+
+    def test_atomic_failure(self):
+        """
+        If an operation of an atomic batch fails, none of the changes are
+        saved.
+        """
+        dataset_id = unicode(uuid4())
+        generation = self.persistence_service.configuration_generation()
+        d = self.apply_batch(
+            [{u"operation": u"create_dataset", u"primary": self.NODE_A,
+              u"dataset_id": dataset_id},
+             {u"operation": u"delete_dataset",
+              u"dataset_id": unicode(uuid4())}],
+            [(CREATED, api_dataset_from_dataset_and_node(
+                Dataset(dataset_id=dataset_id), self.NODE_A_UUID)),
+             (NOT_FOUND, {u"description": u"Dataset not found."})],
+            committed=False, atomic=True)
+        d.addCallback(lambda _: self.assertEqual(
+            generation, self.persistence_service.configuration_generation()))
+        return d
+
+    def test_atomic_success(self):
+        """
+        An atomic batch whose operations all succeed is saved.
+        """
+        dataset_id = unicode(uuid4())
+        expected = api_dataset_from_dataset_and_node(
+            Dataset(dataset_id=dataset_id), self.NODE_A_UUID)
+        d = self.apply_batch(
+            [{u"operation": u"create_dataset", u"primary": self.NODE_A,
+              u"dataset_id": dataset_id}],
+            [(CREATED, expected)], atomic=True)
+        d.addCallback(lambda _: self.assertEqual(
+            [expected],
+            list(datasets_from_deployment(self.persistence_service.get()))))
+        return d
+
+    def test_configuration_changed(self):
+        """
+        A batch with a ``X-If-Configuration-Matches`` header that doesn't
+        match the configuration is refused.
+        """
+        return self.assertResponseCode(
+            b"POST", b"/configuration/batch",
+            {u"operations": [{u"operation": u"create_dataset",
+                              u"primary": self.NODE_A}]},
+            PRECONDITION_FAILED, {IF_MATCHES_HEADER: [b"willnotmatch"]})
+
+
+RealTestsBatch, MemoryTestsBatch = (
+    buildIntegrationTests(BatchTestsMixin, "Batch", _build_app))
+
+
 class ConfigurationComposeTestsMixin(APITestsMixin):
     """
     Tests for the container configuration endpoint at
@@ -3642,3 +4354,202 @@ class NodeByEraTestsMixin(APITestsMixin):
 
 RealNodeByEra, MemoryRealByEra = buildIntegrationTests(
     NodeByEraTestsMixin, "NodeByEra", _build_app)
+
+
+class WatchTestsMixin(APITestsMixin):
+    """
+    Tests for the watch endpoint at ``/watch``.
+    """
+    def watch(self, tags=None, timeout=None):
+        """
+        Request ``/watch``.
+
+        :param dict tags: Tags to give as query arguments, if any.
+        :param timeout: If not ``None``, the timeout to give as a query
+            argument.
+
+        :return: ``Deferred`` firing with the decoded response.
+        """
+        arguments = [
+            (name.encode("utf-8"), tag.encode("utf-8"))
+            for (name, tag) in sorted((tags or {}).items())
+        ]
+        if timeout is not None:
+            arguments.append((b"timeout", bytes(timeout)))
+        path = b"/watch"
+        if arguments:
+            path += b"?" + b"&".join(b"=".join(pair) for pair in arguments)
+        d = self.assertResponseCode(b"GET", path, None, OK)
+        d.addCallback(readBody)
+        d.addCallback(loads)
+        return d
+
+    def watch_after_change(self, change):
+        """
+        Wait for a change with the current tags, then make a change.
+
+        :param change: Callable making a change.
+
+        :return: ``Deferred`` firing with a tuple of the tags before the
+            change and the tags the wait finished with.
+        """
+        d = self.watch()
+
+        def got_tags(tags):
+            waiting = self.watch(tags)
+            change()
+            waiting.addCallback(lambda changed: (tags, changed))
+            return waiting
+        d.addCallback(got_tags)
+        return d
+
+    def test_current_tags(self):
+        """
+        Without any tags ``/watch`` immediately returns the tags of the
+        current configuration and cluster state.
+        """
+        d = gatherResults([self.watch(), self.watch()])
+
+        def got_tags((first, second)):
+            self.assertEqual(
+                (first, sorted(first)), (second, [u"configuration", u"state"]))
+        d.addCallback(got_tags)
+        return d
+
+    def test_out_of_date_tag(self):
+        """
+        If a given tag doesn't match the current one ``/watch`` immediately
+        returns the current tags.
+        """
+        d = self.watch()
+
+        def got_tags(tags):
+            out_of_date = tags.copy()
+            out_of_date[u"configuration"] = u"out-of-date"
+            result = self.watch(out_of_date)
+            result.addCallback(self.assertEqual, tags)
+            return result
+        d.addCallback(got_tags)
+        return d
+
+    def test_configuration_changed(self):
+        """
+        ``/watch`` returns a new configuration tag once the configuration
+        changes.
+        """
+        d = self.watch_after_change(
+            lambda: self.persistence_service.save(
+                Deployment(nodes={Node(uuid=self.NODE_A_UUID)})))
+
+        def changed((tags, new_tags)):
+            self.assertEqual(
+                (new_tags[u"state"],
+                 new_tags[u"configuration"] != tags[u"configuration"]),
+                (tags[u"state"], True))
+        d.addCallback(changed)
+        return d
+
+    def test_state_changed(self):
+        """
+        ``/watch`` returns a new state tag once the cluster state changes.
+        """
+        d = self.watch_after_change(
+            lambda: self.cluster_state_service.apply_changes([
+                NodeState(uuid=self.NODE_A_UUID, hostname=self.NODE_A_IP)]))
+
+        def changed((tags, new_tags)):
+            self.assertEqual(
+                (new_tags[u"configuration"],
+                 new_tags[u"state"] != tags[u"state"]),
+                (tags[u"configuration"], True))
+        d.addCallback(changed)
+        return d
+
+    def test_timeout(self):
+        """
+        If nothing changes within the timeout ``/watch`` returns the
+        unchanged tags.
+        """
+        d = self.watch()
+
+        def got_tags(tags):
+            result = self.watch(tags, timeout=5)
+            result.addCallback(self.assertEqual, tags)
+            # The request may take a while to reach the API, so keep
+            # advancing its clock until there is a response:
+            advancing = LoopingCall(self.clock.advance, 1)
+            advancing.start(0.01)
+
+            def stop(passthrough):
+                advancing.stop()
+                return passthrough
+            return result.addBoth(stop)
+        d.addCallback(got_tags)
+        return d
+
+    def test_zero_timeout(self):
+        """
+        With a timeout of zero ``/watch`` immediately returns the unchanged
+        tags.
+        """
+        d = self.watch()
+        d.addCallback(
+            lambda tags: self.watch(tags, timeout=0).addCallback(
+                self.assertEqual, tags))
+        return d
+
+    def test_invalid_timeout(self):
+        """
+        A timeout which isn't a number of seconds up to
+        ``MAXIMUM_WATCH_TIMEOUT`` is rejected.
+        """
+        description = (
+            u"timeout must be a number of seconds between 0 and {}.".format(
+                httpapi.MAXIMUM_WATCH_TIMEOUT))
+        return gatherResults([
+            self.assertResult(
+                b"GET", b"/watch?timeout=" + timeout, None, BAD_REQUEST,
+                {u"description": description})
+            for timeout in [b"soon", b"-1",
+                            bytes(httpapi.MAXIMUM_WATCH_TIMEOUT + 1)]
+        ])
+
+    def test_unknown_argument(self):
+        """
+        Unknown query arguments are rejected.
+        """
+        return self.assertResult(
+            b"GET", b"/watch?containers=abc", None, BAD_REQUEST,
+            {u"description": u"Unknown query argument: containers."})
+
+
+RealTestsWatch, MemoryTestsWatch = buildIntegrationTests(
+    WatchTestsMixin, "Watch", _build_app)
+
+
+class WaitForChangeTests(TestCase):
+    """
+    Tests for ``ConfigurationAPIUserV1._wait_for_change``.
+    """
+    def test_abandoned(self):
+        """
+        If the client goes away while waiting, the wait stops watching for
+        changes and its timeout is cancelled.
+        """
+        clock = Clock()
+        persistence_service = ConfigurationPersistenceService(
+            EagerClock(), FilePath(self.mktemp()))
+        persistence_service.startService()
+        self.addCleanup(persistence_service.stopService)
+        cluster_state_service = ClusterStateService(Clock())
+        cluster_state_service.startService()
+        self.addCleanup(cluster_state_service.stopService)
+        api = ConfigurationAPIUserV1(
+            persistence_service, cluster_state_service, clock)
+        finished = Deferred()
+        waiting = api._wait_for_change(get_watch_tags(api), 30, finished)
+        finished.errback(ConnectionDone())
+        persistence_service.save(Deployment(nodes={Node(uuid=uuid4())}))
+        self.assertNoResult(waiting)
+        self.assertEqual(
+            (set(), []), (api._watchers, clock.getDelayedCalls()))
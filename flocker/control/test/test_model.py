@@ -10,7 +10,7 @@ from uuid import uuid4, UUID
 
 from pyrsistent import (
     InvariantException, pset, PClass, PSet, pmap, PMap, thaw, PVector,
-    pvector, PRecord
+    pvector, PRecord, field, discard,
 )
 
 from twisted.python.filepath import FilePath
@@ -21,7 +21,11 @@ from hypothesis.strategies import sampled_from
 from zope.interface.verify import verifyObject
 
 from ...testtools import make_with_init_tests, TestCase
-from .._model import pset_field, pmap_field, pvector_field, ip_to_uuid
+from .._model import (
+    pset_field, pmap_field, pvector_field, ip_to_uuid, _IdentityMemo,
+    _node_index, _node_indexes, _dataset_index, _dataset_indexes,
+    _index_datasets,
+)
 
 from .. import (
     IClusterStateChange, IClusterStateWipe,
@@ -503,6 +507,316 @@ class GetNodeTests(TestCase):
         )
 
 
+class IdentityMemoTests(TestCase):
+    """
+    Tests for ``_IdentityMemo``.
+    """
+    def setUp(self):
+        super(IdentityMemoTests, self).setUp()
+        self.calls = []
+        self.uuid = uuid4()
+
+        def function(obj):
+            self.calls.append(obj)
+            return obj.uuid
+        self.memo = _IdentityMemo(function)
+
+    def test_memoized(self):
+        """
+        The function is only called once for the same object.
+        """
+        node = Node(uuid=self.uuid)
+        results = [self.memo(node), self.memo(node)]
+        self.assertEqual(
+            ([self.uuid, self.uuid], [node]), (results, self.calls),
+        )
+
+    def test_equal_objects(self):
+        """
+        The function is called again for an object which is equal to, but
+        not the same as, one it was called with.
+        """
+        self.memo(Node(uuid=self.uuid))
+        self.memo(Node(uuid=self.uuid))
+        self.assertEqual(2, len(self.calls))
+
+    def test_garbage_collected(self):
+        """
+        Results are discarded when their argument is garbage collected.
+        """
+        node = Node(uuid=self.uuid)
+        self.memo(node)
+        del self.calls[:]
+        before = len(self.memo)
+        del node
+        self.assertEqual((1, 0), (before, len(self.memo)))
+
+    def test_remember(self):
+        """
+        The function isn't called for an object whose result was recorded
+        using ``remember``.
+        """
+        node = Node(uuid=self.uuid)
+        self.memo.remember(node, u"remembered")
+        self.assertEqual((u"remembered", []), (self.memo(node), self.calls))
+
+    def test_get(self):
+        """
+        ``_IdentityMemo.get`` returns the result for an object if it is known,
+        without calling the function, and the default otherwise.
+        """
+        node = Node(uuid=self.uuid)
+        before = self.memo.get(node, u"default")
+        self.memo(node)
+        self.assertEqual(
+            (u"default", self.uuid, [node]),
+            (before, self.memo.get(node), self.calls),
+        )
+
+
+class NodeIndexTests(TestCase):
+    """
+    Tests for the UUID to node index used by ``Deployment`` and
+    ``DeploymentState``.
+    """
+    def setUp(self):
+        super(NodeIndexTests, self).setUp()
+        self.calls = []
+        index_nodes = _node_indexes._function
+
+        def counting(nodes):
+            self.calls.append(nodes)
+            return index_nodes(nodes)
+        self.patch(_node_indexes, "_function", counting)
+
+    def test_derived(self):
+        """
+        The index of a ``DeploymentState`` created by updating or removing
+        a node is derived from the original index rather than rebuilt, and
+        matches the nodes.
+        """
+        nodes = [NodeState(uuid=uuid4(), hostname=u"192.0.2.{}".format(i))
+                 for i in range(3)]
+        state = DeploymentState(nodes=nodes)
+        state.get_node(nodes[0].uuid)
+        updated = state.update_node(
+            nodes[1].set(applications=[APP1])
+        ).remove_node(nodes[2].uuid)
+        results = [updated.get_node(node.uuid, hostname=u"192.0.2.99")
+                   for node in nodes]
+        self.assertEqual(
+            ([state.nodes],
+             [nodes[0], nodes[1].set(applications=[APP1]),
+              NodeState(uuid=nodes[2].uuid, hostname=u"192.0.2.99")],
+             {node.uuid: node for node in updated.nodes}),
+            (self.calls, results, dict(_node_index(updated))),
+        )
+
+    def test_unchanged(self):
+        """
+        Updating a node with the node which is already there returns the same
+        ``Deployment``.
+        """
+        node = Node(uuid=uuid4())
+        deployment = Deployment(nodes=[node])
+        self.assertIs(deployment, deployment.update_node(node))
+
+    def test_deployment_derived(self):
+        """
+        The index of a ``Deployment`` created by ``Deployment.update_node`` is
+        derived from the original index rather than rebuilt.
+        """
+        node = Node(uuid=uuid4())
+        deployment = Deployment(nodes=[node, Node(uuid=uuid4())])
+        updated = deployment.update_node(node.set(applications=[APP1]))
+        self.assertEqual(
+            ([deployment.nodes], node.set(applications=[APP1])),
+            (self.calls, updated.get_node(node.uuid)),
+        )
+
+    def test_duplicate_uuids(self):
+        """
+        ``Deployment.update_node`` replaces every node with the same UUID as
+        the update, and the index of the result matches its nodes.
+        """
+        uuid = uuid4()
+        other = Node(uuid=uuid4())
+        deployment = Deployment(nodes=[
+            Node(uuid=uuid), Node(uuid=uuid, applications=[APP1]), other])
+        update = Node(uuid=uuid, applications=[APP2])
+        updated = deployment.update_node(update)
+        self.assertEqual(
+            ({update, other}, {uuid: update, other.uuid: other}),
+            (set(updated.nodes), dict(_node_index(updated))),
+        )
+
+    def test_other_changes(self):
+        """
+        Changing something other than the nodes of a ``Deployment`` keeps
+        the index of the original.
+        """
+        node = Node(uuid=uuid4())
+        deployment = Deployment(nodes=[node])
+        deployment.get_node(node.uuid)
+        updated = deployment.set(leases=deployment.leases.acquire(
+            datetime.datetime.now(), uuid4(), node.uuid))
+        self.assertEqual(
+            ([deployment.nodes], node),
+            (self.calls, updated.get_node(node.uuid)),
+        )
+
+
+class CachedHashTests(TestCase):
+    """
+    Tests for the cached hashes and equality of ``Node``, ``NodeState``,
+    ``Deployment`` and ``DeploymentState``.
+    """
+    def test_equal(self):
+        """
+        Equal deployments created separately have the same hash and are
+        equal.
+        """
+        uuid = uuid4()
+        deployments = [
+            Deployment(nodes={Node(uuid=uuid, applications={APP1})})
+            for _ in range(2)
+        ]
+        self.assertEqual(
+            (hash(deployments[0]), True, False),
+            (hash(deployments[1]), deployments[0] == deployments[1],
+             deployments[0] != deployments[1]),
+        )
+
+    def test_not_equal(self):
+        """
+        Node states which only differ deep inside are not equal.
+        """
+        uuid = uuid4()
+        states = [
+            NodeState(uuid=uuid, hostname=u"192.0.2.1",
+                      manifestations={MANIFESTATION.dataset_id: manifestation},
+                      devices={}, paths={})
+            for manifestation in [MANIFESTATION,
+                                  MANIFESTATION.set(primary=False)]
+        ]
+        self.assertEqual(
+            (False, True), (states[0] == states[1], states[0] != states[1]),
+        )
+
+    def test_other_types(self):
+        """
+        A ``Node`` is not equal to objects of other types.
+        """
+        self.assertEqual(
+            (False, True), (Node(uuid=uuid4()) == 1, Node(uuid=uuid4()) != 1),
+        )
+
+
+class DatasetIndexTests(TestCase):
+    """
+    Tests for ``Deployment.get_dataset_manifestations`` and the dataset ID
+    index it uses.
+    """
+    def setUp(self):
+        super(DatasetIndexTests, self).setUp()
+        self.replica = MANIFESTATION.set(primary=False)
+        self.node = Node(
+            uuid=uuid4(),
+            manifestations={MANIFESTATION.dataset_id: MANIFESTATION},
+        )
+        self.other_node = Node(
+            uuid=uuid4(),
+            manifestations={MANIFESTATION.dataset_id: self.replica},
+        )
+        self.deployment = Deployment(nodes={self.node, self.other_node})
+
+    def test_manifestations(self):
+        """
+        ``get_dataset_manifestations`` maps the UUID of every node a dataset
+        is manifest on to its manifestation there.
+        """
+        self.assertEqual(
+            {self.node.uuid: MANIFESTATION,
+             self.other_node.uuid: self.replica},
+            self.deployment.get_dataset_manifestations(
+                MANIFESTATION.dataset_id),
+        )
+
+    def test_unknown_dataset(self):
+        """
+        ``get_dataset_manifestations`` returns an empty map for a dataset
+        with no manifestations.
+        """
+        self.assertEqual(
+            {}, self.deployment.get_dataset_manifestations(unicode(uuid4())),
+        )
+
+    def test_derived(self):
+        """
+        The index of a ``Deployment`` created by replacing a node is derived
+        from the original index, if there is one, and matches the nodes.
+        """
+        calls = []
+        index_datasets = _dataset_indexes._function
+
+        def counting(nodes):
+            calls.append(nodes)
+            return index_datasets(nodes)
+        self.patch(_dataset_indexes, "_function", counting)
+
+        dataset = Dataset(dataset_id=unicode(uuid4()))
+        self.deployment.get_dataset_manifestations(dataset.dataset_id)
+        updated = self.deployment.update_node(
+            self.node.transform(
+                ["manifestations", MANIFESTATION.dataset_id], discard,
+                ["manifestations", dataset.dataset_id],
+                Manifestation(dataset=dataset, primary=True),
+            )
+        ).update_node(
+            self.other_node.transform(
+                ["manifestations", MANIFESTATION.dataset_id, "primary"], True,
+            )
+        )
+        self.assertEqual(
+            ([self.deployment.nodes], _index_datasets(updated.nodes)),
+            (calls, _dataset_index(updated)),
+        )
+
+    def test_other_changes(self):
+        """
+        Changing something other than the nodes of a ``Deployment``, e.g.
+        its leases, keeps the index of the original.
+        """
+        calls = []
+        index_datasets = _dataset_indexes._function
+
+        def counting(nodes):
+            calls.append(nodes)
+            return index_datasets(nodes)
+        self.patch(_dataset_indexes, "_function", counting)
+
+        self.deployment.get_dataset_manifestations(MANIFESTATION.dataset_id)
+        updated = self.deployment.set(
+            leases=self.deployment.leases.acquire(
+                datetime.datetime.now(), UUID(MANIFESTATION.dataset_id),
+                self.node.uuid))
+        self.assertEqual(
+            ([self.deployment.nodes],
+             {self.node.uuid: MANIFESTATION,
+              self.other_node.uuid: self.replica}),
+            (calls, updated.get_dataset_manifestations(
+                MANIFESTATION.dataset_id)),
+        )
+
+    def test_not_derived_unless_needed(self):
+        """
+        No index is derived for a ``Deployment`` created by replacing a node
+        if the original deployment's index was never needed.
+        """
+        updated = self.deployment.update_node(self.node.set(applications={}))
+        self.assertIs(None, _dataset_indexes.get(updated.nodes))
+
+
 class DeploymentTests(TestCase):
     """
     Tests for ``Deployment``.
@@ -837,6 +1151,18 @@ class PSetFieldTests(TestCase):
         record = Record(value=[1, 2])
         assert isinstance(record.value, PSet)
 
+    @given(PYRSISTENT_STRUCT)
+    def test_checked_value_not_copied(self, klass):
+        """
+        Setting another field of a record doesn't copy a ``pset_field``
+        value.
+        """
+        class Record(klass):
+            value = pset_field(int)
+            other = field()
+        record = Record(value=[1, 2])
+        assert record.set(other=1).value is record.value
+
     @given(PYRSISTENT_STRUCT)
     def test_checked_set(self, klass):
         """
@@ -1084,6 +1410,18 @@ class PMapFieldTests(TestCase):
         record = Record(value={1:  1234})
         assert isinstance(record.value, PMap)
 
+    @given(PYRSISTENT_STRUCT)
+    def test_checked_value_not_copied(self, klass):
+        """
+        Setting another field of a record doesn't copy a ``pmap_field``
+        value.
+        """
+        class Record(klass):
+            value = pmap_field(int, int)
+            other = field()
+        record = Record(value={1: 2})
+        assert record.set(other=1).value is record.value
+
     @given(PYRSISTENT_STRUCT)
     def test_checked_map_key(self, klass):
         """
@@ -6,13 +6,16 @@ Tests for ``flocker.control._persistence``.
 import json
 import string
 
+from hashlib import sha256
+
 from datetime import datetime, timedelta
 from uuid import uuid4, UUID
 
 from pytz import UTC
 
 from eliot.testing import (
-    validate_logging, assertHasMessage, assertHasAction, capture_logging)
+    validate_logging, assertHasMessage, assertHasAction, capture_logging,
+    LoggedAction)
 
 from hypothesis import given
 from hypothesis import strategies as st
@@ -20,17 +23,23 @@ from hypothesis.extra.datetime import datetimes
 
 from twisted.internet import reactor
 from twisted.internet.task import Clock
+from twisted.application.service import MultiService
 from twisted.python.filepath import FilePath
 
 from pyrsistent import PClass, pset
 
 from ...testtools import AsyncTestCase, TestCase
+from ..testtools import ManualThreadPool, ThreadClock
+from .. import _persistence
 from .._persistence import (
     ConfigurationPersistenceService, wire_decode, wire_encode,
     _LOG_SAVE, _LOG_STARTUP, migrate_configuration,
+    migrate_configuration_file,
     _CONFIG_VERSION, ConfigurationMigration, ConfigurationMigrationError,
     _LOG_UPGRADE, MissingMigrationError, update_leases, _LOG_EXPIRE,
+    _LOG_UPGRADE_STEP,
     _LOG_UNCHANGED_DEPLOYMENT_NOT_SAVED, to_unserialized_json,
+    _ConfigurationEncoder,
     )
 from .._model import (
     Deployment, Application, DockerImage, Node, Dataset, Manifestation,
@@ -83,6 +92,7 @@ class LeasesTests(AsyncTestCase):
             self.clock, FilePath(self.mktemp()))
         self.persistence_service.startService()
         self.addCleanup(self.persistence_service.stopService)
+        self.node_id = uuid4()
 
     def test_update_leases_saves_changed_leases(self):
         """
@@ -100,8 +110,10 @@ class LeasesTests(AsyncTestCase):
 
         d = self.persistence_service.save(
             TEST_DEPLOYMENT.set(leases=original_leases))
+        self.clock.advance(0)
         d.addCallback(
             lambda _: update_leases(update, self.persistence_service))
+        self.clock.advance(0)
 
         def updated(_):
             self.assertEqual(
@@ -123,6 +135,7 @@ class LeasesTests(AsyncTestCase):
             return leases.acquire(
                 datetime.fromtimestamp(1000, UTC), dataset_id, node_id)
         d = update_leases(update, self.persistence_service)
+        self.clock.advance(0)
 
         def updated(updated_leases):
             self.assertEqual(updated_leases, update(original_leases))
@@ -146,6 +159,7 @@ class LeasesTests(AsyncTestCase):
             datetime.fromtimestamp(now, UTC), ids[1], node_id, timestep * 2)
         new_config = Deployment(leases=leases)
         d = self.persistence_service.save(new_config)
+        self.clock.advance(0)
 
         def saved(_):
             self.clock.advance(timestep - 1)  # 99
@@ -165,6 +179,119 @@ class LeasesTests(AsyncTestCase):
         d.addCallback(saved)
         return d
 
+    def test_nothing_expired(self):
+        """
+        When no lease has expired the configuration is left as the very same
+        object, without saving a new generation.
+        """
+        leases = Leases().acquire(
+            datetime.fromtimestamp(self.clock.seconds(), UTC),
+            uuid4(), uuid4(), 100)
+        d = self.persistence_service.save(Deployment(leases=leases))
+        self.clock.advance(0)
+
+        def saved(_):
+            before = (self.persistence_service.get(),
+                      self.persistence_service.configuration_generation())
+            self.clock.advance(1)
+            self.assertEqual(
+                (True, before[1]),
+                (self.persistence_service.get() is before[0],
+                 self.persistence_service.configuration_generation()),
+            )
+        d.addCallback(saved)
+        return d
+
+    def acquire(self, dataset_id, expires):
+        """
+        Acquire a lease through the persistence service, and let the
+        service commit it.
+
+        :param UUID dataset_id: The dataset to lease.
+        :param expires: The number of seconds until the lease expires, or
+            ``None``.
+
+        :return Deferred: Fires when the lease has been saved.
+        """
+        now = datetime.fromtimestamp(self.clock.seconds(), UTC)
+        d = update_leases(
+            lambda leases: leases.acquire(now, dataset_id, self.node_id,
+                                          expires),
+            self.persistence_service,
+        )
+        self.clock.advance(0)
+        return d
+
+    def expiry_times(self):
+        """
+        :return: A ``list`` of the times of the delayed calls scheduled by the
+            ``LeaseService``.
+        """
+        return [call.getTime() for call in self.clock.getDelayedCalls()]
+
+    def test_no_expiry_scheduled(self):
+        """
+        Nothing is scheduled while no lease has an expiration time.
+        """
+        self.acquire(uuid4(), None)
+        self.assertEqual([], self.expiry_times())
+
+    def test_earliest_expiry_scheduled(self):
+        """
+        A single delayed call is scheduled, just after the earliest lease
+        expiration time.
+        """
+        self.clock.advance(10)
+        self.acquire(uuid4(), 200)
+        self.acquire(uuid4(), 100)
+        [when] = self.expiry_times()
+        self.assertAlmostEqual(110, when, places=2)
+
+    def test_rescheduled_on_release(self):
+        """
+        When the lease which expires first is released, the delayed call is
+        rescheduled for the next one.
+        """
+        first = uuid4()
+        self.acquire(first, 100)
+        self.acquire(uuid4(), 200)
+        update_leases(
+            lambda leases: leases.release(first, self.node_id),
+            self.persistence_service,
+        )
+        self.clock.advance(0)
+        [when] = self.expiry_times()
+        self.assertAlmostEqual(200, when, places=2)
+
+    def test_cancelled_on_release(self):
+        """
+        When the only expiring lease is released, the delayed call is
+        cancelled.
+        """
+        dataset_id = uuid4()
+        self.acquire(dataset_id, 100)
+        update_leases(
+            lambda leases: leases.release(dataset_id, self.node_id),
+            self.persistence_service,
+        )
+        self.clock.advance(0)
+        self.assertEqual([], self.expiry_times())
+
+    def test_expired_at_deadline(self):
+        """
+        A lease is removed as soon as its expiration time has passed, and the
+        next expiration is then scheduled.
+        """
+        first, second = uuid4(), uuid4()
+        self.acquire(first, 100)
+        self.acquire(second, 200)
+        self.clock.advance(100.01)
+        self.assertEqual(
+            ([second], 1),
+            (list(self.persistence_service.get().leases),
+             len(self.expiry_times())),
+        )
+
     @capture_logging(None)
     def test_expire_lease_logging(self, logger):
         """
@@ -177,6 +304,7 @@ class LeasesTests(AsyncTestCase):
             dataset_id, node_id, 1)
 
         d = self.persistence_service.save(Deployment(leases=leases))
+        self.clock.advance(0)
 
         def saved(_):
             logger.reset()
@@ -466,6 +594,75 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         d.addCallback(saved)
         return d
 
+    def test_generation_on_save(self):
+        """
+        The configuration generation increases when a changed configuration is
+        saved, but not when an unchanged one is.
+        """
+        service = self.service(FilePath(self.mktemp()))
+        generations = [service.configuration_generation()]
+        d = service.save(TEST_DEPLOYMENT)
+        d.addCallback(lambda _: generations.append(
+            service.configuration_generation()))
+        d.addCallback(lambda _: service.save(
+            TEST_DEPLOYMENT.set(leases=TEST_DEPLOYMENT.leases)))
+        d.addCallback(lambda _: generations.append(
+            service.configuration_generation()))
+        d.addCallback(lambda _: self.assertEqual(
+            [generations[0], generations[0] + 1, generations[0] + 1],
+            generations,
+        ))
+        return d
+
+    def test_loads_from_cache(self):
+        """
+        A service which was stopped leaves a snapshot cache, from which the
+        configuration is loaded by a new service without decoding the
+        snapshot.
+        """
+        path = FilePath(self.mktemp())
+        service = ConfigurationPersistenceService(reactor, path)
+        service.startService()
+        d = service.save(TEST_DEPLOYMENT)
+        d.addCallback(lambda _: service.stopService())
+
+        def stopped(_):
+            self.patch(_persistence, "wire_decode", None)
+            self.assertEqual(TEST_DEPLOYMENT, self.service(path).get())
+        d.addCallback(stopped)
+        return d
+
+    def test_stale_cache_ignored(self):
+        """
+        A snapshot cache is not used if the snapshot has been replaced since
+        it was written.
+        """
+        path = FilePath(self.mktemp())
+        self.service(path).stopService()
+        path.child(b"current_configuration.json").setContent(wire_encode(
+            Configuration(version=_CONFIG_VERSION,
+                          deployment=TEST_DEPLOYMENT)))
+        self.assertEqual(TEST_DEPLOYMENT, self.service(path).get())
+
+    def test_current_snapshot_not_rewritten(self):
+        """
+        A snapshot of the current version is not rewritten when it is
+        loaded.
+        """
+        path = FilePath(self.mktemp())
+        snapshot = path.child(b"current_configuration.json")
+        path.makedirs()
+        snapshot.setContent(json.dumps(json.loads(wire_encode(
+            Configuration(version=_CONFIG_VERSION,
+                          deployment=TEST_DEPLOYMENT))), indent=4))
+        original = snapshot.getContent()
+        service = self.service(path)
+        self.assertEqual(
+            (TEST_DEPLOYMENT, original, sha256(original).hexdigest()),
+            (service.get(), snapshot.getContent(),
+             service.configuration_hash()),
+        )
+
     def test_hash_persists_across_restarts(self):
         """
         A configuration that was saved can be loaded from a new service.
@@ -485,6 +682,681 @@ class ConfigurationPersistenceServiceTests(AsyncTestCase):
         return d
 
 
+class GroupCommitTests(TestCase):
+    """
+    Tests for ``ConfigurationPersistenceService`` committing saves in batches
+    in a threadpool.
+    """
+    def setUp(self):
+        super(GroupCommitTests, self).setUp()
+        self.threadpool = ManualThreadPool()
+        self.path = FilePath(self.mktemp())
+        self.service = ConfigurationPersistenceService(
+            ThreadClock(), self.path, threadpool=self.threadpool)
+        self.service.startService()
+        self.addCleanup(
+            lambda: self.service.running and self.service.stopService())
+        self.snapshot = self.path.child(b"current_configuration.json")
+        self.writes = []
+        original_write = self.service._write
+
+        def write(previous, deployment, data):
+            self.writes.append(deployment)
+            return original_write(previous, deployment, data)
+        self.patch(self.service, "_write", write)
+
+    def test_written_in_threadpool(self):
+        """
+        ``save`` doesn't write the configuration itself but has the
+        threadpool write it, and the ``Deferred`` it returns fires once that
+        is done.
+        """
+        before = self.snapshot.getContent()
+        saved = []
+        self.service.save(TEST_DEPLOYMENT).addCallback(saved.append)
+        unsaved = (list(saved), self.snapshot.getContent() == before)
+        self.threadpool.run()
+        self.assertEqual(
+            (([], True), [None], TEST_DEPLOYMENT),
+            (unsaved, saved,
+             wire_decode(self.snapshot.getContent()).deployment),
+        )
+
+    def test_batch(self):
+        """
+        Saves made while a commit is being written are committed together by
+        writing only the latest configuration, after which all their
+        ``Deferred``\ s fire and the change callbacks are called once.
+        """
+        changes = []
+        self.service.register(lambda: changes.append(None))
+        first = Deployment(nodes={Node(uuid=uuid4())})
+        second = Deployment(nodes={Node(uuid=uuid4())})
+        saved = []
+        for deployment in [first, second, TEST_DEPLOYMENT]:
+            self.service.save(deployment).addCallback(saved.append)
+        self.threadpool.run()
+        self.threadpool.run()
+        self.assertEqual(
+            ([first, TEST_DEPLOYMENT], 2, [None] * 3, []),
+            (self.writes, len(changes), saved, self.threadpool.calls),
+        )
+
+    def test_get_before_written(self):
+        """
+        ``get`` returns the saved configuration before it has been written,
+        and the configuration hash has already changed.
+        """
+        original_hash = self.service.configuration_hash()
+        self.service.save(TEST_DEPLOYMENT)
+        self.assertEqual(
+            (TEST_DEPLOYMENT, True),
+            (self.service.get(),
+             self.service.configuration_hash() != original_hash),
+        )
+
+    def test_hash_once_written(self):
+        """
+        Once the latest configuration has been written, the configuration
+        hash is that of the configuration on disk.
+        """
+        self.service.save(TEST_DEPLOYMENT)
+        self.threadpool.run()
+        self.assertEqual(
+            sha256(self.snapshot.getContent()).hexdigest(),
+            self.service.configuration_hash(),
+        )
+
+    def test_hash_unchanged_when_written(self):
+        """
+        Neither the configuration hash nor the configuration generation
+        changes once a save has been written.
+        """
+        self.service.save(TEST_DEPLOYMENT)
+        before = (self.service.configuration_generation(),
+                  self.service.configuration_hash())
+        self.threadpool.run()
+        self.assertEqual(
+            before,
+            (self.service.configuration_generation(),
+             self.service.configuration_hash()),
+        )
+
+    @capture_logging(None)
+    def test_write_fails(self, logger):
+        """
+        If a commit can't be written, the ``Deferred``\ s of its saves fail,
+        and the failure is logged.
+        """
+        self.patch(self.service, "logger", logger)
+        self.patch(
+            self.service, "_write",
+            lambda previous, deployment, data: 1 / 0)
+        saved = self.service.save(TEST_DEPLOYMENT)
+        self.threadpool.run()
+        self.failureResultOf(saved, ZeroDivisionError)
+        self.assertEqual(
+            1, len(logger.flush_tracebacks(ZeroDivisionError)))
+
+    @capture_logging(None)
+    def test_write_fails_rolled_back(self, logger):
+        """
+        If a commit can't be written, the configuration goes back to the one
+        on disk, with a new generation and the hash it had before.
+        """
+        self.patch(self.service, "logger", logger)
+        original = (self.service.get(), self.service.configuration_hash())
+        self.patch(
+            self.service, "_write",
+            lambda previous, deployment, data: 1 / 0)
+        saved = self.service.save(TEST_DEPLOYMENT)
+        generation = self.service.configuration_generation()
+        self.threadpool.run()
+        self.failureResultOf(saved, ZeroDivisionError)
+        logger.flush_tracebacks(ZeroDivisionError)
+        self.assertEqual(
+            (original, True),
+            ((self.service.get(), self.service.configuration_hash()),
+             self.service.configuration_generation() > generation),
+        )
+
+    @capture_logging(None)
+    def test_write_fails_callbacks(self, logger):
+        """
+        If a commit can't be written, the registered callbacks are called
+        once the configuration has been rolled back.
+        """
+        self.patch(self.service, "logger", logger)
+        original = self.service.get()
+        self.patch(
+            self.service, "_write",
+            lambda previous, deployment, data: 1 / 0)
+        called = []
+        self.service.register(lambda: called.append(self.service.get()))
+        saved = self.service.save(TEST_DEPLOYMENT)
+        self.threadpool.run()
+        self.failureResultOf(saved, ZeroDivisionError)
+        logger.flush_tracebacks(ZeroDivisionError)
+        self.assertEqual([original], called)
+
+    @capture_logging(None)
+    def test_write_fails_later_save(self, logger):
+        """
+        If a commit can't be written but there have been further saves, the
+        configuration isn't rolled back and the next commit writes it, after
+        which the ``Deferred``\ s of the failed commit's saves fire.
+        """
+        self.patch(self.service, "logger", logger)
+        original_write = self.service._write
+
+        def write(previous, deployment, data):
+            self.patch(self.service, "_write", original_write)
+            1 / 0
+        self.patch(self.service, "_write", write)
+        failed = self.service.save(Deployment(nodes={Node(uuid=uuid4())}))
+        self.service.save(TEST_DEPLOYMENT)
+        self.threadpool.run()
+        logger.flush_tracebacks(ZeroDivisionError)
+        self.assertNoResult(failed)
+        self.threadpool.run()
+        self.successResultOf(failed)
+        self.assertEqual(
+            (TEST_DEPLOYMENT, TEST_DEPLOYMENT),
+            (self.service.get(),
+             wire_decode(self.snapshot.getContent()).deployment),
+        )
+
+    @capture_logging(None)
+    def test_write_fails_later_save_fails(self, logger):
+        """
+        If a commit can't be written but there have been further saves, and
+        the next commit can't be written either, the ``Deferred``\ s of
+        both commits' saves fail and the configuration is rolled back to the
+        one on disk.
+        """
+        self.patch(self.service, "logger", logger)
+        original = self.service.get()
+        self.patch(
+            self.service, "_write",
+            lambda previous, deployment, data: 1 / 0)
+        first = self.service.save(Deployment(nodes={Node(uuid=uuid4())}))
+        second = self.service.save(TEST_DEPLOYMENT)
+        self.threadpool.run()
+        self.threadpool.run()
+        self.failureResultOf(first, ZeroDivisionError)
+        self.failureResultOf(second, ZeroDivisionError)
+        logger.flush_tracebacks(ZeroDivisionError)
+        self.assertEqual(original, self.service.get())
+
+    def test_stop_waits_for_commits(self):
+        """
+        ``stopService`` returns a ``Deferred`` which fires once the commits
+        being written and waiting to be written are done.
+        """
+        self.service.save(Deployment(nodes={Node(uuid=uuid4())}))
+        self.service.save(TEST_DEPLOYMENT)
+        stopped = self.service.stopService()
+        self.threadpool.run()
+        self.assertNoResult(stopped)
+        self.threadpool.run()
+        self.successResultOf(stopped)
+
+
+class ReactorCommitTests(TestCase):
+    """
+    Tests for ``ConfigurationPersistenceService`` committing saves in the
+    reactor thread, without a threadpool.
+    """
+    def setUp(self):
+        super(ReactorCommitTests, self).setUp()
+        self.clock = Clock()
+        self.path = FilePath(self.mktemp())
+        self.service = ConfigurationPersistenceService(self.clock, self.path)
+        self.service.startService()
+        self.addCleanup(
+            lambda: self.service.running and self.service.stopService())
+        self.snapshot = self.path.child(b"current_configuration.json")
+        self.writes = []
+        original_write = self.service._write
+
+        def write(previous, deployment, data):
+            self.writes.append(deployment)
+            return original_write(previous, deployment, data)
+        self.patch(self.service, "_write", write)
+
+    def test_batch_per_turn(self):
+        """
+        The saves made in one reactor turn are committed together once it
+        ends, by writing only the latest configuration.
+        """
+        saved = []
+        for deployment in [Deployment(nodes={Node(uuid=uuid4())}),
+                           Deployment(nodes={Node(uuid=uuid4())}),
+                           TEST_DEPLOYMENT]:
+            self.service.save(deployment).addCallback(saved.append)
+        unsaved = (list(saved), list(self.writes))
+        self.clock.advance(0)
+        self.assertEqual(
+            (([], []), [TEST_DEPLOYMENT], [None] * 3, TEST_DEPLOYMENT),
+            (unsaved, self.writes, saved,
+             wire_decode(self.snapshot.getContent()).deployment),
+        )
+
+    def test_durable(self):
+        """
+        The ``Deferred`` returned by ``save`` fires once the new snapshot has
+        been synced to disk and has replaced the old one.
+        """
+        synced = []
+        original_fsync = _persistence.os.fsync
+
+        def fsync(fd):
+            original_fsync(fd)
+            synced.append(None)
+        self.patch(_persistence.os, "fsync", fsync)
+        fired = []
+        self.service.save(TEST_DEPLOYMENT).addCallback(
+            lambda _: fired.append(
+                (len(synced),
+                 wire_decode(self.snapshot.getContent()).deployment)))
+        self.clock.advance(0)
+        self.assertEqual([(1, TEST_DEPLOYMENT)], fired)
+
+    def test_stop_commits(self):
+        """
+        ``stopService`` commits the saves made in the current reactor turn
+        rather than waiting for it to end.
+        """
+        self.service.save(TEST_DEPLOYMENT)
+        self.successResultOf(self.service.stopService())
+        self.assertEqual(
+            ([TEST_DEPLOYMENT], [], TEST_DEPLOYMENT),
+            (self.writes, self.clock.getDelayedCalls(),
+             wire_decode(self.snapshot.getContent()).deployment),
+        )
+
+
+class JournalTests(TestCase):
+    """
+    Tests for ``ConfigurationPersistenceService`` in journal mode.
+    """
+    def setUp(self):
+        super(JournalTests, self).setUp()
+        self.clock = Clock()
+        self.path = FilePath(self.mktemp())
+        self.snapshot = self.path.child(b"current_configuration.json")
+        self.journal = self.path.child(b"current_configuration.journal")
+
+    def service(self):
+        """
+        Start a service in journal mode, schedule its stop.
+
+        :return: Started ``ConfigurationPersistenceService``.
+        """
+        service = ConfigurationPersistenceService(
+            self.clock, self.path, journal=True)
+        service.startService()
+        self.addCleanup(lambda: service.running and service.stopService())
+        return service
+
+    def crash(self, service):
+        """
+        Abandon a service without stopping it once the saves made so far are
+        committed, as if the process had crashed.
+        """
+        self.clock.advance(0)
+        service._journal.close()
+        MultiService.stopService(service)
+
+    def test_save_appends(self):
+        """
+        Saving a change appends a line to the journal rather than rewriting
+        the snapshot.
+        """
+        service = self.service()
+        snapshot = self.snapshot.getContent()
+        journal = self.journal.getContent()
+        service.save(TEST_DEPLOYMENT)
+        self.crash(service)
+        self.assertEqual(
+            (snapshot, journal, 1),
+            (self.snapshot.getContent(),
+             self.journal.getContent()[:len(journal)],
+             self.journal.getContent()[len(journal):].count(b"\n")),
+        )
+
+    def test_batch_appends_one_change(self):
+        """
+        The saves committed together in a batch are appended to the journal
+        as a single change.
+        """
+        threadpool = ManualThreadPool()
+        service = ConfigurationPersistenceService(
+            ThreadClock(), self.path, journal=True, threadpool=threadpool)
+        service.startService()
+        self.addCleanup(service.stopService)
+        journal = self.journal.getContent()
+        for deployment in [Deployment(nodes={Node(uuid=uuid4())}),
+                           Deployment(nodes={Node(uuid=uuid4())}),
+                           TEST_DEPLOYMENT]:
+            service.save(deployment)
+        threadpool.run()
+        threadpool.run()
+        self.assertEqual(
+            2, self.journal.getContent()[len(journal):].count(b"\n"))
+
+    def test_replay_after_crash(self):
+        """
+        Changes saved to the journal are loaded by a new service after a
+        crash.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        changed = TEST_DEPLOYMENT.update_node(
+            TEST_DEPLOYMENT.get_node(NODE_UUID).transform(
+                ["applications"], lambda _: pset()))
+        service.save(changed)
+        self.crash(service)
+        self.assertEqual(changed, self.service().get())
+
+    def test_hash_after_replay(self):
+        """
+        The configuration hash changes with each change saved to the journal,
+        and is the same for a service loading the journal after a crash.
+        """
+        service = self.service()
+        hashes = [service.configuration_hash()]
+        service.save(TEST_DEPLOYMENT)
+        hashes.append(service.configuration_hash())
+        self.crash(service)
+        hashes.append(self.service().configuration_hash())
+        self.assertEqual(
+            (True, hashes[1]), (hashes[0] != hashes[1], hashes[2]))
+
+    def test_hash_matches_snapshot_mode(self):
+        """
+        The configuration hash is the same as that of the same configuration
+        saved without a journal.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        snapshot_service = ConfigurationPersistenceService(
+            self.clock, FilePath(self.mktemp()))
+        snapshot_service.startService()
+        self.addCleanup(snapshot_service.stopService)
+        snapshot_service.save(TEST_DEPLOYMENT)
+        self.clock.advance(0)
+        self.assertEqual(
+            snapshot_service.configuration_hash(),
+            service.configuration_hash())
+
+    def test_stale_journal_ignored(self):
+        """
+        A journal written for a different snapshot is not replayed.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        self.crash(service)
+        journal = self.journal.getContent()
+        self.service().stopService()
+        self.journal.setContent(journal)
+        snapshot = Deployment(nodes={Node(uuid=uuid4())})
+        self.snapshot.setContent(wire_encode(Configuration(
+            version=_CONFIG_VERSION, deployment=snapshot)))
+        self.assertEqual(snapshot, self.service().get())
+
+    def test_incomplete_change_ignored(self):
+        """
+        A change only partly written to the end of the journal is not
+        replayed, but the changes before it are.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        self.clock.advance(0)
+        service.save(Deployment())
+        self.crash(service)
+        self.journal.setContent(self.journal.getContent()[:-10])
+        self.assertEqual(TEST_DEPLOYMENT, self.service().get())
+
+    def test_compaction(self):
+        """
+        Once the journal is bigger than the snapshot, the configuration is
+        written to a new snapshot and the journal is emptied.
+        """
+        self.patch(_persistence, "_MINIMUM_COMPACTION_SIZE", 0)
+        service = self.service()
+        sizes = []
+        deployment = TEST_DEPLOYMENT
+        for index in range(10):
+            deployment = deployment.transform(
+                ["persistent_state", "blockdevice_ownership"],
+                lambda ownership, index=index: ownership.set(
+                    uuid4(), u"blockdevice-{}".format(index)),
+            )
+            service.save(deployment)
+            self.clock.advance(0)
+            sizes.append(len(self.journal.getContent()))
+        self.crash(service)
+        self.assertEqual(
+            (True, deployment),
+            (sizes[-1] < max(sizes), self.service().get()),
+        )
+
+    def test_generation_with_compaction(self):
+        """
+        The configuration generation increases by one for each save, including
+        saves which compact the journal.
+        """
+        self.patch(_persistence, "_MINIMUM_COMPACTION_SIZE", 0)
+        service = self.service()
+        generations = [service.configuration_generation()]
+        deployment = TEST_DEPLOYMENT
+        for index in range(5):
+            deployment = deployment.transform(
+                ["persistent_state", "blockdevice_ownership"],
+                lambda ownership, index=index: ownership.set(
+                    uuid4(), u"blockdevice-{}".format(index)),
+            )
+            service.save(deployment)
+            generations.append(service.configuration_generation())
+        self.assertEqual(
+            range(generations[0], generations[0] + 6), generations)
+
+    def test_compacted_on_stop(self):
+        """
+        Stopping the service writes the configuration to the snapshot and
+        empties the journal.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        service.stopService()
+        self.journal.remove()
+        self.assertEqual(TEST_DEPLOYMENT, self.service().get())
+
+
+class DatabaseTests(TestCase):
+    """
+    Tests for ``ConfigurationPersistenceService`` in database mode.
+    """
+    def setUp(self):
+        super(DatabaseTests, self).setUp()
+        self.clock = Clock()
+        self.path = FilePath(self.mktemp())
+        self.snapshot = self.path.child(b"current_configuration.json")
+        self.database = self.path.child(b"current_configuration.sqlite")
+
+    def service(self, database=True):
+        """
+        Start a service, schedule its stop.
+
+        :param bool database: Whether to keep the configuration in a
+            database.
+
+        :return: Started ``ConfigurationPersistenceService``.
+        """
+        service = ConfigurationPersistenceService(
+            self.clock, self.path, database=database)
+        service.startService()
+        self.addCleanup(lambda: service.running and service.stopService())
+        return service
+
+    def restart(self, service, database=True):
+        """
+        Stop a service and start a new one using the same directory.
+
+        :return: The new ``ConfigurationPersistenceService``.
+        """
+        service.stopService()
+        return self.service(database)
+
+    def test_journal(self):
+        """
+        A database can't be used with a journal.
+        """
+        self.assertRaises(
+            ValueError, ConfigurationPersistenceService,
+            self.clock, self.path, journal=True, database=True,
+        )
+
+    def test_empty(self):
+        """
+        A new database holds an empty configuration.
+        """
+        service = self.service()
+        self.assertEqual(
+            (Deployment(), Deployment(), False),
+            (service.get(), self.restart(service).get(),
+             self.snapshot.exists()),
+        )
+
+    def test_saved(self):
+        """
+        Saved changes are loaded by a new service, including removals.
+        """
+        dataset_id = UUID(DATASET.dataset_id)
+        lease = Lease(dataset_id=dataset_id, node_id=NODE_UUID)
+        service = self.service()
+        service.save(TEST_DEPLOYMENT.set(leases=Leases({
+            dataset_id: lease,
+        })))
+        service = self.restart(service)
+        changed = TEST_DEPLOYMENT.update_node(Node(uuid=uuid4()))
+        service.save(changed)
+        self.assertEqual(changed, self.restart(service).get())
+
+    def test_save_updates_rows(self):
+        """
+        Saving a change to a manifestation only updates that manifestation's
+        row in the database.
+        """
+        deployment = Deployment(nodes={Node(
+            uuid=NODE_UUID,
+            manifestations={DATASET.dataset_id: MANIFESTATION},
+        )})
+        service = self.service()
+        service.save(deployment)
+        self.clock.advance(0)
+        connection = service._database._connection
+        changes = connection.total_changes
+        service.save(deployment.update_node(
+            deployment.get_node(NODE_UUID).transform(
+                [u"manifestations", DATASET.dataset_id, u"primary"], False,
+            )
+        ))
+        self.clock.advance(0)
+        self.assertEqual(1, connection.total_changes - changes)
+
+    def test_hash_changes(self):
+        """
+        The configuration hash changes when a change is saved.
+        """
+        service = self.service()
+        original = service.configuration_hash()
+        service.save(TEST_DEPLOYMENT)
+        self.assertNotEqual(original, service.configuration_hash())
+
+    def test_hash_persists_across_restarts(self):
+        """
+        The configuration hash is the same once the service is restarted, and
+        is the same as that of the same configuration held in a snapshot.
+        """
+        service = self.service()
+        service.save(TEST_DEPLOYMENT)
+        self.clock.advance(0)
+        original = service.configuration_hash()
+        service = self.restart(service)
+        in_database = service.configuration_hash()
+        service = self.restart(service, database=False)
+        self.assertEqual(
+            (original, original),
+            (in_database, service.configuration_hash()),
+        )
+
+    def test_import(self):
+        """
+        A snapshot is imported into a new database, and is then archived.
+        """
+        service = self.service(database=False)
+        service.save(TEST_DEPLOYMENT)
+        service = self.restart(service)
+        self.assertEqual(
+            (TEST_DEPLOYMENT, False, TEST_DEPLOYMENT),
+            (service.get(), self.snapshot.exists(),
+             self.restart(service).get()),
+        )
+
+    def test_import_migrates(self):
+        """
+        A snapshot of an older configuration version is upgraded when it is
+        imported.
+        """
+        self.path.makedirs()
+        self.path.child(b"current_configuration.v1.json").setContent(
+            V1_TEST_DEPLOYMENT_JSON)
+        self.assertEqual(
+            TEST_DEPLOYMENT.set(persistent_state=PersistentState()),
+            self.service().get(),
+        )
+
+    def test_import_replays_journal(self):
+        """
+        Changes left in the journal by a service in journal mode which
+        crashed are imported along with the snapshot, and the journal is
+        archived.
+        """
+        service = ConfigurationPersistenceService(
+            self.clock, self.path, journal=True)
+        service.startService()
+        service.save(TEST_DEPLOYMENT)
+        self.clock.advance(0)
+        service._journal.close()
+        MultiService.stopService(service)
+        service = self.service()
+        self.assertEqual(
+            (TEST_DEPLOYMENT, False, TEST_DEPLOYMENT),
+            (service.get(),
+             self.path.child(b"current_configuration.journal").exists(),
+             self.restart(service).get()),
+        )
+
+    def test_export(self):
+        """
+        Without a database the configuration is exported from an existing
+        database to the snapshot, and the database is archived.
+        """
+        service = self.service(database=False)
+        service.save(TEST_DEPLOYMENT)
+        service = self.restart(service)
+        changed = TEST_DEPLOYMENT.update_node(Node(uuid=uuid4()))
+        service.save(changed)
+        service = self.restart(service, database=False)
+        self.assertEqual(
+            (changed, False, changed),
+            (service.get(), self.database.exists(),
+             self.restart(service, database=False).get()),
+        )
+
+
 class StubMigration(object):
     """
     A simple stub migration class, used to test ``migrate_configuration``.
@@ -495,21 +1367,19 @@ class StubMigration(object):
     """
     @classmethod
     def upgrade_from_v1(cls, config):
-        config = json.loads(config)
         if config['version'] != 1:
             raise ConfigurationMigrationError(
                 "Supplied configuration was not a valid v1 config."
             )
-        return json.dumps({"version": 2, "configuration": "fake"})
+        return {"version": 2, "configuration": "fake"}
 
     @classmethod
     def upgrade_from_v2(cls, config):
-        config = json.loads(config)
         if config['version'] != 2:
             raise ConfigurationMigrationError(
                 "Supplied configuration was not a valid v2 config."
             )
-        return json.dumps({"version": 3, "configuration": "fake"})
+        return {"version": 3, "configuration": "fake"}
 
 
 class MigrateConfigurationTests(TestCase):
@@ -549,7 +1419,56 @@ class MigrateConfigurationTests(TestCase):
         # Compare the v1 --> v3 upgrade to the direct result of the
         # v2 --> v3 upgrade on the v2 config, Both should be identical
         # and valid v3 configs.
-        self.assertEqual(result, StubMigration.upgrade_from_v2(v2_config))
+        self.assertEqual(
+            json.loads(result),
+            StubMigration.upgrade_from_v2(json.loads(v2_config)))
+
+    def test_decoded_once(self):
+        """
+        Each upgrade is given the decoded configuration returned by the
+        previous one, rather than a reserialized copy.
+        """
+        marker = object()
+        received = []
+        self.patch(StubMigration, "upgrade_from_v1", classmethod(
+            lambda cls, config: {"version": 2, "marker": marker}))
+        self.patch(StubMigration, "upgrade_from_v2", classmethod(
+            lambda cls, config: received.append(config) or {"version": 3}))
+        migrate_configuration(1, 3, self.v1_config, StubMigration)
+        self.assertIs(marker, received[0]["marker"])
+
+    @capture_logging(None)
+    def test_failed_step_logged(self, logger):
+        """
+        An upgrade which raises an exception is logged as a failed step.
+        """
+        self.patch(StubMigration, "upgrade_from_v2", classmethod(
+            lambda cls, config: 1 / 0))
+        self.assertRaises(
+            ZeroDivisionError,
+            migrate_configuration, 1, 3, self.v1_config, StubMigration)
+        self.assertEqual(
+            [(1, True), (2, False)],
+            [(step.start_message[u"source_version"], step.succeeded)
+             for step in LoggedAction.of_type(
+                 logger.messages, _LOG_UPGRADE_STEP)])
+
+    def test_file(self):
+        """
+        ``migrate_configuration_file`` writes the same configuration
+        ``migrate_configuration`` returns to the target file.
+        """
+        source = FilePath(self.mktemp())
+        source.setContent(V1_TEST_DEPLOYMENT_JSON)
+        target = FilePath(self.mktemp())
+        migrate_configuration_file(
+            1, _CONFIG_VERSION, source, target, ConfigurationMigration)
+        self.assertEqual(
+            json.loads(migrate_configuration(
+                1, _CONFIG_VERSION, V1_TEST_DEPLOYMENT_JSON,
+                ConfigurationMigration)),
+            json.loads(target.getContent()),
+        )
 
 
 DATASETS = st.builds(
@@ -696,6 +1615,34 @@ class WireEncodeDecodeTests(TestCase):
         unserialized = to_unserialized_json(deployment)
         self.assertEquals(wire_decode(json.dumps(unserialized)), deployment)
 
+    @given(DEPLOYMENTS)
+    def test_to_unserialized_json_matches_wire_encode(self, deployment):
+        """
+        ``to_unserialized_json`` returns the same thing as decoding the JSON
+        ``wire_encode`` returns.
+        """
+        self.assertEqual(
+            json.loads(wire_encode(deployment)),
+            to_unserialized_json(deployment),
+        )
+
+    def test_to_unserialized_json_unchanged_nodes(self):
+        """
+        ``to_unserialized_json`` reuses the conversions of nodes which are
+        shared with a previously converted object.
+        """
+        node = Node(uuid=NODE_UUID, manifestations={
+            MANIFESTATION.dataset_id: MANIFESTATION,
+        })
+        deployment = Deployment(nodes={node})
+        [converted] = to_unserialized_json(deployment)[u"nodes"]
+        updated = deployment.update_node(Node(uuid=uuid4()))
+        self.assertIn(
+            id(converted),
+            [id(converted_node)
+             for converted_node in to_unserialized_json(updated)[u"nodes"]],
+        )
+
     def test_no_arbitrary_decoding(self):
         """
         ``wire_decode`` will not decode classes that are not in
@@ -743,6 +1690,38 @@ class WireEncodeDecodeTests(TestCase):
         self.assertRaises(ValueError, wire_encode, datetime.now())
 
 
+class WireEncodeMemoizationTests(TestCase):
+    """
+    Tests for the memoization of the encodings of nodes by ``wire_encode``.
+    """
+    @given(DEPLOYMENTS)
+    def test_same_as_unmemoized(self, deployment):
+        """
+        ``wire_encode`` gives exactly the same bytes as encoding the whole
+        object with ``_ConfigurationEncoder``, both the first time an object
+        is encoded and when memoized encodings are used.
+        """
+        expected = json.dumps(deployment, cls=_ConfigurationEncoder)
+        self.assertEqual(
+            (expected, expected),
+            (wire_encode(deployment), wire_encode(deployment)),
+        )
+
+    def test_changed_node(self):
+        """
+        Encoding a configuration with a changed node encodes the new version
+        of the node, not the memoized encoding of the old one.
+        """
+        node = Node(uuid=NODE_UUID, applications={
+            Application(name=u"postgres", image=DockerImage.from_string(
+                u"postgres"
+            )),
+        })
+        wire_encode(Deployment(nodes={node}))
+        changed = Deployment(nodes={node.set(applications=set())})
+        self.assertEqual(changed, wire_decode(wire_encode(changed)))
+
+
 class ConfigurationMigrationTests(TestCase):
     """
     Tests for ``ConfigurationMigration`` class that performs individual
@@ -4,6 +4,7 @@
 Tests for ``flocker.control._protocol``.
 """
 
+from datetime import timedelta
 from uuid import uuid4
 from json import loads
 
@@ -14,14 +15,15 @@ from characteristic import attributes, Attribute
 
 from eliot import ActionType, start_action, MemoryLogger, Logger
 from eliot.testing import (
-    capture_logging, validate_logging, assertHasAction,
+    capture_logging, validate_logging, assertHasAction, assertHasMessage,
+    LoggedMessage,
 )
 
 from twisted.internet.error import ConnectionDone
 from twisted.test.iosim import connectedServerAndClient
 from twisted.protocols.amp import (
     MAX_VALUE_LENGTH, IArgumentType, Command, String, ListOf, Integer,
-    CommandLocator, AMP, parseString,
+    CommandLocator, AMP, AmpBox, parseString,
 )
 from twisted.python.failure import Failure
 from twisted.internet.error import ConnectionLost
@@ -29,7 +31,10 @@ from twisted.internet.defer import succeed
 from twisted.application.internet import StreamServerEndpointService
 from twisted.internet.task import Clock
 
-from ..testtools import build_control_amp_service
+from ..testtools import (
+    build_control_amp_service, ManualThreadPool, ThreadClock,
+)
+from ...common import TimerWheel
 from ...testtools import TestCase
 from ...testtools.amp import (
     DelayedAMPClient, connected_amp_protocol,
@@ -42,13 +47,23 @@ from .._protocol import (
     NoOp, AgentAMP, ControlAMP, _AgentLocator,
     ControlServiceLocator, LOG_SEND_CLUSTER_STATE, LOG_SEND_TO_AGENT,
     AGENT_CONNECTED, caching_wire_encode, SetNodeEraCommand,
-    timeout_for_protocol,
+    timeout_for_protocol, ClusterStatusDiffCommand, MissingClusterStatus,
+    FEATURE_CLUSTER_STATUS_DIFFS, LOG_SEND_DIFF_TO_AGENT,
+    AGENT_UPDATE_UNCHANGED, FEATURE_BINARY_WIRE_FORMAT, SUPPORTED_FEATURES,
+    _FramedBox, NODE_CHANGED_COALESCE_WINDOW, NODE_CHANGED_MAX_LATENCY,
+    LOG_COALESCED_NODE_CHANGES, caching_binary_wire_encode,
+    NodeStateDiffCommand, FEATURE_NODE_STATE_DIFFS,
 )
 from .. import (
     Deployment, Application, DockerImage, Node, NodeState, Manifestation,
     Dataset, DeploymentState, NonManifestDatasets,
 )
 from .._persistence import wire_encode
+from .._model import ChangeSource
+from .._binary import is_binary_wire_encoded
+from .._diffing import create_diff, create_sequence_diff
+from .._clusterstate import ResyncRequired
+from .._scope import AgentScope, ClusterScope
 from .clusterstatetools import advance_some, advance_rest
 
 
@@ -193,6 +208,14 @@ class BigArgumentTests(TestCase):
             ("big", Big(ListOf(Integer()))),
         ]
 
+    class FramedCommand(Command):
+        commandType = _FramedBox
+        arguments = [
+            ("big", Big(String())),
+            ("large", Big(String())),
+            ("regular", String()),
+        ]
+
     def test_interface(self):
         """
         ``Big`` instances provide ``IArgumentType``.
@@ -269,11 +292,121 @@ class BigArgumentTests(TestCase):
             regular=b"goodbye world",
         )
 
+    def test_roundtrip_empty(self):
+        """
+        ``Big`` can serialize and unserialize empty arguments.
+        """
+        self.assert_roundtrips(self.CommandWithBigArgument, big=b"")
+
+    def test_roundtrip_framed(self):
+        """
+        AMP can serialize and unserialize a ``Command`` whose box is a
+        ``_FramedBox`` with a combination of large and small ``Big`` and
+        regular arguments.
+        """
+        self.assert_roundtrips(
+            self.FramedCommand,
+            big=b"x" * (MAX_VALUE_LENGTH * 2 + 1),
+            large=b"hello world",
+            regular=b"goodbye world",
+        )
+
+    def test_chunks_shared(self):
+        """
+        Boxes for the same large argument share the same chunks.
+        """
+        big = b"x" * (MAX_VALUE_LENGTH + 1)
+        first = self.CommandWithBigArgument.makeArguments(dict(big=big), None)
+        second = self.CommandWithBigArgument.makeArguments(
+            dict(big=big), None)
+        self.assertEqual(
+            [True, True],
+            [first[key] is second[key] for key in ["big.0", "big.1"]],
+        )
+
+    def test_framed_same_as_unframed(self):
+        """
+        A ``_FramedBox`` serializes to bytes which parse the same as those of
+        an ``AmpBox`` with the same contents.
+        """
+        box = self.FramedCommand.makeArguments(
+            dict(
+                big=b"x" * (MAX_VALUE_LENGTH * 2 + 1),
+                large=b"hello world",
+                regular=b"goodbye world",
+            ),
+            None,
+        )
+        box[b"_ask"] = b"1"
+        self.assertEqual(
+            parseString(AmpBox(box).serialize()),
+            parseString(box.serialize()),
+        )
+
+    def test_framed_modified(self):
+        """
+        If the chunks of a ``Big`` argument are changed after being added to
+        a ``_FramedBox``, the box serializes the new chunks.
+        """
+        box = self.FramedCommand.makeArguments(
+            dict(
+                big=b"x" * (MAX_VALUE_LENGTH + 1),
+                large=b"hello world",
+                regular=b"goodbye world",
+            ),
+            None,
+        )
+        box[b"big.1"] = b"y"
+        [roundtripped] = parseString(box.serialize())
+        self.assertEqual(
+            b"x" * MAX_VALUE_LENGTH + b"y",
+            self.FramedCommand.parseArguments(roundtripped, None)["big"],
+        )
+
 
 class SerializationTests(TestCase):
     """
     Tests for argument serialization.
     """
+    def test_json_by_default(self):
+        """
+        ``SerializableArgument`` encodes as JSON for protocols which have not
+        negotiated the binary wire format.
+        """
+        argument = SerializableArgument(Deployment)
+        as_bytes = argument.toStringProto(TEST_DEPLOYMENT, AMP())
+        self.assertEqual(
+            (False, TEST_DEPLOYMENT),
+            (is_binary_wire_encoded(as_bytes), argument.fromString(as_bytes)),
+        )
+
+    def test_binary(self):
+        """
+        ``SerializableArgument`` can round-trip an object in the binary wire
+        format for protocols which have negotiated it.
+        """
+        argument = SerializableArgument(Deployment)
+        protocol = AMP()
+        protocol.binary_wire_format = True
+        as_bytes = argument.toStringProto(TEST_DEPLOYMENT, protocol)
+        self.assertEqual(
+            (True, TEST_DEPLOYMENT),
+            (is_binary_wire_encoded(as_bytes), argument.fromString(as_bytes)),
+        )
+
+    def test_binary_wrong_type(self):
+        """
+        ``SerializableArgument`` raises ``TypeError`` when asked to encode an
+        object of the wrong type in the binary wire format.
+        """
+        protocol = AMP()
+        protocol.binary_wire_format = True
+        self.assertRaises(
+            TypeError,
+            SerializableArgument(Deployment).toStringProto, NODE_STATE,
+            protocol,
+        )
+
     def test_nodestate(self):
         """
         ``SerializableArgument`` can round-trip a ``NodeState`` instance.
@@ -486,7 +619,49 @@ class ControlAMPTests(ControlTestCase):
         """
         self.assertEqual(
             self.successResultOf(self.client.callRemote(VersionCommand)),
-            {"major": 1})
+            {"major": 1, "features": sorted(SUPPORTED_FEATURES)})
+
+    def test_version_binary_wire_format(self):
+        """
+        If the agent announces ``FEATURE_BINARY_WIRE_FORMAT`` the connection
+        starts using the binary wire format.
+        """
+        self.patch_call_remote([], self.protocol)
+        self.protocol.makeConnection(StringTransportWithAbort())
+        initial = self.protocol.binary_wire_format
+        self.successResultOf(self.client.callRemote(
+            VersionCommand, features=[FEATURE_BINARY_WIRE_FORMAT],
+        ))
+        self.assertEqual(
+            (False, True), (initial, self.protocol.binary_wire_format),
+        )
+
+    def test_version_other_binary_wire_format(self):
+        """
+        If the agent announces a binary wire format with a different
+        signature the connection continues to use JSON.
+        """
+        self.patch_call_remote([], self.protocol)
+        self.protocol.makeConnection(StringTransportWithAbort())
+        self.successResultOf(self.client.callRemote(
+            VersionCommand, features=[u"binary-wire-format-0123456789abcdef"],
+        ))
+        self.assertFalse(self.protocol.binary_wire_format)
+
+    def test_version_records_features(self):
+        """
+        The features listed in a ``VersionCommand`` are recorded by the
+        control service against the connection the command arrived on.
+        """
+        self.patch_call_remote([], self.protocol)
+        self.protocol.makeConnection(StringTransportWithAbort())
+        self.successResultOf(self.client.callRemote(
+            VersionCommand, features=[FEATURE_CLUSTER_STATUS_DIFFS],
+        ))
+        self.assertEqual(
+            {self.protocol: frozenset([FEATURE_CLUSTER_STATUS_DIFFS])},
+            self.control_amp_service._agent_features,
+        )
 
     def test_nodestate_updates_node_state(self):
         """
@@ -505,6 +680,51 @@ class ControlAMPTests(ControlTestCase):
             self.control_amp_service.cluster_state.as_deployment(),
         )
 
+    def test_nodestate_diff_updates_node_state(self):
+        """
+        ``NodeStateDiffCommand`` updates the node state by applying the diff
+        to the changes of the preceding ``NodeStateCommand``.
+        """
+        changed = NODE_STATE.set(hostname=u"192.0.2.99")
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand,
+                                   state_changes=(NODE_STATE, NONMANIFEST),
+                                   sequence=1,
+                                   eliot_context=TEST_ACTION))
+        self.successResultOf(
+            self.client.callRemote(NodeStateDiffCommand,
+                                   state_diff=create_sequence_diff(
+                                       (NODE_STATE, NONMANIFEST),
+                                       (changed, NONMANIFEST)),
+                                   sequence=2,
+                                   eliot_context=TEST_ACTION))
+        self.assertEqual(
+            (DeploymentState(
+                nodes={changed},
+                nonmanifest_datasets=NONMANIFEST.datasets,
+            ), 2),
+            (self.control_amp_service.cluster_state.as_deployment(),
+             self.control_amp_service.node_changes),
+        )
+
+    def test_nodestate_diff_resync_required(self):
+        """
+        ``NodeStateDiffCommand`` fails with ``ResyncRequired`` if there was
+        no preceding ``NodeStateCommand`` with a sequence number.
+        """
+        self.successResultOf(
+            self.client.callRemote(NodeStateCommand,
+                                   state_changes=(NODE_STATE,),
+                                   eliot_context=TEST_ACTION))
+        self.failureResultOf(
+            self.client.callRemote(NodeStateDiffCommand,
+                                   state_diff=create_sequence_diff(
+                                       (NODE_STATE,), (NONMANIFEST,)),
+                                   sequence=2,
+                                   eliot_context=TEST_ACTION),
+            ResyncRequired,
+        )
+
     def test_activity_refreshes_node_state(self):
         """
         Any time commands are dispatched by ``ControlAMP`` its activity
@@ -563,6 +783,7 @@ class ControlAMPTests(ControlTestCase):
             self.client.callRemote(NodeStateCommand,
                                    state_changes=(NODE_STATE,),
                                    eliot_context=TEST_ACTION))
+        self.reactor.advance(NODE_CHANGED_COALESCE_WINDOW.total_seconds())
 
         cluster_state = self.control_amp_service.cluster_state.as_deployment()
         expected = dict(configuration=TEST_DEPLOYMENT, state=cluster_state)
@@ -609,6 +830,44 @@ class ControlAMPTests(ControlTestCase):
             self.control_amp_service.cluster_state.as_deployment(),
         )
 
+    def test_set_node_era_scope(self):
+        """
+        A ``SetNodeEraCommand`` with a cluster scope results in the scope being
+        recorded for the connection.
+        """
+        self.patch_call_remote([], self.protocol)
+        self.protocol.makeConnection(StringTransportWithAbort())
+        node_uuid = uuid4()
+        self.successResultOf(self.client.callRemote(
+            SetNodeEraCommand,
+            node_uuid=unicode(node_uuid), era=unicode(uuid4()),
+            cluster_scope=ClusterScope.NODE_DATASETS.value,
+        ))
+        self.assertEqual(
+            {self.protocol: AgentScope(scope=ClusterScope.NODE_DATASETS,
+                                       node_uuid=node_uuid)},
+            self.control_amp_service._agent_scopes,
+        )
+
+    def test_set_node_era_unknown_scope(self):
+        """
+        An unknown cluster scope in a ``SetNodeEraCommand`` is treated as
+        ``ClusterScope.CLUSTER``.
+        """
+        self.patch_call_remote([], self.protocol)
+        self.protocol.makeConnection(StringTransportWithAbort())
+        node_uuid = uuid4()
+        self.successResultOf(self.client.callRemote(
+            SetNodeEraCommand,
+            node_uuid=unicode(node_uuid), era=unicode(uuid4()),
+            cluster_scope=u"some-future-scope",
+        ))
+        self.assertEqual(
+            {self.protocol: AgentScope(scope=ClusterScope.CLUSTER,
+                                       node_uuid=node_uuid)},
+            self.control_amp_service._agent_scopes,
+        )
+
 
 class ControlAMPServiceTests(ControlTestCase):
     """
@@ -850,6 +1109,337 @@ class ControlAMPServiceTests(ControlTestCase):
         )
 
 
+class NodeChangeCoalescingTests(TestCase):
+    """
+    Tests for the coalescing of node state changes by ``ControlAMPService``.
+    """
+    WINDOW = NODE_CHANGED_COALESCE_WINDOW.total_seconds()
+    MAX_LATENCY = NODE_CHANGED_MAX_LATENCY.total_seconds()
+
+    def setUp(self):
+        super(NodeChangeCoalescingTests, self).setUp()
+        self.reactor = Clock()
+        self.service = build_control_amp_service(self, self.reactor)
+        self.broadcasts = []
+        self.patch(
+            self.service, "_send_state_to_connections",
+            lambda connections: self.broadcasts.append(
+                self.service.cluster_state.as_deployment()),
+        )
+
+    def node_changed(self, hostname=u"192.0.2.1"):
+        """
+        Tell the service a node's state changed.
+        """
+        self.service.node_changed(
+            ChangeSource(),
+            [NodeState(uuid=NODE_STATE.uuid, hostname=hostname)],
+        )
+
+    def test_not_immediate(self):
+        """
+        The cluster state isn't sent to agents as soon as a node state change
+        is received, though the change is applied to the cluster state.
+        """
+        self.node_changed()
+        self.assertEqual(
+            ([], DeploymentState(nodes={
+                NodeState(uuid=NODE_STATE.uuid, hostname=u"192.0.2.1")})),
+            (self.broadcasts, self.service.cluster_state.as_deployment()),
+        )
+
+    def test_coalesced(self):
+        """
+        Node state changes received within the coalescing window of each
+        other result in the latest cluster state being sent to agents once,
+        when no change has been received for the length of the window.
+        """
+        self.node_changed(u"192.0.2.1")
+        self.reactor.advance(self.WINDOW / 2)
+        self.node_changed(u"192.0.2.2")
+        self.reactor.advance(self.WINDOW / 2)
+        self.node_changed(u"192.0.2.3")
+        self.reactor.advance(self.WINDOW * 0.99)
+        before = list(self.broadcasts)
+        self.reactor.advance(self.WINDOW * 0.01)
+        self.assertEqual(
+            ([], [DeploymentState(nodes={
+                NodeState(uuid=NODE_STATE.uuid, hostname=u"192.0.2.3")})]),
+            (before, self.broadcasts),
+        )
+
+    def test_max_latency(self):
+        """
+        However often node state changes are received, the cluster state is
+        sent to agents no later than the maximum latency after the first
+        change.
+        """
+        while self.reactor.seconds() <= self.MAX_LATENCY:
+            self.node_changed()
+            self.reactor.advance(self.WINDOW / 2)
+        self.assertEqual(1, len(self.broadcasts))
+
+    def test_counters(self):
+        """
+        ``ControlAMPService`` counts the node state changes it received, the
+        times it sent the cluster state to all agents and the times it didn't
+        because changes were coalesced.
+        """
+        for _ in range(3):
+            self.node_changed()
+        self.reactor.advance(self.WINDOW)
+        self.node_changed()
+        self.reactor.advance(self.WINDOW)
+        self.assertEqual(
+            (4, 2, 2),
+            (self.service.node_changes, self.service.broadcasts,
+             self.service.broadcasts_saved),
+        )
+
+    @capture_logging(
+        assertHasMessage, LOG_COALESCED_NODE_CHANGES,
+        dict(node_changes=3, broadcasts_saved=2),
+    )
+    def test_logged(self, logger):
+        """
+        Sending the cluster state after coalescing node state changes is
+        logged.
+        """
+        for _ in range(3):
+            self.node_changed()
+        self.reactor.advance(self.WINDOW)
+
+    def test_configuration_change(self):
+        """
+        A configuration change while node state changes are being coalesced
+        sends the cluster state to agents immediately, including those
+        changes, and nothing more is sent once the window ends.
+        """
+        self.node_changed()
+        self.node_changed()
+        self.service.configuration_service.save(TEST_DEPLOYMENT)
+        self.reactor.advance(self.MAX_LATENCY)
+        self.assertEqual(
+            (1, 2),
+            (len(self.broadcasts), self.service.broadcasts_saved),
+        )
+
+    def test_no_window(self):
+        """
+        If the coalescing window is zero the cluster state is sent to agents
+        as soon as a node state change is received.
+        """
+        service = build_control_amp_service(
+            self, self.reactor, coalesce_window=timedelta(0),
+        )
+        sent = []
+        self.patch(service, "_send_state_to_connections", sent.append)
+        service.node_changed(ChangeSource(), [NODE_STATE])
+        service.node_changed(ChangeSource(), [NODE_STATE])
+        self.assertEqual(
+            (2, 0), (len(sent), service.broadcasts_saved),
+        )
+
+    def test_stop_service(self):
+        """
+        Stopping the service cancels the sending of coalesced node state
+        changes.
+        """
+        self.service.startService()
+        self.node_changed()
+        self.service.stopService()
+        self.reactor.advance(self.MAX_LATENCY)
+        self.assertEqual([], self.broadcasts)
+
+
+class ClusterStatusDiffTests(TestCase):
+    """
+    Tests for sending ``ClusterStatusDiffCommand`` from
+    ``ControlAMPService``.
+    """
+    def setUp(self):
+        super(ClusterStatusDiffTests, self).setUp()
+        self.agent = FakeAgent()
+        self.client = AgentAMP(Clock(), self.agent)
+        self.service = build_control_amp_service(self)
+        self.service.startService()
+        loopback = LoopbackAMPClient(self.client.locator)
+        self.sent = []
+        call_remote = loopback.callRemote
+
+        def record_call_remote(command, **kwargs):
+            self.sent.append(command)
+            return call_remote(command, **kwargs)
+        self.patch(loopback, "callRemote", record_call_remote)
+        self.server = DelayedAMPClient(loopback)
+
+    def connect(self, features):
+        """
+        Connect the agent to the service, announcing the given features, and
+        acknowledge the initial complete update.
+
+        :param features: The features the agent announces.
+        """
+        self.service.connected(self.server)
+        self.service.set_agent_features(self.server, features)
+        self.server.respond()
+
+    def test_diff_after_acknowledgement(self):
+        """
+        Once an agent which supports diffs has acknowledged a complete
+        update, further updates are sent as a ``ClusterStatusDiffCommand``
+        and result in the agent having the new configuration.
+        """
+        self.connect([FEATURE_CLUSTER_STATUS_DIFFS])
+        configuration = arbitrary_transformation(
+            self.service.configuration_service.get()
+        )
+        self.service.configuration_service.save(configuration)
+        self.server.respond()
+        self.assertEqual(
+            (ClusterStatusDiffCommand, configuration, DeploymentState()),
+            (self.sent[-1], self.agent.desired, self.agent.actual),
+        )
+
+    def test_no_diff_without_feature(self):
+        """
+        Agents which did not announce ``FEATURE_CLUSTER_STATUS_DIFFS`` are
+        always sent complete updates.
+        """
+        self.connect([])
+        self.service.configuration_service.save(
+            arbitrary_transformation(self.service.configuration_service.get())
+        )
+        self.assertEqual(ClusterStatusCommand, self.sent[-1])
+
+    def test_no_diff_before_acknowledgement(self):
+        """
+        An update following one which has not been acknowledged is sent
+        complete.
+        """
+        self.service.connected(self.server)
+        self.service.set_agent_features(
+            self.server, [FEATURE_CLUSTER_STATUS_DIFFS])
+        d, _ = self.server._calls.pop()
+        d.errback(ConnectionLost())
+        self.service.configuration_service.save(
+            arbitrary_transformation(self.service.configuration_service.get())
+        )
+        self.assertEqual(ClusterStatusCommand, self.sent[-1])
+
+    def test_resync_on_missing_status(self):
+        """
+        If the agent cannot apply a diff because it has no complete status,
+        a complete update is sent immediately.
+        """
+        self.connect([FEATURE_CLUSTER_STATUS_DIFFS])
+        # Forget what the agent knows, as if it had been restarted behind
+        # the control service's back.
+        self.client.locator._configuration = None
+        configuration = arbitrary_transformation(
+            self.service.configuration_service.get()
+        )
+        self.service.configuration_service.save(configuration)
+        self.server.respond()
+        self.server.respond()
+        self.assertEqual(
+            ([ClusterStatusCommand, ClusterStatusDiffCommand,
+              ClusterStatusCommand], configuration),
+            (self.sent, self.agent.desired),
+        )
+
+    def test_disconnect_forgets(self):
+        """
+        When a connection is lost, the features and acknowledged status
+        recorded for it are discarded.
+        """
+        self.connect([FEATURE_CLUSTER_STATUS_DIFFS])
+        self.service.disconnected(self.server)
+        self.assertEqual(
+            ({}, {}),
+            (self.service._agent_features, self.service._last_acknowledged),
+        )
+
+    @capture_logging(None)
+    def test_logging(self, logger):
+        """
+        Sending a diff is logged as a ``LOG_SEND_DIFF_TO_AGENT`` action.
+        """
+        self.connect([FEATURE_CLUSTER_STATUS_DIFFS])
+        self.service.configuration_service.save(
+            arbitrary_transformation(self.service.configuration_service.get())
+        )
+        self.server.respond()
+        assertHasAction(
+            self, logger, LOG_SEND_DIFF_TO_AGENT, succeeded=True,
+            startFields={"agent": self.server},
+        )
+
+
+class ScopedUpdateTests(TestCase):
+    """
+    Tests for sending scoped views of the cluster from
+    ``ControlAMPService``.
+    """
+    def setUp(self):
+        super(ScopedUpdateTests, self).setUp()
+        self.agent = FakeAgent()
+        self.client = AgentAMP(Clock(), self.agent)
+        self.service = build_control_amp_service(self)
+        self.service.startService()
+        self.server = LoopbackAMPClient(self.client.locator)
+        self.node = Node(uuid=uuid4())
+        self.other_node = Node(uuid=uuid4())
+        self.service.configuration_service.save(
+            Deployment(nodes={self.node, self.other_node})
+        )
+        self.service.connected(self.server)
+        self.service.set_agent_scope(
+            self.server,
+            AgentScope(scope=ClusterScope.NODE_DATASETS,
+                       node_uuid=self.node.uuid),
+        )
+
+    def test_scoped_view(self):
+        """
+        Agents which declared a scope are only sent their view of the
+        cluster.
+        """
+        configuration = Deployment(nodes={
+            self.node.set(manifestations={
+                MANIFESTATION.dataset_id: MANIFESTATION,
+            }),
+            self.other_node,
+        })
+        self.service.configuration_service.save(configuration)
+        self.assertEqual(
+            Deployment(nodes={configuration.get_node(self.node.uuid)}),
+            self.agent.desired,
+        )
+
+    @capture_logging(None)
+    def test_unchanged_view_not_sent(self, logger):
+        """
+        Agents which declared a scope are not sent an update if their view of
+        the cluster is unchanged since the last acknowledged update.
+        """
+        # Acknowledge the first scoped view:
+        self.service.configuration_service.save(
+            Deployment(nodes={self.node})
+        )
+        sent = []
+        self.patch(self.server, "callRemote",
+                   lambda *args, **kwargs: sent.append(args))
+        self.service.configuration_service.save(
+            Deployment(nodes={self.node, Node(uuid=uuid4())})
+        )
+        self.assertEqual(
+            ([], 1),
+            (sent, len(LoggedMessage.of_type(
+                logger.messages, AGENT_UPDATE_UNCHANGED))),
+        )
+
+
 @implementer(IConvergenceAgent)
 @attributes([Attribute("is_connected", default_value=False),
              Attribute("is_disconnected", default_value=False),
@@ -875,6 +1465,134 @@ class FakeAgent(object):
         self.actual = cluster_state
 
 
+class _RecordingAgent(FakeAgent):
+    """
+    A ``FakeAgent`` which records all the configurations it is sent.
+    """
+    def __init__(self):
+        self.configurations = []
+
+    def cluster_updated(self, configuration, cluster_state):
+        FakeAgent.cluster_updated(self, configuration, cluster_state)
+        self.configurations.append(configuration)
+
+
+class ThreadedSerializationTests(TestCase):
+    """
+    Tests for ``ControlAMPService`` serializing the configuration and state it
+    sends in a threadpool.
+    """
+    def setUp(self):
+        super(ThreadedSerializationTests, self).setUp()
+        self.threadpool = ManualThreadPool()
+        self.reactor = ThreadClock()
+        self.service = build_control_amp_service(
+            self, self.reactor, threadpool=self.threadpool,
+        )
+        # A configuration which hasn't been serialized before:
+        self.configuration = Deployment(nodes={Node(uuid=uuid4())})
+        self.service.configuration_service.save(self.configuration)
+        self.reactor.advance(0)
+        self.agent = _RecordingAgent()
+        self.server = LoopbackAMPClient(
+            AgentAMP(Clock(), self.agent).locator)
+
+    def test_no_connections(self):
+        """
+        Nothing is serialized if there is nobody to send the configuration
+        and state to.
+        """
+        self.assertEqual([], self.threadpool.calls)
+
+    def test_serialized_before_sending(self):
+        """
+        The configuration and state are serialized in the threadpool, and
+        only sent once that is done.
+        """
+        self.service.connected(self.server)
+        before = list(self.agent.configurations)
+        [(_, _, (encodings,), _)] = self.threadpool.calls
+        self.threadpool.run()
+        self.assertEqual(
+            ([], {(caching_wire_encode, self.configuration),
+                  (caching_wire_encode,
+                   self.service.cluster_state.as_deployment())},
+             [self.configuration]),
+            (before, set(encodings), self.agent.configurations),
+        )
+
+    def test_binary_wire_format(self):
+        """
+        The binary wire format encoding is also done in the threadpool for
+        connections using it.
+        """
+        self.server.binary_wire_format = True
+        self.service.connected(self.server)
+        [(_, _, (encodings,), _)] = self.threadpool.calls
+        self.assertEqual(
+            {caching_wire_encode, caching_binary_wire_encode},
+            {encode for (encode, obj) in encodings},
+        )
+
+    def test_scoped(self):
+        """
+        Nothing needs serializing in the threadpool for agents which are only
+        sent scoped views.
+        """
+        self.service.connections.add(self.server)
+        self.service.set_agent_scope(self.server, AgentScope(
+            scope=ClusterScope.NODE_DATASETS, node_uuid=uuid4(),
+        ))
+        self.assertEqual(
+            [caching_wire_encode, caching_wire_encode],
+            [encode for (encode, obj) in self.service._encodings_needed(
+                [self.server], self.configuration, DeploymentState(
+                    nodes={NodeState(uuid=uuid4(), hostname=u"192.0.2.1")}),
+            )],
+        )
+
+    def test_already_serialized(self):
+        """
+        If the configuration and state have already been serialized they are
+        sent immediately.
+        """
+        self.service.connected(self.server)
+        self.threadpool.run()
+        self.service._send_state_to_connections([self.server])
+        self.assertEqual(
+            ([], [self.configuration, self.configuration]),
+            (self.threadpool.calls, self.agent.configurations),
+        )
+
+    def test_updates_in_order(self):
+        """
+        Updates requested while serializing wait until it is done, and are
+        then sent the latest configuration.
+        """
+        self.service.connected(self.server)
+        changed = Deployment(nodes={Node(uuid=uuid4())})
+        self.service.configuration_service.save(changed)
+        self.reactor.advance(0)
+        self.threadpool.run()
+        self.threadpool.run()
+        self.assertEqual(
+            [self.configuration, changed], self.agent.configurations,
+        )
+
+    def test_disconnected(self):
+        """
+        Agents which disconnect while the configuration and state are being
+        serialized are not sent them.
+        """
+        self.service.connected(self.server)
+        self.service.disconnected(self.server)
+        self.threadpool.run()
+        self.assertEqual(
+            ([], {}),
+            (self.agent.configurations, self.service._current_command),
+        )
+
+
 TEST_ACTION = start_action(MemoryLogger(), 'test:action')
 
 
@@ -991,6 +1709,93 @@ class AgentClientTests(TestCase):
                                                desired=TEST_DEPLOYMENT,
                                                actual=actual))
 
+    def test_cluster_updated_diff(self):
+        """
+        ``ClusterStatusDiffCommand`` sent to the ``AgentClient`` after a
+        ``ClusterStatusCommand`` results in the agent having the cluster
+        state with the diffs applied.
+        """
+        actual = DeploymentState(nodes=[])
+        self.successResultOf(self.server.callRemote(
+            ClusterStatusCommand,
+            configuration=TEST_DEPLOYMENT,
+            state=actual,
+            eliot_context=TEST_ACTION
+        ))
+        configuration = arbitrary_transformation(TEST_DEPLOYMENT)
+        state = actual.update_node(NODE_STATE)
+        self.successResultOf(self.server.callRemote(
+            ClusterStatusDiffCommand,
+            configuration_diff=create_diff(TEST_DEPLOYMENT, configuration),
+            state_diff=create_diff(actual, state),
+            eliot_context=TEST_ACTION
+        ))
+        self.assertEqual(
+            (configuration, state), (self.agent.desired, self.agent.actual),
+        )
+
+    def test_cluster_updated_diff_without_status(self):
+        """
+        ``ClusterStatusDiffCommand`` sent to the ``AgentClient`` before any
+        ``ClusterStatusCommand`` fails with ``MissingClusterStatus``.
+        """
+        d = self.server.callRemote(
+            ClusterStatusDiffCommand,
+            configuration_diff=create_diff(TEST_DEPLOYMENT, TEST_DEPLOYMENT),
+            state_diff=create_diff(DeploymentState(), DeploymentState()),
+            eliot_context=TEST_ACTION
+        )
+        self.failureResultOf(d, MissingClusterStatus)
+        self.assertEqual(None, self.agent.desired)
+
+    def test_announces_features(self):
+        """
+        When the connection is made, the agent sends a ``VersionCommand``
+        listing the features it supports.
+        """
+        sent = self.client.transport.value()
+        self.assertEqual(
+            (True, True),
+            (VersionCommand.commandName in sent,
+             FEATURE_CLUSTER_STATUS_DIFFS.encode("ascii") in sent),
+        )
+
+    def test_binary_wire_format_negotiated(self):
+        """
+        If the control service's response to ``VersionCommand`` includes
+        ``FEATURE_BINARY_WIRE_FORMAT`` the agent starts using the binary wire
+        format.
+        """
+        initial = self.client.binary_wire_format
+        self.client._got_version(
+            {"major": 1, "features": [FEATURE_BINARY_WIRE_FORMAT]})
+        self.assertEqual(
+            (False, True), (initial, self.client.binary_wire_format),
+        )
+
+    def test_node_state_diffs_negotiated(self):
+        """
+        If the control service's response to ``VersionCommand`` includes
+        ``FEATURE_NODE_STATE_DIFFS`` the agent may send node state diffs.
+        """
+        initial = self.client.node_state_diffs
+        self.client._got_version(
+            {"major": 1, "features": [FEATURE_NODE_STATE_DIFFS]})
+        self.assertEqual(
+            (False, True), (initial, self.client.node_state_diffs),
+        )
+
+    def test_old_control_service(self):
+        """
+        If the control service's response to ``VersionCommand`` includes no
+        features, the agent keeps using JSON and sends complete node state.
+        """
+        self.client._got_version({"major": 1})
+        self.assertEqual(
+            (False, False),
+            (self.client.binary_wire_format, self.client.node_state_diffs),
+        )
+
 
 def iconvergence_agent_tests_factory(fixture):
     """
@@ -1084,6 +1889,17 @@ class ClusterStatusCommandTests(TestCase):
             ['configuration', 'state', 'eliot_context'],
             (v[0] for v in ClusterStatusCommand.arguments))
 
+    def test_framed(self):
+        """
+        ``ClusterStatusCommand`` and ``ClusterStatusDiffCommand`` are sent as
+        ``_FramedBox``, since they are sent to many agents at once.
+        """
+        self.assertEqual(
+            (_FramedBox, _FramedBox),
+            (ClusterStatusCommand.commandType,
+             ClusterStatusDiffCommand.commandType),
+        )
+
 
 class AgentLocatorTests(TestCase):
     """
@@ -1100,7 +1916,8 @@ class AgentLocatorTests(TestCase):
         reactor = Clock()
         protocol = AgentAMP(reactor, fake_agent)
         locator = _AgentLocator(
-            agent=fake_agent, timeout=timeout_for_protocol(reactor, protocol))
+            agent=fake_agent,
+            timeout=timeout_for_protocol(TimerWheel(reactor), protocol))
         self.assertIs(logger, locator.logger)
 
 
@@ -1122,7 +1939,7 @@ class ControlServiceLocatorTests(TestCase):
         locator = ControlServiceLocator(
             reactor=reactor,
             control_amp_service=fake_control_amp_service,
-            timeout=timeout_for_protocol(reactor, protocol)
+            timeout=timeout_for_protocol(TimerWheel(reactor), protocol)
         )
         self.assertIs(logger, locator.logger)
 
@@ -1214,6 +2031,20 @@ class PingTestsMixin(object):
         reactor.advance(PING_INTERVAL.total_seconds())
         self.assertEqual(b"", transport.value())
 
+    def test_timers_cancelled_on_connection_lost(self):
+        """
+        When the protocol loses its connection, its ping and timeout timers
+        are cancelled and the delayed call which was needed for them, from
+        when the protocol was created, is no longer scheduled.
+        """
+        reactor = Clock()
+        protocol = self.build_protocol(reactor)
+        before = len(reactor.getDelayedCalls())
+        protocol.makeConnection(StringTransportWithAbort())
+        protocol.connectionLost(Failure(ConnectionDone("test, simulated")))
+        reactor.advance(1)
+        self.assertEqual(before - 1, len(reactor.getDelayedCalls()))
+
 
 class ControlAMPPingTests(TestCase, PingTestsMixin):
     """
@@ -1225,6 +2056,24 @@ class ControlAMPPingTests(TestCase, PingTestsMixin):
         )
         return ControlAMP(reactor, control_amp_service)
 
+    def test_shared_timer_wheel(self):
+        """
+        All the connections to a ``ControlAMPService`` schedule their pings
+        and timeouts on the service's ``TimerWheel``, which needs a single
+        delayed call however many connections there are.
+        """
+        reactor = Clock()
+        control_amp_service = build_control_amp_service(self, reactor)
+        before = len(reactor.getDelayedCalls())
+        for _ in range(3):
+            protocol = ControlAMP(reactor, control_amp_service)
+            protocol.makeConnection(StringTransportWithAbort())
+        self.assertEqual(
+            (6, before + 1),
+            (len(control_amp_service.timer_wheel),
+             len(reactor.getDelayedCalls())),
+        )
+
 
 class AgentAMPPingTests(TestCase, PingTestsMixin):
     """
@@ -1264,3 +2113,33 @@ class CachingWireEncodeTests(TestCase):
              caching_wire_encode(TEST_DEPLOYMENT) is result1,
              caching_wire_encode(NODE_STATE) is result2],
             [True, True, True, True])
+
+    def test_equal_objects(self):
+        """
+        ``caching_wire_encode`` returns the cached result for an object equal
+        to one it has already encoded.
+        """
+        result = caching_wire_encode(TEST_DEPLOYMENT)
+        self.assertIs(
+            result,
+            caching_wire_encode(Deployment(nodes=TEST_DEPLOYMENT.nodes)),
+        )
+
+    def test_same_object_not_hashed(self):
+        """
+        ``caching_wire_encode`` returns the cached result for an object it
+        has already encoded without hashing it again, since hashing large
+        objects is expensive.
+        """
+        hashed = []
+
+        class HashCountingDeployment(Deployment):
+            def __hash__(self):
+                hashed.append(self)
+                return Deployment.__hash__(self)
+
+        deployment = HashCountingDeployment(nodes=TEST_DEPLOYMENT.nodes)
+        caching_wire_encode(deployment)
+        del hashed[:]
+        caching_wire_encode(deployment)
+        self.assertEqual([], hashed)
@@ -0,0 +1,188 @@
+# Copyright ClusterHQ Inc.  See LICENSE file for details.
+
+"""
+Tests for ``flocker.control._scope``.
+"""
+
+from datetime import datetime
+from uuid import uuid4
+
+from pytz import UTC
+
+from .._scope import AgentScope, ClusterScope, ClusterViews
+from .._model import (
+    Deployment, DeploymentState, Node, NodeState, Application, DockerImage,
+    Port, Leases, PersistentState, BlockDeviceOwnership,
+)
+
+from ...testtools import TestCase
+
+IMAGE = DockerImage.from_string(u"postgres")
+EXPOSED = Application(
+    name=u"exposed", image=IMAGE,
+    ports={Port(internal_port=5432, external_port=15432)},
+    environment={u"SECRET": u"value"},
+)
+HIDDEN = Application(name=u"hidden", image=IMAGE)
+
+LOCAL = Node(uuid=uuid4(), applications={HIDDEN, EXPOSED.set(
+    name=u"local-exposed")})
+REMOTE = Node(uuid=uuid4(), applications={EXPOSED, HIDDEN})
+QUIET = Node(uuid=uuid4(), applications={HIDDEN})
+
+LOCAL_ERA = uuid4()
+LOCAL_LEASE_DATASET = uuid4()
+NOW = datetime(2016, 1, 1, tzinfo=UTC)
+LEASES = Leases().acquire(
+    NOW, LOCAL_LEASE_DATASET, LOCAL.uuid,
+).acquire(
+    NOW, uuid4(), REMOTE.uuid,
+)
+PERSISTENT_STATE = PersistentState(
+    blockdevice_ownership=BlockDeviceOwnership({uuid4(): u"block-1"}),
+)
+CONFIGURATION = Deployment(
+    nodes={LOCAL, REMOTE, QUIET},
+    leases=LEASES,
+    persistent_state=PERSISTENT_STATE,
+)
+
+LOCAL_STATE = NodeState(uuid=LOCAL.uuid, hostname=u"192.0.2.1",
+                        applications=LOCAL.applications)
+REMOTE_STATE = NodeState(uuid=REMOTE.uuid, hostname=u"192.0.2.2",
+                         applications=REMOTE.applications)
+QUIET_STATE = NodeState(uuid=QUIET.uuid, hostname=u"192.0.2.3")
+STATE = DeploymentState(
+    nodes={LOCAL_STATE, REMOTE_STATE, QUIET_STATE},
+    node_uuid_to_era={LOCAL.uuid: LOCAL_ERA, REMOTE.uuid: uuid4()},
+)
+
+
+class ClusterViewsTests(TestCase):
+    """
+    Tests for ``ClusterViews``.
+    """
+    def setUp(self):
+        super(ClusterViewsTests, self).setUp()
+        self.views = ClusterViews(CONFIGURATION, STATE)
+
+    def test_no_scope(self):
+        """
+        Agents without a scope get the original configuration and state.
+        """
+        configuration, state = self.views.view(None)
+        self.assertEqual(
+            (True, True),
+            (configuration is CONFIGURATION, state is STATE),
+        )
+
+    def test_cluster_scope(self):
+        """
+        Agents with ``ClusterScope.CLUSTER`` get the original configuration
+        and state.
+        """
+        configuration, state = self.views.view(
+            AgentScope(scope=ClusterScope.CLUSTER, node_uuid=LOCAL.uuid)
+        )
+        self.assertEqual(
+            (True, True),
+            (configuration is CONFIGURATION, state is STATE),
+        )
+
+    def test_node_datasets(self):
+        """
+        Agents with ``ClusterScope.NODE_DATASETS`` get their own node's
+        configuration and state, the leases held by their node and the
+        persistent state.
+        """
+        self.assertEqual(
+            (
+                Deployment(
+                    nodes={LOCAL},
+                    leases=Leases({LOCAL_LEASE_DATASET: LEASES[
+                        LOCAL_LEASE_DATASET]}),
+                    persistent_state=PERSISTENT_STATE,
+                ),
+                DeploymentState(
+                    nodes={LOCAL_STATE},
+                    node_uuid_to_era={LOCAL.uuid: LOCAL_ERA},
+                ),
+            ),
+            self.views.view(
+                AgentScope(scope=ClusterScope.NODE_DATASETS,
+                           node_uuid=LOCAL.uuid)
+            ),
+        )
+
+    def test_node_datasets_unknown_node(self):
+        """
+        Agents on nodes the cluster knows nothing about get an empty view.
+        """
+        self.assertEqual(
+            (Deployment(persistent_state=PERSISTENT_STATE),
+             DeploymentState()),
+            self.views.view(
+                AgentScope(scope=ClusterScope.NODE_DATASETS,
+                           node_uuid=uuid4())
+            ),
+        )
+
+    def test_node_applications(self):
+        """
+        Agents with ``ClusterScope.NODE_APPLICATIONS`` get their own node's
+        configuration and state, plus the exposed applications and the
+        address of other nodes.
+        """
+        self.assertEqual(
+            (
+                Deployment(
+                    nodes={
+                        LOCAL,
+                        Node(uuid=REMOTE.uuid, applications={
+                            Application(name=EXPOSED.name, image=IMAGE,
+                                        ports=EXPOSED.ports),
+                        }),
+                    },
+                    persistent_state=PERSISTENT_STATE,
+                ),
+                DeploymentState(
+                    nodes={
+                        LOCAL_STATE,
+                        NodeState(uuid=REMOTE.uuid, hostname=u"192.0.2.2"),
+                    },
+                    node_uuid_to_era={LOCAL.uuid: LOCAL_ERA},
+                ),
+            ),
+            self.views.view(
+                AgentScope(scope=ClusterScope.NODE_APPLICATIONS,
+                           node_uuid=LOCAL.uuid)
+            ),
+        )
+
+    def test_memoized(self):
+        """
+        Agents with the same scope on the same node share a view.
+        """
+        first = self.views.view(
+            AgentScope(scope=ClusterScope.NODE_DATASETS, node_uuid=LOCAL.uuid)
+        )
+        second = self.views.view(
+            AgentScope(scope=ClusterScope.NODE_DATASETS, node_uuid=LOCAL.uuid)
+        )
+        self.assertIs(first, second)
+
+    def test_unaffected_by_other_nodes(self):
+        """
+        Changes to other nodes don't change the ``ClusterScope.NODE_DATASETS``
+        view of a node.
+        """
+        agent_scope = AgentScope(
+            scope=ClusterScope.NODE_DATASETS, node_uuid=LOCAL.uuid,
+        )
+        changed = ClusterViews(
+            CONFIGURATION.update_node(REMOTE.set(applications={HIDDEN})),
+            STATE.update_node(REMOTE_STATE.set(hostname=u"192.0.2.99")),
+        )
+        self.assertEqual(
+            self.views.view(agent_scope), changed.view(agent_scope),
+        )
@@ -1,12 +1,16 @@
 # Copyright ClusterHQ Inc.  See LICENSE file for details.
 
+from datetime import timedelta
+
 from twisted.python.filepath import FilePath
+from twisted.python.usage import UsageError
 
 from ..script import ControlOptions, ControlScript
 from ...testtools import (
     MemoryCoreReactor, make_standard_options_test, TestCase,
 )
 from .._clusterstate import ClusterStateService
+from .._protocol import NODE_CHANGED_COALESCE_WINDOW, NODE_CHANGED_MAX_LATENCY
 from ..httpapi import REST_API_PORT
 
 from ...ca.testtools import get_credential_sets
@@ -69,6 +73,92 @@ class ControlOptionsTests(make_standard_options_test(ControlOptions)):
         options.parseOptions([b"--agent-port", b"tcp:1234"])
         self.assertEqual(options["agent-port"], b"tcp:1234")
 
+    def test_default_node_state_coalescing(self):
+        """
+        By default node state changes are coalesced using
+        ``NODE_CHANGED_COALESCE_WINDOW`` and ``NODE_CHANGED_MAX_LATENCY``.
+        """
+        options = ControlOptions()
+        options.parseOptions([])
+        self.assertEqual(
+            (NODE_CHANGED_COALESCE_WINDOW.total_seconds(),
+             NODE_CHANGED_MAX_LATENCY.total_seconds()),
+            (options["node-state-coalesce-window"],
+             options["node-state-max-latency"]),
+        )
+
+    def test_serialize_in_thread(self):
+        """
+        Serialization in a thread is disabled by default and enabled by the
+        ``--serialize-in-thread`` command-line option.
+        """
+        default = ControlOptions()
+        default.parseOptions([])
+        options = ControlOptions()
+        options.parseOptions([b"--serialize-in-thread"])
+        self.assertEqual(
+            (False, True),
+            (bool(default["serialize-in-thread"]),
+             bool(options["serialize-in-thread"])),
+        )
+
+    def test_journal_configuration(self):
+        """
+        Journalling of configuration changes is disabled by default and
+        enabled by the ``--journal-configuration`` command-line option.
+        """
+        default = ControlOptions()
+        default.parseOptions([])
+        options = ControlOptions()
+        options.parseOptions([b"--journal-configuration"])
+        self.assertEqual(
+            (False, True),
+            (bool(default["journal-configuration"]),
+             bool(options["journal-configuration"])),
+        )
+
+    def test_configuration_database(self):
+        """
+        Keeping the configuration in a database is disabled by default and
+        enabled by the ``--configuration-database`` command-line option.
+        """
+        default = ControlOptions()
+        default.parseOptions([])
+        options = ControlOptions()
+        options.parseOptions([b"--configuration-database"])
+        self.assertEqual(
+            (False, True),
+            (bool(default["configuration-database"]),
+             bool(options["configuration-database"])),
+        )
+
+    def test_journal_and_database(self):
+        """
+        ``--journal-configuration`` and ``--configuration-database`` can't be
+        used together.
+        """
+        options = ControlOptions()
+        self.assertRaises(
+            UsageError, options.parseOptions,
+            [b"--journal-configuration", b"--configuration-database"],
+        )
+
+    def test_custom_node_state_coalescing(self):
+        """
+        The ``--node-state-coalesce-window`` and ``--node-state-max-latency``
+        command-line options are converted to ``float``.
+        """
+        options = ControlOptions()
+        options.parseOptions([
+            b"--node-state-coalesce-window", b"0.5",
+            b"--node-state-max-latency", b"3",
+        ])
+        self.assertEqual(
+            (0.5, 3.0),
+            (options["node-state-coalesce-window"],
+             options["node-state-max-latency"]),
+        )
+
 
 class ControlScriptTests(TestCase):
     """
@@ -86,11 +176,14 @@ class ControlScriptTests(TestCase):
         self.script = ControlScript()
         self.options = ControlOptions()
         self.data_path = FilePath(self.mktemp())
-        self.options.parseOptions([
+        self.options_arguments = [
             b"--port", b"tcp:8001", b"--agent-port", b"tcp:8002",
             b"--data-path", self.data_path.path,
-            b"--certificates-directory", self.certificate_path.path
-        ])
+            b"--certificates-directory", self.certificate_path.path,
+            b"--node-state-coalesce-window", b"0.5",
+            b"--node-state-max-latency", b"3",
+        ]
+        self.options.parseOptions(self.options_arguments)
 
     def test_no_immediate_stop(self):
         """
@@ -118,3 +211,79 @@ class ControlScriptTests(TestCase):
         service = control_resource._v1_user.cluster_state_service
         self.assertEqual((service.__class__, service.running),
                          (ClusterStateService, True))
+
+    def test_node_state_coalescing(self):
+        """
+        ``ControlScript.main`` configures the control service to coalesce
+        node state changes as given by the command-line options.
+        """
+        reactor = MemoryCoreReactor()
+        self.script.main(reactor, self.options)
+        service = self.control_amp_service(reactor)
+        self.assertEqual(
+            (timedelta(seconds=0.5), timedelta(seconds=3)),
+            (timedelta(seconds=service._coalesce_window),
+             timedelta(seconds=service._max_coalesce_latency)),
+        )
+
+    def control_amp_service(self, reactor):
+        """
+        :return: The ``ControlAMPService`` started by the script.
+        """
+        server = reactor.tcpServers[1]
+        return server[1].wrappedFactory.buildProtocol(
+            None).control_amp_service
+
+    def test_no_threadpool(self):
+        """
+        By default ``ControlScript.main`` configures the control service to
+        serialize in the reactor thread.
+        """
+        reactor = MemoryCoreReactor()
+        self.script.main(reactor, self.options)
+        self.assertIs(None, self.control_amp_service(reactor)._threadpool)
+
+    def test_threadpool(self):
+        """
+        With ``--serialize-in-thread`` ``ControlScript.main`` configures the
+        control service to serialize in the reactor's threadpool.
+        """
+        threadpool = object()
+        reactor = MemoryCoreReactor()
+        reactor.getThreadPool = lambda: threadpool
+        self.options.parseOptions(
+            self.options_arguments + [b"--serialize-in-thread"])
+        self.script.main(reactor, self.options)
+        self.assertIs(
+            threadpool, self.control_amp_service(reactor)._threadpool)
+
+    def test_persistence_no_threadpool(self):
+        """
+        By default ``ControlScript.main`` configures the configuration
+        persistence service to save in the reactor thread.
+        """
+        reactor = MemoryCoreReactor()
+        self.script.main(reactor, self.options)
+        self.assertIs(
+            None,
+            self.control_amp_service(
+                reactor).configuration_service._threadpool,
+        )
+
+    def test_persistence_threadpool(self):
+        """
+        With ``--save-in-thread`` ``ControlScript.main`` configures the
+        configuration persistence service to save in the reactor's
+        threadpool.
+        """
+        threadpool = object()
+        reactor = MemoryCoreReactor()
+        reactor.getThreadPool = lambda: threadpool
+        self.options.parseOptions(
+            self.options_arguments + [b"--save-in-thread"])
+        self.script.main(reactor, self.options)
+        self.assertIs(
+            threadpool,
+            self.control_amp_service(
+                reactor).configuration_service._threadpool,
+        )
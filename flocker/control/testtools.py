@@ -9,6 +9,7 @@ from zope.interface.verify import verifyObject
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.internet.ssl import ClientContextFactory
 from twisted.internet.task import Clock
+from twisted.python.failure import Failure
 from twisted.test.proto_helpers import MemoryReactor
 
 from ..testtools import TestCase
@@ -33,6 +34,8 @@ __all__ = [
     'InMemoryStatePersister',
     'make_istatepersister_tests',
     'make_loopback_control_client',
+    'ManualThreadPool',
+    'ThreadClock',
 ]
 
 
@@ -107,16 +110,17 @@ def make_istatepersister_tests(fixture):
     return IStatePersisterTests
 
 
-def build_control_amp_service(test_case, reactor=None):
+def build_control_amp_service(test_case, reactor=None, **kwargs):
     """
     Create a new ``ControlAMPService``.
 
     :param TestCase test_case: The test this service is for.
+    :param kwargs: Additional keyword arguments for ``ControlAMPService``.
 
     :return ControlAMPService: Not started.
     """
     if reactor is None:
-        reactor = Clock()
+        reactor = EagerClock()
     cluster_state = ClusterStateService(reactor)
     cluster_state.startService()
     test_case.addCleanup(cluster_state.stopService)
@@ -129,6 +133,7 @@ def build_control_amp_service(test_case, reactor=None):
         TCP4ServerEndpoint(MemoryReactor(), 1234),
         # Easiest TLS context factory to create:
         ClientContextFactory(),
+        **kwargs
     )
 
 
@@ -144,3 +149,55 @@ def make_loopback_control_client(test_case, reactor):
         command_locator=ControlAMP(reactor, control_amp_service).locator,
     )
     return control_amp_service, client
+
+
+class ManualThreadPool(object):
+    """
+    A stand-in for ``twisted.python.threadpool.ThreadPool`` which runs the
+    functions given to it in the calling thread, when told to.
+
+    :ivar list calls: The calls waiting to be run, as tuples of the callback
+        for the result, the function and its positional and keyword
+        arguments.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kw):
+        self.calls.append((onResult, func, args, kw))
+
+    def run(self):
+        """
+        Run the oldest waiting call.
+        """
+        onResult, func, args, kw = self.calls.pop(0)
+        try:
+            result = func(*args, **kw)
+        except:
+            onResult(False, Failure())
+        else:
+            onResult(True, result)
+
+
+class ThreadClock(Clock):
+    """
+    A ``Clock`` which also lets ``ManualThreadPool`` return results.
+    """
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+class EagerClock(Clock):
+    """
+    A ``Clock`` which runs calls scheduled without a delay straight away,
+    rather than when it is next advanced.
+
+    This lets a ``ConfigurationPersistenceService`` commit each save as it is
+    made, for tests of the code using the service rather than of the service
+    itself.
+    """
+    def callLater(self, delay, f, *args, **kwargs):
+        call = Clock.callLater(self, delay, f, *args, **kwargs)
+        if delay <= 0:
+            self.advance(0)
+        return call
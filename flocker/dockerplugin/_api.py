@@ -26,11 +26,12 @@ from klein import Klein
 from ..restapi import (
     structured, EndpointResponse, BadRequest, make_bad_request,
 )
-from ..apiclient import DatasetAlreadyExists, conditional_create
+from ..apiclient import (
+    DatasetAlreadyExists, conditional_create, wait_for_state,
+)
 from ..node.agents.blockdevice import PROFILE_METADATA_KEY
 from ..common import (
-    RACKSPACE_MINIMUM_VOLUME_SIZE, DEVICEMAPPER_LOOPBACK_SIZE,
-    loop_until, timeout,
+    RACKSPACE_MINIMUM_VOLUME_SIZE, DEVICEMAPPER_LOOPBACK_SIZE, timeout,
 )
 
 
@@ -224,12 +225,12 @@ class VolumePlugin(object):
         :return: ``Deferred`` firing with dataset ID as ``UUID``, or
             errbacks with ``_NotFound`` if no dataset was found.
         """
-        listing = self._flocker_client.list_datasets_configuration()
+        listing = self._flocker_client.list_datasets_configuration(
+            metadata={NAME_FIELD: name})
 
         def got_configured(configured):
             for dataset in configured:
-                if dataset.metadata.get(NAME_FIELD) == name:
-                    return dataset.dataset_id
+                return dataset.dataset_id
             raise NOT_FOUND_RESPONSE
 
         listing.addCallback(got_configured)
@@ -299,11 +300,9 @@ class VolumePlugin(object):
             ``None`` if the dataset is not locally mounted, or errbacks
             with ``_NotFound`` if it is does not exist at all.
         """
-        d = self._flocker_client.list_datasets_state()
+        d = self._flocker_client.list_datasets_state(dataset_id=dataset_id)
 
         def got_state(datasets):
-            datasets = [dataset for dataset in datasets
-                        if dataset.dataset_id == dataset_id]
             if datasets and datasets[0].primary == self._node_id:
                 return datasets[0].path
             else:
@@ -318,7 +317,8 @@ class VolumePlugin(object):
         Move a volume with the given name to the current node and mount it.
 
         Since we need to return the filesystem path we wait until the
-        dataset is mounted locally.
+        dataset is mounted locally, checking each time the cluster state
+        changes.
 
         :param unicode Name: The name of the volume.
 
@@ -330,8 +330,8 @@ class VolumePlugin(object):
                                                         dataset_id))
         d.addCallback(lambda dataset: dataset.dataset_id)
 
-        d.addCallback(lambda dataset_id: loop_until(
-            self._reactor,
+        d.addCallback(lambda dataset_id: wait_for_state(
+            self._flocker_client, self._reactor,
             lambda: self._get_path_from_dataset_id(dataset_id),
             repeat(self._POLL_INTERVAL)))
         d.addCallback(lambda p: {u"Err": u"", u"Mountpoint": p.path})
@@ -10,7 +10,7 @@ from bitmath import TiB, GiB, MiB, KiB, Byte
 
 from twisted.web.http import OK, NOT_ALLOWED, NOT_FOUND
 from twisted.internet.task import Clock, LoopingCall
-from twisted.internet.defer import gatherResults
+from twisted.internet.defer import gatherResults, fail
 
 from hypothesis import given
 from hypothesis.strategies import (
@@ -23,6 +23,7 @@ from eliot.testing import capture_logging
 
 from .._api import VolumePlugin, DEFAULT_SIZE, parse_num, NAME_FIELD
 from ...apiclient import FakeFlockerClient, Dataset, DatasetsConfiguration
+from ...apiclient._client import ResponseError
 from ...testtools import CustomException, random_name
 
 from ...restapi import make_bad_request
@@ -354,6 +355,40 @@ class APITestsMixin(APIAssertionsMixin):
 
         return d
 
+    def test_mount_without_watch(self):
+        """
+        ``/VolumeDriver.Mount`` polls for the dataset to arrive if the control
+        service can't wait for changes.
+        """
+        name = u"myvol"
+        dataset_id = uuid4()
+        self.patch(
+            self.flocker_client._wrapped, "watch_state",
+            lambda tag=None: fail(ResponseError(NOT_FOUND, b"")))
+
+        # Create dataset on a different node:
+        d = self.flocker_client.create_dataset(
+            self.NODE_B, int(DEFAULT_SIZE.to_Byte()),
+            metadata={NAME_FIELD: name},
+            dataset_id=dataset_id)
+
+        self._flush_volume_plugin_reactor_on_endpoint_render()
+
+        # Pretend that it takes 5 seconds for the dataset to get established on
+        # Node A.
+        self.volume_plugin_reactor.callLater(
+            5.0, self.flocker_client.synchronize_state)
+
+        d.addCallback(lambda _:
+                      self.assertResult(
+                          b"POST", b"/VolumeDriver.Mount",
+                          {u"Name": name}, OK,
+                          {u"Err": u"",
+                           u"Mountpoint": u"/flocker/{}".format(dataset_id)}))
+        d.addCallback(lambda _: self.assertLess(
+            1, self.flocker_client.num_calls('list_datasets_state')))
+        return d
+
     def test_mount_timeout(self):
         """
         ``/VolumeDriver.Mount`` sets the primary of the dataset with matching
@@ -519,7 +554,7 @@ class APITestsMixin(APIAssertionsMixin):
         """
         If an unexpected error occurs Docker gets back a useful error message.
         """
-        def error():
+        def error(**kwargs):
             raise CustomException("I've made a terrible mistake")
         self.patch(self.flocker_client, "list_datasets_configuration",
                    error)
@@ -534,7 +569,7 @@ class APITestsMixin(APIAssertionsMixin):
         If a ``BadRequest`` exception is raised it is converted to appropriate
         JSON.
         """
-        def error():
+        def error(**kwargs):
             raise make_bad_request(code=423, Err=u"no good")
         self.patch(self.flocker_client, "list_datasets_configuration",
                    error)
@@ -58,9 +58,13 @@ class IDeployer(Interface):
     :ivar UUID node_uuid: The UUID of the node this deployer is running.
     :ivar unicode hostname: The hostname (really, IP) of the node this
         deployer is managing.
+    :ivar ClusterScope cluster_scope: The part of the cluster configuration
+        and state that ``discover_state`` and ``calculate_changes`` need.
+        The control service only sends that part to the agent.
     """
     node_uuid = Attribute("")
     hostname = Attribute("")
+    cluster_scope = Attribute("")
 
     def discover_state(cluster_state, persistent_state):
         """
@@ -48,10 +48,12 @@ from . import run_state_change, NoOp
 
 from ..common import gather_deferreds
 from ..control import (
-    NodeStateCommand, IConvergenceAgent, AgentAMP, SetNodeEraCommand,
-    IStatePersister, SetBlockDeviceIdForDatasetId,
+    NodeStateCommand, NodeStateDiffCommand, IConvergenceAgent, AgentAMP,
+    SetNodeEraCommand, IStatePersister, SetBlockDeviceIdForDatasetId,
 )
 from ..control._persistence import to_unserialized_json
+from ..control._diffing import create_sequence_diff
+from ..control._clusterstate import ResyncRequired
 
 
 class ClusterStatusInputs(Names):
@@ -419,6 +421,11 @@ class ConvergenceLoop(object):
         to the control service.
     :type _last_acknowledged_state: tuple of IClusterStateChange
 
+    :ivar int _sequence: The sequence number of the last state sent to the
+        control service.  If the control service supports it, state is sent
+        as a diff against the last acknowledged state, which must have the
+        previous sequence number.
+
     :ivar _last_discovered_local_state: The discovered local state from
         last iteration done.
 
@@ -438,6 +445,7 @@ class ConvergenceLoop(object):
         self.client = None
         self._last_discovered_local_state = None
         self._last_acknowledged_state = None
+        self._sequence = 0
         self._sleep_timeout = None
         self._unconverged_sleep = _UnconvergedDelay()
 
@@ -481,10 +489,21 @@ class ConvergenceLoop(object):
             local_changes=list(state_changes),
         )
         with context.context():
+            command = NodeStateCommand
+            arguments = dict(state_changes=state_changes)
+            if getattr(self.client, "node_state_diffs", False):
+                self._sequence += 1
+                arguments["sequence"] = self._sequence
+                if self._last_acknowledged_state is not None:
+                    command = NodeStateDiffCommand
+                    arguments = dict(
+                        state_diff=create_sequence_diff(
+                            self._last_acknowledged_state, state_changes,
+                        ),
+                        sequence=self._sequence,
+                    )
             d = DeferredContext(self.client.callRemote(
-                NodeStateCommand,
-                state_changes=state_changes,
-                eliot_context=context)
+                command, eliot_context=context, **arguments)
             )
 
             def record_acknowledged_state(ignored):
@@ -498,6 +517,13 @@ class ConvergenceLoop(object):
                 return failure
 
             d.addCallbacks(record_acknowledged_state, clear_acknowledged_state)
+            if command is NodeStateDiffCommand:
+                def resync(failure):
+                    # The control service doesn't have the state the diff is
+                    # against, so send all of it instead.
+                    failure.trap(ResyncRequired)
+                    return self._send_state_to_control_service(state_changes)
+                d.addErrback(resync)
             d.addErrback(
                 writeFailure, self.fsm.logger,
                 u"Failed to send local state to control node.")
@@ -761,9 +787,12 @@ class AgentLoopService(MultiService, object):
         # Reduce reconnect delay back to normal, since we've successfully
         # connected:
         self.reconnecting_factory.resetDelay()
-        d = client.callRemote(SetNodeEraCommand,
-                              era=unicode(self.era),
-                              node_uuid=unicode(self.deployer.node_uuid))
+        d = client.callRemote(
+            SetNodeEraCommand,
+            era=unicode(self.era),
+            node_uuid=unicode(self.deployer.node_uuid),
+            cluster_scope=self.deployer.cluster_scope.value,
+        )
         d.addErrback(writeFailure)
         self.cluster_status.receive(_ConnectedToControlService(client=client))
 
@@ -26,6 +26,7 @@ from ..control._model import (
     DatasetChanges, DatasetHandoff, NodeState, Manifestation, Dataset,
     ip_to_uuid,
     )
+from ..control._scope import ClusterScope
 from ..volume._ipc import RemoteVolumeManager, standard_node
 from ..volume._model import VolumeSize
 from ..volume.service import VolumeName
@@ -208,6 +209,9 @@ class P2PManifestationDeployer(object):
     :ivar unicode hostname: The hostname of the node that this is running on.
     :ivar VolumeService volume_service: The volume manager for this node.
     """
+    # Hand-offs need to know where datasets are on other nodes:
+    cluster_scope = ClusterScope.CLUSTER
+
     def __init__(self, hostname, volume_service, node_uuid=None):
         if node_uuid is None:
             # To be removed in https://clusterhq.atlassian.net/browse/FLOC-1795
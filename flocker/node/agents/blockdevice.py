@@ -41,6 +41,7 @@ from .._deploy import NotInUseDatasets
 
 from ...control import NodeState, Manifestation, Dataset, NonManifestDatasets
 from ...control._model import pvector_field
+from ...control._scope import ClusterScope
 from ...common import RACKSPACE_MINIMUM_VOLUME_SIZE, auto_threaded, provides
 from ...common.algebraic import TaggedUnionInvariant
 
@@ -1697,6 +1698,9 @@ class BlockDeviceDeployer(PClass):
         mandatory=True,
         initial=BlockDeviceCalculator(),
     )
+    # Only this node's configuration and state and the ownership of datasets
+    # are needed:
+    cluster_scope = ClusterScope.NODE_DATASETS
 
     @property
     def profiled_blockdevice_api(self):
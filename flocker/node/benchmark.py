@@ -1,6 +1,7 @@
 # Copyright ClusterHQ Inc.  See LICENSE file for details.
 
 import sys
+from json import dumps
 
 from twisted.python.usage import Options, UsageError
 from twisted.internet.defer import succeed
@@ -10,6 +11,10 @@ from pyrsistent import PClass
 from zope.interface import implementer
 
 from .diagnostics import list_hardware
+from ..control._benchmarks import (
+    benchmark_wire_format, benchmark_connection_timers, benchmark_node_index,
+    benchmark_migration,
+)
 
 from ..common.script import (
     ICommandLineScript,
@@ -25,6 +30,83 @@ class HardwareReportOptions(Options):
     """
 
 
+class WireFormatOptions(Options):
+    """
+    Command line options for ``flocker-benchmark wire-format``.
+    """
+    longdesc = """\
+    Compare the size and the encoding and decoding time of the JSON and
+    binary wire formats for a synthetic cluster.  One JSON result is printed
+    per line.
+    """
+
+    optParameters = [
+        ['datasets', None, 10000, "The number of datasets in the cluster.",
+         int],
+        ['nodes', None, 10, "The number of nodes in the cluster.", int],
+        ['repeat', None, 3, "The number of times to repeat each measurement.",
+         int],
+    ]
+
+
+class ConnectionTimersOptions(Options):
+    """
+    Command line options for ``flocker-benchmark connection-timers``.
+    """
+    longdesc = """\
+    Compare the time spent managing the idle timeouts and pings of many
+    simulated AMP connections using a delayed call per timer and using a
+    shared timer wheel.  One JSON result is printed per line.
+    """
+
+    optParameters = [
+        ['connections', None, 5000, "The number of connections.", int],
+        ['seconds', None, 120.0, "The number of seconds of simulated time.",
+         float],
+        ['box-interval', None, 1.0,
+         "The number of seconds between boxes received by each connection.",
+         float],
+    ]
+
+
+class NodeIndexOptions(Options):
+    """
+    Command line options for ``flocker-benchmark node-index``.
+    """
+    longdesc = """\
+    Compare the time taken to look up and replace nodes of the configuration
+    and the state of a synthetic cluster by scanning all the nodes and by
+    using the UUID to node index.  One JSON result is printed per line.
+    """
+
+    optParameters = [
+        ['nodes', None, 1000, "The number of nodes in the cluster.", int],
+        ['operations', None, 100,
+         "The number of nodes looked up or replaced per measurement.", int],
+        ['repeat', None, 3, "The number of times to repeat each measurement.",
+         int],
+    ]
+
+
+class MigrationOptions(Options):
+    """
+    Command line options for ``flocker-benchmark migration``.
+    """
+    longdesc = """\
+    Compare the time taken to migrate a synthetic version 1 configuration to
+    the current version by reserializing it for every upgrade and by parsing
+    and serializing it only once.  One JSON result is printed per line.
+    """
+
+    optParameters = [
+        ['datasets', None, 10000, "The number of datasets in the cluster.",
+         int],
+        ['nodes', None, 10, "The number of nodes in the cluster.", int],
+        ['repeat', None, 3, "The number of times to repeat each measurement.",
+         int],
+    ]
+
+
 @flocker_standard_options
 class BenchmarkOptions(Options):
     """
@@ -39,6 +121,14 @@ class BenchmarkOptions(Options):
     subCommands = [
         ['hardware-report', None, HardwareReportOptions,
          "Print a hardware report."],
+        ['wire-format', None, WireFormatOptions,
+         "Benchmark the control service wire formats."],
+        ['connection-timers', None, ConnectionTimersOptions,
+         "Benchmark the timers of many AMP connections."],
+        ['node-index', None, NodeIndexOptions,
+         "Benchmark looking up and replacing nodes by UUID."],
+        ['migration', None, MigrationOptions,
+         "Benchmark configuration migrations."],
     ]
 
     def postOptions(self):
@@ -56,6 +146,54 @@ def hardware_report(options):
     return succeed(None)
 
 
+def wire_format(options):
+    """
+    Print the results of benchmarking the wire formats to stdout.
+    """
+    for result in benchmark_wire_format(
+        datasets=options['datasets'], nodes=options['nodes'],
+        repeat=options['repeat'],
+    ):
+        sys.stdout.write(dumps(result, sort_keys=True) + "\n")
+    return succeed(None)
+
+
+def connection_timers(options):
+    """
+    Print the results of benchmarking connection timers to stdout.
+    """
+    for result in benchmark_connection_timers(
+        connections=options['connections'], seconds=options['seconds'],
+        box_interval=options['box-interval'],
+    ):
+        sys.stdout.write(dumps(result, sort_keys=True) + "\n")
+    return succeed(None)
+
+
+def node_index(options):
+    """
+    Print the results of benchmarking node lookups to stdout.
+    """
+    for result in benchmark_node_index(
+        nodes=options['nodes'], operations=options['operations'],
+        repeat=options['repeat'],
+    ):
+        sys.stdout.write(dumps(result, sort_keys=True) + "\n")
+    return succeed(None)
+
+
+def migration(options):
+    """
+    Print the results of benchmarking configuration migrations to stdout.
+    """
+    for result in benchmark_migration(
+        datasets=options['datasets'], nodes=options['nodes'],
+        repeat=options['repeat'],
+    ):
+        sys.stdout.write(dumps(result, sort_keys=True) + "\n")
+    return succeed(None)
+
+
 @implementer(ICommandLineScript)
 class BenchmarkScript(PClass):
     """
@@ -63,6 +201,10 @@ class BenchmarkScript(PClass):
     """
     _subcommands = {
         'hardware-report': hardware_report,
+        'wire-format': wire_format,
+        'connection-timers': connection_timers,
+        'node-index': node_index,
+        'migration': migration,
     }
 
     def main(self, reactor, options):
@@ -47,7 +47,11 @@ from ...control import (
     NodeState, Deployment, Manifestation, Dataset, DeploymentState,
     Application, DockerImage, PersistentState,
 )
-from ...control._protocol import NodeStateCommand, AgentAMP, SetNodeEraCommand
+from ...control._protocol import (
+    NodeStateCommand, NodeStateDiffCommand, AgentAMP, SetNodeEraCommand,
+)
+from ...control._diffing import create_sequence_diff
+from ...control._clusterstate import ResyncRequired
 from ...control.testtools import (
     make_istatepersister_tests,
     make_loopback_control_client,
@@ -562,6 +566,98 @@ class ConvergenceLoopFSMTests(TestCase):
             )
         )
 
+    def run_with_node_state_diffs(self, responses):
+        """
+        Run two iterations of the convergence loop, discovering a changed
+        state the second time, with a client which supports
+        ``NodeStateDiffCommand``.
+
+        :param responses: A ``list`` of ``(command, kwargs, response)``
+            tuples to register with the client.
+
+        :return: A tuple of the calls made using the client, the first local
+            state and the changed local state.
+        """
+        local_state = NodeState(hostname=u'192.0.2.123')
+        changed_local_state = local_state.set(
+            applications=pset([Application(
+                name=u"app",
+                image=DockerImage.from_string(u"nginx"))]),
+        )
+        deployer = ControllableDeployer(
+            local_state.hostname,
+            [succeed(local_state), succeed(changed_local_state)],
+            [no_action(), no_action()])
+        client = FakeAMPClient()
+        client.node_state_diffs = True
+        for command, kwargs, response in responses(
+                local_state, changed_local_state):
+            client.register_response(
+                command=command, kwargs=kwargs, response=response,
+            )
+        reactor = Clock()
+        loop = build_convergence_loop_fsm(reactor, deployer)
+        loop.receive(_ClientStatusUpdate(
+            client=client, configuration=Deployment(
+                nodes=[to_node(local_state)]),
+            state=DeploymentState(nodes=[local_state])))
+        reactor.advance(_UNCONVERGED_DELAY)
+        return client.calls, local_state, changed_local_state
+
+    def test_convergence_sends_state_diff(self):
+        """
+        If the control service supports ``NodeStateDiffCommand``, an FSM
+        doing convergence sends its first state with a sequence number and
+        later states as a diff against the last acknowledged state, with the
+        next sequence number.
+        """
+        def responses(local_state, changed_local_state):
+            return [
+                (NodeStateCommand,
+                 dict(state_changes=(local_state,), sequence=1), {}),
+                (NodeStateDiffCommand,
+                 dict(state_diff=create_sequence_diff(
+                     (local_state,), (changed_local_state,)), sequence=2),
+                 {}),
+            ]
+        calls, local_state, changed_local_state = (
+            self.run_with_node_state_diffs(responses)
+        )
+        self.assertEqual(
+            [(NodeStateCommand,
+              dict(state_changes=(local_state,), sequence=1)),
+             (NodeStateDiffCommand,
+              dict(state_diff=create_sequence_diff(
+                  (local_state,), (changed_local_state,)), sequence=2))],
+            calls,
+        )
+
+    def test_convergence_state_diff_resync(self):
+        """
+        If the control service can't apply a state diff, the complete state
+        is sent straight away.
+        """
+        def responses(local_state, changed_local_state):
+            return [
+                (NodeStateCommand,
+                 dict(state_changes=(local_state,), sequence=1), {}),
+                (NodeStateDiffCommand,
+                 dict(state_diff=create_sequence_diff(
+                     (local_state,), (changed_local_state,)), sequence=2),
+                 ResyncRequired()),
+                (NodeStateCommand,
+                 dict(state_changes=(changed_local_state,), sequence=3), {}),
+            ]
+        calls, local_state, changed_local_state = (
+            self.run_with_node_state_diffs(responses)
+        )
+        self.assertEqual(
+            [NodeStateCommand, NodeStateDiffCommand,
+             (NodeStateCommand,
+              dict(state_changes=(changed_local_state,), sequence=3))],
+            [calls[0][0], calls[1][0], calls[2]],
+        )
+
     @validate_logging(assertHasMessage, LOG_CALCULATED_ACTIONS)
     def test_convergence_done_update_local_state(self, logger):
         """
@@ -1178,11 +1274,13 @@ class UpdateNodeEraLocator(CommandLocator):
     """
     uuid = None
     era = None
+    cluster_scope = None
 
     @SetNodeEraCommand.responder
-    def set_node_era(self, era, node_uuid):
+    def set_node_era(self, era, node_uuid, cluster_scope=None):
         self.era = era
         self.uuid = node_uuid
+        self.cluster_scope = cluster_scope
         return {}
 
 
@@ -1248,7 +1346,7 @@ class AgentLoopServiceTests(TestCase):
     def test_send_era_on_connect(self):
         """
         Upon connecting a ``SetNodeEraCommand`` is sent with the current
-        node's era and UUID.
+        node's era and UUID and the deployer's cluster scope.
         """
         client = AgentAMP(self.reactor, self.service)
         # The object that processes incoming AMP commands:
@@ -1258,10 +1356,12 @@ class AgentLoopServiceTests(TestCase):
         pump.flush()
         self.assertEqual(
             # Actual result of handling AMP commands, if any:
-            dict(era=server_locator.era, uuid=server_locator.uuid),
+            dict(era=server_locator.era, uuid=server_locator.uuid,
+                 cluster_scope=server_locator.cluster_scope),
             # Expected result:
             dict(era=unicode(self.service.era),
-                 uuid=unicode(self.deployer.node_uuid)))
+                 uuid=unicode(self.deployer.node_uuid),
+                 cluster_scope=self.deployer.cluster_scope.value))
 
     def test_connected_resets_factory_delay(self):
         """
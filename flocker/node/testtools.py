@@ -33,6 +33,7 @@ from ..control import (
     PersistentState,
 )
 from ..control._model import ip_to_uuid, Leases
+from ..control._scope import ClusterScope
 from ._docker import AddressInUse, DockerClient
 
 
@@ -169,6 +170,7 @@ class DummyDeployer(object):
     """
     hostname = u"127.0.0.1"
     node_uuid = uuid4()
+    cluster_scope = ClusterScope.CLUSTER
 
     def discover_state(self, cluster_state, persistent_state):
         return succeed(DummyLocalState())
@@ -194,6 +196,7 @@ class ControllableDeployer(object):
         """
         self.node_uuid = ip_to_uuid(hostname)
         self.hostname = hostname
+        self.cluster_scope = ClusterScope.CLUSTER
         self.local_states = local_states
         self.calculated_actions = calculated_actions
         self.calculate_inputs = []